@@ -0,0 +1,72 @@
+"""
+JWT authentication without a user query per request.
+
+Access tokens carry the user's role and company id next to the user id.
+CachedJWTAuthentication serves request.user from accounts.cache; when the
+cached user disagrees with the token's claims (changed in another process,
+or a token minted before the change) the user is read from the database
+again, and that is what the request sees. Refreshing a token re-issues the
+claims from the current user.
+"""
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .cache import get_cached_user
+
+ROLE_CLAIM = 'role'
+COMPANY_CLAIM = 'company_id'
+
+
+def add_user_claims(token, user):
+    token[ROLE_CLAIM] = user.role
+    token[COMPANY_CLAIM] = str(user.company_id) if user.company_id else None
+    return token
+
+
+def claims_match(token, user) -> bool:
+    """Whether the token's role and company claims, where present, are the user's"""
+    if ROLE_CLAIM in token and token[ROLE_CLAIM] != user.role:
+        return False
+    if COMPANY_CLAIM in token:
+        return token[COMPANY_CLAIM] == (str(user.company_id) if user.company_id else None)
+    return True
+
+
+class UserClaimsRefreshToken(RefreshToken):
+    """A refresh token whose access tokens carry the user's current role and company"""
+
+    @classmethod
+    def for_user(cls, user):
+        return add_user_claims(super().for_user(user), user)
+
+    @property
+    def access_token(self):
+        access = super().access_token
+        user = get_cached_user(self[api_settings.USER_ID_CLAIM])
+        if user is not None:
+            add_user_claims(access, user)
+        return access
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        if api_settings.CHECK_REVOKE_TOKEN:
+            # Needs the password hash, which the cache does not keep
+            return super().get_user(validated_token)
+
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        user = get_cached_user(user_id)
+        if user is not None and not claims_match(validated_token, user):
+            user = get_cached_user(user_id, refresh=True)
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user
@@ -0,0 +1,72 @@
+"""
+Short-lived cache of the users and companies that authenticate API requests.
+
+CachedJWTAuthentication reads the request's user, and the user's company,
+from here rather than from the database. Entries live for
+AUTH_USER_CACHE_TIMEOUT seconds and are dropped when a User or Company is
+saved or deleted, so a changed role or company is seen by the next request.
+With a per-process cache (LocMem) other processes only see the change once
+their entry expires, which is why the timeout is short.
+"""
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+USER_KEY = 'auth:user:{}'
+COMPANY_KEY = 'auth:company:{}'
+
+
+def _timeout() -> int:
+    return getattr(settings, 'AUTH_USER_CACHE_TIMEOUT', 60)
+
+
+def _forget(key: str):
+    cache.delete(key)
+    # Again once committed, in case a request cached the old row in between
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def forget_user(user_id):
+    _forget(USER_KEY.format(user_id))
+
+
+def forget_company(company_id):
+    _forget(COMPANY_KEY.format(company_id))
+
+
+def get_cached_company(company_id):
+    """The company, from the cache or the database; None if it does not exist"""
+    from companies.models import Company
+
+    key = COMPANY_KEY.format(company_id)
+    company = cache.get(key)
+    if company is None:
+        company = Company.objects.filter(pk=company_id).first()
+        if company is None:
+            return None
+        cache.set(key, company, _timeout())
+    return company
+
+
+def get_cached_user(user_id, refresh: bool = False) -> Optional['User']:
+    """
+    The user with their company attached, from the cache or the database;
+    None if there is no such user. The password is not loaded, so saving the
+    returned user never writes back a stale hash.
+    """
+    from .models import User
+
+    key = USER_KEY.format(user_id)
+    user = None if refresh else cache.get(key)
+    if user is None:
+        user = User.objects.defer('password').filter(pk=user_id).first()
+        if user is None:
+            return None
+        cache.set(key, user, _timeout())
+    if user.company_id is not None:
+        company = get_cached_company(user.company_id)
+        if company is not None:
+            user.company = company
+    return user
@@ -3,6 +3,7 @@ from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
+from .cache import forget_user
 
 class CustomUserManager(BaseUserManager):
     def create_user(self, email, password=None, **extra_fields):
@@ -57,6 +58,14 @@ class User(AbstractUser):
     def __str__(self):
         return self.email
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        forget_user(self.pk)
+
+    def delete(self, *args, **kwargs):
+        forget_user(self.pk)
+        return super().delete(*args, **kwargs)
+
     @property
     def is_parent(self):
         return self.role == self.UserRole.PARENT
@@ -0,0 +1,91 @@
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from companies.models import Company, Customer
+from companies.services import sync_shopify_customers
+from .models import User
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(email='owner@example.com', password='secret', role='PARENT')
+        self.company = Company.objects.create(name='Acme', owner=self.owner, email='acme@example.com')
+        self.user = User.objects.create_user(email='staff@example.com', password='secret', role='EMPLOYEE',
+                                             company=self.company)
+        self.client = APIClient()
+        tokens = self.client.post('/accounts/api/token/', {'email': 'staff@example.com', 'password': 'secret'},
+                                  format='json').json()
+        self.refresh, self.access = tokens['refresh'], tokens['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+
+    def me(self):
+        response = self.client.get('/accounts/api/user/')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_access_token_carries_role_and_company(self):
+        access = AccessToken(self.access)
+        self.assertEqual((access['role'], access['company_id']), ('EMPLOYEE', str(self.company.id)))
+
+    def test_repeat_requests_do_not_query_the_user(self):
+        self.me()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.me()['role'], 'EMPLOYEE')
+        with self.assertNumQueries(0):
+            user = self.client.get('/accounts/api/user/').wsgi_request.user
+            self.assertEqual(user.company.name, 'Acme')
+
+    def test_changes_to_the_user_are_seen_at_once(self):
+        self.me()
+        self.user.role = User.UserRole.ADMIN
+        self.user.save()
+        self.assertEqual(self.me()['role'], 'ADMIN')
+
+        # The token still says EMPLOYEE; a refreshed one has the new role
+        access = self.client.post('/accounts/api/token/refresh/', {'refresh': self.refresh}, format='json').json()['access']
+        self.assertEqual(AccessToken(access)['role'], 'ADMIN')
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/accounts/api/user/').status_code, 401)
+
+    def test_changes_to_the_company_are_seen_at_once(self):
+        self.client.get('/accounts/api/user/')
+        self.company.name = 'Acme Retail'
+        self.company.save()
+        self.assertEqual(self.client.get('/accounts/api/user/').wsgi_request.user.company.name, 'Acme Retail')
+
+    def test_saving_the_cached_user_keeps_the_password(self):
+        self.me()
+        self.client.patch('/accounts/api/user/', {'phone': '9876543210'}, format='json')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.phone, '9876543210')
+        self.assertTrue(self.user.check_password('secret'))
+
+    def test_saving_the_cached_company_keeps_other_changes(self):
+        self.me()
+        # Changed by another worker, whose cache invalidation this process never sees
+        Company.objects.filter(pk=self.company.pk).update(name='Acme Retail')
+        response = self.client.post('/companies/api/connect-shopify/',
+                                    {'domain': 'acme.myshopify.com', 'access_token': 'token'}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.company.refresh_from_db()
+        self.assertEqual((self.company.name, self.company.shopify_domain), ('Acme Retail', 'acme.myshopify.com'))
+
+    def test_stale_cached_company_does_not_bring_back_shopify_stats(self):
+        self.me()
+        # Recomputed by another worker, whose cache invalidation this process never sees
+        Company.objects.filter(pk=self.company.pk).update(customer_stats_recomputed_at=timezone.now())
+        company = self.client.get('/accounts/api/user/').wsgi_request.user.company
+        self.assertIsNone(company.customer_stats_recomputed_at)
+
+        sync_shopify_customers(company, [{'id': '77', 'email': 'shopper@example.com',
+                                          'number_of_orders': 7, 'amount_spent': '1234.50'}])
+        customer = Customer.objects.get(shopify_customer_id='77')
+        self.assertEqual((customer.number_of_orders, customer.amount_spent), (0, Decimal('0.00')))
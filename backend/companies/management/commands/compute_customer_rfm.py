@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from companies.models import Company
+from companies.rfm import update_customer_rfm
+
+
+class Command(BaseCommand):
+    help = 'Recompute RFM scores, segments and lifetime value for customers from their orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', help='Only compute for this company (UUID)')
+
+    def handle(self, *args, **options):
+        companies = Company.objects.filter(is_active=True)
+        if options['company']:
+            companies = companies.filter(id=options['company'])
+            if not companies.exists():
+                raise CommandError(f"Company {options['company']} not found")
+
+        for company in companies:
+            result = update_customer_rfm(company)
+            self.stdout.write(
+                f"{company.name}: scored {result['customers']} customers from {result['orders']} orders "
+                f"in {result['seconds']:.2f}s ({result['cleared']} cleared)"
+            )
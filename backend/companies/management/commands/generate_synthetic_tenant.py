@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.synthetic import BATCH_SIZE, SCALES, SYNTHETIC_PASSWORD, generate_tenant
+
+
+class Command(BaseCommand):
+    help = 'Create synthetic companies with customers, products, orders and order items for benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=sorted(SCALES), default='small',
+                            help='Preset row counts; the options below override it')
+        parser.add_argument('--companies', type=int, default=1, help='Number of companies to create')
+        parser.add_argument('--customers', type=int, help='Customers per company')
+        parser.add_argument('--products', type=int, help='Products per company')
+        parser.add_argument('--variants-per-product', type=int, default=3)
+        parser.add_argument('--orders', type=int, help='Orders per company')
+        parser.add_argument('--items-per-order', type=int, default=4, help='Average line items per order')
+        parser.add_argument('--days', type=int, default=365, help='Spread orders over this many days')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed; company n uses seed + n')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Rows per INSERT batch')
+        parser.add_argument('--name', default='Synthetic', help='Company name prefix')
+
+    def handle(self, *args, **options):
+        counts = dict(SCALES[options['scale']])
+        for key in counts:
+            if options[key] is not None:
+                counts[key] = options[key]
+        if options['items_per_order'] < 1 or options['variants_per_product'] < 1:
+            raise CommandError("--items-per-order and --variants-per-product must be at least 1")
+
+        for n in range(options['companies']):
+            started = time.monotonic()
+            company = generate_tenant(
+                f"{options['name']} {n + 1}",
+                variants_per_product=options['variants_per_product'],
+                items_per_order=options['items_per_order'],
+                days=options['days'],
+                seed=options['seed'] + n,
+                batch_size=options['batch_size'],
+                progress=self.stdout.write,
+                **counts,
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f"Created {company.name} ({company.id}) in {time.monotonic() - started:.1f}s; "
+                f"log in as {company.owner.email} / {SYNTHETIC_PASSWORD}"
+            ))
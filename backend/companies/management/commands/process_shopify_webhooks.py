@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from companies.webhooks import process_webhook_events
+
+
+class Command(BaseCommand):
+    help = 'Apply stored Shopify webhook events to orders, products and customers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of events claimed per batch')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep polling for new events instead of exiting when the inbox is empty')
+        parser.add_argument('--sleep', type=float, default=2.0,
+                            help='Seconds to wait between polls when the inbox is empty (with --loop)')
+
+    def handle(self, *args, **options):
+        while True:
+            stats = process_webhook_events(batch_size=options['batch_size'])
+            handled = stats['processed'] + stats['stale'] + stats['retrying'] + stats['failed']
+            if handled:
+                self.stdout.write(
+                    f"Processed {stats['processed']} events, skipped {stats['stale']} stale, "
+                    f"{stats['retrying']} will be retried, {stats['failed']} failed"
+                )
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['sleep'])
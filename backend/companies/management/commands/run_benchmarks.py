@@ -0,0 +1,83 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from companies.models import Company
+from core.benchmarks import (
+    LIST_ENDPOINTS, RecordedShopify, environment, json_benchmarks, list_benchmarks, serializer_benchmarks,
+    sync_benchmarks, tenant_size,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the Shopify customer, product and order syncs against a recorded Shopify, and the list '
+        'endpoints, list serializers and JSON rendering of a company, reporting wall time, SQL queries and '
+        'peak RSS as JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', help='Company (UUID) whose list endpoints are timed, '
+                                              'e.g. one made by generate_synthetic_tenant')
+        parser.add_argument('--recording', help='Recorded Shopify data (JSON); created on first use')
+        parser.add_argument('--customers', type=int, default=1000, help='Customers in a new recording')
+        parser.add_argument('--products', type=int, default=200, help='Products in a new recording')
+        parser.add_argument('--orders', type=int, default=2000, help='Orders in a new recording')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--only', choices=['sync', 'list', 'serializers', 'json'],
+                            help='Run only one group of benchmarks')
+        parser.add_argument('--list', nargs='+', choices=sorted(LIST_ENDPOINTS), default=list(LIST_ENDPOINTS),
+                            dest='list_resources', help='List endpoints to time')
+        parser.add_argument('--rows', type=int, default=10000,
+                            help='Customers and orders serialized by the serializer benchmarks')
+        parser.add_argument('--keep', action='store_true',
+                            help='Keep the tenant the syncs ran into (delete it before the next run)')
+        parser.add_argument('--label', default='', help='Free text stored with the results, e.g. a branch')
+        parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+
+    def handle(self, *args, **options):
+        report = {'label': options['label'], **environment(), 'results': []}
+
+        if options['only'] in (None, 'sync'):
+            path = options['recording']
+            if path and os.path.exists(path):
+                shopify = RecordedShopify.load(path)
+            else:
+                shopify = RecordedShopify.generate(
+                    customers=options['customers'], products=options['products'],
+                    orders=options['orders'], seed=options['seed'],
+                )
+                if path:
+                    shopify.save(path)
+            report['recording'] = {name: len(nodes) for name, nodes in shopify.nodes.items()}
+            report['results'] += sync_benchmarks(shopify, keep=options['keep'])
+
+        if options['only'] != 'sync':
+            if not options['company']:
+                if options['only']:
+                    raise CommandError(f"--company is required for the {options['only']} benchmarks")
+                self.stderr.write("No --company given, skipping the list, serializer and JSON benchmarks")
+            else:
+                company = Company.objects.filter(id=options['company']).first()
+                if not company:
+                    raise CommandError(f"Company {options['company']} not found")
+                report['tenant'] = tenant_size(company)
+                if options['only'] in (None, 'list'):
+                    report['results'] += list_benchmarks(company, options['list_resources'])
+                if options['only'] in (None, 'serializers'):
+                    report['results'] += serializer_benchmarks(company, options['rows'])
+                if options['only'] in (None, 'json'):
+                    report['results'] += json_benchmarks(company, options['list_resources'])
+
+        output = json.dumps(report, indent=2, default=str)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                handle.write(output + '\n')
+            for result in report['results']:
+                self.stdout.write(
+                    f"{result['name']}: {result['wall_seconds']:.3f}s, {result['queries']} queries, "
+                    f"peak RSS {result['peak_rss_kb']} KiB"
+                )
+        else:
+            self.stdout.write(output)
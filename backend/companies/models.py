@@ -1,6 +1,10 @@
+import time
 import uuid
+from contextlib import contextmanager
+from typing import Dict, Optional
 from django.db import models
 from django.utils.translation import gettext_lazy as _
+from accounts.cache import forget_company
 from accounts.models import User
 from django.utils import timezone
 from decimal import Decimal
@@ -107,12 +111,25 @@ class Company(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     
     # Shopify Integration fields
-    shopify_domain = models.CharField(_('Shopify Domain'), max_length=255, blank=True, null=True)
+    shopify_domain = models.CharField(_('Shopify Domain'), max_length=255, blank=True, null=True, db_index=True)
     shopify_access_token = models.CharField(_('Shopify Access Token'), max_length=255, blank=True, null=True)
+    shopify_webhook_secret = models.CharField(
+        _('Shopify Webhook Secret'), max_length=255, blank=True, null=True,
+        help_text=_('Secret used to verify Shopify webhook signatures')
+    )
+    customer_stats_recomputed_at = models.DateTimeField(
+        _('Customer Stats Recomputed At'), null=True, blank=True,
+        help_text=_('When customer order stats were last rebuilt from local orders; '
+                    'until then the Shopify customer sync copies Shopify\'s figures')
+    )
     
     # Shiprocket Integration fields
     shiprocket_email = models.CharField(_('Shiprocket Email'), max_length=255, blank=True, null=True)
     shiprocket_token = models.CharField(_('Shiprocket Token'), max_length=255, blank=True, null=True)
+    shiprocket_pickup_location = models.CharField(
+        _('Shiprocket Pickup Location'), max_length=100, default='Primary',
+        help_text=_('Pickup location name configured in Shiprocket')
+    )
     
     # Company owner
     owner = models.OneToOneField(
@@ -122,6 +139,16 @@ class Company(models.Model):
         null=True
     )
     
+    # Stock levels used when recalculating Product.stock_status from variants
+    low_stock_threshold = models.PositiveIntegerField(
+        _('Low Stock Threshold'), default=10,
+        help_text=_('Products with this many units or fewer are low on stock')
+    )
+    out_of_stock_threshold = models.PositiveIntegerField(
+        _('Out of Stock Threshold'), default=0,
+        help_text=_('Products with this many units or fewer are out of stock')
+    )
+
     is_active = models.BooleanField(_('Active'), default=True)
 
     class Meta:
@@ -137,6 +164,11 @@ class Company(models.Model):
         if not self.owner.is_parent:
             raise ValueError(_('Company owner must be a Parent User'))
         super().save(*args, **kwargs)
+        forget_company(self.pk)
+
+    def delete(self, *args, **kwargs):
+        forget_company(self.pk)
+        return super().delete(*args, **kwargs)
 
 class Department(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -182,6 +214,17 @@ class UserDeleteOTP(models.Model):
         return f"OTP for {self.owner.email} - {self.otp} (target: {self.target_user_id})" 
     
 
+def format_full_name(first_name: Optional[str], last_name: Optional[str]) -> str:
+    """A customer's full name from whichever of the two names is set"""
+    if first_name and last_name:
+        return f"{first_name} {last_name}"
+    elif first_name:
+        return first_name
+    elif last_name:
+        return last_name
+    return ""
+
+
 class Customer(models.Model):
     company = models.ForeignKey(
         Company, on_delete=models.CASCADE, related_name='customers'
@@ -209,13 +252,7 @@ class Customer(models.Model):
     @property
     def full_name(self):
         """Returns the customer's full name"""
-        if self.first_name and self.last_name:
-            return f"{self.first_name} {self.last_name}"
-        elif self.first_name:
-            return self.first_name
-        elif self.last_name:
-            return self.last_name
-        return ""
+        return format_full_name(self.first_name, self.last_name)
 
     # Shopify Sales Metrics
     number_of_orders = models.IntegerField(
@@ -292,10 +329,49 @@ class Customer(models.Model):
         _('Country'), max_length=100, blank=True, null=True
     )
 
+    # Shopify change tracking
+    shopify_push_hash = models.CharField(
+        _('Shopify Push Hash'), max_length=64, blank=True, null=True,
+        help_text=_('Hash of the Shopify fields as of the last sync')
+    )
+    shopify_field_hashes = models.JSONField(
+        _('Shopify Field Hashes'), blank=True, null=True,
+        help_text=_('Per-field hashes of the Shopify fields as of the last sync')
+    )
+    shopify_payload_hash = models.CharField(
+        _('Shopify Payload Hash'), max_length=64, blank=True, null=True,
+        help_text=_('Hash of the Shopify payload this customer was last synced from')
+    )
+
+    # RFM segmentation, computed from orders by compute_customer_rfm
+    class RFMSegment(models.TextChoices):
+        CHAMPIONS = 'champions', _('Champions')
+        LOYAL = 'loyal', _('Loyal')
+        POTENTIAL_LOYALIST = 'potential_loyalist', _('Potential Loyalist')
+        NEW = 'new', _('New')
+        AT_RISK = 'at_risk', _('At Risk')
+        HIBERNATING = 'hibernating', _('Hibernating')
+
+    last_order_at = models.DateTimeField(_('Last Order At'), blank=True, null=True)
+    recency_days = models.PositiveIntegerField(_('Days Since Last Order'), blank=True, null=True)
+    rfm_recency_score = models.PositiveSmallIntegerField(_('Recency Score'), blank=True, null=True)
+    rfm_frequency_score = models.PositiveSmallIntegerField(_('Frequency Score'), blank=True, null=True)
+    rfm_monetary_score = models.PositiveSmallIntegerField(_('Monetary Score'), blank=True, null=True)
+    rfm_segment = models.CharField(
+        _('RFM Segment'), max_length=20, choices=RFMSegment.choices, blank=True, null=True
+    )
+    predicted_ltv = models.DecimalField(
+        _('Predicted Lifetime Value'), max_digits=12, decimal_places=2, blank=True, null=True
+    )
+    rfm_updated_at = models.DateTimeField(_('RFM Updated At'), blank=True, null=True)
+
     class Meta:
         verbose_name = _('customer')
         verbose_name_plural = _('customers')
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['company', 'rfm_segment']),
+        ]
 
     def __str__(self):
         return f"{self.email or self.phone or self.shopify_customer_id}"
@@ -384,4 +460,158 @@ class Customer(models.Model):
     def save(self, *args, **kwargs):
         """Override save to run full_clean"""
         self.full_clean()
-        super().save(*args, **kwargs)
\ No newline at end of file
+        super().save(*args, **kwargs)
+
+
+class ShopifyWebhookEvent(models.Model):
+    """Inbox of received Shopify webhooks, applied later by process_shopify_webhooks"""
+    class Status(models.TextChoices):
+        PENDING = 'pending', _('Pending')
+        PROCESSING = 'processing', _('Processing')
+        PROCESSED = 'processed', _('Processed')
+        FAILED = 'failed', _('Failed')
+
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='shopify_webhook_events')
+    webhook_id = models.CharField(_('Webhook ID'), max_length=255, unique=True)
+    topic = models.CharField(_('Topic'), max_length=100)
+    shop_domain = models.CharField(_('Shop Domain'), max_length=255)
+    payload = models.TextField(_('Payload'))
+    status = models.CharField(_('Status'), max_length=20, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveIntegerField(_('Attempts'), default=0)
+    last_error = models.TextField(_('Last Error'), blank=True, default='')
+    received_at = models.DateTimeField(_('Received At'), auto_now_add=True)
+    claimed_at = models.DateTimeField(_('Claimed At'), null=True, blank=True)
+    processed_at = models.DateTimeField(_('Processed At'), null=True, blank=True)
+
+    class Meta:
+        verbose_name = _('Shopify webhook event')
+        verbose_name_plural = _('Shopify webhook events')
+        ordering = ['received_at']
+        indexes = [
+            models.Index(fields=['status', 'received_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.topic} from {self.shop_domain} ({self.status})"
+
+
+class SyncRun(models.Model):
+    """
+    One Shopify sync of a company's customers, products or orders: when it
+    ran, how long it waited on Shopify (fetch) and on the database (write),
+    the API cost it used and what it did to the rows.
+    """
+    class Resource(models.TextChoices):
+        CUSTOMERS = 'customers', _('Customers')
+        PRODUCTS = 'products', _('Products')
+        ORDERS = 'orders', _('Orders')
+
+    class Trigger(models.TextChoices):
+        MANUAL = 'manual', _('Manual')
+        WEBHOOK = 'webhook', _('Webhook')
+        SCHEDULED = 'scheduled', _('Scheduled')
+
+    class Status(models.TextChoices):
+        RUNNING = 'running', _('Running')
+        SUCCEEDED = 'succeeded', _('Succeeded')
+        FAILED = 'failed', _('Failed')
+
+    # Error details kept per run
+    MAX_ERRORS = 50
+
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='sync_runs')
+    resource = models.CharField(_('Resource'), max_length=20, choices=Resource.choices)
+    trigger = models.CharField(_('Trigger'), max_length=20, choices=Trigger.choices, default=Trigger.MANUAL)
+    triggered_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True,
+                                     related_name='sync_runs')
+    status = models.CharField(_('Status'), max_length=20, choices=Status.choices, default=Status.RUNNING)
+    started_at = models.DateTimeField(_('Started At'), default=timezone.now)
+    finished_at = models.DateTimeField(_('Finished At'), null=True, blank=True)
+    duration_seconds = models.FloatField(_('Duration (s)'), null=True, blank=True)
+
+    # Shopify side
+    pages = models.PositiveIntegerField(_('Pages Fetched'), default=0)
+    api_cost = models.PositiveIntegerField(_('API Cost'), default=0)
+    fetch_seconds = models.FloatField(_('Fetch Time (s)'), default=0)
+    throttle_wait_seconds = models.FloatField(_('Throttle Wait (s)'), default=0)
+
+    # Database side
+    write_seconds = models.FloatField(_('Write Time (s)'), default=0)
+    rows_fetched = models.PositiveIntegerField(_('Rows Fetched'), default=0)
+    created = models.PositiveIntegerField(_('Created'), default=0)
+    updated = models.PositiveIntegerField(_('Updated'), default=0)
+    unchanged = models.PositiveIntegerField(_('Unchanged'), default=0)
+    failed = models.PositiveIntegerField(_('Failed'), default=0)
+    rows_per_second = models.FloatField(_('Rows per Second'), null=True, blank=True)
+
+    errors = models.JSONField(_('Errors'), default=list, blank=True)
+    error_message = models.TextField(_('Error Message'), blank=True, default='')
+
+    class Meta:
+        verbose_name = _('sync run')
+        verbose_name_plural = _('sync runs')
+        ordering = ['-started_at']
+        indexes = [
+            models.Index(fields=['company', 'resource', '-started_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.resource} sync of {self.company_id} at {self.started_at} ({self.status})"
+
+    @classmethod
+    @contextmanager
+    def record(cls, company, resource, trigger=Trigger.MANUAL, user=None):
+        """
+        Create a run, yield it to be filled in, and save it finished when the
+        block exits. An exception marks it failed; handled errors call fail().
+        """
+        run = cls.objects.create(
+            company=company, resource=resource, trigger=trigger,
+            triggered_by=user if user and user.is_authenticated else None,
+        )
+        try:
+            yield run
+        except Exception as e:
+            run.fail(str(e))
+            raise
+        finally:
+            run.finish()
+
+    @contextmanager
+    def timed(self, phase: str):
+        """Add the time spent in the block to fetch_seconds or write_seconds"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            field = f'{phase}_seconds'
+            setattr(self, field, getattr(self, field) + time.monotonic() - started)
+
+    def add_usage(self, usage: Dict):
+        """Pages, API cost and throttle waits as counted by a Shopify client (client.usage)"""
+        self.pages += usage.get('requests', 0)
+        self.api_cost += int(usage.get('cost', 0))
+        self.throttle_wait_seconds += usage.get('throttle_wait', 0)
+
+    def add_rows(self, fetched: int = 0, created: int = 0, updated: int = 0, unchanged: int = 0,
+                 failed: int = 0, errors: Optional[list] = None):
+        self.rows_fetched += fetched
+        self.created += created
+        self.updated += updated
+        self.unchanged += unchanged
+        self.failed += failed
+        if errors:
+            self.errors = (self.errors + list(errors))[:self.MAX_ERRORS]
+
+    def fail(self, message: str):
+        self.status = self.Status.FAILED
+        self.error_message = message
+
+    def finish(self):
+        self.finished_at = timezone.now()
+        self.duration_seconds = (self.finished_at - self.started_at).total_seconds()
+        if self.status == self.Status.RUNNING:
+            self.status = self.Status.SUCCEEDED
+        handled = self.created + self.updated + self.unchanged + self.failed
+        self.rows_per_second = handled / self.duration_seconds if self.duration_seconds else None
+        self.save()
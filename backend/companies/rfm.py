@@ -0,0 +1,176 @@
+import logging
+import time
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from itertools import islice
+from typing import Dict
+
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+
+from orders.archive import order_sources
+from .models import Company, Customer
+
+logger = logging.getLogger(__name__)
+
+# Number of quantile buckets per RFM dimension (scores run 1..RFM_BUCKETS)
+RFM_BUCKETS = 5
+# Years of future purchases counted in the predicted lifetime value
+LTV_HORIZON_YEARS = 3
+# Tenure used for customers whose orders all fall within this many days,
+# so a single recent order does not extrapolate to a huge yearly rate
+MIN_TENURE_DAYS = 90
+UPDATE_BATCH_SIZE = 1000
+LOAD_CHUNK_SIZE = 10000
+
+RFM_FIELDS = [
+    'last_order_at', 'recency_days', 'rfm_recency_score', 'rfm_frequency_score',
+    'rfm_monetary_score', 'rfm_segment', 'predicted_ltv', 'lifetime_duration', 'rfm_updated_at',
+]
+
+SECONDS_PER_DAY = 86400.0
+
+ORDER_DTYPE = np.dtype([('customer_id', np.int64), ('created_at', np.float64), ('total_price', np.float64)])
+
+
+def quantile_scores(values: np.ndarray, buckets: int = RFM_BUCKETS) -> np.ndarray:
+    """Score each value 1..buckets by the quantile bucket it falls in (higher value, higher score)"""
+    if values.size == 0:
+        return np.zeros(0, dtype=np.int64)
+    edges = np.quantile(values, np.linspace(0, 1, buckets + 1)[1:-1])
+    return np.searchsorted(edges, values, side='right') + 1
+
+
+def rfm_segments(recency: np.ndarray, frequency: np.ndarray) -> np.ndarray:
+    """Map recency and frequency scores to Customer.RFMSegment values"""
+    segment = Customer.RFMSegment
+    conditions = [
+        (recency >= 4) & (frequency >= 4),
+        (recency >= 4) & (frequency <= 1),
+        (recency >= 3) & (frequency >= 3),
+        recency >= 3,
+        frequency >= 3,
+    ]
+    choices = [segment.CHAMPIONS, segment.NEW, segment.LOYAL, segment.POTENTIAL_LOYALIST, segment.AT_RISK]
+    return np.select(conditions, [str(choice) for choice in choices], default=str(segment.HIBERNATING))
+
+
+def compute_rfm(customer_ids: np.ndarray, order_times: np.ndarray, totals: np.ndarray, now: float) -> Dict:
+    """
+    Compute per-customer RFM scores and LTV from one row per order.
+
+    order_times are POSIX timestamps. Returns arrays aligned with the sorted
+    unique customer ids.
+    """
+    order = np.lexsort((order_times, customer_ids))
+    customer_ids = customer_ids[order]
+    order_times = order_times[order]
+    totals = totals[order]
+
+    ids, starts, frequency = np.unique(customer_ids, return_index=True, return_counts=True)
+    ends = starts + frequency - 1
+    first_order = order_times[starts]
+    last_order = order_times[ends]
+    monetary = np.add.reduceat(totals, starts) if ids.size else np.zeros(0)
+
+    recency_days = np.maximum((now - last_order) // SECONDS_PER_DAY, 0).astype(np.int64)
+    tenure_days = (last_order - first_order) / SECONDS_PER_DAY
+
+    # Fewer days since the last order is better, so recency is scored on the negated value
+    recency_score = quantile_scores(-recency_days)
+    frequency_score = quantile_scores(frequency)
+    monetary_score = quantile_scores(monetary)
+
+    average_order_value = monetary / frequency
+    orders_per_year = frequency / (np.maximum(tenure_days, MIN_TENURE_DAYS) / 365.0)
+    predicted_ltv = average_order_value * orders_per_year * LTV_HORIZON_YEARS
+
+    return {
+        'ids': ids,
+        'last_order': last_order,
+        'recency_days': recency_days,
+        'tenure_days': tenure_days,
+        'recency_score': recency_score,
+        'frequency_score': frequency_score,
+        'monetary_score': monetary_score,
+        'segment': rfm_segments(recency_score, frequency_score),
+        'predicted_ltv': predicted_ltv,
+    }
+
+
+def _load_orders(company: Company):
+    """
+    Load one row per non-cancelled order, live and archived, as customer id,
+    created_at timestamp and total price arrays.
+
+    Each chunk of the query is read straight into a structured array, so no
+    Python list of the rows is built.
+    """
+    chunks = []
+    for order_model, _ in order_sources():
+        rows = order_model.objects.filter(company=company).exclude(erp_status='Cancelled').order_by().values_list(
+            'customer_id', 'created_at', 'total_price'
+        ).iterator(chunk_size=LOAD_CHUNK_SIZE)
+        while True:
+            chunk = np.fromiter(
+                ((customer_id, created_at.timestamp(), total_price)
+                 for customer_id, created_at, total_price in islice(rows, LOAD_CHUNK_SIZE)),
+                dtype=ORDER_DTYPE,
+            )
+            if not chunk.size:
+                break
+            chunks.append(chunk)
+    orders = np.concatenate(chunks) if chunks else np.zeros(0, dtype=ORDER_DTYPE)
+    return orders['customer_id'], orders['created_at'], orders['total_price']
+
+
+def _money(value: float) -> Decimal:
+    return Decimal(str(round(float(value), 2)))
+
+
+def update_customer_rfm(company: Company) -> Dict:
+    """Recompute RFM scores, segments and LTV for every customer of a company from its orders"""
+    started = time.monotonic()
+    now = timezone.now()
+    customer_ids, order_times, totals = _load_orders(company)
+    result = compute_rfm(customer_ids, order_times, totals, now.timestamp())
+
+    customers = [
+        Customer(
+            id=int(customer_id),
+            last_order_at=datetime.fromtimestamp(last_order, tz=dt_timezone.utc),
+            recency_days=int(recency_days),
+            rfm_recency_score=int(recency_score),
+            rfm_frequency_score=int(frequency_score),
+            rfm_monetary_score=int(monetary_score),
+            rfm_segment=segment,
+            predicted_ltv=_money(ltv),
+            lifetime_duration=_money(tenure_days),
+            rfm_updated_at=now,
+        )
+        for customer_id, last_order, recency_days, recency_score, frequency_score,
+            monetary_score, segment, ltv, tenure_days in zip(
+                result['ids'].tolist(), result['last_order'].tolist(), result['recency_days'].tolist(),
+                result['recency_score'].tolist(), result['frequency_score'].tolist(),
+                result['monetary_score'].tolist(), result['segment'].tolist(),
+                result['predicted_ltv'].tolist(), result['tenure_days'].tolist(),
+            )
+    ]
+
+    with transaction.atomic():
+        Customer.objects.bulk_update(customers, RFM_FIELDS, batch_size=UPDATE_BATCH_SIZE)
+        # Customers whose orders are all gone lose their scores
+        cleared = Customer.objects.filter(
+            company=company, rfm_updated_at__isnull=False
+        ).exclude(rfm_updated_at=now).update(
+            last_order_at=None, recency_days=None, rfm_recency_score=None, rfm_frequency_score=None,
+            rfm_monetary_score=None, rfm_segment=None, predicted_ltv=None, rfm_updated_at=None,
+        )
+
+    elapsed = time.monotonic() - started
+    logger.info(
+        f"Computed RFM for company {company.id}: {len(customers)} customers from "
+        f"{customer_ids.size} orders in {elapsed:.2f}s"
+    )
+    return {'orders': int(customer_ids.size), 'customers': len(customers), 'cleared': cleared, 'seconds': elapsed}
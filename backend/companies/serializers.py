@@ -1,5 +1,6 @@
 from rest_framework import serializers
-from .models import Company, Department, Customer
+from .models import Company, Department, Customer, SyncRun, format_full_name
+from core.fast_serializers import ValuesSerializer
 from accounts.models import User
 
 class CompanySerializer(serializers.ModelSerializer):
@@ -14,6 +15,7 @@ class CompanySerializer(serializers.ModelSerializer):
             'id', 'name', 'registration_number', 'email', 'phone', 'address', 'city', 'state',
             'country', 'postal_code', 'shopify_domain', 'shopify_access_token',
             'shiprocket_email', 'shiprocket_token', 'owner',
+            'low_stock_threshold', 'out_of_stock_threshold',
             'employees_count', 'departments_count', 'admin_count',
             'has_shopify_token', 'is_active', 'created_at', 'updated_at'
         ]
@@ -23,6 +25,15 @@ class CompanySerializer(serializers.ModelSerializer):
             'shiprocket_token': {'write_only': True}
         }
 
+    def validate(self, attrs):
+        low = attrs.get('low_stock_threshold', getattr(self.instance, 'low_stock_threshold', 10))
+        out = attrs.get('out_of_stock_threshold', getattr(self.instance, 'out_of_stock_threshold', 0))
+        if out > low:
+            raise serializers.ValidationError({
+                'out_of_stock_threshold': 'Cannot be higher than the low stock threshold.'
+            })
+        return attrs
+
     def get_employees_count(self, obj):
         from employees.models import Employee
         return Employee.objects.filter(company=obj).count()
@@ -175,12 +186,52 @@ class CustomerSerializer(serializers.ModelSerializer):
             'cust_code',
             'city',
             'state',
-            'country'
+            'country',
+            'last_order_at',
+            'recency_days',
+            'rfm_recency_score',
+            'rfm_frequency_score',
+            'rfm_monetary_score',
+            'rfm_segment',
+            'predicted_ltv',
+            'rfm_updated_at'
+        ]
+        read_only_fields = [
+            'id', 'company', 'created_at', 'updated_at',
+            'last_order_at', 'recency_days', 'rfm_recency_score', 'rfm_frequency_score',
+            'rfm_monetary_score', 'rfm_segment', 'predicted_ltv', 'rfm_updated_at'
         ]
-        read_only_fields = ['id', 'company', 'created_at', 'updated_at']
 
     def get_display_name(self, obj):
         """Returns the customer's full name or other identifier if name is not available"""
-        if obj.full_name:
-            return obj.full_name
-        return obj.email or obj.phone or f"Customer {obj.shopify_customer_id}" 
\ No newline at end of file
+        return customer_display_name(obj.full_name, obj.email, obj.phone, obj.shopify_customer_id)
+
+
+def customer_display_name(full_name, email, phone, shopify_customer_id):
+    return full_name or email or phone or f"Customer {shopify_customer_id}"
+
+
+class CustomerValuesSerializer(ValuesSerializer):
+    """CustomerSerializer output for customer lists, read from .values() rows"""
+    serializer_class = CustomerSerializer
+    method_columns = ('first_name', 'last_name', 'email', 'phone', 'shopify_customer_id')
+
+    def get_display_name(self, row):
+        return customer_display_name(
+            format_full_name(row['first_name'], row['last_name']), row['email'], row['phone'],
+            row['shopify_customer_id']
+        )
+
+class SyncRunSerializer(serializers.ModelSerializer):
+    triggered_by_email = serializers.EmailField(source='triggered_by.email', read_only=True, default=None)
+
+    class Meta:
+        model = SyncRun
+        fields = [
+            'id', 'resource', 'trigger', 'triggered_by', 'triggered_by_email', 'status',
+            'started_at', 'finished_at', 'duration_seconds',
+            'pages', 'api_cost', 'fetch_seconds', 'throttle_wait_seconds', 'write_seconds',
+            'rows_fetched', 'created', 'updated', 'unchanged', 'failed', 'rows_per_second',
+            'errors', 'error_message',
+        ]
+        read_only_fields = fields
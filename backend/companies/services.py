@@ -1,12 +1,429 @@
+import decimal
+import json
+import logging
+import time
 import requests
+from decimal import Decimal
 from typing import Dict, List, Optional
 from django.conf import settings
-from .models import Company, Customer
+from django.core.exceptions import ValidationError
+from .models import (
+    Company,
+    Customer,
+    validate_phone_number,
+    validate_currency_code,
+    validate_amount,
+    validate_tags,
+)
+from .utils.shopify_client import CUSTOMER_BATCH_SIZE, PUSH_READ_CHUNK_SIZE, shopify_api_url
+from .utils.sync_hash import content_hash, field_hashes
+from core.metrics import record_sync
+
+logger = logging.getLogger(__name__)
+
+
+def build_shopify_customer_data(customer: Customer) -> Dict:
+    """Build the Shopify payload for a customer"""
+    # Parse tags from JSON string to array
+    try:
+        tags = json.loads(customer.tags) if customer.tags else []
+    except json.JSONDecodeError:
+        tags = []
+
+    # Format address data
+    addresses = []
+    if customer.addresses and isinstance(customer.addresses, list):
+        for addr in customer.addresses:
+            if isinstance(addr, dict):
+                formatted_addr = {
+                    'address1': addr.get('address1', ''),
+                    'city': addr.get('city', ''),
+                    'province': addr.get('province', ''),
+                    'country': addr.get('country', ''),
+                    'zip': addr.get('zip', '')
+                }
+                addresses.append(formatted_addr)
+
+    shopify_data = {
+        'email': customer.email,
+        'phone': customer.phone,
+        'firstName': customer.first_name,
+        'lastName': customer.last_name,
+        'note': customer.note,
+        'tags': tags,  # Now it's an array
+        'addresses': addresses  # Now it's an array of properly formatted address objects
+    }
+
+    # Add default address if any field is present
+    if customer.default_address_line or customer.city or customer.state or customer.country:
+        default_address = {
+            'address1': customer.default_address_line or '',
+            'city': customer.city or '',
+            'province': customer.state or '',
+            'country': customer.country or '',
+        }
+        # Only add if at least one field has a value
+        if any(default_address.values()):
+            shopify_data['addresses'].append(default_address)
+
+    return shopify_data
+
+
+def is_valid_shopify_customer_id(shopify_id: Optional[str]) -> bool:
+    """Check that a stored Shopify customer ID came from a real Shopify sync"""
+    return bool(shopify_id) and shopify_id != 'existing_shopify_id' and (
+        shopify_id.isdigit() or shopify_id.startswith('gid://')
+    )
+
+
+def build_changed_customer_data(customer: Customer) -> Optional[Dict]:
+    """
+    Build a Shopify payload holding only the fields changed since the last sync.
+    Returns None when nothing changed.
+    """
+    shopify_data = build_shopify_customer_data(customer)
+    stored = customer.shopify_field_hashes or {}
+    current = field_hashes(shopify_data)
+    changed = {key: value for key, value in shopify_data.items() if stored.get(key) != current[key]}
+    return changed or None
+
+
+def set_customer_sync_hashes(customer: Customer) -> None:
+    """Set the customer's push hashes from its current Shopify fields, without saving"""
+    shopify_data = build_shopify_customer_data(customer)
+    customer.shopify_push_hash = content_hash(shopify_data)
+    customer.shopify_field_hashes = field_hashes(shopify_data)
+
+
+def mark_customers_synced(customers: List[Customer]) -> None:
+    """Record the customers' current Shopify fields as synced, in one bulk UPDATE"""
+    for customer in customers:
+        set_customer_sync_hashes(customer)
+    Customer.objects.bulk_update(customers, ['shopify_push_hash', 'shopify_field_hashes'])
+
+
+def mark_customer_synced(customer: Customer) -> None:
+    """Record the customer's current Shopify fields as synced"""
+    mark_customers_synced([customer])
+
+
+def _push_customer_batch(client, batch: List[tuple], result: Dict) -> None:
+    responses = client.bulk_update_customers(
+        [(customer.shopify_customer_id, shopify_data) for customer, shopify_data in batch], batch_size=len(batch)
+    )
+    synced = []
+    for (customer, _), response in zip(batch, responses):
+        if 'errors' in response:
+            result['errors'].append({'customer_id': customer.id, 'error': str(response['errors'])})
+        else:
+            synced.append(customer)
+    mark_customers_synced(synced)
+    result['pushed'] += [customer.id for customer in synced]
+
+
+def push_dirty_customers(client, customers, batch_size: int = CUSTOMER_BATCH_SIZE) -> Dict:
+    """
+    Push the customers whose Shopify fields changed since the last sync.
+
+    The queryset is read PUSH_READ_CHUNK_SIZE rows at a time. Dirty customers
+    go to Shopify batch_size per batched mutation, and the hashes of each
+    pushed batch are written with one bulk UPDATE.
+    Returns the pushed ids, the number unchanged and per-customer errors.
+    """
+    result = {'pushed': [], 'unchanged': 0, 'errors': []}
+    batch = []
+    pks = list(customers.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(pks), PUSH_READ_CHUNK_SIZE):
+        for customer in customers.filter(pk__in=pks[start:start + PUSH_READ_CHUNK_SIZE]).order_by('pk'):
+            if not is_valid_shopify_customer_id(customer.shopify_customer_id):
+                result['errors'].append({
+                    'customer_id': customer.id,
+                    'error': 'Invalid Shopify ID. Please sync customers from Shopify first to get valid IDs.'
+                })
+                continue
+            shopify_data = build_changed_customer_data(customer)
+            if shopify_data is None:
+                result['unchanged'] += 1
+                continue
+            batch.append((customer, shopify_data))
+            if len(batch) == batch_size:
+                _push_customer_batch(client, batch, result)
+                batch = []
+    if batch:
+        _push_customer_batch(client, batch, result)
+    return result
+
+
+def validate_customer_data(data: Dict) -> None:
+    """Validate data types for customer fields"""
+
+    errors = {}
+
+    # Phone validation
+    if 'phone' in data and data['phone'] is not None:
+        try:
+            validate_phone_number(data['phone'])
+        except ValidationError as e:
+            errors['phone'] = str(e)
+
+    # Currency code validation
+    if 'currency_code' in data and data['currency_code'] is not None:
+        try:
+            validate_currency_code(data['currency_code'])
+        except ValidationError as e:
+            errors['currency_code'] = str(e)
+
+    # Amount validations
+    if 'amount_spent' in data:
+        try:
+            amount = Decimal(str(data['amount_spent']))
+            validate_amount(amount)
+        except (ValidationError, decimal.InvalidOperation) as e:
+            errors['amount_spent'] = str(e)
+
+    if 'lifetime_duration' in data:
+        try:
+            duration = Decimal(str(data['lifetime_duration']))
+            validate_amount(duration)
+        except (ValidationError, decimal.InvalidOperation) as e:
+            errors['lifetime_duration'] = str(e)
+
+    # Tags validation
+    if 'tags' in data and data['tags'] is not None:
+        try:
+            validate_tags(data['tags'])
+        except ValidationError as e:
+            errors['tags'] = str(e)
+
+    # Address validation
+    if 'addresses' in data and data['addresses'] is not None:
+        try:
+            if not isinstance(data['addresses'], list):
+                errors['addresses'] = 'Addresses must be a list'
+            else:
+                for i, addr in enumerate(data['addresses']):
+                    if not isinstance(addr, dict):
+                        errors[f'addresses[{i}]'] = 'Address must be an object'
+                        continue
+
+                    # Validate required fields
+                    required_fields = ['address1', 'city', 'province', 'country']
+                    missing = [f for f in required_fields if not addr.get(f)]
+                    if missing:
+                        errors[f'addresses[{i}]'] = f'Missing required fields: {", ".join(missing)}'
+                        continue
+
+                    # Validate field lengths
+                    if len(addr.get('address1', '')) > 255:
+                        errors[f'addresses[{i}].address1'] = 'Address line is too long (max 255 characters)'
+                    if len(addr.get('city', '')) > 100:
+                        errors[f'addresses[{i}].city'] = 'City name is too long (max 100 characters)'
+                    if len(addr.get('province', '')) > 100:
+                        errors[f'addresses[{i}].province'] = 'Province/State name is too long (max 100 characters)'
+                    if len(addr.get('country', '')) > 100:
+                        errors[f'addresses[{i}].country'] = 'Country name is too long (max 100 characters)'
+                    if 'zip' in addr and len(addr['zip']) > 20:
+                        errors[f'addresses[{i}].zip'] = 'ZIP/Postal code is too long (max 20 characters)'
+
+        except Exception as e:
+            errors['addresses'] = f'Invalid address format: {str(e)}'
+
+    # Text field length validations
+    text_fields = {
+        'city': 100,
+        'state': 100,
+        'country': 100,
+        'cust_code': 50,
+        'default_address_line': 255,
+        'default_address_formatted_area': 255
+    }
+
+    for field, max_length in text_fields.items():
+        if field in data and data[field] is not None:
+            if not isinstance(data[field], str):
+                errors[field] = f'{field} must be a string'
+            elif len(data[field]) > max_length:
+                errors[field] = f'{field} is too long (max {max_length} characters)'
+
+    if errors:
+        raise ValidationError(errors)
+
+
+def uses_shopify_customer_stats(company: Company) -> bool:
+    """
+    Whether customers still take number_of_orders and amount_spent from
+    Shopify, i.e. recompute_customer_order_stats never ran for the company.
+    Read from the database, as the company may come from the auth cache.
+    """
+    return Company.objects.filter(pk=company.pk, customer_stats_recomputed_at__isnull=True).exists()
+
+
+def upsert_shopify_customer(company: Company, data: Dict, existing_customer: Optional[Customer] = None,
+                            payload_hash: Optional[str] = None, shopify_stats: Optional[bool] = None) -> tuple:
+    """
+    Create or update a customer from a Shopify customer payload shaped like
+    ShopifyGraphQLClient.get_all_customers() output. shopify_stats is
+    uses_shopify_customer_stats(company), looked up when not given.
+    Returns (customer, created).
+    """
+    # Validate data types
+    validate_customer_data(data)
+
+    if payload_hash is None:
+        payload_hash = content_hash(data)
+
+    # Format addresses as objects
+    formatted_addresses = []
+    if data.get('addresses'):
+        for addr in data['addresses']:
+            formatted_addresses.append({
+                'address1': addr.get('address1', ''),
+                'city': addr.get('city', ''),
+                'province': addr.get('province', ''),
+                'country': addr.get('country', ''),
+                'zip': addr.get('zip', '')
+            })
+
+    # Format tags properly, keeping tags that are already a JSON array
+    tags = data.get('tags', '[]')
+    try:
+        tags_are_json = isinstance(tags, str) and isinstance(json.loads(tags), list)
+    except ValueError:
+        tags_are_json = False
+    if isinstance(tags, str) and not tags_are_json:
+        # Remove any nested quotes and brackets
+        tags = tags.strip('[]').replace("'", '"')
+        if not tags:
+            tags = '[]'
+        elif not tags.startswith('['):
+            tags = f'["{tags}"]'
+
+    # Preserve custom fields if customer exists
+    defaults = {
+        'first_name': data.get('first_name', ''),
+        'last_name': data.get('last_name', ''),
+        'email': data.get('email', ''),
+        'phone': data.get('phone', ''),
+        'verified_email': bool(data.get('verified_email', False)),
+        'currency_code': data.get('currency_code', ''),
+        'default_address_line': data.get('default_address_line', ''),
+        'default_address_formatted_area': data.get('default_address_formatted_area', ''),
+        'addresses': formatted_addresses,
+        'created_at': data.get('created_at'),
+        'updated_at': data.get('updated_at'),
+        'valid_email_address': bool(data.get('email')),
+        'note': data.get('note', ''),
+        'tags': tags,
+        'shopify_payload_hash': payload_hash,
+    }
+    # Once rebuilt from local orders (see orders.services), number_of_orders
+    # and amount_spent are kept up to date from them; until then Shopify's
+    # figures are the best there are.
+    if shopify_stats is None:
+        shopify_stats = uses_shopify_customer_stats(company)
+    if shopify_stats:
+        defaults['number_of_orders'] = int(data.get('number_of_orders') or 0)
+        defaults['amount_spent'] = str(data.get('amount_spent') or '0.00')
+
+    if existing_customer is None:
+        existing_customer = Customer.objects.filter(
+            company=company,
+            shopify_customer_id=data['id']
+        ).first()
+
+    if existing_customer:
+        # Only update location if not already set
+        if not existing_customer.city:
+            defaults['city'] = data.get('city', '')
+        if not existing_customer.state:
+            defaults['state'] = data.get('state', '')
+        if not existing_customer.country:
+            defaults['country'] = data.get('country', '')
+        customer = existing_customer
+        for key, value in defaults.items():
+            setattr(customer, key, value)
+        created = False
+    else:
+        customer = Customer(company=company, shopify_customer_id=data['id'], **defaults)
+        created = True
+
+    # The local copy now matches Shopify, so it is not dirty
+    set_customer_sync_hashes(customer)
+    customer.save()
+    return customer, created
+
+
+def sync_shopify_customers(company: Company, data_list: List[Dict]) -> Dict:
+    """
+    Upsert customers fetched from Shopify, skipping the ones that did not change.
+    Payload hashes are compared with one query, and only changed customers are
+    loaded and saved.
+    Returns created/updated/unchanged counts and error details.
+    """
+    started = time.monotonic()
+    stats = {'created': 0, 'updated': 0, 'unchanged': 0, 'error_count': 0, 'errors': []}
+
+    payload_hashes = {str(data.get('id')): content_hash(data) for data in data_list}
+    stored_hashes = dict(
+        Customer.objects.filter(
+            company=company,
+            shopify_customer_id__in=list(payload_hashes)
+        ).values_list('shopify_customer_id', 'shopify_payload_hash')
+    )
+    changed_ids = [
+        shopify_id for shopify_id, payload_hash in payload_hashes.items()
+        if shopify_id in stored_hashes and stored_hashes[shopify_id] != payload_hash
+    ]
+    existing_customers = Customer.objects.filter(company=company).in_bulk(
+        changed_ids, field_name='shopify_customer_id'
+    )
+    shopify_stats = uses_shopify_customer_stats(company)
+
+    for data in data_list:
+        shopify_id = str(data.get('id'))
+        try:
+            payload_hash = payload_hashes[shopify_id]
+            if stored_hashes.get(shopify_id) == payload_hash:
+                stats['unchanged'] += 1
+                continue
+
+            customer, created = upsert_shopify_customer(
+                company,
+                data,
+                existing_customer=existing_customers.get(shopify_id),
+                payload_hash=payload_hash,
+                shopify_stats=shopify_stats,
+            )
+            stats['created' if created else 'updated'] += 1
+
+        except (ValueError, TypeError) as e:
+            stats['error_count'] += 1
+            stats['errors'].append({
+                'customer_id': data.get('id'),
+                'error': str(e)
+            })
+            logger.error(f"Data type error syncing customer {data.get('id')}: {str(e)}")
+            continue
+        except Exception as e:
+            stats['error_count'] += 1
+            stats['errors'].append({
+                'customer_id': data.get('id'),
+                'error': str(e)
+            })
+            logger.error(f"Error syncing customer {data.get('id')}: {str(e)}")
+            continue
+
+    record_sync(
+        'customers', time.monotonic() - started, created=stats['created'], updated=stats['updated'],
+        unchanged=stats['unchanged'], failed=stats['error_count']
+    )
+    return stats
+
 
 class ShopifyService:
     def __init__(self, company: Company):
         self.company = company
-        self.shop_url = f"https://{company.shopify_domain}/admin/api/2024-01/graphql.json"
+        self.shop_url = shopify_api_url(company.shopify_domain)
         self.access_token = company.shopify_access_token
         
     def _get_headers(self) -> Dict:
@@ -93,6 +510,7 @@ class ShopifyService:
         """
         stats = {"created": 0, "updated": 0, "failed": 0}
         cursor = None
+        shopify_stats = uses_shopify_customer_stats(self.company)
         
         while True:
             try:
@@ -120,32 +538,34 @@ class ShopifyService:
                         avg_order = shopify_customer.get('averageOrderAmountV2', {})
                         currency_code = avg_order.get('currencyCode') if avg_order else None
                         
+                        defaults = {
+                            "email": shopify_customer.get('email'),
+                            "phone": shopify_customer.get('phone'),
+                            "currency_code": currency_code,
+                            "created_at": shopify_customer.get('createdAt'),
+                            "updated_at": shopify_customer.get('updatedAt'),
+                            "verified_email": shopify_customer.get('verifiedEmail', False),
+                            "note": shopify_customer.get('note'),
+                            "tags": shopify_customer.get('tags'),
+                            "addresses": addresses,
+                            "src": shopify_customer.get('image', {}).get('url'),
+                            # Set default address if available
+                            "default_address_formatted_area": default_address.get('formatted', ''),
+                            "default_address_line": (
+                                f"{default_address.get('address1', '')} "
+                                f"{default_address.get('address2', '')}"
+                            ).strip(),
+                            "city": default_address.get('city'),
+                            "state": default_address.get('province'),
+                            "country": default_address.get('country'),
+                        }
+                        if shopify_stats:
+                            defaults["number_of_orders"] = shopify_customer.get('ordersCount', 0)
+                            defaults["amount_spent"] = float(shopify_customer.get('totalSpent', 0))
                         customer, created = Customer.objects.update_or_create(
                             company=self.company,
                             shopify_customer_id=shopify_id,
-                            defaults={
-                                "email": shopify_customer.get('email'),
-                                "phone": shopify_customer.get('phone'),
-                                "number_of_orders": shopify_customer.get('ordersCount', 0),
-                                "amount_spent": float(shopify_customer.get('totalSpent', 0)),
-                                "currency_code": currency_code,
-                                "created_at": shopify_customer.get('createdAt'),
-                                "updated_at": shopify_customer.get('updatedAt'),
-                                "verified_email": shopify_customer.get('verifiedEmail', False),
-                                "note": shopify_customer.get('note'),
-                                "tags": shopify_customer.get('tags'),
-                                "addresses": addresses,
-                                "src": shopify_customer.get('image', {}).get('url'),
-                                # Set default address if available
-                                "default_address_formatted_area": default_address.get('formatted', ''),
-                                "default_address_line": (
-                                    f"{default_address.get('address1', '')} "
-                                    f"{default_address.get('address2', '')}"
-                                ).strip(),
-                                "city": default_address.get('city'),
-                                "state": default_address.get('province'),
-                                "country": default_address.get('country'),
-                            }
+                            defaults=defaults
                         )
                         
                         if created:
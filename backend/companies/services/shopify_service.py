@@ -6,6 +6,7 @@ from decimal import Decimal
 import time
 from typing import Optional, Dict, List
 import logging
+from core.metrics import SHOPIFY_THROTTLE_WAIT
 
 logger = logging.getLogger(__name__)
 
@@ -19,7 +20,9 @@ class ShopifyRateLimiter:
         current_time = time.time()
         time_since_last_call = current_time - self.last_call_time
         if time_since_last_call < (1.0 / self.calls_per_second):
-            time.sleep((1.0 / self.calls_per_second) - time_since_last_call)
+            wait = (1.0 / self.calls_per_second) - time_since_last_call
+            SHOPIFY_THROTTLE_WAIT.inc(wait, client='rest')
+            time.sleep(wait)
         self.last_call_time = time.time()
 
 class ShopifyService:
@@ -0,0 +1,516 @@
+import base64
+import csv
+import hashlib
+import hmac
+import io
+import json
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+import numpy as np
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from companies.models import Company, Customer, ShopifyWebhookEvent, SyncRun
+from companies.rfm import compute_rfm, update_customer_rfm
+from companies.serializers import CustomerSerializer, CustomerValuesSerializer
+from companies.services import (
+    build_changed_customer_data, mark_customer_synced, push_dirty_customers, sync_shopify_customers,
+)
+from companies.utils.shopify_client import ShopifyGraphQLClient
+from companies.webhooks import claim_webhook_events, process_webhook_events
+from core.fake_shopify import FakeShopify, api_url, generate_store, start_server
+from core.synthetic import generate_tenant
+from orders.models import Order
+from products.models import Product
+
+
+def _response(payload):
+    response = mock.Mock(status_code=200)
+    response.json.return_value = payload
+    return response
+
+
+def _echo_mutations(url, json=None, headers=None):
+    """Answer every aliased mutation in the request with an empty success."""
+    data = {}
+    for name, value in json['variables'].items():
+        if name.startswith('c'):
+            data[name] = {'customer': {'id': value['id']}, 'userErrors': []}
+        elif name.startswith('pid'):
+            continue
+        elif name.startswith('p'):
+            data[name] = {'product': {'id': value['id']}, 'userErrors': []}
+        elif name.startswith('v'):
+            data[name] = {'productVariants': [{'id': v['id']} for v in value], 'userErrors': []}
+    return _response({'data': data})
+
+
+class ShopifyBulkPushTests(SimpleTestCase):
+    def setUp(self):
+        self.shopify = ShopifyGraphQLClient('bulk-push.myshopify.com', 'token')
+
+    def test_customers_are_pushed_in_batches_and_returned_in_order(self):
+        customers = [(str(i), {'email': f'c{i}@example.com'}) for i in range(1, 31)]
+        with mock.patch('companies.utils.shopify_client.requests.post', side_effect=_echo_mutations) as post:
+            results = self.shopify.bulk_update_customers(customers, batch_size=25)
+
+        self.assertEqual(post.call_count, 2)
+        self.assertEqual(len(post.call_args_list[0].kwargs['json']['variables']), 25)
+        self.assertEqual(
+            [result['customer']['id'] for result in results],
+            [f'gid://shopify/Customer/{i}' for i in range(1, 31)],
+        )
+
+    def test_product_and_variants_are_updated_in_one_request(self):
+        product = {
+            'title': 'Tee',
+            'variants': [{'id': '11', 'price': '10.00'}, {'id': '12', 'price': '12.00'}, {'price': '1.00'}],
+        }
+        with mock.patch('companies.utils.shopify_client.requests.post', side_effect=_echo_mutations) as post:
+            result = self.shopify.update_product('7', product)
+
+        self.assertEqual(post.call_count, 1)
+        query = post.call_args.kwargs['json']['query']
+        self.assertIn('productUpdate', query)
+        self.assertEqual(query.count('productVariantsBulkUpdate'), 1)
+        self.assertEqual(result['product'], {'id': 'gid://shopify/Product/7'})
+        self.assertEqual(len(result['productVariants']), 2)
+
+    def test_cleared_variant_fields_are_sent_as_null(self):
+        product = {'variants': [
+            {'id': '11', 'price': '10.00', 'compareAtPrice': None, 'sku': '', 'barcode': None},
+            {'id': '12', 'price': '12.00', 'compareAtPrice': '15.00', 'sku': 'TEE-M'},
+        ]}
+        with mock.patch('companies.utils.shopify_client.requests.post', side_effect=_echo_mutations) as post:
+            self.shopify.update_product('7', product)
+
+        cleared, kept = post.call_args.kwargs['json']['variables']['v0']
+        self.assertEqual((cleared['compareAtPrice'], cleared['sku'], cleared['barcode']), (None, None, None))
+        self.assertEqual((kept['compareAtPrice'], kept['sku']), ('15.00', 'TEE-M'))
+        self.assertNotIn('barcode', kept)
+
+    def test_throttled_request_is_retried(self):
+        throttled = _response({
+            'errors': [{'message': 'Throttled', 'extensions': {'code': 'THROTTLED'}}],
+            'extensions': {'cost': {'requestedQueryCost': 100, 'throttleStatus': {'currentlyAvailable': 50, 'restoreRate': 50}}},
+        })
+        responses = iter([throttled])
+
+        def post(url, json=None, headers=None):
+            return next(responses, None) or _echo_mutations(url, json=json, headers=headers)
+
+        with mock.patch('companies.utils.shopify_client.requests.post', side_effect=post), \
+                mock.patch('companies.utils.shopify_client.time.sleep') as sleep:
+            result = self.shopify.update_customer('5', {'email': 'c5@example.com'})
+
+        sleep.assert_called_once_with(1.0)
+        self.assertEqual(result['customer'], {'id': 'gid://shopify/Customer/5'})
+
+
+class CustomerChangeTrackingTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(email='owner@example.com', password='secret', role='PARENT')
+        self.company = Company.objects.create(name='Acme', owner=user, email='acme@example.com',
+                                              shopify_domain='acme.myshopify.com', shopify_access_token='token')
+        user.company = self.company
+        user.save()
+        self.api = APIClient()
+        self.api.force_authenticate(user)
+        self.customers = [
+            Customer.objects.create(company=self.company, email=f'c{i}@example.com', first_name=f'C{i}',
+                                    shopify_customer_id=str(100 + i))
+            for i in range(3)
+        ]
+        for customer in self.customers:
+            mark_customer_synced(customer)
+
+    def bulk_push(self):
+        with mock.patch('companies.utils.shopify_client.requests.post', side_effect=_echo_mutations) as post:
+            response = self.api.post('/companies/api/customers/bulk-push-to-shopify/', format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['data'], post
+
+    def test_only_changed_fields_are_built(self):
+        customer = Customer.objects.get(pk=self.customers[0].pk)
+        self.assertIsNone(build_changed_customer_data(customer))
+
+        customer.first_name = 'Renamed'
+        self.assertEqual(build_changed_customer_data(customer), {'firstName': 'Renamed'})
+
+    def test_bulk_push_sends_only_dirty_customers(self):
+        data, post = self.bulk_push()
+        self.assertEqual((data['pushed'], data['unchanged']), ([], 3))
+        self.assertEqual(post.call_count, 0)
+
+        Customer.objects.filter(pk=self.customers[1].pk).update(note='VIP')
+        data, post = self.bulk_push()
+        self.assertEqual((data['pushed'], data['unchanged']), ([self.customers[1].pk], 2))
+        sent = post.call_args.kwargs['json']['variables']
+        self.assertEqual(sent, {'c0': {'id': 'gid://shopify/Customer/101', 'note': 'VIP'}})
+
+        data, post = self.bulk_push()
+        self.assertEqual((data['pushed'], data['unchanged']), ([], 3))
+
+
+class CustomerShopifySyncTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(email='owner@example.com', password='secret', role='PARENT')
+        self.company = Company.objects.create(name='Acme', owner=user, email='acme@example.com')
+        self.payloads = [
+            {'id': str(200 + i), 'first_name': f'C{i}', 'last_name': 'Doe', 'email': f'c{i}@example.com',
+             'amount_spent': '10.00', 'number_of_orders': 1, 'tags': [],
+             'created_at': '2024-01-01T00:00:00Z', 'updated_at': '2024-01-02T00:00:00Z'}
+            for i in range(3)
+        ]
+
+    def test_unchanged_resync_writes_nothing(self):
+        stats = sync_shopify_customers(self.company, self.payloads)
+        self.assertEqual((stats['created'], stats['errors']), (3, []))
+
+        with CaptureQueriesContext(connection) as queries:
+            stats = sync_shopify_customers(self.company, self.payloads)
+        self.assertEqual((stats['created'], stats['updated'], stats['unchanged']), (0, 0, 3))
+        self.assertEqual([query['sql'] for query in queries if not query['sql'].startswith('SELECT')], [])
+
+    def test_changed_payload_is_saved(self):
+        sync_shopify_customers(self.company, self.payloads)
+        self.payloads[1] = dict(self.payloads[1], first_name='Renamed', updated_at='2024-02-01T00:00:00Z')
+
+        stats = sync_shopify_customers(self.company, self.payloads)
+        self.assertEqual((stats['updated'], stats['unchanged']), (1, 2))
+        customer = Customer.objects.get(company=self.company, shopify_customer_id='201')
+        self.assertEqual(customer.first_name, 'Renamed')
+        self.assertIsNone(build_changed_customer_data(customer))
+
+
+class ShopifyWebhookTests(TestCase):
+    secret = 'webhook-secret'
+
+    def setUp(self):
+        owner = User.objects.create_user(email='hooks@example.com', password='secret', role='PARENT')
+        self.company = Company.objects.create(name='Hooks', owner=owner, email='hooks-co@example.com',
+                                              shopify_domain='hooks.myshopify.com',
+                                              shopify_webhook_secret=self.secret)
+        owner.company = self.company
+        owner.save()
+        self.api = APIClient()
+
+    def order_payload(self, updated_at, total='100.00'):
+        address = {'address1': '1 MG Road', 'city': 'Pune', 'province': 'Maharashtra', 'country': 'India'}
+        return {
+            'id': 5001, 'name': '#5001', 'email': 'hook@example.com', 'created_at': '2026-01-01T10:00:00Z',
+            'updated_at': updated_at, 'subtotal_price': total, 'total_tax': '0.00', 'total_price': total,
+            'shipping_address': address, 'billing_address': address, 'line_items': [],
+        }
+
+    def deliver(self, webhook_id, payload, topic='orders/updated', secret=None):
+        body = json.dumps(payload).encode('utf-8')
+        signature = base64.b64encode(
+            hmac.new((secret or self.secret).encode('utf-8'), body, hashlib.sha256).digest()
+        ).decode('utf-8')
+        return self.api.generic(
+            'POST', '/companies/api/webhooks/shopify/', body, content_type='application/json',
+            HTTP_X_SHOPIFY_TOPIC=topic, HTTP_X_SHOPIFY_SHOP_DOMAIN='hooks.myshopify.com',
+            HTTP_X_SHOPIFY_WEBHOOK_ID=webhook_id, HTTP_X_SHOPIFY_HMAC_SHA256=signature,
+        )
+
+    def test_bad_signature_is_rejected(self):
+        response = self.deliver('w1', self.order_payload('2026-01-01T10:00:00Z'), secret='wrong')
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(ShopifyWebhookEvent.objects.exists())
+
+    def test_redelivery_is_stored_once(self):
+        payload = self.order_payload('2026-01-01T10:00:00Z')
+        self.assertEqual(self.deliver('w1', payload).status_code, 200)
+        self.assertEqual(self.deliver('w1', payload).status_code, 200)
+        self.assertEqual(ShopifyWebhookEvent.objects.filter(webhook_id='w1').count(), 1)
+
+    def test_claimed_events_are_not_claimed_again(self):
+        for n in range(3):
+            self.deliver(f'w{n}', self.order_payload('2026-01-01T10:00:00Z'))
+        first = claim_webhook_events(2)
+        self.assertEqual(len(first), 2)
+        self.assertEqual(claim_webhook_events(2), [
+            ShopifyWebhookEvent.objects.exclude(id__in=first).get().id
+        ])
+        self.assertEqual(claim_webhook_events(2), [])
+        self.assertEqual(set(ShopifyWebhookEvent.objects.values_list('status', 'attempts')),
+                         {(ShopifyWebhookEvent.Status.PROCESSING, 1)})
+
+    def test_events_are_applied_and_failures_retried(self):
+        self.deliver('w1', self.order_payload('2026-01-01T10:00:00Z'), topic='orders/create')
+        self.deliver('w2', {**self.order_payload('2026-01-01T11:00:00Z'), 'email': ''})
+        stats = process_webhook_events()
+        self.assertEqual((stats['processed'], stats['retrying']), (1, 1))
+        self.assertEqual(Order.objects.get(company=self.company).order_id, '#5001')
+        failed = ShopifyWebhookEvent.objects.get(webhook_id='w2')
+        self.assertEqual(failed.status, ShopifyWebhookEvent.Status.PENDING)
+        self.assertIn('no customer email', failed.last_error)
+
+    def test_stale_update_is_skipped(self):
+        self.deliver('w1', self.order_payload('2026-01-01T12:00:00Z', total='150.00'))
+        self.deliver('w2', self.order_payload('2026-01-01T11:00:00Z', total='120.00'))
+        stats = process_webhook_events()
+        self.assertEqual((stats['processed'], stats['stale']), (1, 1))
+        order = Order.objects.get(company=self.company)
+        self.assertEqual(order.total_price, Decimal('150.00'))
+        self.assertEqual(ShopifyWebhookEvent.objects.get(webhook_id='w2').status,
+                         ShopifyWebhookEvent.Status.PROCESSED)
+
+        self.deliver('w3', self.order_payload('2026-01-01T13:00:00Z', total='180.00'))
+        process_webhook_events()
+        order.refresh_from_db()
+        self.assertEqual(order.total_price, Decimal('180.00'))
+
+    def test_stale_product_update_is_skipped(self):
+        def payload(updated_at, title):
+            return {'id': 7001, 'title': title, 'updated_at': updated_at, 'variants': [
+                {'id': 8001, 'title': 'Default Title', 'sku': 'SKU-1', 'price': '10.00', 'inventory_quantity': 5},
+            ]}
+
+        self.deliver('w1', payload('2026-01-01T12:00:00Z', 'Newer'), topic='products/update')
+        self.deliver('w2', payload('2026-01-01T11:00:00Z', 'Older'), topic='products/update')
+        self.assertEqual(process_webhook_events()['stale'], 1)
+        self.assertEqual(Product.objects.get(shopify_product_id='7001').title, 'Newer')
+
+    def test_stale_customer_update_is_skipped(self):
+        def payload(updated_at, first_name):
+            return {'id': 9001, 'email': 'shopper@example.com', 'first_name': first_name, 'updated_at': updated_at}
+
+        self.deliver('w1', payload('2026-01-01T12:00:00Z', 'Newer'), topic='customers/update')
+        self.deliver('w2', payload('2026-01-01T11:00:00Z', 'Older'), topic='customers/update')
+        self.assertEqual(process_webhook_events()['stale'], 1)
+        self.assertEqual(Customer.objects.get(shopify_customer_id='9001').first_name, 'Newer')
+
+        self.deliver('w3', payload('2026-01-01T13:00:00Z', 'Newest'), topic='customers/update')
+        self.assertEqual(process_webhook_events()['stale'], 0)
+        self.assertEqual(Customer.objects.get(shopify_customer_id='9001').first_name, 'Newest')
+
+
+class CustomerRFMTests(TestCase):
+    def test_scores_of_a_fixed_set_of_customers(self):
+        day = 86400.0
+        result = compute_rfm(
+            customer_ids=np.array([1, 1, 2, 3, 3, 3, 4, 5]),
+            order_times=np.array([99, 90, 99, 10, 50, 95, 0, 40]) * day,
+            totals=np.array([100, 200, 50, 100, 200, 300, 20, 1000.0]),
+            now=100 * day,
+        )
+        self.assertEqual(result['ids'].tolist(), [1, 2, 3, 4, 5])
+        self.assertEqual(result['recency_days'].tolist(), [1, 1, 5, 100, 60])
+        # Customers 1 and 2 tie on recency, 2, 4 and 5 on frequency; ties share a score
+        self.assertEqual(result['recency_score'].tolist(), [5, 5, 3, 1, 2])
+        self.assertEqual(result['frequency_score'].tolist(), [4, 3, 5, 3, 3])
+        self.assertEqual(result['monetary_score'].tolist(), [3, 2, 4, 1, 5])
+        self.assertEqual(result['segment'].tolist(), ['champions', 'loyal', 'loyal', 'at_risk', 'at_risk'])
+        # 150 an order, 2 orders over the 90 day minimum tenure, for 3 years
+        self.assertAlmostEqual(result['predicted_ltv'][0], 150 * 2 / (90 / 365) * 3)
+
+    def test_no_orders(self):
+        result = compute_rfm(np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0), 0.0)
+        self.assertEqual((result['ids'].size, result['recency_score'].size), (0, 0))
+
+    def test_customers_without_orders_have_no_scores(self):
+        owner = User.objects.create_user(email='owner@example.com', password='secret', role='PARENT')
+        company = Company.objects.create(name='Acme', owner=owner, email='acme@example.com')
+        buyer = Customer.objects.create(company=company, email='buyer@example.com')
+        idle = Customer.objects.create(company=company, email='idle@example.com')
+        Order.objects.create(company=company, customer=buyer, subtotal_price=Decimal('20.00'),
+                             tax_amount=0, shipping_charges=0, total_price=Decimal('20.00'))
+
+        self.assertEqual(update_customer_rfm(company)['customers'], 1)
+        buyer.refresh_from_db()
+        idle.refresh_from_db()
+        self.assertEqual((buyer.recency_days, buyer.rfm_segment), (0, 'champions'))
+        self.assertIsNone(idle.rfm_segment)
+
+        Order.objects.all().delete()
+        self.assertEqual(update_customer_rfm(company)['cleared'], 1)
+        buyer.refresh_from_db()
+        self.assertIsNone(buyer.rfm_recency_score)
+
+    def test_orders_are_read_in_chunks_and_cancelled_ones_skipped(self):
+        owner = User.objects.create_user(email='owner@example.com', password='secret', role='PARENT')
+        company = Company.objects.create(name='Acme', owner=owner, email='acme@example.com')
+        buyer = Customer.objects.create(company=company, email='buyer@example.com')
+        for n, status in enumerate(['Pending', 'Shipped', 'Cancelled', 'Pending', 'Pending']):
+            Order.objects.create(company=company, customer=buyer, erp_status=status,
+                                 subtotal_price=Decimal(10 * (n + 1)), tax_amount=0, shipping_charges=0,
+                                 total_price=Decimal(10 * (n + 1)))
+
+        with mock.patch('companies.rfm.LOAD_CHUNK_SIZE', 2):
+            self.assertEqual(update_customer_rfm(company)['orders'], 4)
+        buyer.refresh_from_db()
+        # (10 + 20 + 40 + 50) / 4 an order, 4 orders over the 90 day minimum tenure, for 3 years
+        self.assertEqual(buyer.predicted_ltv, Decimal(str(round(30 * 4 / (90 / 365) * 3, 2))))
+
+
+class CustomerCSVExportTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(email='owner@example.com', password='secret', role='PARENT')
+        company = Company.objects.create(name='Acme', owner=user, email='acme@example.com')
+        user.company = company
+        user.save()
+        Customer.objects.create(company=company, email='champion@example.com',
+                                rfm_segment=Customer.RFMSegment.CHAMPIONS)
+        Customer.objects.create(company=company, email='other@example.com')
+        self.api = APIClient()
+        self.api.force_authenticate(user)
+
+    def emails(self, **params):
+        response = self.api.get('/companies/api/customers/export/', params)
+        self.assertEqual(response.status_code, 200)
+        body = b''.join(response.streaming_content).decode('utf-8')
+        return sorted(row['email'] for row in csv.DictReader(io.StringIO(body)))
+
+    def test_export_applies_the_list_filters(self):
+        self.assertEqual(self.emails(segment='champions'), ['champion@example.com'])
+        self.assertEqual(self.emails(), ['champion@example.com', 'other@example.com'])
+
+
+class SyncRunTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='ledger@example.com', password='secret', role='PARENT')
+        self.company = Company.objects.create(name='Ledger', owner=self.user, email='ledger@example.com')
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def test_run_records_phases_rows_and_failures(self):
+        with mock.patch('companies.models.time.monotonic', side_effect=[10.0, 12.5, 20.0, 20.5]):
+            with SyncRun.record(self.company, SyncRun.Resource.CUSTOMERS, user=self.user) as run:
+                with run.timed('fetch'):
+                    run.add_usage({'requests': 2, 'cost': 84.0, 'throttle_wait': 0.25})
+                with run.timed('write'):
+                    run.add_rows(fetched=60, created=5, updated=3, unchanged=50, failed=2,
+                                 errors=[{'row': n} for n in range(SyncRun.MAX_ERRORS + 10)])
+        run.refresh_from_db()
+        self.assertEqual((run.status, run.triggered_by, run.pages, run.api_cost), ('succeeded', self.user, 2, 84))
+        self.assertEqual((run.fetch_seconds, run.write_seconds, run.throttle_wait_seconds), (2.5, 0.5, 0.25))
+        self.assertEqual((run.rows_fetched, run.created, run.updated, run.unchanged, run.failed), (60, 5, 3, 50, 2))
+        self.assertEqual(len(run.errors), SyncRun.MAX_ERRORS)
+        self.assertIsNotNone(run.finished_at)
+
+        with self.assertRaisesMessage(ValueError, 'bad page'):
+            with SyncRun.record(self.company, SyncRun.Resource.ORDERS, trigger=SyncRun.Trigger.WEBHOOK):
+                raise ValueError('bad page')
+        failed = SyncRun.objects.get(resource=SyncRun.Resource.ORDERS)
+        self.assertEqual((failed.status, failed.error_message, failed.trigger), ('failed', 'bad page', 'webhook'))
+        self.assertIsNotNone(failed.duration_seconds)
+
+    def test_summary_compares_with_the_previous_period(self):
+        now = timezone.now()
+        other = Company.objects.create(
+            name='Other', owner=User.objects.create_user(email='other@example.com', password='secret', role='PARENT'),
+            email='other@example.com',
+        )
+        for company, days_ago, duration, status in [
+            (self.company, 1, 30.0, SyncRun.Status.SUCCEEDED),
+            (self.company, 2, 30.0, SyncRun.Status.FAILED),
+            (self.company, 10, 20.0, SyncRun.Status.SUCCEEDED),
+            (other, 1, 99.0, SyncRun.Status.SUCCEEDED),
+        ]:
+            SyncRun.objects.create(company=company, resource=SyncRun.Resource.PRODUCTS, status=status,
+                                   started_at=now - timedelta(days=days_ago), duration_seconds=duration,
+                                   api_cost=10)
+
+        response = self.api.get('/companies/api/sync-runs/summary/', {'days': 7})
+        self.assertEqual(response.status_code, 200, response.content)
+        products = response.json()['data']['products']
+        self.assertEqual((products['runs'], products['failures'], products['api_cost']), (2, 1, 20))
+        self.assertEqual(products['change']['avg_duration_seconds'], 0.5)
+        self.assertEqual([row['runs'] for row in products['trend']], [1, 1])
+        self.assertEqual(list(response.json()['data']), ['products'])
+
+        self.assertEqual(len(self.api.get('/companies/api/sync-runs/', {'status': 'failed'}).json()), 1)
+        self.assertEqual(self.api.get('/companies/api/sync-runs/', {'status': 'done'}).status_code, 400)
+        self.assertEqual(self.api.get('/companies/api/sync-runs/summary/', {'days': 0}).status_code, 400)
+
+
+class CustomerValuesSerializerTests(TestCase):
+    def test_renders_the_same_bytes_as_the_model_serializer(self):
+        company = generate_tenant('Parity', customers=20, products=1, orders=0, seed=3)
+        Customer.objects.create(company=company, phone='+919800000000', note='no name', tags='["vip"]')
+        Customer.objects.create(company=company, last_name='Rao', email='rao@example.com',
+                                amount_spent=Decimal('12.5'))
+        customers = Customer.objects.filter(company=company)
+        values_serializer = CustomerValuesSerializer()
+        self.assertEqual(JSONRenderer().render(values_serializer.serialize(values_serializer.values(customers))),
+                         JSONRenderer().render(CustomerSerializer(customers, many=True).data))
+
+
+class CustomerShopifyPushTests(TestCase):
+    def setUp(self):
+        self.fake = FakeShopify(generate_store(customers=5, products=0, orders=0))
+        server = start_server(self.fake)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.settings = override_settings(SHOPIFY_API_URL=api_url(server))
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+
+        user = User.objects.create_user(email='push@example.com', password='secret', role='PARENT')
+        self.company = Company.objects.create(name='Pusher', owner=user, email='pusher@example.com',
+                                              shopify_domain='pusher.myshopify.com', shopify_access_token='token')
+        user.company = self.company
+        user.save()
+        self.customers = []
+        for n in range(1, 6):
+            customer = Customer.objects.create(
+                company=self.company, shopify_customer_id=str(n), email=f'customer{n}@fake-shopify.invalid',
+                first_name='Asha', note='VIP', tags='["vip"]',
+            )
+            mark_customer_synced(customer)
+            self.customers.append(customer)
+        self.api = APIClient()
+        self.api.force_authenticate(user)
+
+    def shopify_customer(self, n):
+        return self.fake.nodes['customers'][n]
+
+    def test_cleared_fields_are_cleared_in_shopify(self):
+        customer = self.customers[0]
+        customer.note = ''
+        customer.tags = None
+        customer.first_name = 'Asha Rao'
+        customer.save()
+        self.assertEqual(build_changed_customer_data(customer), {'firstName': 'Asha Rao', 'note': '', 'tags': []})
+
+        response = self.api.post(f'/companies/api/customers/{customer.pk}/push_to_shopify/', format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        pushed = self.shopify_customer(1)
+        self.assertEqual((pushed['firstName'], pushed['note'], pushed['tags']), ('Asha Rao', None, []))
+        self.assertEqual(pushed['email'], 'customer1@fake-shopify.invalid')
+        self.assertIsNone(build_changed_customer_data(Customer.objects.get(pk=customer.pk)))
+
+    def test_bulk_push_skips_unchanged_customers(self):
+        dirty = [self.customers[1].pk, self.customers[3].pk]
+        Customer.objects.filter(pk__in=dirty).update(note='Wholesale')
+
+        response = self.api.post('/companies/api/customers/bulk-push-to-shopify/', format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        data = response.json()['data']
+        self.assertEqual((data['pushed'], data['unchanged'], data['errors']), (dirty, 3, []))
+        self.assertEqual(self.fake.stats['requests'], 1)
+        self.assertEqual([self.shopify_customer(n)['note'] for n in (2, 4)], ['Wholesale', 'Wholesale'])
+
+        response = self.api.post('/companies/api/customers/bulk-push-to-shopify/', format='json')
+        self.assertEqual((response.json()['data']['pushed'], response.json()['data']['unchanged']), ([], 5))
+        self.assertEqual(self.fake.stats['requests'], 1)
+
+    def test_bulk_push_sends_and_marks_batches(self):
+        Customer.objects.update(note='Wholesale')
+        client = ShopifyGraphQLClient('pusher.myshopify.com', 'token')
+        with CaptureQueriesContext(connection) as queries:
+            result = push_dirty_customers(client, Customer.objects.filter(company=self.company), batch_size=2)
+        self.assertEqual(len(result['pushed']), 5)
+        self.assertEqual(self.fake.stats['requests'], 3)
+        hash_writes = [query for query in queries if query['sql'].startswith('UPDATE "companies_customer"')]
+        self.assertEqual(len(hash_writes), 3)
+        self.assertFalse([customer for customer in Customer.objects.all() if build_changed_customer_data(customer)])
@@ -8,16 +8,19 @@ from .views import (
     CompanyViewSet,
     DepartmentViewSet,
     CustomerViewSet,
+    SyncRunViewSet,
     CompanyRegistrationView,
     ShopifyIntegrationView,
     ShiprocketIntegrationView,
-    IntegrationStatusView
+    IntegrationStatusView,
+    ShopifyWebhookView
 )
 
 router = DefaultRouter()
 router.register(r'companies', CompanyViewSet, basename='company')
 router.register(r'departments', DepartmentViewSet, basename='department')
 router.register(r'customers', CustomerViewSet, basename='customer')
+router.register(r'sync-runs', SyncRunViewSet, basename='sync-run')
 
 
 app_name = 'companies'
@@ -29,6 +32,7 @@ urlpatterns = [
     path('api/integrations/<uuid:id>/shopify/connect/', ShopifyIntegrationView.as_view(), name='api_shopify_connect'),
     path('api/integrations/<uuid:id>/shiprocket/connect/', ShiprocketIntegrationView.as_view(), name='api_shiprocket_connect'),
     path('api/integrations/<uuid:id>/status/', IntegrationStatusView.as_view(), name='api_integration_status'),
+    path('api/webhooks/shopify/', ShopifyWebhookView.as_view(), name='api_shopify_webhook'),
     
     # API endpoints for departments
     path('api/departments/', views.DepartmentListCreateView.as_view(), name='api_department_list_create'),
@@ -1,9 +1,12 @@
 import os
+import time
 import requests
 import logging
 from typing import Dict, List, Any, Optional
 from django.conf import settings
 
+from core.metrics import SHOPIFY_REQUEST_DURATION, SHOPIFY_THROTTLE_WAIT, SHOPIFY_THROTTLED
+
 logger = logging.getLogger(__name__)
 
 CUSTOMERS_QUERY = """
@@ -50,11 +53,122 @@ query getCustomers($cursor: String, $limit: Int!) {
 }
 """
 
+# Number of products / customers sent per batched mutation request. Each
+# aliased mutation costs ~10 points against Shopify's 1000 point bucket, so
+# these stay well under the per-request cost limit.
+PRODUCT_BATCH_SIZE = 10
+CUSTOMER_BATCH_SIZE = 25
+
+# Rows read per query while looking for the dirty rows of a bulk push
+PUSH_READ_CHUNK_SIZE = 500
+
+# Retries for requests rejected with a THROTTLED error
+MAX_THROTTLE_RETRIES = 5
+
+PRODUCT_UPDATE_FIELDS = """
+    product {
+        id
+        title
+        descriptionHtml
+        vendor
+        productType
+        status
+        tags
+        handle
+        publishedAt
+    }
+    userErrors {
+        field
+        message
+    }
+"""
+
+VARIANTS_BULK_UPDATE_FIELDS = """
+    productVariants {
+        id
+        price
+        compareAtPrice
+        sku
+        barcode
+        inventoryPolicy
+        inventoryQuantity
+    }
+    userErrors {
+        field
+        message
+    }
+"""
+
+CUSTOMER_UPDATE_FIELDS = """
+    customer {
+        id
+        email
+        phone
+        firstName
+        lastName
+        note
+        tags
+        addresses {
+            address1
+            city
+            province
+            country
+            zip
+        }
+    }
+    userErrors {
+        field
+        message
+    }
+"""
+
+
+def shopify_api_url(shop_domain: str, path: str = 'graphql.json') -> str:
+    """URL of an Admin API endpoint of a shop, from settings.SHOPIFY_API_URL"""
+    return f"{settings.SHOPIFY_API_URL.format(shop_domain=shop_domain).rstrip('/')}/{path}"
+
+
+def query_cost(data: Dict[str, Any]) -> int:
+    """Actual cost Shopify charged for a GraphQL response, from extensions.cost"""
+    cost = ((data.get('extensions') or {}).get('cost') or {}).get('actualQueryCost')
+    return int(cost or 0)
+
+
+def _to_gid(resource_id: str, resource: str) -> str:
+    """Return a Shopify global ID (gid://shopify/<resource>/<id>) for a numeric or gid ID."""
+    resource_id = str(resource_id)
+    if resource_id.startswith('gid://'):
+        return resource_id
+    return f"gid://shopify/{resource}/{resource_id}"
+
+
+def _is_throttled(errors) -> bool:
+    """Check whether a GraphQL error list contains Shopify's THROTTLED error."""
+    if not isinstance(errors, list):
+        return False
+    return any(
+        isinstance(error, dict) and (error.get('extensions') or {}).get('code') == 'THROTTLED'
+        for error in errors
+    )
+
+
+def _throttle_wait_seconds(data: Dict[str, Any]) -> float:
+    """Work out how long to wait before the cost bucket can cover the rejected query."""
+    cost = (data.get('extensions') or {}).get('cost') or {}
+    throttle_status = cost.get('throttleStatus') or {}
+    requested = cost.get('requestedQueryCost') or 0
+    available = throttle_status.get('currentlyAvailable') or 0
+    restore_rate = throttle_status.get('restoreRate') or 50
+    return max(requested - available, 0) / restore_rate or 1.0
+
+
 class ShopifyGraphQLClient:
     def __init__(self, shop_domain: str, access_token: str):
         self.shop_domain = shop_domain
         self.access_token = access_token
-        self.api_url = f"https://{shop_domain}/admin/api/2024-01/graphql.json"
+        self.api_url = shopify_api_url(shop_domain)
+        # Answered requests, their API cost and time spent throttled, for SyncRun
+        self.usage = {'requests': 0, 'cost': 0, 'throttle_wait': 0.0}
         logger.info(f"Initialized ShopifyGraphQLClient for domain: {shop_domain}")
 
     def execute(self, query: str, variables: Dict = None) -> Dict[str, Any]:
@@ -74,12 +188,38 @@ class ShopifyGraphQLClient:
             logger.debug(f"Query: {query}")
             logger.debug(f"Variables: {variables}")
             
-            response = requests.post(self.api_url, json=payload, headers=headers)
-            response.raise_for_status()
-            
-            logger.info(f"Shopify API Response Status: {response.status_code}")
-            
-            data = response.json()
+            for attempt in range(MAX_THROTTLE_RETRIES + 1):
+                started = time.perf_counter()
+                try:
+                    response = requests.post(self.api_url, json=payload, headers=headers)
+                    response.raise_for_status()
+                except requests.exceptions.RequestException:
+                    SHOPIFY_REQUEST_DURATION.observe(
+                        time.perf_counter() - started, client='graphql', outcome='error'
+                    )
+                    raise
+
+                logger.info(f"Shopify API Response Status: {response.status_code}")
+
+                data = response.json()
+                throttled = _is_throttled(data.get('errors'))
+                SHOPIFY_REQUEST_DURATION.observe(
+                    time.perf_counter() - started, client='graphql',
+                    outcome='throttled' if throttled else 'error' if 'errors' in data else 'ok'
+                )
+                if throttled:
+                    SHOPIFY_THROTTLED.inc(client='graphql')
+                if attempt < MAX_THROTTLE_RETRIES and throttled:
+                    wait = _throttle_wait_seconds(data)
+                    logger.warning(f"Shopify request throttled, retrying in {wait:.2f}s")
+                    SHOPIFY_THROTTLE_WAIT.inc(wait, client='graphql')
+                    self.usage['throttle_wait'] += wait
+                    time.sleep(wait)
+                    continue
+                break
+
+            self.usage['requests'] += 1
+            self.usage['cost'] += query_cost(data)
             
             if 'errors' in data:
                 logger.error(f"GraphQL Errors: {data['errors']}")
@@ -279,76 +419,69 @@ class ShopifyGraphQLClient:
 
     def update_customer(self, customer_id: str, customer_data: Dict[str, Any]) -> Dict[str, Any]:
         """Update an existing customer in Shopify."""
-        # Format the customer ID correctly for Shopify's GraphQL API
-        if not customer_id.startswith('gid://'):
-            customer_id = f"gid://shopify/Customer/{customer_id}"
-
-        logger.info(f"Updating Shopify customer: {customer_id}")
-        logger.debug(f"Update data: {customer_data}")
-
-        query = """
-        mutation customerUpdate($input: CustomerInput!) {
-            customerUpdate(input: $input) {
-                customer {
-                    id
-                    email
-                    phone
-                    firstName
-                    lastName
-                    note
-                    tags
-                    addresses {
-                        address1
-                        city
-                        province
-                        country
-                        zip
-                    }
-                }
-                userErrors {
-                    field
-                    message
-                }
-            }
-        }
-        """
-
-        # Prepare the input data
-        input_data = {
-            "id": customer_id,
-            "email": customer_data.get('email'),
-            "phone": customer_data.get('phone'),
-            "firstName": customer_data.get('firstName'),
-            "lastName": customer_data.get('lastName'),
-            "note": customer_data.get('note'),
-            "tags": customer_data.get('tags', [])
-        }
-
-        # Clean up None values
-        input_data = {k: v for k, v in input_data.items() if v is not None}
-
-        # Handle addresses
-        if customer_data.get('addresses'):
-            input_data['addresses'] = customer_data['addresses']
-
-        variables = {
-            "input": input_data
-        }
-
-        logger.info(f"Sending update mutation with variables: {variables}")
-        result = self.execute(query, variables)
-
+        result = self.bulk_update_customers([(customer_id, customer_data)])[0]
         if 'errors' in result:
-            logger.error(f"GraphQL errors updating customer: {result['errors']}")
             return result
 
-        data = result.get('data', {}).get('customerUpdate', {})
-        if 'userErrors' in data and data['userErrors']:
-            logger.error(f"User errors updating customer: {data['userErrors']}")
-            return {'errors': data['userErrors']}
-
         logger.info(f"Successfully updated customer in Shopify")
-        return data
+        return result
+
+    def bulk_update_customers(self, customers: List[tuple], batch_size: int = CUSTOMER_BATCH_SIZE) -> List[Dict[str, Any]]:
+        """Update many existing customers in Shopify with batched mutations.
+
+        ``customers`` is a list of ``(customer_id, customer_data)`` tuples. Up to
+        ``batch_size`` aliased ``customerUpdate`` mutations are sent per request.
+        Returns one result dict per customer, in input order.
+        """
+        results = []
+        for start in range(0, len(customers), batch_size):
+            batch = customers[start:start + batch_size]
+
+            definitions = []
+            selections = []
+            variables = {}
+            for i, (customer_id, customer_data) in enumerate(batch):
+                customer_gid = _to_gid(customer_id, 'Customer')
+                logger.info(f"Updating Shopify customer: {customer_gid}")
+                definitions.append(f"$c{i}: CustomerInput!")
+                selections.append(f"c{i}: customerUpdate(input: $c{i}) {{ {CUSTOMER_UPDATE_FIELDS} }}")
+                variables[f"c{i}"] = self._customer_update_input(customer_gid, customer_data)
+
+            mutation = f"mutation bulkCustomerUpdate({', '.join(definitions)}) {{ {' '.join(selections)} }}"
+            logger.info(f"Pushing {len(batch)} customers to Shopify in one request")
+            result = self.execute(mutation, variables)
+
+            if 'errors' in result:
+                logger.error(f"GraphQL errors updating customers: {result['errors']}")
+                results.extend({'errors': result['errors']} for _ in batch)
+                continue
+
+            data = result['data']
+            for i, _ in enumerate(batch):
+                customer_result = data.get(f"c{i}") or {}
+                if customer_result.get('userErrors'):
+                    logger.error(f"User errors updating customer: {customer_result['userErrors']}")
+                    results.append({'errors': customer_result['userErrors']})
+                else:
+                    results.append(customer_result)
+        return results
+
+    def _customer_update_input(self, customer_id: str, customer_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Build the ``CustomerInput`` for a ``customerUpdate`` mutation.
+
+        Every field in ``customer_data`` is sent; one cleared locally is sent
+        as null (or an empty list), so Shopify clears it too. Fields left out
+        of ``customer_data`` are left as they are.
+        """
+        input_data = {"id": customer_id}
+        for field in ('email', 'phone', 'firstName', 'lastName', 'note'):
+            if field in customer_data:
+                input_data[field] = customer_data[field] or None
+        for field in ('tags', 'addresses'):
+            if field in customer_data:
+                input_data[field] = customer_data[field] or []
+
+        return input_data
 
     def delete_customer(self, customer_id: str) -> Dict[str, Any]:
         """Delete a customer from Shopify."""
@@ -415,6 +548,7 @@ class ShopifyGraphQLClient:
                             }
                         }
                         publishedAt
+                        updatedAt
                     }
                 }
             }
@@ -458,95 +592,120 @@ class ShopifyGraphQLClient:
         return products
 
     def update_product(self, product_id: str, product_data: dict) -> dict:
-        """Update an existing product in Shopify"""
-        # First update the product details
-        product_mutation = """
-        mutation productUpdate($input: ProductInput!) {
-            productUpdate(input: $input) {
-                product {
-                    id
-                    title
-                    descriptionHtml
-                    vendor
-                    productType
-                    status
-                    tags
-                    handle
-                    publishedAt
-                }
-                userErrors {
-                    field
-                    message
-                }
-            }
-        }
-        """
+        """Update an existing product and all of its variants in Shopify.
 
-        # Clean up input data to match Shopify's API requirements
-        input_data = {
-            'id': product_id,
-            'title': product_data.get('title'),
-            'vendor': product_data.get('vendor'),
-            'productType': product_data.get('productType'),
-            'tags': product_data.get('tags', []),
-            'status': product_data.get('status', 'ACTIVE').upper(),
-            'handle': product_data.get('handle'),
-        }
+        The product fields and the variants are sent in a single request:
+        one ``productUpdate`` plus one ``productVariantsBulkUpdate``.
+        """
+        results = self.bulk_update_products([(product_id, product_data)])
+        result = results[0]
+        if 'errors' in result:
+            logger.error(f"Error updating product: {result['errors']}")
+            raise Exception(f"Error updating product: {result['errors']}")
+        return result
 
-        # Update product first
-        product_response = self.execute(product_mutation, {'input': input_data})
-        if 'errors' in product_response:
-            logger.error(f"Error updating product: {product_response['errors']}")
-            raise Exception(f"Error updating product: {product_response['errors']}")
+    def bulk_update_products(self, products: List[tuple], batch_size: int = PRODUCT_BATCH_SIZE) -> List[Dict[str, Any]]:
+        """Update many existing products in Shopify with batched mutations.
 
-        # Then update each variant separately
-        if 'variants' in product_data:
-            variant_mutation = """
-            mutation variantUpdate($input: ProductVariantInput!) {
-                productVariantUpdate(input: $input) {
-                    productVariant {
-                        id
-                        price
-                        compareAtPrice
-                        sku
-                        barcode
-                        inventoryPolicy
-                        inventoryQuantity
-                    }
-                    userErrors {
-                        field
-                        message
-                    }
-                }
+        ``products`` is a list of ``(product_id, product_data)`` tuples. Up to
+        ``batch_size`` products are sent per request, each as an aliased
+        ``productUpdate`` followed by a ``productVariantsBulkUpdate`` for its
+        variants. Returns one result dict per product, in input order.
+        """
+        results = []
+        for start in range(0, len(products), batch_size):
+            batch = products[start:start + batch_size]
+
+            definitions = []
+            selections = []
+            variables = {}
+            for i, (product_id, product_data) in enumerate(batch):
+                product_gid = _to_gid(product_id, 'Product')
+                product_input = self._product_update_input(product_gid, product_data)
+                if product_input:
+                    definitions.append(f"$p{i}: ProductInput!")
+                    selections.append(f"p{i}: productUpdate(input: $p{i}) {{ {PRODUCT_UPDATE_FIELDS} }}")
+                    variables[f"p{i}"] = product_input
+
+                variant_inputs = self._variants_bulk_input(product_data.get('variants') or [])
+                if variant_inputs:
+                    definitions.append(f"$pid{i}: ID!")
+                    definitions.append(f"$v{i}: [ProductVariantsBulkInput!]!")
+                    selections.append(
+                        f"v{i}: productVariantsBulkUpdate(productId: $pid{i}, variants: $v{i}) "
+                        f"{{ {VARIANTS_BULK_UPDATE_FIELDS} }}"
+                    )
+                    variables[f"pid{i}"] = product_gid
+                    variables[f"v{i}"] = variant_inputs
+
+            if not selections:
+                results.extend({'product': None, 'productVariants': [], 'userErrors': []} for _ in batch)
+                continue
+
+            mutation = f"mutation bulkProductUpdate({', '.join(definitions)}) {{ {' '.join(selections)} }}"
+            logger.info(f"Pushing {len(batch)} products to Shopify in one request")
+            response = self.execute(mutation, variables)
+
+            if 'errors' in response:
+                results.extend({'errors': response['errors']} for _ in batch)
+                continue
+
+            data = response['data']
+            for i, _ in enumerate(batch):
+                product_result = data.get(f"p{i}") or {}
+                variant_result = data.get(f"v{i}") or {}
+                user_errors = (product_result.get('userErrors') or []) + (variant_result.get('userErrors') or [])
+                results.append({
+                    'product': product_result.get('product'),
+                    'productVariants': variant_result.get('productVariants', []),
+                    'userErrors': user_errors,
+                })
+        return results
+
+    def _product_update_input(self, product_id: str, product_data: dict) -> Optional[dict]:
+        """Build the ``ProductInput`` for a ``productUpdate`` mutation.
+
+        Only fields present in ``product_data`` are sent, so a payload holding
+        just the changed fields leaves the rest untouched in Shopify. Returns
+        None when there are no product fields to update.
+        """
+        input_data = {'id': product_id}
+        for field in ('title', 'vendor', 'productType', 'handle'):
+            if field in product_data:
+                input_data[field] = product_data[field]
+        if 'tags' in product_data:
+            input_data['tags'] = product_data['tags'] or []
+        if 'status' in product_data:
+            input_data['status'] = (product_data['status'] or 'ACTIVE').upper()
+        return input_data if len(input_data) > 1 else None
+
+    def _variants_bulk_input(self, variants: List[dict]) -> List[dict]:
+        """Build ``ProductVariantsBulkInput`` entries for variants that already exist in Shopify.
+
+        A compare-at price, SKU or barcode cleared locally is sent as null,
+        so Shopify clears it too. Fields left out of a variant are left as
+        they are.
+        """
+        variant_inputs = []
+        for variant in variants:
+            if 'id' not in variant:
+                continue
+
+            variant_input = {
+                'id': _to_gid(variant['id'], 'ProductVariant'),
+                'price': str(variant.get('price', '0.00')),
+                'inventoryPolicy': (variant.get('inventoryPolicy') or 'DENY').upper(),
             }
-            """
-
-            for variant in product_data['variants']:
-                if 'id' not in variant:
-                    continue
-
-                variant_input = {
-                    'id': variant['id'],
-                    'price': str(variant.get('price', '0.00')),
-                    'inventoryPolicy': variant.get('inventoryPolicy', 'DENY').upper(),
-                }
-
-                if variant.get('compareAtPrice'):
-                    variant_input['compareAtPrice'] = str(variant['compareAtPrice'])
-                if variant.get('sku'):
-                    variant_input['sku'] = variant['sku']
-                if variant.get('barcode'):
-                    variant_input['barcode'] = variant['barcode']
 
-                # Update variant
-                logger.info(f"Variant Update Variables: {variant_input}")
-                variant_response = self.execute(variant_mutation, {'input': variant_input})
-
-                if 'errors' in variant_response:
-                    logger.error(f"Error updating variant: {variant_response['errors']}")
-                    continue
+            if 'compareAtPrice' in variant:
+                compare_at_price = variant['compareAtPrice']
+                variant_input['compareAtPrice'] = str(compare_at_price) if compare_at_price else None
+            for field in ('sku', 'barcode'):
+                if field in variant:
+                    variant_input[field] = variant[field] or None
 
-        return product_response['data']['productUpdate'] 
+            variant_inputs.append(variant_input)
+        return variant_inputs
 
     def create_product(self, product_data: dict) -> dict:
         """Create a new product in Shopify"""
@@ -0,0 +1,18 @@
+import hashlib
+import json
+from typing import Any, Dict
+
+
+def content_hash(data: Any) -> str:
+    """Return a stable SHA-256 hex digest of JSON-serializable data.
+
+    Keys are sorted and separators fixed so that equal data always hashes
+    the same, regardless of dict ordering.
+    """
+    encoded = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def field_hashes(data: Dict[str, Any]) -> Dict[str, str]:
+    """Return a short hash per top-level field of ``data``."""
+    return {key: content_hash(value)[:16] for key, value in data.items()}
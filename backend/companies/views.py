@@ -2,15 +2,18 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.utils.translation import gettext_lazy as _
-from django.db.models import Count
-from .models import Company, Department, AdminDeleteOTP, UserDeleteOTP, Customer
+from django.db import IntegrityError, transaction
+from django.db.models import Avg, Count, Max, Q, Sum
+from django.db.models.functions import TruncDate
+from datetime import timedelta
+from .models import Company, Department, AdminDeleteOTP, UserDeleteOTP, Customer, ShopifyWebhookEvent, SyncRun
 from .forms import CompanyRegistrationForm, AdminUserCreationForm, DepartmentForm
 from accounts.models import User
 from employees.models import Employee
 from rest_framework import generics, status, viewsets, permissions
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.exceptions import PermissionDenied, NotFound
+from rest_framework.exceptions import PermissionDenied, NotFound, ValidationError as DRFValidationError
 from rest_framework.decorators import action, api_view, permission_classes
 from .serializers import (
     CompanySerializer,
@@ -22,7 +25,9 @@ from .serializers import (
     AdminDeleteOTPVerifySerializer,
     UserDeleteOTPSendSerializer,
     UserDeleteOTPVerifySerializer,
-    CustomerSerializer
+    CustomerSerializer,
+    CustomerValuesSerializer,
+    SyncRunSerializer
 )
 from django.core.mail import send_mail
 import random
@@ -30,8 +35,19 @@ from rest_framework.views import APIView
 from django.utils import timezone
 from django.conf import settings
 import logging
-from .utils.shopify_client import ShopifyGraphQLClient
-from .services import ShopifyService
+from .utils.shopify_client import ShopifyGraphQLClient, shopify_api_url
+from .services import (
+    ShopifyService,
+    build_shopify_customer_data,
+    build_changed_customer_data,
+    is_valid_shopify_customer_id,
+    mark_customer_synced,
+    push_dirty_customers,
+    sync_shopify_customers,
+    validate_customer_data,
+)
+from .webhooks import SUPPORTED_TOPICS, find_webhook_company, verify_shopify_hmac
+from core.exports import EXPORT_CHUNK_SIZE, stream_csv_response, wants_gzip
 import shopify
 from decimal import Decimal
 from django.core.exceptions import ValidationError
@@ -41,6 +57,12 @@ import json
 # Configure logger
 logger = logging.getLogger(__name__)
 
+CUSTOMER_EXPORT_FIELDS = [
+    'id', 'shopify_customer_id', 'cust_code', 'first_name', 'last_name', 'email', 'phone',
+    'number_of_orders', 'amount_spent', 'currency_code', 'city', 'state', 'country',
+    'tags', 'rfm_segment', 'predicted_ltv', 'last_order_at', 'created_at',
+]
+
 def register_company(request):
     if request.method == 'POST':
         form = CompanyRegistrationForm(request.POST)
@@ -502,23 +524,47 @@ class CustomerViewSet(viewsets.ModelViewSet):
         else:
             return Customer.objects.none()
 
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+
+        # Filter by RFM segment, e.g. ?segment=champions
+        segment = self.request.query_params.get('segment')
+        if segment:
+            if segment not in Customer.RFMSegment.values:
+                raise DRFValidationError({
+                    'segment': f"Invalid segment. Must be one of: {', '.join(Customer.RFMSegment.values)}"
+                })
+            queryset = queryset.filter(rfm_segment=segment)
+        return queryset
+
     def list(self, request, *args, **kwargs):
         try:
-            queryset = self.get_queryset()
-            serializer = self.get_serializer(queryset, many=True)
+            try:
+                queryset = self.filter_queryset(self.get_queryset())
+            except DRFValidationError as e:
+                return Response({
+                    'success': False,
+                    'data': None,
+                    'error': e.detail['segment']
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+            # Same output as CustomerSerializer, built from .values() rows
+            values_serializer = CustomerValuesSerializer()
+            rows = list(values_serializer.values(queryset))
+            data = values_serializer.serialize(rows)
             
             # Add some useful metadata
-            total_amount_spent = sum(float(customer.amount_spent or 0) for customer in queryset)
-            total_orders = sum(customer.number_of_orders or 0 for customer in queryset)
+            total_amount_spent = sum(float(row['amount_spent'] or 0) for row in rows)
+            total_orders = sum(row['number_of_orders'] or 0 for row in rows)
             
             return Response({
                 'success': True,
-                'data': serializer.data,
+                'data': data,
                 'metadata': {
-                    'total_customers': len(serializer.data),
+                    'total_customers': len(data),
                     'total_amount_spent': total_amount_spent,
                     'total_orders': total_orders,
-                    'fields_included': list(serializer.data[0].keys()) if serializer.data else []
+                    'fields_included': list(data[0].keys()) if data else []
                 },
                 'error': None
             })
@@ -537,101 +583,18 @@ class CustomerViewSet(viewsets.ModelViewSet):
                 'error': str(e)
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream the customers as CSV. Accepts the list filters; add ?gzip=1 to compress."""
+        customers = self.filter_queryset(self.get_queryset()).order_by('id').values_list(*CUSTOMER_EXPORT_FIELDS)
+        return stream_csv_response(
+            'customers', CUSTOMER_EXPORT_FIELDS,
+            customers.iterator(chunk_size=EXPORT_CHUNK_SIZE), gzip=wants_gzip(request)
+        )
+
     def _validate_data_types(self, data):
         """Validate data types for customer fields"""
-        from django.core.exceptions import ValidationError
-        from .models import validate_phone_number, validate_currency_code, validate_amount, validate_tags
-
-        errors = {}
-
-        # Phone validation
-        if 'phone' in data and data['phone'] is not None:
-            try:
-                validate_phone_number(data['phone'])
-            except ValidationError as e:
-                errors['phone'] = str(e)
-
-        # Currency code validation
-        if 'currency_code' in data and data['currency_code'] is not None:
-            try:
-                validate_currency_code(data['currency_code'])
-            except ValidationError as e:
-                errors['currency_code'] = str(e)
-
-        # Amount validations
-        if 'amount_spent' in data:
-            try:
-                amount = Decimal(str(data['amount_spent']))
-                validate_amount(amount)
-            except (ValidationError, decimal.InvalidOperation) as e:
-                errors['amount_spent'] = str(e)
-
-        if 'lifetime_duration' in data:
-            try:
-                duration = Decimal(str(data['lifetime_duration']))
-                validate_amount(duration)
-            except (ValidationError, decimal.InvalidOperation) as e:
-                errors['lifetime_duration'] = str(e)
-
-        # Tags validation
-        if 'tags' in data and data['tags'] is not None:
-            try:
-                validate_tags(data['tags'])
-            except ValidationError as e:
-                errors['tags'] = str(e)
-
-        # Address validation
-        if 'addresses' in data and data['addresses'] is not None:
-            try:
-                if not isinstance(data['addresses'], list):
-                    errors['addresses'] = 'Addresses must be a list'
-                else:
-                    for i, addr in enumerate(data['addresses']):
-                        if not isinstance(addr, dict):
-                            errors[f'addresses[{i}]'] = 'Address must be an object'
-                            continue
-
-                        # Validate required fields
-                        required_fields = ['address1', 'city', 'province', 'country']
-                        missing = [f for f in required_fields if not addr.get(f)]
-                        if missing:
-                            errors[f'addresses[{i}]'] = f'Missing required fields: {", ".join(missing)}'
-                            continue
-
-                        # Validate field lengths
-                        if len(addr.get('address1', '')) > 255:
-                            errors[f'addresses[{i}].address1'] = 'Address line is too long (max 255 characters)'
-                        if len(addr.get('city', '')) > 100:
-                            errors[f'addresses[{i}].city'] = 'City name is too long (max 100 characters)'
-                        if len(addr.get('province', '')) > 100:
-                            errors[f'addresses[{i}].province'] = 'Province/State name is too long (max 100 characters)'
-                        if len(addr.get('country', '')) > 100:
-                            errors[f'addresses[{i}].country'] = 'Country name is too long (max 100 characters)'
-                        if 'zip' in addr and len(addr['zip']) > 20:
-                            errors[f'addresses[{i}].zip'] = 'ZIP/Postal code is too long (max 20 characters)'
-
-            except Exception as e:
-                errors['addresses'] = f'Invalid address format: {str(e)}'
-
-        # Text field length validations
-        text_fields = {
-            'city': 100,
-            'state': 100,
-            'country': 100,
-            'cust_code': 50,
-            'default_address_line': 255,
-            'default_address_formatted_area': 255
-        }
-
-        for field, max_length in text_fields.items():
-            if field in data and data[field] is not None:
-                if not isinstance(data[field], str):
-                    errors[field] = f'{field} must be a string'
-                elif len(data[field]) > max_length:
-                    errors[field] = f'{field} is too long (max {max_length} characters)'
-
-        if errors:
-            raise ValidationError(errors)
+        validate_customer_data(data)
 
     def create(self, request, *args, **kwargs):
         try:
@@ -777,7 +740,7 @@ class CustomerViewSet(viewsets.ModelViewSet):
 
             # Validate Shopify ID format
             shopify_id = customer.shopify_customer_id
-            if shopify_id == 'existing_shopify_id' or not (shopify_id.isdigit() or shopify_id.startswith('gid://')):
+            if not is_valid_shopify_customer_id(shopify_id):
                 return Response({
                     'success': False,
                     'error': 'Invalid Shopify ID. Please sync customers from Shopify first to get valid IDs.'
@@ -791,51 +754,22 @@ class CustomerViewSet(viewsets.ModelViewSet):
 
             client = ShopifyGraphQLClient(company.shopify_domain, company.shopify_access_token)
             
-            # Prepare customer data for Shopify
+            # Prepare customer data for Shopify, sending only what changed
+            # since the last sync unless forced
             try:
-                # Parse tags from JSON string to array
-                try:
-                    tags = json.loads(customer.tags) if customer.tags else []
-                except json.JSONDecodeError:
-                    tags = []
-                
-                # Format address data
-                addresses = []
-                if customer.addresses and isinstance(customer.addresses, list):
-                    for addr in customer.addresses:
-                        if isinstance(addr, dict):
-                            formatted_addr = {
-                                'address1': addr.get('address1', ''),
-                                'city': addr.get('city', ''),
-                                'province': addr.get('province', ''),
-                                'country': addr.get('country', ''),
-                                'zip': addr.get('zip', '')
+                if request.data.get('force'):
+                    shopify_data = build_shopify_customer_data(customer)
+                else:
+                    shopify_data = build_changed_customer_data(customer)
+                    if shopify_data is None:
+                        return Response({
+                            'success': True,
+                            'message': 'Customer has no changes since the last Shopify sync',
+                            'data': {
+                                'customer': self.get_serializer(customer).data,
+                                'skipped': True
                             }
-                            addresses.append(formatted_addr)
-
-                shopify_data = {
-                    'email': customer.email,
-                    'phone': customer.phone,
-                    'firstName': customer.first_name,
-                    'lastName': customer.last_name,
-                    'note': customer.note,
-                    'tags': tags,  # Now it's an array
-                    'addresses': addresses  # Now it's an array of properly formatted address objects
-                }
-
-                # Add default address if any field is present
-                if customer.default_address_line or customer.city or customer.state or customer.country:
-                    default_address = {
-                        'address1': customer.default_address_line or '',
-                        'city': customer.city or '',
-                        'province': customer.state or '',
-                        'country': customer.country or '',
-                    }
-                    # Only add if at least one field has a value
-                    if any(default_address.values()):
-                        if not shopify_data['addresses']:
-                            shopify_data['addresses'] = []
-                        shopify_data['addresses'].append(default_address)
+                        })
 
                 logger.info(f"Prepared Shopify data: {shopify_data}")
             except AttributeError as e:
@@ -871,6 +805,8 @@ class CustomerViewSet(viewsets.ModelViewSet):
                     'error': str(user_errors)
                 }, status=status.HTTP_400_BAD_REQUEST)
 
+            mark_customer_synced(customer)
+
             return Response({
                 'success': True,
                 'message': 'Customer pushed to Shopify successfully',
@@ -892,6 +828,49 @@ class CustomerViewSet(viewsets.ModelViewSet):
                 'error': f'Error pushing to Shopify: {str(e)}'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @action(detail=False, methods=['post'], url_path='bulk-push-to-shopify')
+    def bulk_push_to_shopify(self, request):
+        """Push all dirty customers to Shopify using batched customerUpdate mutations"""
+        try:
+            user = request.user
+            if user.is_parent:
+                company = Company.objects.get(owner=user)
+            else:
+                company = user.company
+
+            if not company:
+                return Response({
+                    'success': False,
+                    'error': 'No company found for user'
+                }, status=status.HTTP_404_NOT_FOUND)
+
+            if not (company.shopify_domain and company.shopify_access_token):
+                return Response({
+                    'success': False,
+                    'error': 'Shopify credentials not configured'
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+            customers = self.get_queryset().exclude(shopify_customer_id__isnull=True)
+            ids = request.data.get('ids')
+            if ids:
+                customers = customers.filter(pk__in=ids)
+
+            client = ShopifyGraphQLClient(company.shopify_domain, company.shopify_access_token)
+            result = push_dirty_customers(client, customers)
+
+            return Response({
+                'success': not result['errors'],
+                'message': f"Pushed {len(result['pushed'])} customers to Shopify, {result['unchanged']} unchanged",
+                'data': result
+            })
+
+        except Exception as e:
+            logger.exception("Error bulk pushing customers to Shopify")
+            return Response({
+                'success': False,
+                'error': f'Error pushing to Shopify: {str(e)}'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
     @action(detail=False, methods=['post'], url_path='sync-shopify')
     def sync_shopify(self, request):
         """Pull customers from Shopify and save to local database"""
@@ -920,123 +899,40 @@ class CustomerViewSet(viewsets.ModelViewSet):
                 }, status=status.HTTP_400_BAD_REQUEST)
 
             client = ShopifyGraphQLClient(company.shopify_domain, company.shopify_access_token)
-            
-            try:
-                data_list = client.get_all_customers()
-            except Exception as e:
-                logger.exception("Shopify sync failed")
-                return Response({
-                    'success': False,
-                    'error': f"Shopify sync failed: {str(e)}"
-                }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-            created_count = 0
-            updated_count = 0
-            error_count = 0
-            errors = []
 
-            for data in data_list:
+            with SyncRun.record(company, SyncRun.Resource.CUSTOMERS, user=user) as run:
                 try:
-                    # Validate data types
-                    self._validate_data_types(data)
-
-                    # Format addresses as objects
-                    formatted_addresses = []
-                    if data.get('addresses'):
-                        for addr in data['addresses']:
-                            formatted_addresses.append({
-                                'address1': addr.get('address1', ''),
-                                'city': addr.get('city', ''),
-                                'province': addr.get('province', ''),
-                                'country': addr.get('country', ''),
-                                'zip': addr.get('zip', '')
-                            })
-
-                    # Format tags properly
-                    tags = data.get('tags', '[]')
-                    if isinstance(tags, str):
-                        # Remove any nested quotes and brackets
-                        tags = tags.strip('[]').replace("'", '"')
-                        if not tags:
-                            tags = '[]'
-                        elif not tags.startswith('['):
-                            tags = f'["{tags}"]'
-
-                    # Preserve custom fields if customer exists
-                    defaults = {
-                        'first_name': data.get('first_name', ''),
-                        'last_name': data.get('last_name', ''),
-                        'email': data.get('email', ''),
-                        'phone': data.get('phone', ''),
-                        'verified_email': bool(data.get('verified_email', False)),
-                        'number_of_orders': int(data.get('number_of_orders', 0)),
-                        'amount_spent': str(data.get('amount_spent', '0.00')),
-                        'currency_code': data.get('currency_code', ''),
-                        'default_address_line': data.get('default_address_line', ''),
-                        'default_address_formatted_area': data.get('default_address_formatted_area', ''),
-                        'addresses': formatted_addresses,
-                        'created_at': data.get('created_at'),
-                        'updated_at': data.get('updated_at'),
-                        'valid_email_address': bool(data.get('email')),
-                        'note': data.get('note', ''),
-                        'tags': tags,
-                    }
-
-                    # Get existing customer if any
-                    existing_customer = Customer.objects.filter(
-                        company=company,
-                        shopify_customer_id=data['id']
-                    ).first()
-
-                    if existing_customer:
-                        # Preserve custom fields
-                        defaults['cust_code'] = existing_customer.cust_code
-                        # Only update location if not already set
-                        if not existing_customer.city:
-                            defaults['city'] = data.get('city', '')
-                        if not existing_customer.state:
-                            defaults['state'] = data.get('state', '')
-                        if not existing_customer.country:
-                            defaults['country'] = data.get('country', '')
-
-                    customer, created = Customer.objects.update_or_create(
-                        company=company,
-                        shopify_customer_id=data['id'],
-                        defaults=defaults
-                    )
-
-                    if created:
-                        created_count += 1
-                    else:
-                        updated_count += 1
-
-                except (ValueError, TypeError) as e:
-                    error_count += 1
-                    errors.append({
-                        'customer_id': data.get('id'),
-                        'error': str(e)
-                    })
-                    logger.error(f"Data type error syncing customer {data.get('id')}: {str(e)}")
-                    continue
+                    with run.timed('fetch'):
+                        data_list = client.get_all_customers()
                 except Exception as e:
-                    error_count += 1
-                    errors.append({
-                        'customer_id': data.get('id'),
-                        'error': str(e)
-                    })
-                    logger.error(f"Error syncing customer {data.get('id')}: {str(e)}")
-                    continue
+                    logger.exception("Shopify sync failed")
+                    run.fail(str(e))
+                    return Response({
+                        'success': False,
+                        'error': f"Shopify sync failed: {str(e)}"
+                    }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                finally:
+                    run.add_usage(client.usage)
+
+                with run.timed('write'):
+                    stats = sync_shopify_customers(company, data_list)
+                run.add_rows(
+                    fetched=len(data_list), created=stats['created'], updated=stats['updated'],
+                    unchanged=stats['unchanged'], failed=stats['error_count'], errors=stats['errors']
+                )
 
             return Response({
                 'success': True,
                 'message': f"Successfully synced customers",
                 'data': {
-                    'created': created_count,
-                    'updated': updated_count,
-                    'errors': error_count,
-                    'error_details': errors if errors else None,
-                    'total': created_count + updated_count,
-                    'note': 'Custom fields (cust_code) were preserved during sync'
+                    'created': stats['created'],
+                    'updated': stats['updated'],
+                    'unchanged': stats['unchanged'],
+                    'errors': stats['error_count'],
+                    'error_details': stats['errors'] if stats['errors'] else None,
+                    'total': stats['created'] + stats['updated'] + stats['unchanged'],
+                    'note': 'Custom fields (cust_code) were preserved during sync',
+                    'sync_run': run.id,
                 }
             })
 
@@ -1074,6 +970,110 @@ class CustomerViewSet(viewsets.ModelViewSet):
                 'error': f'Error deleting customer: {str(e)}'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+class SyncRunViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    The company's Shopify sync ledger, newest first. Filter with
+    ?resource=customers|products|orders, ?status= and ?trigger=.
+    """
+    serializer_class = SyncRunSerializer
+    permission_classes = [IsAuthenticated]
+    FILTERS = {'resource': SyncRun.Resource, 'status': SyncRun.Status, 'trigger': SyncRun.Trigger}
+
+    def get_company(self):
+        user = self.request.user
+        if user.is_parent:
+            return Company.objects.filter(owner=user).first()
+        return user.company
+
+    def get_queryset(self):
+        company = self.get_company()
+        if not company:
+            return SyncRun.objects.none()
+        return SyncRun.objects.filter(company=company).select_related('triggered_by')
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        for name, choices in self.FILTERS.items():
+            value = self.request.query_params.get(name)
+            if value:
+                if value not in choices.values:
+                    raise DRFValidationError({name: f"Invalid {name}. Must be one of: {', '.join(choices.values)}"})
+                queryset = queryset.filter(**{name: value})
+        return queryset
+
+    @staticmethod
+    def _totals(queryset):
+        return queryset.aggregate(
+            runs=Count('id'),
+            failures=Count('id', filter=Q(status=SyncRun.Status.FAILED)),
+            avg_duration_seconds=Avg('duration_seconds'),
+            avg_fetch_seconds=Avg('fetch_seconds'),
+            avg_write_seconds=Avg('write_seconds'),
+            avg_rows_per_second=Avg('rows_per_second'),
+            throttle_wait_seconds=Sum('throttle_wait_seconds'),
+            api_cost=Sum('api_cost'),
+            rows=Sum('rows_fetched'),
+            last_run_at=Max('started_at'),
+        )
+
+    @staticmethod
+    def _change(current, previous):
+        """Relative change of a period average against the one before, e.g. 0.25 for 25% slower"""
+        if current is None or not previous:
+            return None
+        return round((current - previous) / previous, 4)
+
+    @action(detail=False, methods=['get'])
+    def summary(self, request):
+        """
+        Per resource totals and daily averages over the last ?days= (default 30),
+        compared with the period before it, to spot syncs getting slower.
+        """
+        try:
+            days = int(request.query_params.get('days', 30))
+        except ValueError:
+            days = 0
+        if not 1 <= days <= 365:
+            return Response({'success': False, 'error': "'days' must be a number from 1 to 365"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        since = timezone.now() - timedelta(days=days)
+        queryset = self.filter_queryset(self.get_queryset())
+        current = queryset.filter(started_at__gte=since)
+        previous = queryset.filter(started_at__gte=since - timedelta(days=days), started_at__lt=since)
+
+        trend = {}
+        daily = current.annotate(day=TruncDate('started_at')).values('resource', 'day').annotate(
+            runs=Count('id'),
+            failures=Count('id', filter=Q(status=SyncRun.Status.FAILED)),
+            avg_duration_seconds=Avg('duration_seconds'),
+            avg_fetch_seconds=Avg('fetch_seconds'),
+            avg_write_seconds=Avg('write_seconds'),
+            avg_rows_per_second=Avg('rows_per_second'),
+            api_cost=Sum('api_cost'),
+        ).order_by('resource', 'day')
+        for row in daily:
+            trend.setdefault(row.pop('resource'), []).append(row)
+
+        resources = {}
+        for resource in SyncRun.Resource.values:
+            totals = self._totals(current.filter(resource=resource))
+            if not totals['runs']:
+                continue
+            before = self._totals(previous.filter(resource=resource))
+            resources[resource] = {
+                **totals,
+                'change': {
+                    field: self._change(totals[field], before[field])
+                    for field in ('avg_duration_seconds', 'avg_fetch_seconds', 'avg_write_seconds',
+                                  'avg_rows_per_second')
+                },
+                'trend': trend.get(resource, []),
+            }
+
+        return Response({'success': True, 'days': days, 'since': since, 'data': resources})
+
+
 class ShopifyIntegrationView(generics.GenericAPIView):
     queryset = Company.objects.all()
     serializer_class = CompanySerializer
@@ -1115,7 +1115,7 @@ class ShopifyIntegrationView(generics.GenericAPIView):
         try:
             # Test Shopify connection
             import requests
-            shop_url = f"https://{shopify_domain}/admin/api/2024-01/shop.json"
+            shop_url = shopify_api_url(shopify_domain, 'shop.json')
             headers = {'X-Shopify-Access-Token': shopify_access_token}
             
             logger.info(f"Making request to Shopify API: {shop_url}")
@@ -1145,7 +1145,11 @@ class ShopifyIntegrationView(generics.GenericAPIView):
             # Save credentials if connection test succeeds
             company.shopify_domain = shopify_domain
             company.shopify_access_token = shopify_access_token
-            company.save()
+            shopify_webhook_secret = request.data.get('shopify_webhook_secret', '').strip()
+            if shopify_webhook_secret:
+                company.shopify_webhook_secret = shopify_webhook_secret
+            company.save(update_fields=['shopify_domain', 'shopify_access_token', 'shopify_webhook_secret',
+                                        'updated_at'])
 
             # Log the successful update
             logger.info(f"Shopify integration updated for company {company.id}. Domain: {shopify_domain}")
@@ -1174,6 +1178,49 @@ class ShopifyIntegrationView(generics.GenericAPIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+class ShopifyWebhookView(APIView):
+    """
+    Receive Shopify webhooks. The payload is verified and stored in the
+    ShopifyWebhookEvent inbox; process_shopify_webhooks applies it later.
+    """
+    authentication_classes = []
+    permission_classes = []
+
+    def post(self, request, *args, **kwargs):
+        body = request.body
+        topic = request.headers.get('X-Shopify-Topic', '')
+        shop_domain = request.headers.get('X-Shopify-Shop-Domain', '')
+        webhook_id = request.headers.get('X-Shopify-Webhook-Id', '')
+        hmac_header = request.headers.get('X-Shopify-Hmac-Sha256', '')
+
+        company = find_webhook_company(shop_domain) if shop_domain else None
+        if company is None:
+            logger.warning(f"Shopify webhook from unknown shop: {shop_domain}")
+            return Response(status=status.HTTP_401_UNAUTHORIZED)
+
+        company_id, secret = company
+        if not verify_shopify_hmac(body, hmac_header, secret):
+            logger.warning(f"Invalid Shopify webhook signature from {shop_domain}")
+            return Response(status=status.HTTP_401_UNAUTHORIZED)
+
+        if topic not in SUPPORTED_TOPICS or not webhook_id:
+            return Response(status=status.HTTP_200_OK)
+
+        try:
+            with transaction.atomic():
+                ShopifyWebhookEvent.objects.create(
+                    company_id=company_id,
+                    webhook_id=webhook_id,
+                    topic=topic,
+                    shop_domain=shop_domain,
+                    payload=body.decode('utf-8'),
+                )
+        except IntegrityError:
+            # Shopify retried a delivery we already stored
+            logger.info(f"Duplicate Shopify webhook {webhook_id} ignored")
+
+        return Response(status=status.HTTP_200_OK)
+
 class ShiprocketIntegrationView(generics.GenericAPIView):
     queryset = Company.objects.all()
     serializer_class = CompanySerializer
@@ -1199,26 +1246,23 @@ class ShiprocketIntegrationView(generics.GenericAPIView):
 
         try:
             # Test Shiprocket connection and get token
-            import requests
-            login_url = "https://apiv2.shiprocket.in/v1/external/auth/login"
-            login_data = {
-                "email": shiprocket_email,
-                "password": shiprocket_password
-            }
-            response = requests.post(login_url, json=login_data)
-            
-            if response.status_code != 200:
+            from orders.utils.shiprocket_client import ShiprocketClient, ShiprocketAuthError
+            try:
+                token = ShiprocketClient(shiprocket_email, password=shiprocket_password).login()
+            except ShiprocketAuthError:
                 return Response(
                     {"message": "Failed to connect to Shiprocket. Please verify your credentials."},
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            token_data = response.json()
-            
             # Save credentials if connection test succeeds
             company.shiprocket_email = shiprocket_email
-            company.shiprocket_token = token_data.get('token')
-            company.save()
+            company.shiprocket_token = token
+            pickup_location = request.data.get('shiprocket_pickup_location')
+            if pickup_location:
+                company.shiprocket_pickup_location = pickup_location
+            company.save(update_fields=['shiprocket_email', 'shiprocket_token', 'shiprocket_pickup_location',
+                                        'updated_at'])
 
             # Log the successful update
             logger.info(f"Shiprocket integration updated for company {company.id}")
@@ -1295,7 +1339,8 @@ def connect_shopify(request):
     
     company.shopify_domain = domain
     company.shopify_access_token = access_token
-    company.save()
+    # request.user.company may come from the auth cache, so only write what changed
+    company.save(update_fields=['shopify_domain', 'shopify_access_token', 'updated_at'])
     
     return Response({
         'shopify_domain': domain,
@@ -0,0 +1,320 @@
+import base64
+import hashlib
+import hmac
+import json
+import logging
+from datetime import timedelta
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Company, Customer, ShopifyWebhookEvent, SyncRun
+from .services import upsert_shopify_customer
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_TOPICS = ('orders/create', 'orders/updated', 'products/update', 'customers/update')
+MAX_WEBHOOK_ATTEMPTS = 5
+# Failed events are retried no sooner than this after their last attempt
+RETRY_DELAY = timedelta(minutes=1)
+# Events left in 'processing' longer than this are assumed to belong to a dead worker
+STALE_CLAIM_AFTER = timedelta(minutes=10)
+
+
+def verify_shopify_hmac(body: bytes, hmac_header: str, secret: str) -> bool:
+    """Check the X-Shopify-Hmac-Sha256 header against the raw request body"""
+    if not (hmac_header and secret):
+        return False
+    digest = hmac.new(secret.encode('utf-8'), body, hashlib.sha256).digest()
+    expected = base64.b64encode(digest).decode('utf-8')
+    return hmac.compare_digest(expected, hmac_header)
+
+
+def _gid(resource: str, resource_id) -> str:
+    return f"gid://shopify/{resource}/{resource_id}"
+
+
+def _money(price_set: Optional[Dict], fallback) -> str:
+    shop_money = (price_set or {}).get('shop_money') or {}
+    return shop_money.get('amount', fallback)
+
+
+def _rest_address(address: Optional[Dict]) -> Dict:
+    """Convert a REST address to the GraphQL shape stored by the order sync"""
+    if not address:
+        return {}
+    return {
+        'address1': address.get('address1') or '',
+        'address2': address.get('address2') or '',
+        'city': address.get('city') or '',
+        'province': address.get('province') or '',
+        'country': address.get('country') or '',
+        'zip': address.get('zip') or '',
+        'phone': address.get('phone') or '',
+        'firstName': address.get('first_name') or '',
+        'lastName': address.get('last_name') or '',
+    }
+
+
+def order_from_webhook(payload: Dict) -> Dict:
+    """Convert an orders/* webhook payload to the ShopifyOrdersClient.get_all_orders() shape"""
+    return {
+        'id': str(payload.get('id', '')),
+        'name': payload.get('name', ''),
+        'email': payload.get('email') or payload.get('contact_email') or '',
+        'phone': payload.get('phone') or '',
+        'created_at': payload.get('created_at'),
+        'updated_at': payload.get('updated_at'),
+        'financial_status': (payload.get('financial_status') or '').lower(),
+        'fulfillment_status': (payload.get('fulfillment_status') or 'unfulfilled').lower(),
+        'subtotal_price': payload.get('subtotal_price', '0.00'),
+        'total_shipping_price': _money(payload.get('total_shipping_price_set'), '0.00'),
+        'total_tax': payload.get('total_tax', '0.00'),
+        'total_price': payload.get('total_price', '0.00'),
+        'currency_code': payload.get('currency', 'INR'),
+        'shipping_address': _rest_address(payload.get('shipping_address')),
+        'billing_address': _rest_address(payload.get('billing_address')),
+        'line_items': [
+            {
+                'title': item.get('title', ''),
+                'variant_title': item.get('variant_title') or '',
+                'quantity': item.get('quantity', 1),
+                'price': item.get('price', '0.00'),
+                'sku': item.get('sku') or '',
+            }
+            for item in payload.get('line_items', [])
+        ],
+    }
+
+
+def product_from_webhook(payload: Dict) -> Dict:
+    """Convert a products/update webhook payload to the ShopifyGraphQLClient.get_all_products() shape"""
+    tags = payload.get('tags') or ''
+    if isinstance(tags, str):
+        tags = [tag.strip() for tag in tags.split(',') if tag.strip()]
+
+    variants = []
+    for variant in payload.get('variants', []):
+        variant_data = {
+            'id': variant.get('admin_graphql_api_id') or _gid('ProductVariant', variant.get('id')),
+            'title': variant.get('title', ''),
+            'sku': variant.get('sku') or '',
+            'barcode': variant.get('barcode'),
+            'price': variant.get('price'),
+            'compareAtPrice': variant.get('compare_at_price'),
+            'inventoryQuantity': variant.get('inventory_quantity', 0),
+            'inventoryPolicy': (variant.get('inventory_policy') or 'deny').upper(),
+        }
+        for i in range(1, 4):
+            if variant.get(f'option{i}') is not None:
+                variant_data[f'option{i}'] = variant[f'option{i}']
+        variants.append(variant_data)
+
+    return {
+        'id': payload.get('admin_graphql_api_id') or _gid('Product', payload.get('id')),
+        'title': payload.get('title', ''),
+        'description': payload.get('body_html') or '',
+        'handle': payload.get('handle'),
+        'productType': payload.get('product_type') or 'Uncategorized',
+        'vendor': payload.get('vendor'),
+        'status': (payload.get('status') or 'active').upper(),
+        'tags': tags,
+        'options': [
+            {'name': option.get('name'), 'values': option.get('values', [])}
+            for option in payload.get('options', [])
+        ],
+        'variants': variants,
+        'images': [image.get('src') for image in payload.get('images', []) if image.get('src')],
+        'publishedAt': payload.get('published_at'),
+        'updatedAt': payload.get('updated_at'),
+        'requires_shipping': True,
+        'weight': None,
+        'weight_unit': 'kg',
+        'published_scope': 'global',
+    }
+
+
+def customer_from_webhook(payload: Dict) -> Dict:
+    """Convert a customers/update webhook payload to the ShopifyGraphQLClient.get_all_customers() shape"""
+    default = payload.get('default_address') or {}
+    addresses = [
+        {
+            'address1': addr.get('address1') or '',
+            'city': addr.get('city') or '',
+            'province': addr.get('province') or '',
+            'country': addr.get('country') or '',
+            'zip': addr.get('zip') or '',
+        }
+        for addr in payload.get('addresses', [])
+    ]
+    tags = [tag.strip() for tag in (payload.get('tags') or '').split(',') if tag.strip()]
+
+    return {
+        'id': str(payload.get('id', '')),
+        'first_name': payload.get('first_name') or '',
+        'last_name': payload.get('last_name') or '',
+        'email': payload.get('email') or '',
+        'phone': payload.get('phone') or '',
+        'verified_email': payload.get('verified_email', False),
+        'number_of_orders': payload.get('orders_count', 0),
+        'amount_spent': payload.get('total_spent', '0.00'),
+        'currency_code': payload.get('currency', ''),
+        'default_address_line': default.get('address1') or '',
+        'default_address_formatted_area': ', '.join(filter(None, [
+            default.get('city'),
+            default.get('province'),
+            default.get('country'),
+        ])),
+        'addresses': addresses,
+        'city': default.get('city') or '',
+        'state': default.get('province') or '',
+        'country': default.get('country') or '',
+        'created_at': payload.get('created_at'),
+        'updated_at': payload.get('updated_at'),
+        'note': payload.get('note') or '',
+        'tags': json.dumps(tags),
+    }
+
+
+def is_stale_webhook(company: Company, topic: str, payload: Dict) -> bool:
+    """
+    Whether the stored order, product or customer already has a Shopify
+    version at least as new as the payload's updated_at. Shopify does not deliver
+    webhooks in order, so an older update can arrive after a newer one.
+    """
+    from orders.models import Order
+    from products.models import Product
+
+    updated_at = parse_datetime(payload.get('updated_at') or '')
+    if updated_at is None:
+        return False
+    if topic in ('orders/create', 'orders/updated'):
+        stored = Order.objects.filter(company=company, order_id=payload.get('name', ''))
+    elif topic == 'products/update':
+        stored = Product.objects.filter(user__company=company, shopify_product_id=str(payload.get('id', '')))
+    elif topic == 'customers/update':
+        # Customer.updated_at is Shopify's own updated_at, not a local timestamp
+        return Customer.objects.filter(
+            company=company, shopify_customer_id=str(payload.get('id', '')), updated_at__gte=updated_at
+        ).exists()
+    else:
+        return False
+    return stored.filter(shopify_updated_at__gte=updated_at).exists()
+
+
+def apply_webhook_event(event: ShopifyWebhookEvent) -> bool:
+    """
+    Apply one stored webhook through the same upsert code the sync views use.
+    Returns False when the event was skipped as stale.
+    """
+    # Imported here because orders and products depend on the companies app
+    from orders.services import upsert_shopify_order
+    from products.inventory import recalculate_stock_status
+    from products.services import upsert_shopify_product
+
+    payload = json.loads(event.payload)
+    company = event.company
+
+    if is_stale_webhook(company, event.topic, payload):
+        logger.info(f"Skipping stale Shopify webhook {event.webhook_id} ({event.topic})")
+        return False
+    if event.topic in ('orders/create', 'orders/updated'):
+        upsert_shopify_order(company, order_from_webhook(payload))
+    elif event.topic == 'products/update':
+        product, created, variant_errors = upsert_shopify_product(
+            company.owner, product_from_webhook(payload), company=company
+        )
+        if variant_errors:
+            raise ValueError(f"Variant errors: {variant_errors}")
+        recalculate_stock_status(company, [product.id])
+    elif event.topic == 'customers/update':
+        upsert_shopify_customer(company, customer_from_webhook(payload))
+    else:
+        raise ValueError(f"Unsupported webhook topic: {event.topic}")
+    return True
+
+
+def claim_webhook_events(batch_size: int) -> list:
+    """Mark up to batch_size pending events as processing and return their ids"""
+    now = timezone.now()
+    with transaction.atomic():
+        event_ids = list(
+            ShopifyWebhookEvent.objects.select_for_update(skip_locked=True).filter(
+                Q(status=ShopifyWebhookEvent.Status.PENDING, claimed_at__isnull=True) |
+                Q(status=ShopifyWebhookEvent.Status.PENDING, claimed_at__lt=now - RETRY_DELAY) |
+                Q(status=ShopifyWebhookEvent.Status.PROCESSING, claimed_at__lt=now - STALE_CLAIM_AFTER)
+            ).order_by('received_at').values_list('id', flat=True)[:batch_size]
+        )
+        if event_ids:
+            ShopifyWebhookEvent.objects.filter(id__in=event_ids).update(
+                status=ShopifyWebhookEvent.Status.PROCESSING,
+                claimed_at=now,
+                attempts=F('attempts') + 1,
+            )
+    return event_ids
+
+
+def process_webhook_events(batch_size: int = 100) -> Dict:
+    """Claim and apply one batch of pending webhook events"""
+    stats = {'processed': 0, 'stale': 0, 'retrying': 0, 'failed': 0}
+    event_ids = claim_webhook_events(batch_size)
+    events = ShopifyWebhookEvent.objects.filter(id__in=event_ids).select_related(
+        'company', 'company__owner'
+    ).order_by('received_at')
+
+    # One ledger entry per company and resource for the batch
+    runs = {}
+    for event in events:
+        key = (event.company_id, event.topic.split('/')[0])
+        run = runs.get(key)
+        if run is None:
+            run = runs[key] = SyncRun.objects.create(
+                company=event.company, resource=key[1], trigger=SyncRun.Trigger.WEBHOOK
+            )
+        try:
+            with run.timed('write'), transaction.atomic():
+                applied = apply_webhook_event(event)
+        except Exception as e:
+            logger.error(f"Error applying Shopify webhook {event.webhook_id} ({event.topic}): {str(e)}")
+            run.add_rows(fetched=1, failed=1, errors=[f"{event.webhook_id} ({event.topic}): {e}"])
+            if event.attempts >= MAX_WEBHOOK_ATTEMPTS:
+                event.status = ShopifyWebhookEvent.Status.FAILED
+                stats['failed'] += 1
+            else:
+                event.status = ShopifyWebhookEvent.Status.PENDING
+                stats['retrying'] += 1
+            event.last_error = str(e)
+            event.save(update_fields=['status', 'last_error'])
+            continue
+
+        event.status = ShopifyWebhookEvent.Status.PROCESSED
+        event.processed_at = timezone.now()
+        event.last_error = ''
+        event.save(update_fields=['status', 'processed_at', 'last_error'])
+        if applied:
+            run.add_rows(fetched=1, updated=1)
+            stats['processed'] += 1
+        else:
+            run.add_rows(fetched=1, unchanged=1)
+            stats['stale'] += 1
+
+    for run in runs.values():
+        if run.failed == run.rows_fetched:
+            run.fail(f"All {run.failed} webhook events failed")
+        run.finish()
+    return stats
+
+
+def find_webhook_company(shop_domain: str) -> Optional[tuple]:
+    """Return (company_id, webhook secret) for a shop domain, or None"""
+    row = Company.objects.filter(shopify_domain=shop_domain).values_list(
+        'id', 'shopify_webhook_secret'
+    ).first()
+    if row is None:
+        return None
+    company_id, secret = row
+    return company_id, secret or getattr(settings, 'SHOPIFY_WEBHOOK_SECRET', '')
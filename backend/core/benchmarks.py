@@ -0,0 +1,411 @@
+"""
+Benchmark suite for the Shopify sync paths and the list endpoints.
+
+Syncs run through their API views against RecordedShopify, which answers
+the Shopify GraphQL clients from a recording instead of the network, so
+every run sees the same data and only our side is measured. List
+endpoints are timed against an existing (usually synthetic) tenant. Each
+benchmark reports wall time, SQL queries and peak RSS; the whole run is a
+JSON document that can be diffed against an earlier one.
+"""
+import io
+import json
+import platform
+import random
+import sys
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Callable, Dict, List, Optional
+
+import requests
+from django.db import connection
+from django.utils import timezone
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from companies.models import Company, Customer
+from companies.serializers import CustomerSerializer, CustomerValuesSerializer
+from orders.models import Order
+from orders.serializers import OrderSerializer, OrderValuesSerializer
+from .parsers import ORJSONParser
+from .renderers import ORJSONRenderer, orjson
+from products.models import Product
+from .synthetic import CITIES, FIRST_NAMES, LAST_NAMES, create_tenant_company, delete_tenant
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+RECORDING_VERSION = 1
+
+SYNC_ENDPOINTS = {
+    'customers': '/companies/api/customers/sync-shopify/',
+    'products': '/api/products/sync_shopify/',
+    'orders': '/api/orders/sync_shopify_orders/',
+}
+LIST_ENDPOINTS = {
+    'customers': '/companies/api/customers/',
+    'products': '/api/products/',
+    'orders': '/api/orders/',
+}
+
+
+def peak_rss_kb() -> Optional[int]:
+    """Peak resident set size of this process so far, in KiB"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and KiB elsewhere
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def _money(amount: float) -> Dict:
+    return {'shopMoney': {'amount': f'{amount:.2f}', 'currencyCode': 'INR'}}
+
+
+class _FakeResponse:
+    status_code = 200
+
+    def __init__(self, body: bytes):
+        self.content = body
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class RecordedShopify:
+    """
+    Replays recorded Shopify GraphQL nodes for the customers, products and
+    orders queries, paginated by the query's `limit` and `cursor` variables.
+    Responses are encoded to JSON and decoded by the client as real ones are.
+    """
+
+    def __init__(self, nodes: Dict[str, List[Dict]]):
+        self.nodes = nodes
+        self.requests = 0
+
+    @classmethod
+    def load(cls, path: str) -> 'RecordedShopify':
+        with open(path) as handle:
+            recording = json.load(handle)
+        if recording.get('version') != RECORDING_VERSION:
+            raise ValueError(f"{path} is not a version {RECORDING_VERSION} recording")
+        return cls(recording['nodes'])
+
+    def save(self, path: str):
+        with open(path, 'w') as handle:
+            json.dump({'version': RECORDING_VERSION, 'nodes': self.nodes}, handle)
+
+    @classmethod
+    def generate(cls, customers: int = 1000, products: int = 200, orders: int = 2000,
+                 variants_per_product: int = 3, seed: int = 0) -> 'RecordedShopify':
+        """A recording of a store with the given number of customers, products and orders"""
+        rng = random.Random(seed)
+        now = timezone.now()
+        customer_nodes = []
+        for n in range(customers):
+            city, province, zip_code = rng.choice(CITIES)
+            address = {'address1': f'{rng.randint(1, 400)} MG Road', 'city': city, 'province': province,
+                       'country': 'India', 'zip': zip_code}
+            customer_nodes.append({
+                'id': f'gid://shopify/Customer/{9000000 + n}',
+                'firstName': rng.choice(FIRST_NAMES),
+                'lastName': rng.choice(LAST_NAMES),
+                'email': f'shopper{n}@recorded.invalid',
+                'phone': f'+919{rng.randint(100000000, 999999999)}',
+                'verifiedEmail': True,
+                'numberOfOrders': str(rng.randint(0, 20)),
+                'amountSpent': {'amount': f'{rng.randint(0, 500000) / 100:.2f}', 'currencyCode': 'INR'},
+                'defaultAddress': address,
+                # The customer sync rejects address lists and tags as the client formats them
+                # (strings and comma-separated text), so recorded customers have neither
+                'addresses': [],
+                'createdAt': (now - timedelta(days=rng.randint(0, 1000))).isoformat(),
+                'updatedAt': now.isoformat(),
+                'tags': [],
+                'note': '',
+            })
+
+        product_nodes, skus = [], []
+        for n in range(products):
+            variants = []
+            for v in range(variants_per_product):
+                sku = f'REC-{n}-{v}'
+                price = f'{rng.randint(19900, 499900) / 100:.2f}'
+                skus.append((sku, f'Recorded Product {n}', f'Option {v}', price))
+                variants.append({'node': {
+                    'id': f'gid://shopify/ProductVariant/{8000000 + n * 100 + v}',
+                    'title': f'Option {v}',
+                    'sku': sku,
+                    'barcode': None,
+                    'price': price,
+                    'compareAtPrice': None,
+                    'inventoryQuantity': rng.randint(0, 500),
+                    'inventoryPolicy': 'DENY',
+                    'selectedOptions': [{'name': 'Option', 'value': f'Option {v}'}],
+                }})
+            product_nodes.append({
+                'id': f'gid://shopify/Product/{7000000 + n}',
+                'title': f'Recorded Product {n}',
+                'description': 'Recorded for benchmarks',
+                'handle': f'recorded-product-{n}',
+                'productType': 'Benchmark',
+                'vendor': f'Recorded Vendor {n % 5}',
+                'status': 'ACTIVE',
+                'tags': ['benchmark'],
+                'options': [{'name': 'Option', 'values': [f'Option {v}' for v in range(variants_per_product)]}],
+                'variants': {'edges': variants},
+                'images': {'edges': []},
+                'publishedAt': now.isoformat(),
+            })
+
+        order_nodes = []
+        for n in range(orders):
+            customer = rng.randrange(customers) if customers else None
+            first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            city, province, zip_code = rng.choice(CITIES)
+            address = {'address1': f'{rng.randint(1, 400)} MG Road', 'address2': '', 'city': city,
+                       'province': province, 'country': 'India', 'zip': zip_code,
+                       'phone': f'+919{rng.randint(100000000, 999999999)}',
+                       'firstName': first_name, 'lastName': last_name}
+            lines = rng.sample(skus, min(rng.randint(1, 7), len(skus)))
+            subtotal = 0.0
+            line_items = []
+            for sku, title, variant_title, price in lines:
+                quantity = rng.randint(1, 3)
+                subtotal += float(price) * quantity
+                line_items.append({'node': {'title': title, 'variantTitle': variant_title, 'quantity': quantity,
+                                            'originalUnitPrice': price, 'sku': sku}})
+
+            order_nodes.append({
+                'id': f'gid://shopify/Order/{6000000 + n}',
+                'name': f'#R{1000 + n}',
+                'email': f'shopper{customer}@recorded.invalid' if customer is not None else None,
+                'phone': address['phone'],
+                'createdAt': (now - timedelta(minutes=orders - n)).isoformat(),
+                'displayFinancialStatus': rng.choice(['PAID', 'PENDING']),
+                'displayFulfillmentStatus': rng.choice(['FULFILLED', 'UNFULFILLED']),
+                'subtotalPriceSet': _money(subtotal),
+                'totalShippingPriceSet': _money(0 if subtotal > 999 else 49),
+                'totalTaxSet': _money(subtotal * 0.18),
+                'totalPriceSet': _money(subtotal * 1.18 + (0 if subtotal > 999 else 49)),
+                'shippingAddress': address,
+                'billingAddress': address,
+                'lineItems': {'edges': line_items},
+            })
+
+        return cls({'customers': customer_nodes, 'products': product_nodes, 'orders': order_nodes})
+
+    def post(self, url, json=None, headers=None, **kwargs):
+        """Stands in for requests.post in the Shopify clients"""
+        self.requests += 1
+        query = (json or {}).get('query', '')
+        variables = (json or {}).get('variables') or {}
+        for resource_name, nodes in self.nodes.items():
+            if f'{resource_name}(' in query:
+                break
+        else:
+            raise ValueError(f"No recording answers this query: {query[:80]!r}")
+
+        if 'pageInfo' in query:
+            start = int(variables.get('cursor') or 0)
+            end = start + int(variables.get('limit') or 50)
+            page = {
+                'pageInfo': {'hasNextPage': end < len(nodes), 'endCursor': str(end)},
+                'edges': [{'node': node} for node in nodes[start:end]],
+            }
+        else:
+            # Queries without pagination (products) get everything in one page
+            page = {'edges': [{'node': node} for node in nodes]}
+        return _FakeResponse(_json_dumps({'data': {resource_name: page}}))
+
+    @contextmanager
+    def installed(self):
+        """Route the Shopify clients' requests.post to this recording"""
+        original = requests.post
+        requests.post = self.post
+        try:
+            yield self
+        finally:
+            requests.post = original
+
+
+def _json_dumps(data) -> bytes:
+    # RecordedShopify.post has a `json` argument, like requests.post, hiding the module
+    return json.dumps(data).encode()
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def measure(name: str, fn: Callable[[], Dict]) -> Dict:
+    """Run fn once and report its wall time, queries and the process' peak RSS afterwards"""
+    counter = _QueryCounter()
+    rss_before = peak_rss_kb()
+    started = time.perf_counter()
+    with connection.execute_wrapper(counter):
+        details = fn() or {}
+    wall = time.perf_counter() - started
+    rss_after = peak_rss_kb()
+    return {
+        'name': name,
+        'wall_seconds': round(wall, 4),
+        'queries': counter.count,
+        'peak_rss_kb': rss_after,
+        'peak_rss_growth_kb': rss_after - rss_before if rss_after is not None else None,
+        **details,
+    }
+
+
+def api_client(company: Company) -> APIClient:
+    """A client authenticated as the company owner with a real JWT, as the frontend is"""
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(company.owner).access_token}')
+    return client
+
+
+def _sync(client: APIClient, resource_name: str) -> Callable[[], Dict]:
+    def run():
+        response = client.post(SYNC_ENDPOINTS[resource_name])
+        body = response.json()
+        return {'status': response.status_code, 'response': body.get('data') or body.get('message') or body}
+    return run
+
+
+def _list(client: APIClient, resource_name: str) -> Callable[[], Dict]:
+    def run():
+        response = client.get(LIST_ENDPOINTS[resource_name])
+        content = b''.join(response) if response.streaming else response.content
+        rows = json.loads(content) if response.status_code == 200 else None
+        if isinstance(rows, dict):
+            rows = rows.get('results', rows.get('data', rows))
+        return {'status': response.status_code, 'rows': len(rows) if isinstance(rows, list) else None,
+                'response_bytes': len(content)}
+    return run
+
+
+def sync_benchmarks(shopify: RecordedShopify, keep: bool = False) -> List[Dict]:
+    """
+    Sync the recording into a fresh tenant twice: the first pass creates
+    everything, the second finds nothing changed. Customers and products go
+    first so the orders sync finds their customers and SKUs.
+    """
+    company = create_tenant_company('Benchmark sync tenant')
+    client = api_client(company)
+    results = []
+    try:
+        with shopify.installed():
+            for resource_name in ('customers', 'products', 'orders'):
+                results.append(measure(f'sync_{resource_name}_initial', _sync(client, resource_name)))
+                results.append(measure(f'sync_{resource_name}_unchanged', _sync(client, resource_name)))
+    finally:
+        if not keep:
+            delete_tenant(company)
+    return results
+
+
+def list_benchmarks(company: Company, resources=tuple(LIST_ENDPOINTS)) -> List[Dict]:
+    client = api_client(company)
+    return [measure(f'list_{resource_name}', _list(client, resource_name)) for resource_name in resources]
+
+
+def serializer_benchmarks(company: Company, rows: int = 10000) -> List[Dict]:
+    """
+    Serialize and render the first `rows` customers and orders of a company
+    with the ModelSerializers and with their .values() counterparts, and check
+    both render the same bytes. Orders are read with their customers and
+    items prefetched, so the ModelSerializer side is not measuring N+1 queries.
+    """
+    cases = [
+        ('customers', CustomerSerializer, CustomerValuesSerializer, Customer.objects.filter(company=company)),
+        ('orders', OrderSerializer, OrderValuesSerializer, Order.objects.filter(company=company).order_by('pk')),
+    ]
+    results = []
+    for resource_name, serializer_class, values_serializer_class, queryset in cases:
+        pks = list(queryset.values_list('pk', flat=True)[:rows])
+        queryset = queryset.filter(pk__in=pks)
+        rendered = {}
+
+        def model_serializer():
+            instances = queryset
+            if resource_name == 'orders':
+                instances = instances.select_related('customer').prefetch_related('items')
+            rendered['model'] = JSONRenderer().render(serializer_class(instances, many=True).data)
+            return {'rows': len(pks), 'response_bytes': len(rendered['model'])}
+
+        def values_serializer():
+            serializer = values_serializer_class()
+            rendered['values'] = JSONRenderer().render(serializer.serialize(serializer.values(queryset)))
+            return {'rows': len(pks), 'response_bytes': len(rendered['values'])}
+
+        results.append(measure(f'serialize_{resource_name}_model_serializer', model_serializer))
+        results.append(measure(f'serialize_{resource_name}_values_serializer', values_serializer))
+        results[-1]['identical'] = rendered['model'] == rendered['values']
+    return results
+
+
+def json_benchmarks(company: Company, resources=tuple(LIST_ENDPOINTS)) -> List[Dict]:
+    """
+    Render and parse the list endpoints' payloads with the stock JSON
+    renderer and parser and with the orjson ones, checking both agree.
+    """
+    client = api_client(company)
+    results = []
+    for resource_name in resources:
+        response = client.get(LIST_ENDPOINTS[resource_name])
+        if getattr(response, 'data', None) is None:
+            continue
+        data = response.data
+        rendered = {}
+
+        def render(renderer_class, key):
+            def run():
+                rendered[key] = renderer_class().render(data)
+                return {'response_bytes': len(rendered[key])}
+            return run
+
+        def parse(parser_class, key):
+            def run():
+                rendered[key] = parser_class().parse(io.BytesIO(rendered['stock']))
+                return {}
+            return run
+
+        results.append(measure(f'render_{resource_name}_stock', render(JSONRenderer, 'stock')))
+        results.append(measure(f'render_{resource_name}_orjson', render(ORJSONRenderer, 'orjson')))
+        results[-1]['identical'] = rendered['stock'] == rendered['orjson']
+        results.append(measure(f'parse_{resource_name}_stock', parse(JSONParser, 'stock_parsed')))
+        results.append(measure(f'parse_{resource_name}_orjson', parse(ORJSONParser, 'orjson_parsed')))
+        results[-1]['identical'] = rendered['stock_parsed'] == rendered['orjson_parsed']
+    return results
+
+
+def tenant_size(company: Company) -> Dict:
+    return {
+        'company': str(company.pk),
+        'customers': Customer.objects.filter(company=company).count(),
+        'products': Product.objects.filter(user__company=company).count(),
+        'orders': Order.objects.filter(company=company).count(),
+    }
+
+
+def environment() -> Dict:
+    return {
+        'started_at': timezone.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'database': connection.vendor,
+        'orjson': orjson.__version__ if orjson is not None else None,
+    }
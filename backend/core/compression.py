@@ -0,0 +1,194 @@
+"""
+Negotiated response compression.
+
+CompressionMiddleware compresses text and JSON responses with the best
+encoding the client accepts: zstd or brotli when the zstandard or brotli
+packages are installed, else gzip. Responses under COMPRESSION_MIN_SIZE are
+sent as they are. Streaming responses (the CSV exports) are compressed
+chunk by chunk as they are produced. Other responses get an ETag from
+their content, and their compressed bodies are kept in the
+COMPRESSION_CACHE_ALIAS cache under that ETag, so the same list fetched
+again is not compressed again.
+"""
+import hashlib
+import zlib
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # optional
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional
+    zstandard = None
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+ZSTD_LEVEL = 3
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml')
+
+
+class _ZlibStream:
+    def __init__(self):
+        self.compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # wbits=31 writes a gzip header
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self.compressor.flush()
+
+
+class _BrotliStream:
+    def __init__(self):
+        self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self.compressor.finish()
+
+
+class _ZstdStream:
+    def __init__(self):
+        self.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self.compressor.flush()
+
+
+# Content-Encoding -> streaming compressor, most preferred first
+ENCODINGS: Dict[str, type] = {}
+if zstandard is not None:
+    ENCODINGS['zstd'] = _ZstdStream
+if brotli is not None:
+    ENCODINGS['br'] = _BrotliStream
+ENCODINGS['gzip'] = _ZlibStream
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """The available encoding with the highest q in an Accept-Encoding header, ties going to ENCODINGS order"""
+    weights = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            weights[name.strip().lower()] = quality
+
+    best, best_quality = None, 0.0
+    for encoding in ENCODINGS:
+        quality = weights.get(encoding, weights.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress_body(encoding: str, content: bytes) -> bytes:
+    stream = ENCODINGS[encoding]()
+    return stream.compress(content) + stream.flush()
+
+
+def _compress_chunks(encoding: str, chunks):
+    stream = ENCODINGS[encoding]()
+    for chunk in chunks:
+        compressed = stream.compress(chunk)
+        if compressed:
+            yield compressed
+    yield stream.flush()
+
+
+async def _compress_chunks_async(encoding: str, chunks):
+    stream = ENCODINGS[encoding]()
+    async for chunk in chunks:
+        compressed = stream.compress(chunk)
+        if compressed:
+            yield compressed
+    yield stream.flush()
+
+
+class CompressionMiddleware:
+    """Compress text and JSON responses with the client's preferred encoding, see the module docstring"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.min_size = getattr(settings, 'COMPRESSION_MIN_SIZE', 1024)
+        self.cache_alias = getattr(settings, 'COMPRESSION_CACHE_ALIAS', None)
+        self.cache_timeout = getattr(settings, 'COMPRESSION_CACHE_TIMEOUT', 600)
+        self.cache_min_size = getattr(settings, 'COMPRESSION_CACHE_MIN_SIZE', 64 * 1024)
+        self.cache_max_size = getattr(settings, 'COMPRESSION_CACHE_MAX_SIZE', 8 * 1024 * 1024)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if response.has_header('Content-Encoding') or not self._compressible(response):
+            return response
+        if not response.streaming and len(response.content) < self.min_size:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+
+        if response.streaming:
+            if encoding is None:
+                return response
+            if response.is_async:
+                response.streaming_content = _compress_chunks_async(encoding, response.streaming_content)
+            else:
+                response.streaming_content = _compress_chunks(encoding, response.streaming_content)
+            del response['Content-Length']
+            response['Content-Encoding'] = encoding
+            return response
+
+        content = response.content
+        digest = hashlib.md5(content, usedforsecurity=False).hexdigest()
+        if not response.has_header('ETag'):
+            response['ETag'] = f'"{digest}"'
+        if encoding is None:
+            return response
+
+        compressed = self._compressed(encoding, digest, content, cacheable=response.status_code == 200)
+        if len(compressed) >= len(content):
+            return response
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        # The compressed bytes differ from the identity ones, so the ETag can only be weak
+        etag = response['ETag']
+        if etag.startswith('"'):
+            response['ETag'] = f'W/{etag}'
+        return response
+
+    @staticmethod
+    def _compressible(response) -> bool:
+        content_type = response.get('Content-Type', '').lower()
+        if 'no-transform' in response.get('Cache-Control', '').lower():
+            return False
+        return content_type.startswith(COMPRESSIBLE_TYPES) or '+json' in content_type
+
+    def _compressed(self, encoding: str, digest: str, content: bytes, cacheable: bool) -> bytes:
+        if not cacheable or self.cache_alias is None or len(content) < self.cache_min_size:
+            return compress_body(encoding, content)
+
+        cache = caches[self.cache_alias]
+        key = f'compressed:{encoding}:{digest}'
+        compressed = cache.get(key)
+        if compressed is None:
+            compressed = compress_body(encoding, content)
+            if len(compressed) <= self.cache_max_size:
+                cache.set(key, compressed, self.cache_timeout)
+        return compressed
@@ -0,0 +1,68 @@
+import csv
+import zlib
+from typing import Iterable, Iterator, Sequence
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+EXPORT_CHUNK_SIZE = 2000
+# Rows written to the CSV buffer before a chunk is yielded to the client
+ROWS_PER_CHUNK = 500
+
+
+class _Buffer:
+    """File-like object that keeps what csv.writer writes until it is collected"""
+    def __init__(self):
+        self.parts = []
+
+    def write(self, value):
+        self.parts.append(value)
+
+    def collect(self) -> str:
+        data = ''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def iter_csv(header: Sequence[str], rows: Iterable[Sequence]) -> Iterator[bytes]:
+    """Encode rows as CSV, yielding one bytes chunk per ROWS_PER_CHUNK rows"""
+    buffer = _Buffer()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    pending = 1
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= ROWS_PER_CHUNK:
+            yield buffer.collect().encode('utf-8')
+            pending = 0
+    if pending:
+        yield buffer.collect().encode('utf-8')
+
+
+def iter_gzip(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip header
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def wants_gzip(request) -> bool:
+    return request.query_params.get('gzip', '').lower() in ('1', 'true', 'yes')
+
+
+def stream_csv_response(name: str, header: Sequence[str], rows: Iterable[Sequence],
+                        gzip: bool = False) -> StreamingHttpResponse:
+    """Stream rows as a CSV download, optionally gzipped, named <name>-<date>.csv[.gz]"""
+    filename = f"{name}-{timezone.localdate():%Y%m%d}.csv"
+    content = iter_csv(header, rows)
+    content_type = 'text/csv; charset=utf-8'
+    if gzip:
+        content = iter_gzip(content)
+        content_type = 'application/gzip'
+        filename += '.gz'
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
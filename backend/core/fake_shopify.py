@@ -0,0 +1,592 @@
+"""
+Fake Shopify Admin API for load and integration tests.
+
+    python -m core.fake_shopify --port 8765 --customers 5000 --orders 20000 --latency 0.05 --error-rate 0.01
+
+Serves POST .../admin/api/<version>/graphql.json and GET .../shop.json,
+with or without a leading /<shop domain>, from generated data. Point the app
+at it with
+
+    SHOPIFY_API_URL=http://127.0.0.1:8765/{shop_domain}/admin/api/2024-01
+
+What it does like Shopify:
+  * customers, products and orders connections with opaque cursors
+    (first/after, pageInfo.hasNextPage/endCursor), stable under inserts
+    and deletes
+  * a leaky cost bucket per access token; queries the bucket cannot cover
+    get a THROTTLED error, and every response carries extensions.cost
+  * the mutations the app sends, aliased and batched: customerCreate,
+    customerUpdate, customerDelete, productCreate, productUpdate and
+    productVariantsBulkUpdate
+  * optional latency and a rate of HTTP 5xx errors
+
+The GraphQL handling is deliberately shallow: root fields and their
+arguments are parsed, and full nodes are returned whatever the selection.
+Query cost is simplified to one point per requested node, plus one per
+nested connection per node, and ten per mutation. The module only needs
+the standard library, so it runs without Django.
+"""
+import argparse
+import base64
+import bisect
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+FIRST_NAMES = ['Aarav', 'Diya', 'Ishaan', 'Kavya', 'Rohan', 'Ananya', 'Vihaan', 'Meera', 'Arjun', 'Saanvi']
+LAST_NAMES = ['Sharma', 'Patel', 'Iyer', 'Reddy', 'Gupta', 'Nair', 'Singh', 'Das', 'Mehta', 'Kapoor']
+CITIES = [('Mumbai', 'Maharashtra', '400001'), ('Bengaluru', 'Karnataka', '560001'),
+          ('Delhi', 'Delhi', '110001'), ('Chennai', 'Tamil Nadu', '600001'), ('Pune', 'Maharashtra', '411001')]
+TAGS = ['vip', 'wholesale', 'newsletter', 'returning']
+
+MAXIMUM_AVAILABLE = 1000
+RESTORE_RATE = 50
+MUTATION_COST = 10
+MAX_PAGE_SIZE = 250
+
+RESOURCES = {'customers': 'Customer', 'products': 'Product', 'orders': 'Order'}
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).replace(microsecond=0).isoformat().replace('+00:00', 'Z')
+
+
+def _gid(resource: str, number: int) -> str:
+    return f'gid://shopify/{resource}/{number}'
+
+
+def _number(gid) -> int:
+    return int(str(gid).rsplit('/', 1)[-1])
+
+
+def _money(amount: float) -> Dict:
+    return {'shopMoney': {'amount': f'{amount:.2f}', 'currencyCode': 'INR'}}
+
+
+def _address(rng: random.Random, first_name: str, last_name: str) -> Dict:
+    city, province, zip_code = rng.choice(CITIES)
+    address1 = f'{rng.randint(1, 400)} MG Road'
+    return {
+        'firstName': first_name, 'lastName': last_name, 'address1': address1, 'address2': '',
+        'city': city, 'province': province, 'country': 'India', 'zip': zip_code,
+        'phone': f'+919{rng.randint(100000000, 999999999)}',
+        'formatted': [address1, f'{city} {province} {zip_code}', 'India'],
+    }
+
+
+def generate_store(customers: int = 1000, products: int = 200, orders: int = 2000,
+                   variants_per_product: int = 3, seed: int = 0) -> Dict[str, List[Dict]]:
+    """Shopify-shaped nodes for a store of the given size, the same for the same seed"""
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    store = {'customers': [], 'products': [], 'orders': []}
+
+    for n in range(1, customers + 1):
+        first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        address = _address(rng, first_name, last_name)
+        spent = rng.randint(0, 500000) / 100
+        store['customers'].append({
+            'id': _gid('Customer', n), 'firstName': first_name, 'lastName': last_name,
+            'email': f'customer{n}@fake-shopify.invalid', 'phone': address['phone'],
+            'verifiedEmail': True, 'numberOfOrders': str(rng.randint(0, 20)),
+            'amountSpent': {'amount': f'{spent:.2f}', 'currencyCode': 'INR'},
+            'defaultAddress': address, 'addresses': [address],
+            'createdAt': (now - timedelta(days=rng.randint(0, 1000))).isoformat(), 'updatedAt': now.isoformat(),
+            'tags': rng.sample(TAGS, rng.randint(0, 2)), 'note': '', 'image': {'url': None},
+        })
+
+    variant_number = 0
+    skus = []
+    for n in range(1, products + 1):
+        variants = []
+        for v in range(variants_per_product):
+            variant_number += 1
+            price = f'{rng.randint(19900, 499900) / 100:.2f}'
+            sku = f'FAKE-{n}-{v}'
+            skus.append((sku, f'Fake Product {n}', f'Option {v}', price))
+            variants.append({'node': {
+                'id': _gid('ProductVariant', variant_number), 'title': f'Option {v}', 'sku': sku,
+                'barcode': None, 'price': price, 'compareAtPrice': None,
+                'inventoryQuantity': rng.randint(0, 500), 'inventoryPolicy': 'DENY',
+                'selectedOptions': [{'name': 'Option', 'value': f'Option {v}'}],
+            }})
+        store['products'].append({
+            'id': _gid('Product', n), 'title': f'Fake Product {n}', 'description': '', 'descriptionHtml': '',
+            'handle': f'fake-product-{n}', 'productType': 'Fake', 'vendor': f'Fake Vendor {n % 5}',
+            'status': 'ACTIVE', 'tags': [],
+            'options': [{'name': 'Option', 'values': [f'Option {v}' for v in range(variants_per_product)]}],
+            'variants': {'edges': variants}, 'images': {'edges': []}, 'publishedAt': now.isoformat(),
+        })
+
+    for n in range(1, orders + 1):
+        customer = rng.randint(1, customers) if customers else None
+        address = _address(rng, rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES))
+        line_items, subtotal = [], 0.0
+        for sku, title, variant_title, price in rng.sample(skus, min(rng.randint(1, 7), len(skus))):
+            quantity = rng.randint(1, 3)
+            subtotal += float(price) * quantity
+            line_items.append({'node': {'title': title, 'variantTitle': variant_title, 'quantity': quantity,
+                                        'originalUnitPrice': price, 'sku': sku}})
+        shipping = 0 if subtotal > 999 else 49
+        store['orders'].append({
+            'id': _gid('Order', n), 'name': f'#{1000 + n}',
+            'email': f'customer{customer}@fake-shopify.invalid' if customer else None,
+            'phone': address['phone'], 'createdAt': (now - timedelta(minutes=orders - n)).isoformat(),
+            'displayFinancialStatus': rng.choice(['PAID', 'PENDING']),
+            'displayFulfillmentStatus': rng.choice(['FULFILLED', 'UNFULFILLED']),
+            'subtotalPriceSet': _money(subtotal), 'totalShippingPriceSet': _money(shipping),
+            'totalTaxSet': _money(subtotal * 0.18), 'totalPriceSet': _money(subtotal * 1.18 + shipping),
+            'shippingAddress': address, 'billingAddress': address, 'lineItems': {'edges': line_items},
+        })
+    return store
+
+
+class GraphQLError(Exception):
+    def __init__(self, message: str, code: str = 'BAD_REQUEST'):
+        super().__init__(message)
+        self.code = code
+
+
+# alias: field(args)
+FIELD_RE = re.compile(r'(?:(\w+)\s*:\s*)?(\w+)\s*(?:\(([^)]*)\))?')
+ARGUMENT_RE = re.compile(r'(\w+)\s*:\s*(\$\w+|"(?:[^"\\]|\\.)*"|-?\d+|true|false|null)')
+NESTED_CONNECTION_RE = re.compile(r'\w+\s*\(\s*first\s*:\s*\d+')
+
+
+def parse_operation(query: str) -> Tuple[str, List[Tuple[str, str, str]]]:
+    """
+    The operation type and its root fields as (alias, name, arguments)
+    triples. Only the top level of the selection set is looked at.
+    """
+    query = re.sub(r'#[^\n]*', '', query)
+    start = query.find('{')
+    if start < 0:
+        raise GraphQLError('Syntax error: expected a selection set')
+    head = query[:start].strip()
+    kind = head.split(None, 1)[0] if head else 'query'
+    if kind not in ('query', 'mutation'):
+        raise GraphQLError(f'Unsupported operation type "{kind}"')
+
+    depth, parens, top = 0, 0, []
+    for char in query[start:]:
+        if char == '(':
+            parens += 1
+        elif char == ')':
+            parens -= 1
+        elif char == '{' and not parens:
+            depth += 1
+            continue
+        elif char == '}' and not parens:
+            depth -= 1
+            if depth == 0:
+                break
+            continue
+        if depth == 1:
+            top.append(char)
+    fields = [(alias or name, name, args or '') for alias, name, args in FIELD_RE.findall(''.join(top))]
+    if not fields:
+        raise GraphQLError('Syntax error: empty selection set')
+    return kind, fields
+
+
+def parse_arguments(text: str, variables: Dict) -> Dict:
+    arguments = {}
+    for name, raw in ARGUMENT_RE.findall(text):
+        arguments[name] = variables.get(raw[1:]) if raw.startswith('$') else json.loads(raw)
+    return arguments
+
+
+def encode_cursor(number: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({'last_id': number}).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        return int(json.loads(base64.urlsafe_b64decode(cursor.encode()))['last_id'])
+    except (ValueError, KeyError, TypeError):
+        raise GraphQLError('Invalid cursor for current pagination sort.', 'INVALID_CURSOR')
+
+
+class CostBucket:
+    """Shopify's leaky bucket: MAXIMUM_AVAILABLE points, refilled at RESTORE_RATE per second"""
+
+    def __init__(self, maximum: float, restore_rate: float):
+        self.maximum = maximum
+        self.restore_rate = restore_rate
+        self.available = float(maximum)
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.available = min(self.maximum, self.available + (now - self.updated) * self.restore_rate)
+        self.updated = now
+
+    def status(self) -> Dict:
+        return {'maximumAvailable': float(self.maximum), 'currentlyAvailable': int(self.available),
+                'restoreRate': float(self.restore_rate)}
+
+
+class FakeShopify:
+    """The fake store and its GraphQL handling, independent of the HTTP server"""
+
+    def __init__(self, store: Dict[str, List[Dict]], access_token: Optional[str] = None,
+                 maximum_available: float = MAXIMUM_AVAILABLE, restore_rate: float = RESTORE_RATE,
+                 latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        self.lock = threading.Lock()
+        self.access_token = access_token
+        self.maximum_available = maximum_available
+        self.restore_rate = restore_rate
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.buckets: Dict[str, CostBucket] = {}
+        self.stats = {'requests': 0, 'throttled': 0, 'injected_errors': 0, 'mutations': 0}
+
+        # Nodes by number, plus sorted numbers for cursor pagination
+        self.nodes: Dict[str, Dict[int, Dict]] = {}
+        self.order: Dict[str, List[int]] = {}
+        for resource in RESOURCES:
+            self.nodes[resource] = {_number(node['id']): node for node in store.get(resource, [])}
+            self.order[resource] = sorted(self.nodes[resource])
+        self.variants = {
+            _number(edge['node']['id']): (product, edge['node'])
+            for product in self.nodes['products'].values() for edge in product['variants']['edges']
+        }
+
+    # HTTP-level behaviour
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(self.latency + self.rng.uniform(0, self.jitter))
+
+    def injected_error(self) -> Optional[int]:
+        if self.error_rate and self.rng.random() < self.error_rate:
+            with self.lock:
+                self.stats['injected_errors'] += 1
+            return self.rng.choice((500, 502, 503))
+        return None
+
+    def authorized(self, token: Optional[str]) -> bool:
+        return bool(token) and (self.access_token is None or token == self.access_token)
+
+    def shop(self, domain: str) -> Dict:
+        return {'id': _gid('Shop', 1), 'name': domain.split('.')[0] or 'fake', 'email': f'owner@{domain}',
+                'myshopifyDomain': domain, 'currencyCode': 'INR', 'plan': {'displayName': 'Fake'}}
+
+    # GraphQL
+
+    def execute(self, token: str, query: str, variables: Optional[Dict] = None, domain: str = '') -> Dict:
+        variables = variables or {}
+        with self.lock:
+            self.stats['requests'] += 1
+        try:
+            kind, fields = parse_operation(query or '')
+        except GraphQLError as e:
+            return {'errors': [{'message': str(e), 'extensions': {'code': e.code}}]}
+
+        requested = self.requested_cost(kind, fields, query, variables)
+        with self.lock:
+            bucket = self.buckets.get(token)
+            if bucket is None:
+                bucket = self.buckets[token] = CostBucket(self.maximum_available, self.restore_rate)
+            bucket.refill()
+            if requested > bucket.available:
+                self.stats['throttled'] += 1
+                return {
+                    'errors': [{'message': 'Throttled', 'extensions': {
+                        'code': 'THROTTLED',
+                        'documentation': 'https://shopify.dev/api/usage/rate-limits',
+                    }}],
+                    'extensions': {'cost': {'requestedQueryCost': requested, 'actualQueryCost': None,
+                                            'throttleStatus': bucket.status()}},
+                }
+            bucket.available -= requested
+
+            data, errors, actual = {}, [], 0
+            for alias, name, arguments in fields:
+                try:
+                    data[alias], cost = self.resolve(kind, name, parse_arguments(arguments, variables), domain)
+                    actual += cost
+                except GraphQLError as e:
+                    data[alias] = None
+                    errors.append({'message': str(e), 'path': [alias], 'extensions': {'code': e.code}})
+            # Unused points are refunded, as Shopify does
+            actual = min(actual, requested)
+            bucket.available = min(bucket.maximum, bucket.available + requested - actual)
+            status = bucket.status()
+
+        response = {'data': data, 'extensions': {'cost': {
+            'requestedQueryCost': requested, 'actualQueryCost': actual, 'throttleStatus': status,
+        }}}
+        if errors:
+            response['errors'] = errors
+        return response
+
+    def requested_cost(self, kind: str, fields, query: str, variables: Dict) -> int:
+        if kind == 'mutation':
+            return MUTATION_COST * len(fields)
+        # Connections with a literal `first` below the root fields
+        nested = len(NESTED_CONNECTION_RE.findall(query)) - sum(
+            1 for _, name, arguments in fields if NESTED_CONNECTION_RE.match(f'{name}({arguments}')
+        )
+        cost = 0
+        for _, name, arguments in fields:
+            if name in RESOURCES:
+                first = parse_arguments(arguments, variables).get('first') or 0
+                cost += 2 + int(first) * (1 + nested)
+            else:
+                cost += 1
+        return cost
+
+    def resolve(self, kind: str, name: str, arguments: Dict, domain: str):
+        """(result, actual cost) of one root field"""
+        if kind == 'query':
+            if name in RESOURCES:
+                return self.connection(name, arguments)
+            if name == 'shop':
+                return self.shop(domain), 1
+            raise GraphQLError(f"Field '{name}' doesn't exist on type 'QueryRoot'", 'undefinedField')
+
+        resolver = getattr(self, f'mutation_{name}', None)
+        if resolver is None:
+            raise GraphQLError(f"Field '{name}' doesn't exist on type 'Mutation'", 'undefinedField')
+        self.stats['mutations'] += 1
+        return resolver(**arguments), MUTATION_COST
+
+    def connection(self, resource: str, arguments: Dict):
+        first = arguments.get('first')
+        if not isinstance(first, int) or not 0 < first <= MAX_PAGE_SIZE:
+            raise GraphQLError(f'first must be between 1 and {MAX_PAGE_SIZE}', 'BAD_REQUEST')
+        numbers = self.order[resource]
+        start = bisect.bisect_right(numbers, decode_cursor(arguments['after'])) if arguments.get('after') else 0
+        page = numbers[start:start + first]
+        edges = [{'cursor': encode_cursor(number), 'node': self.nodes[resource][number]} for number in page]
+        return {
+            'edges': edges,
+            'pageInfo': {
+                'hasNextPage': start + first < len(numbers),
+                'hasPreviousPage': start > 0,
+                'startCursor': edges[0]['cursor'] if edges else None,
+                'endCursor': edges[-1]['cursor'] if edges else None,
+            },
+        }, 2 + len(page)
+
+    def _insert(self, resource: str, node: Dict) -> Dict:
+        number = (self.order[resource][-1] if self.order[resource] else 0) + 1
+        node['id'] = _gid(RESOURCES[resource], number)
+        self.nodes[resource][number] = node
+        self.order[resource].append(number)
+        return node
+
+    def _get(self, resource: str, gid) -> Optional[Dict]:
+        try:
+            return self.nodes[resource].get(_number(gid))
+        except (TypeError, ValueError):
+            return None
+
+    def mutation_customerCreate(self, input=None):
+        input = dict(input or {})
+        if not (input.get('email') or input.get('phone')):
+            return {'customer': None, 'userErrors': [
+                {'field': ['email'], 'message': 'A customer must have either an email or a phone number'}]}
+        now = _now()
+        customer = self._insert('customers', {
+            'firstName': input.get('firstName'), 'lastName': input.get('lastName'),
+            'email': input.get('email'), 'phone': input.get('phone'), 'verifiedEmail': False,
+            'numberOfOrders': '0', 'amountSpent': {'amount': '0.00', 'currencyCode': 'INR'},
+            'defaultAddress': (input.get('addresses') or [None])[0], 'addresses': input.get('addresses') or [],
+            'createdAt': now, 'updatedAt': now, 'tags': input.get('tags') or [], 'note': input.get('note'),
+            'image': {'url': None},
+        })
+        return {'customer': customer, 'userErrors': []}
+
+    def mutation_customerUpdate(self, input=None):
+        input = dict(input or {})
+        customer = self._get('customers', input.pop('id', None))
+        if customer is None:
+            return {'customer': None, 'userErrors': [{'field': ['id'], 'message': 'Customer does not exist'}]}
+        customer.update(input)
+        if input.get('addresses'):
+            customer['defaultAddress'] = input['addresses'][0]
+        customer['updatedAt'] = _now()
+        return {'customer': customer, 'userErrors': []}
+
+    def mutation_customerDelete(self, input=None):
+        gid = (input or {}).get('id')
+        customer = self._get('customers', gid)
+        if customer is None:
+            return {'deletedCustomerId': None,
+                    'userErrors': [{'field': ['id'], 'message': 'Customer does not exist'}]}
+        number = _number(gid)
+        del self.nodes['customers'][number]
+        self.order['customers'].remove(number)
+        return {'deletedCustomerId': customer['id'], 'userErrors': []}
+
+    def mutation_productCreate(self, input=None):
+        input = dict(input or {})
+        if not input.get('title'):
+            return {'product': None, 'userErrors': [{'field': ['title'], 'message': "Title can't be blank"}]}
+        now = _now()
+        product = self._insert('products', {
+            'title': input['title'], 'description': '', 'descriptionHtml': input.get('descriptionHtml') or '',
+            'handle': input.get('handle') or input['title'].lower().replace(' ', '-'),
+            'productType': input.get('productType') or '', 'vendor': input.get('vendor') or '',
+            'status': input.get('status') or 'ACTIVE', 'tags': input.get('tags') or [], 'options': [],
+            'variants': {'edges': []}, 'images': {'edges': []}, 'publishedAt': now,
+        })
+        for variant_input in input.get('variants') or [{'price': '0.00'}]:
+            number = (max(self.variants) if self.variants else 0) + 1
+            quantities = variant_input.get('inventoryQuantities') or [{}]
+            variant = {
+                'id': _gid('ProductVariant', number), 'title': 'Default Title', 'sku': variant_input.get('sku'),
+                'barcode': variant_input.get('barcode'), 'price': str(variant_input.get('price') or '0.00'),
+                'compareAtPrice': variant_input.get('compareAtPrice'),
+                'inventoryQuantity': int(quantities[0].get('availableQuantity') or 0),
+                'inventoryPolicy': variant_input.get('inventoryPolicy') or 'DENY', 'selectedOptions': [],
+            }
+            product['variants']['edges'].append({'node': variant})
+            self.variants[number] = (product, variant)
+        return {'product': product, 'userErrors': []}
+
+    def mutation_productUpdate(self, input=None):
+        input = dict(input or {})
+        product = self._get('products', input.pop('id', None))
+        if product is None:
+            return {'product': None, 'userErrors': [{'field': ['id'], 'message': 'Product does not exist'}]}
+        input.pop('variants', None)
+        product.update(input)
+        return {'product': product, 'userErrors': []}
+
+    def mutation_productVariantsBulkUpdate(self, productId=None, variants=None):
+        product = self._get('products', productId)
+        if product is None:
+            return {'product': None, 'productVariants': None,
+                    'userErrors': [{'field': ['productId'], 'message': 'Product does not exist'}]}
+        updated, errors = [], []
+        for index, variant_input in enumerate(variants or []):
+            variant_input = dict(variant_input)
+            owner, variant = self.variants.get(_number(variant_input.pop('id', 0)), (None, None))
+            if owner is not product:
+                errors.append({'field': ['variants', str(index), 'id'], 'message': 'Product variant does not exist'})
+                continue
+            variant.update(variant_input)
+            updated.append(variant)
+        return {'product': product, 'productVariants': updated, 'userErrors': errors}
+
+
+def make_handler(fake: FakeShopify):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _domain(self) -> str:
+            # /<shop domain>/admin/api/... when several shops share the server
+            first = self.path.lstrip('/').split('/', 1)[0]
+            return first if first != 'admin' else self.headers.get('Host', 'fake.myshopify.com').split(':')[0]
+
+        def _send(self, status: int, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _check(self) -> bool:
+            fake.delay()
+            status = fake.injected_error()
+            if status:
+                self._send(status, {'errors': 'Internal Server Error'})
+                return False
+            if not fake.authorized(self.headers.get('X-Shopify-Access-Token')):
+                self._send(401, {'errors': '[API] Invalid API key or access token '
+                                           '(unrecognized login or wrong password)'})
+                return False
+            return True
+
+        def do_GET(self):
+            if self.path == '/_fake/stats':
+                return self._send(200, fake.stats)
+            if not self.path.endswith('/shop.json'):
+                return self._send(404, {'errors': 'Not Found'})
+            if self._check():
+                self._send(200, {'shop': fake.shop(self._domain())})
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            raw = self.rfile.read(length)
+            if not self.path.endswith('/graphql.json'):
+                return self._send(404, {'errors': 'Not Found'})
+            if not self._check():
+                return
+            try:
+                body = json.loads(raw or b'{}')
+            except ValueError:
+                return self._send(400, {'errors': 'Invalid JSON'})
+            self._send(200, fake.execute(
+                self.headers.get('X-Shopify-Access-Token'), body.get('query'), body.get('variables'),
+                self._domain(),
+            ))
+
+    return Handler
+
+
+def start_server(fake: FakeShopify, host: str = '127.0.0.1', port: int = 0) -> ThreadingHTTPServer:
+    """Serve in a background thread; the bound address is server.server_address"""
+    server = ThreadingHTTPServer((host, port), make_handler(fake))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def api_url(server: ThreadingHTTPServer, version: str = '2024-01') -> str:
+    """SHOPIFY_API_URL for a running server"""
+    host, port = server.server_address[:2]
+    return f'http://{host}:{port}/{{shop_domain}}/admin/api/{version}'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--customers', type=int, default=1000)
+    parser.add_argument('--products', type=int, default=200)
+    parser.add_argument('--variants-per-product', type=int, default=3)
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--access-token', help='Only accept this token (default: any non-empty token)')
+    parser.add_argument('--bucket-size', type=float, default=MAXIMUM_AVAILABLE, help='Cost bucket size')
+    parser.add_argument('--restore-rate', type=float, default=RESTORE_RATE, help='Cost points restored per second')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Up to this many extra random seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered with a 5xx')
+    args = parser.parse_args(argv)
+
+    fake = FakeShopify(
+        generate_store(args.customers, args.products, args.orders, args.variants_per_product, args.seed),
+        access_token=args.access_token, maximum_available=args.bucket_size, restore_rate=args.restore_rate,
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, seed=args.seed,
+    )
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(fake))
+    server.daemon_threads = True
+    print(f"Fake Shopify on http://{args.host}:{args.port} "
+          f"({args.customers} customers, {args.products} products, {args.orders} orders)")
+    print(f"SHOPIFY_API_URL=http://{args.host}:{args.port}/{{shop_domain}}/admin/api/2024-01")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+"""
+Read-only list serialization straight from .values() rows.
+
+On large lists a ModelSerializer spends most of its time resolving
+attributes on model instances and dispatching through every field.
+ValuesSerializer produces the same output as a ModelSerializer from the
+dicts .values() returns: the serializer's fields are inspected once per
+list and turned into plain functions (str, int, a Decimal formatter, ...),
+so each row is a single loop over (key, column, function). Nested
+many=True serializers of reverse foreign keys are loaded with one query
+per NESTED_CHUNK_SIZE parents; method fields are implemented on the
+subclass as get_<field>(row).
+"""
+import decimal
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import fields, relations, serializers
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+# Parent primary keys per query when loading nested rows
+NESTED_CHUNK_SIZE = 2000
+
+
+def _identity(value):
+    return value
+
+
+def _decimal_mapper(field: fields.DecimalField) -> Callable:
+    coerce_to_string = getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+    if not coerce_to_string or field.localize or field.decimal_places is None:
+        return field.to_representation
+    exponent = -field.decimal_places
+
+    def to_representation(value):
+        # Column values already have the field's decimal places, so quantizing changes nothing
+        if isinstance(value, decimal.Decimal) and value.as_tuple().exponent == exponent:
+            return '{:f}'.format(value)
+        return field.to_representation(value)
+    return to_representation
+
+
+def _datetime_mapper(field: fields.DateTimeField) -> Callable:
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+    if output_format is None or output_format.lower() != fields.ISO_8601 or field_timezone is None:
+        return field.to_representation
+
+    def to_representation(value):
+        if getattr(value, 'tzinfo', None) is None:
+            return field.to_representation(value)
+        value = value.astimezone(field_timezone).isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+    return to_representation
+
+
+_SIMPLE_MAPPERS = {
+    fields.CharField.to_representation: str,
+    fields.IntegerField.to_representation: int,
+    fields.FloatField.to_representation: float,
+    fields.BooleanField.to_representation: bool,
+}
+
+
+def field_mapper(field: fields.Field) -> Callable:
+    """A function turning a column value into what field.to_representation returns for it"""
+    method = type(field).to_representation
+    if method in _SIMPLE_MAPPERS:
+        return _SIMPLE_MAPPERS[method]
+    if method is fields.DecimalField.to_representation:
+        return _decimal_mapper(field)
+    if method is fields.DateTimeField.to_representation:
+        return _datetime_mapper(field)
+    if method is fields.JSONField.to_representation and not field.binary:
+        return _identity
+    if method is fields.UUIDField.to_representation and field.uuid_format == 'hex_verbose':
+        return str
+    if isinstance(field, relations.PrimaryKeyRelatedField):
+        # .values() gives the primary key itself, which is what the field reads off the related object
+        return _identity if field.pk_field is None else field.pk_field.to_representation
+    if isinstance(field, (relations.RelatedField, relations.ManyRelatedField, serializers.BaseSerializer,
+                          fields.SerializerMethodField)) or field.source == '*':
+        raise ImproperlyConfigured(f"Field '{field.field_name}' cannot be read from a .values() row")
+    return field.to_representation
+
+
+class ValuesSerializer:
+    """
+    The read side of serializer_class, working on .values() rows. Use
+    values(queryset) for the rows and serialize(rows) for the data. model
+    reads another model with the same fields, e.g. an archive table.
+    """
+    serializer_class = None
+    # Extra columns the get_<field>(row) methods read
+    method_columns: Iterable[str] = ()
+    # Nested list fields whose child needs its own ValuesSerializer (for method fields)
+    nested: Dict[str, type] = {}
+
+    def __init__(self, model=None):
+        if self.serializer_class is None:
+            raise ImproperlyConfigured(f"{type(self).__name__} has no serializer_class")
+        self.model = model or self.serializer_class.Meta.model
+        self.fields = list(self.serializer_class()._readable_fields)
+        self.columns: List[str] = []
+        self.children: Dict[str, Tuple['ValuesSerializer', str]] = {}
+        for field in self.fields:
+            if isinstance(field, fields.SerializerMethodField):
+                if not hasattr(self, field.method_name):
+                    raise ImproperlyConfigured(f"{type(self).__name__} has no {field.method_name}(row)")
+            elif isinstance(field, serializers.ListSerializer):
+                self.children[field.field_name] = self._child(field)
+                self._add_column('pk')
+            else:
+                field_mapper(field)
+                self._add_column(field.source.replace('.', '__'))
+        for column in self.method_columns:
+            self._add_column(column)
+
+    def _add_column(self, column: str):
+        if column not in self.columns:
+            self.columns.append(column)
+
+    def _child(self, field: serializers.ListSerializer) -> Tuple['ValuesSerializer', str]:
+        relation = self.model._meta.get_field(field.source)
+        if not relation.one_to_many:
+            raise ImproperlyConfigured(f"Nested field '{field.field_name}' is not a reverse foreign key")
+        child_class = self.nested.get(field.field_name) or type(
+            f'{type(field.child).__name__}Values', (ValuesSerializer,), {'serializer_class': type(field.child)}
+        )
+        return child_class(model=relation.related_model), relation.field.name
+
+    def values(self, queryset, *extra_columns: str):
+        """The queryset's rows with the columns serialize() reads"""
+        return queryset.values(*self.columns, *extra_columns)
+
+    def _plan(self, nested: Dict[str, Dict]) -> List[Tuple[str, Optional[str], Callable]]:
+        # Built per call, as datetimes are rendered in the timezone active at the time
+        plan = []
+        for field in self.fields:
+            name = field.field_name
+            if isinstance(field, fields.SerializerMethodField):
+                plan.append((name, None, getattr(self, field.method_name)))
+            elif name in nested:
+                rows_by_parent = nested[name]
+                plan.append((name, None, lambda row, rows_by_parent=rows_by_parent: rows_by_parent.get(row['pk'], [])))
+            else:
+                plan.append((name, field.source.replace('.', '__'), field_mapper(field)))
+        return plan
+
+    def _load_children(self, name: str, parent_pks: List) -> Dict:
+        child, foreign_key = self.children[name]
+        queryset = child.model._default_manager.all()
+        if not queryset.ordered:
+            queryset = queryset.order_by('pk')
+        rows_by_parent = {}
+        for start in range(0, len(parent_pks), NESTED_CHUNK_SIZE):
+            rows = list(child.values(
+                queryset.filter(**{f'{foreign_key}__in': parent_pks[start:start + NESTED_CHUNK_SIZE]}),
+                foreign_key,
+            ))
+            for row, data in zip(rows, child.serialize(rows)):
+                rows_by_parent.setdefault(row[foreign_key], []).append(data)
+        return rows_by_parent
+
+    def serialize(self, rows: Iterable[Dict]) -> List[Dict]:
+        """What serializer_class(instances, many=True).data holds for these rows"""
+        rows = list(rows)
+        parent_pks = [row['pk'] for row in rows] if self.children else []
+        nested = {name: self._load_children(name, parent_pks) if parent_pks else {} for name in self.children}
+        plan = self._plan(nested)
+
+        data = []
+        for row in rows:
+            item = {}
+            for name, column, to_representation in plan:
+                if column is None:
+                    item[name] = to_representation(row)
+                else:
+                    value = row[column]
+                    item[name] = None if value is None else to_representation(value)
+            data.append(item)
+        return data
+
+
+class ValuesListMixin:
+    """
+    Serves GET list requests of a viewset through values_serializer_class.
+    Pagination, when the view has it, pages the .values() rows.
+    """
+    values_serializer_class = None
+
+    def get_values_serializer(self) -> ValuesSerializer:
+        return self.values_serializer_class()
+
+    def list(self, request, *args, **kwargs):
+        if self.values_serializer_class is None:
+            return super().list(request, *args, **kwargs)
+        values_serializer = self.get_values_serializer()
+        rows = values_serializer.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(values_serializer.serialize(page))
+        return Response(values_serializer.serialize(rows))
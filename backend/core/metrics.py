@@ -0,0 +1,312 @@
+"""
+In-process metrics registry with a Prometheus text exposition.
+
+Counters and histograms live in memory per process. When
+PROMETHEUS_MULTIPROC_DIR is set (gunicorn with several workers), every
+process also writes its values to a file in that directory at most once per
+FLUSH_INTERVAL seconds, and /metrics merges all the files, so whichever
+worker answers the scrape reports the totals of all of them.
+"""
+import atexit
+import glob
+import json
+import logging
+import math
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+FLUSH_INTERVAL = 1.0
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Metric:
+    kind = ''
+
+    def __init__(self, registry: 'Registry', name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[Tuple, object] = {}
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+        self.registry.changed()
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            # Per-bucket (non-cumulative) counts, then sum and count
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    break
+            else:
+                index = len(self.buckets)
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+        self.registry.changed()
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: Dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+class Registry:
+    def __init__(self, multiprocess_dir: Optional[str] = None):
+        self.lock = threading.Lock()
+        self.metrics: Dict[str, Metric] = {}
+        self.multiprocess_dir = multiprocess_dir
+        self.last_flush = 0.0
+        self.filename = None
+        if multiprocess_dir:
+            os.makedirs(multiprocess_dir, exist_ok=True)
+            self._new_file()
+            atexit.register(self.flush)
+            # gunicorn --preload forks workers from a master that imported this module
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _new_file(self):
+        # pid plus start time, so a recycled pid never overwrites a dead worker's totals
+        self.filename = os.path.join(self.multiprocess_dir, f'metrics-{os.getpid()}-{time.time_ns()}.json')
+
+    def _after_fork(self):
+        self.lock = threading.Lock()
+        for metric in self.metrics.values():
+            metric.values = {}
+        self.last_flush = 0.0
+        self._new_file()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(self, name, *args, **kwargs)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def changed(self):
+        if self.filename and time.monotonic() - self.last_flush >= FLUSH_INTERVAL:
+            self.flush()
+
+    def snapshot(self) -> Dict:
+        with self.lock:
+            return {
+                name: {
+                    'kind': metric.kind,
+                    'documentation': metric.documentation,
+                    'labelnames': list(metric.labelnames),
+                    'buckets': list(getattr(metric, 'buckets', ())),
+                    'values': [[list(key), value if metric.kind == 'counter' else list(value)]
+                               for key, value in metric.values.items()],
+                }
+                for name, metric in self.metrics.items()
+            }
+
+    def flush(self):
+        """Write this process' values for the other workers' /metrics to merge"""
+        if not self.filename:
+            return
+        self.last_flush = time.monotonic()
+        try:
+            temporary = f'{self.filename}.{threading.get_ident()}.tmp'
+            with open(temporary, 'w') as handle:
+                json.dump(self.snapshot(), handle)
+            os.replace(temporary, self.filename)
+        except OSError as e:
+            logger.warning(f"Could not write metrics to {self.filename}: {e}")
+
+    def collect(self) -> Dict:
+        """This process' values, merged with every other process' file in multi-process mode"""
+        if not self.filename:
+            return self.snapshot()
+        self.flush()
+        merged = {}
+        for path in glob.glob(os.path.join(self.multiprocess_dir, 'metrics-*.json')):
+            try:
+                with open(path) as handle:
+                    snapshot = json.load(handle)
+            except (OSError, ValueError):
+                continue
+            for name, metric in snapshot.items():
+                target = merged.setdefault(name, {**metric, 'values': {}})
+                for key, value in metric['values']:
+                    key = tuple(key)
+                    if metric['kind'] == 'counter':
+                        target['values'][key] = target['values'].get(key, 0) + value
+                    else:
+                        current = target['values'].get(key)
+                        target['values'][key] = value if current is None else [a + b for a, b in zip(current, value)]
+        for metric in merged.values():
+            metric['values'] = [[list(key), value] for key, value in metric['values'].items()]
+        return merged
+
+    def render(self) -> str:
+        return render_text(self.collect())
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names: Iterable[str], values: Iterable[str], extra: Tuple = ()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_text(snapshot: Dict) -> str:
+    """Prometheus text format (version 0.0.4) for a registry snapshot"""
+    lines: List[str] = []
+    for name in sorted(snapshot):
+        metric = snapshot[name]
+        lines.append(f"# HELP {name} {metric['documentation']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        for key, value in sorted(metric['values'], key=lambda item: item[0]):
+            if metric['kind'] == 'counter':
+                lines.append(f"{name}{_labels(metric['labelnames'], key)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(list(metric['buckets']) + [math.inf], value[:-2]):
+                cumulative += count
+                le = (('le', _number(float(bound))),)
+                lines.append(f"{name}_bucket{_labels(metric['labelnames'], key, le)} {cumulative}")
+            lines.append(f"{name}_sum{_labels(metric['labelnames'], key)} {_number(float(value[-2]))}")
+            lines.append(f"{name}_count{_labels(metric['labelnames'], key)} {value[-1]}")
+    return '\n'.join(lines) + '\n'
+
+
+registry = Registry(os.getenv('PROMETHEUS_MULTIPROC_DIR') or None)
+
+REQUEST_DURATION = registry.histogram(
+    'http_request_duration_seconds', 'Time spent handling a request', ['method', 'view', 'status'])
+REQUEST_QUERIES = registry.histogram(
+    'http_request_db_queries', 'SQL queries run while handling a request', ['view'], buckets=COUNT_BUCKETS)
+DB_QUERY_DURATION = registry.histogram(
+    'db_query_duration_seconds', 'SQL query time', ['alias', 'operation'], buckets=QUERY_BUCKETS)
+DB_QUERY_ERRORS = registry.counter('db_query_errors_total', 'SQL queries that raised', ['alias', 'operation'])
+SHOPIFY_REQUEST_DURATION = registry.histogram(
+    'shopify_request_duration_seconds', 'Shopify API call latency', ['client', 'outcome'])
+SHOPIFY_THROTTLE_WAIT = registry.counter(
+    'shopify_throttle_wait_seconds_total', 'Time spent waiting on Shopify rate limits', ['client'])
+SHOPIFY_THROTTLED = registry.counter(
+    'shopify_throttled_total', 'Shopify calls rejected as throttled', ['client'])
+SYNC_ROWS = registry.counter('sync_rows_total', 'Rows handled by sync runs', ['kind', 'result'])
+SYNC_DURATION = registry.histogram(
+    'sync_duration_seconds', 'Wall time of sync runs', ['kind'], buckets=DEFAULT_BUCKETS + (60.0, 300.0, 900.0))
+
+
+def record_sync(kind: str, seconds: float, **rows):
+    """Record one sync run; rows are counts by result, e.g. created=3, unchanged=10"""
+    SYNC_DURATION.observe(seconds, kind=kind)
+    for result, count in rows.items():
+        if count:
+            SYNC_ROWS.inc(count, kind=kind, result=result)
+
+
+class QueryTimer:
+    """connection.execute_wrapper hook that times every query and counts them per request"""
+
+    def __init__(self, alias: str):
+        self.alias = alias
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        operation = sql.lstrip().split(None, 1)[0].upper() if sql else ''
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        except Exception:
+            DB_QUERY_ERRORS.inc(alias=self.alias, operation=operation)
+            raise
+        finally:
+            self.count += 1
+            DB_QUERY_DURATION.observe(time.perf_counter() - started, alias=self.alias, operation=operation)
+
+
+class MetricsMiddleware:
+    """Request latency and per-request SQL count and time, labelled by view name"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = QueryTimer(connection.alias)
+        started = time.perf_counter()
+        status_code = 500
+        try:
+            with connection.execute_wrapper(timer):
+                response = self.get_response(request)
+            status_code = response.status_code
+            return response
+        finally:
+            match = getattr(request, 'resolver_match', None)
+            view = (match.view_name or match._func_path) if match else 'unmatched'
+            REQUEST_DURATION.observe(
+                time.perf_counter() - started, method=request.method, view=view, status=status_code
+            )
+            REQUEST_QUERIES.observe(timer.count, view=view)
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint; requires METRICS_TOKEN as a bearer token when it is set"""
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token and request.META.get('HTTP_AUTHORIZATION', '') != f'Bearer {token}':
+        return HttpResponse('Unauthorized', status=401, content_type='text/plain')
+    return HttpResponse(registry.render(), content_type=CONTENT_TYPE)
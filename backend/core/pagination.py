@@ -0,0 +1,21 @@
+"""
+Pagination that list endpoints can adopt without breaking existing clients.
+
+OptInPageNumberPagination only pages a list when the request asks for it
+with ?page= or ?page_size=, and the response is then DRF's usual
+{count, next, previous, results}. Without either parameter the list is
+returned whole, as a plain array, exactly as before.
+"""
+from rest_framework.pagination import PageNumberPagination
+
+
+class OptInPageNumberPagination(PageNumberPagination):
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.page_query_param not in params and self.page_size_query_param not in params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
@@ -0,0 +1,29 @@
+"""
+JSON parser on orjson. UTF-8 bodies are decoded by orjson; other charsets,
+and bodies orjson rejects, go to DRF's JSONParser, which also reports the
+parse errors, so error messages are unchanged. orjson reads integers
+beyond 64 bits as floats; no field here accepts such integers either way.
+"""
+import codecs
+import io
+
+from django.conf import settings
+from rest_framework import parsers
+
+from .renderers import ORJSONRenderer, orjson
+
+
+class ORJSONParser(parsers.JSONParser):
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or codecs.lookup(encoding).name != 'utf-8':
+            return super().parse(stream, media_type, parser_context)
+
+        body = stream.read()
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError:
+            return super().parse(io.BytesIO(body), media_type, parser_context)
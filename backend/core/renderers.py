@@ -0,0 +1,40 @@
+"""
+JSON renderer on orjson, producing the same bytes as DRF's JSONRenderer.
+
+orjson writes str, int, float, bool, None, dict, list, tuple and UUID
+itself; everything else (Decimal, datetimes, lazy strings, querysets, ...)
+goes through DRF's own JSONEncoder.default, so those render exactly as
+before. The exceptions are floats that need an exponent, written as 1e16
+rather than 1e+16, and NaN or infinity, written as null where the stock
+renderer raises. Indented output, non-compact or ASCII-only settings, and
+data orjson refuses (integers beyond 64 bits) are handed to the stock
+renderer, which is also used throughout when orjson is not installed.
+"""
+from rest_framework import renderers
+
+try:
+    import orjson
+except ImportError:  # optional; the stock renderer is used instead
+    orjson = None
+
+if orjson is not None:
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+
+class ORJSONRenderer(renderers.JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Escaped as the stock renderer does, so the output is a strict JavaScript subset
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
@@ -80,6 +80,8 @@ class DebugMiddleware:
         return response
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',  # First, so it times the whole request
+    'core.compression.CompressionMiddleware',  # Early, so it sees the final response body
     'corsheaders.middleware.CorsMiddleware',
     'core.settings.DebugMiddleware',  # Debug middleware first
     # 'django.middleware.security.SecurityMiddleware',  # COMMENTED OUT FOR DEBUGGING
@@ -217,15 +219,17 @@ CORS_ALLOW_CREDENTIALS = True
 
 # Django REST Framework settings
 REST_FRAMEWORK = {
+    # orjson based; same output as the stock JSON classes, which they fall back to without orjson
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'core.renderers.ORJSONRenderer',
     ],
     'DEFAULT_PARSER_CLASSES': [
-        'rest_framework.parsers.JSONParser',
+        'core.parsers.ORJSONParser',
     ],
     'EXCEPTION_HANDLER': 'rest_framework.views.exception_handler',
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # JWTAuthentication with request.user served from a short-lived cache
+        'accounts.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
@@ -240,8 +244,58 @@ SIMPLE_JWT = {
     'BLACKLIST_AFTER_ROTATION': True,
     'AUTH_HEADER_TYPES': ('Bearer',),
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
+    # Access tokens carry the user's role and company id
+    'TOKEN_OBTAIN_SERIALIZER': 'accounts.serializers.UserClaimsTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'accounts.serializers.UserClaimsTokenRefreshSerializer',
 }
 
+# Seconds an authenticated user and their company are cached for, see accounts.cache
+AUTH_USER_CACHE_TIMEOUT = int(os.getenv('AUTH_USER_CACHE_TIMEOUT', '60'))
+
+# Shopify webhooks (a company's own shopify_webhook_secret takes precedence)
+SHOPIFY_WEBHOOK_SECRET = os.getenv('SHOPIFY_WEBHOOK_SECRET', '')
+
+# Base URL of the Shopify Admin API, {shop_domain} is filled in per company.
+# Load tests point it at a local fake (python -m core.fake_shopify).
+SHOPIFY_API_URL = os.getenv('SHOPIFY_API_URL', 'https://{shop_domain}/admin/api/2024-01')
+
+# Prometheus scrapes of /metrics must send this as a bearer token when set
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Response compression (core.compression.CompressionMiddleware). Responses of at least
+# COMPRESSION_CACHE_MIN_SIZE bytes are cached compressed, by ETag, up to COMPRESSION_CACHE_MAX_SIZE.
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '1024'))
+COMPRESSION_CACHE_ALIAS = 'compression'
+COMPRESSION_CACHE_TIMEOUT = 600
+COMPRESSION_CACHE_MIN_SIZE = 64 * 1024
+COMPRESSION_CACHE_MAX_SIZE = 8 * 1024 * 1024
+
+# The default cache also holds the users and companies that authenticate
+# requests (accounts.cache). Their entries are dropped on save, but a
+# per-process LocMem cache only drops them in the process that saved; with
+# several workers use a shared backend (Redis, Memcached) so every worker
+# sees the change at once instead of after AUTH_USER_CACHE_TIMEOUT.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'compression': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'compression',
+        # Compressed list responses run to a few MB each
+        'OPTIONS': {'MAX_ENTRIES': 32},
+    },
+}
+
+# Finished orders older than this many months are moved to the archive tables, see orders.archive
+ORDER_ARCHIVE_AFTER_MONTHS = int(os.getenv('ORDER_ARCHIVE_AFTER_MONTHS', '12'))
+
+# Shiprocket
+SHIPROCKET_API_URL = os.getenv('SHIPROCKET_API_URL', 'https://apiv2.shiprocket.in/v1/external')
+SHIPROCKET_REQUESTS_PER_SECOND = float(os.getenv('SHIPROCKET_REQUESTS_PER_SECOND', '5'))
+# Package dimensions (cm) and weight (kg) sent when an order has none
+SHIPROCKET_DEFAULT_PACKAGE = {'length': 10, 'breadth': 10, 'height': 10, 'weight': 0.5}
+
 print(f"DEBUG MODE: {DEBUG}")
 print(f"SECURE_SSL_REDIRECT: {SECURE_SSL_REDIRECT}")
 print(f"ALLOWED_HOSTS: {ALLOWED_HOSTS}")
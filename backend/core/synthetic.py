@@ -0,0 +1,280 @@
+"""
+Synthetic tenants for benchmarks and load tests.
+
+generate_tenant() creates a company with an owner and any number of
+customers, products with variants, orders and order items. Rows are written
+with bulk_create in batches and only the primary keys needed to link the
+next table are read back, so millions of rows take minutes and memory stays
+flat. Values are random but reproducible for a given seed.
+"""
+import logging
+import random
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional
+
+from django.db import transaction
+from django.utils import timezone
+
+from accounts.models import User
+from companies.models import Company, Customer
+from orders.models import Order, OrderItem
+from products.models import Product, ProductCategory, ProductVariant, Vendor
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 5000
+SYNTHETIC_PASSWORD = 'synthetic-tenant'
+
+# Row counts by preset; 'large' is roughly a big production store
+SCALES = {
+    'small': {'customers': 1000, 'products': 200, 'orders': 5000},
+    'medium': {'customers': 10000, 'products': 2000, 'orders': 50000},
+    'large': {'customers': 100000, 'products': 20000, 'orders': 500000},
+}
+
+FIRST_NAMES = ['Aarav', 'Diya', 'Ishaan', 'Kavya', 'Rohan', 'Ananya', 'Vihaan', 'Meera', 'Arjun', 'Saanvi']
+LAST_NAMES = ['Sharma', 'Patel', 'Iyer', 'Reddy', 'Gupta', 'Nair', 'Singh', 'Das', 'Mehta', 'Kapoor']
+CITIES = [
+    ('Mumbai', 'Maharashtra', '400001'), ('Bengaluru', 'Karnataka', '560001'), ('Delhi', 'Delhi', '110001'),
+    ('Chennai', 'Tamil Nadu', '600001'), ('Pune', 'Maharashtra', '411001'), ('Kolkata', 'West Bengal', '700001'),
+]
+PRODUCT_WORDS = ['Cotton', 'Linen', 'Classic', 'Slim', 'Organic', 'Everyday', 'Premium', 'Travel']
+PRODUCT_TYPES = ['Shirt', 'Kurta', 'Tote', 'Mug', 'Notebook', 'Candle', 'Scarf', 'Bottle']
+SIZES = ['S', 'M', 'L', 'XL', 'XXL']
+COLORS = ['Red', 'Blue', 'Black', 'White', 'Green', 'Grey']
+
+
+def _batches(total: int, size: int):
+    for start in range(0, total, size):
+        yield start, min(start + size, total)
+
+
+def _address(rng: random.Random, first_name: str, last_name: str) -> Dict:
+    city, province, zip_code = rng.choice(CITIES)
+    return {
+        'firstName': first_name,
+        'lastName': last_name,
+        'address1': f'{rng.randint(1, 400)} {rng.choice(LAST_NAMES)} Road',
+        'address2': '',
+        'city': city,
+        'province': province,
+        'country': 'India',
+        'zip': zip_code,
+        'phone': f'+919{rng.randint(100000000, 999999999)}',
+    }
+
+
+def create_tenant_company(name: str) -> Company:
+    """A company with a PARENT owner who can log in with SYNTHETIC_PASSWORD"""
+    token = uuid.uuid4().hex[:8]
+    owner = User.objects.create_user(
+        email=f'syn{token}@synthetic.invalid', password=SYNTHETIC_PASSWORD, role=User.UserRole.PARENT
+    )
+    company = Company.objects.create(
+        name=name, owner=owner, email=f'syn{token}@company.synthetic.invalid',
+        shopify_domain=f'{token}.myshopify.com', shopify_access_token='synthetic',
+    )
+    owner.company = company
+    owner.save(update_fields=['company'])
+    return company
+
+
+def generate_tenant(name: str, customers: int = 1000, products: int = 200, variants_per_product: int = 3,
+                    orders: int = 5000, items_per_order: int = 4, days: int = 365, seed: int = 0,
+                    batch_size: int = BATCH_SIZE, progress: Optional[Callable[[str], None]] = None) -> Company:
+    """
+    Create a company with the given number of rows. Orders are spread evenly
+    over the last `days` days, oldest first, with 1 to 2 * items_per_order - 1
+    items each, so items_per_order is the average.
+    """
+    rng = random.Random(seed)
+    progress = progress or logger.info
+    company = create_tenant_company(name)
+    # Unique per tenant, as Shopify ids, SKUs and product ids are unique across companies
+    prefix = company.owner.email.split('@')[0]
+
+    customer_ids = _generate_customers(company, prefix, customers, rng, batch_size)
+    progress(f"{name}: {len(customer_ids)} customers")
+    variants = _generate_products(company, prefix, products, variants_per_product, rng, batch_size)
+    progress(f"{name}: {products} products, {len(variants)} variants")
+    order_count, item_count = _generate_orders(
+        company, prefix, orders, items_per_order, days, customer_ids, variants, rng, batch_size
+    )
+    progress(f"{name}: {order_count} orders, {item_count} order items")
+    return company
+
+
+def _generate_customers(company: Company, prefix: str, total: int, rng: random.Random,
+                        batch_size: int) -> List[int]:
+    now = timezone.now()
+    for start, end in _batches(total, batch_size):
+        rows = []
+        for n in range(start, end):
+            first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            address = _address(rng, first_name, last_name)
+            rows.append(Customer(
+                company=company,
+                shopify_customer_id=f'{prefix}-c{n}',
+                first_name=first_name,
+                last_name=last_name,
+                email=f'customer{n}@{prefix}.synthetic.invalid',
+                phone=address['phone'],
+                number_of_orders=rng.randint(0, 20),
+                amount_spent=Decimal(rng.randint(0, 5000000)) / 100,
+                currency_code='INR',
+                created_at=now - timedelta(days=rng.randint(0, 1000)),
+                updated_at=now,
+                verified_email=True,
+                city=address['city'],
+                state=address['province'],
+                country=address['country'],
+                default_address_line=address['address1'],
+                default_address_formatted_area=f"{address['city']}, {address['province']}, India",
+                addresses=[{key: address[key] for key in ('address1', 'city', 'province', 'country', 'zip')}],
+            ))
+        with transaction.atomic():
+            Customer.objects.bulk_create(rows)
+    return list(Customer.objects.filter(company=company).order_by('pk').values_list('pk', flat=True))
+
+
+def _generate_products(company: Company, prefix: str, total: int, variants_per_product: int,
+                       rng: random.Random, batch_size: int) -> List[Dict]:
+    categories = [ProductCategory.objects.get_or_create(name=f'Synthetic {kind}')[0] for kind in PRODUCT_TYPES]
+    vendors = [Vendor.objects.get_or_create(name=f'Synthetic Vendor {n}')[0] for n in range(5)]
+    variants = []
+    product_batch = max(batch_size // max(variants_per_product, 1), 1)
+    for start, end in _batches(total, product_batch):
+        rows = []
+        for n in range(start, end):
+            kind = rng.randrange(len(PRODUCT_TYPES))
+            rows.append(Product(
+                user=company.owner,
+                category=categories[kind],
+                vendor=rng.choice(vendors),
+                shopify_product_id=f'{prefix}-p{n}',
+                product_id=f'{prefix}-p{n}',
+                title=f'{rng.choice(PRODUCT_WORDS)} {PRODUCT_TYPES[kind]} {n}',
+                handle=f'{prefix}-product-{n}',
+                price=Decimal(rng.randint(19900, 499900)) / 100,
+                status='active',
+                tags='[]',
+                options=[{'name': 'Size', 'values': SIZES}, {'name': 'Color', 'values': COLORS}],
+                images=[],
+            ))
+        with transaction.atomic():
+            Product.objects.bulk_create(rows)
+            product_ids = dict(Product.objects.filter(
+                product_id__in=[row.product_id for row in rows]
+            ).values_list('product_id', 'pk'))
+
+            variant_rows = []
+            for row in rows:
+                for v in range(variants_per_product):
+                    size, color = SIZES[v % len(SIZES)], COLORS[(v // len(SIZES)) % len(COLORS)]
+                    sku = f'{row.product_id}-{v}'
+                    variant_rows.append(ProductVariant(
+                        product_id=product_ids[row.product_id],
+                        shopify_variant_id=sku,
+                        title=f'{size} / {color}',
+                        sku=sku,
+                        price=row.price,
+                        inventory_quantity=rng.randint(0, 200),
+                        option1=size,
+                        option2=color,
+                    ))
+                    variants.append({'sku': sku, 'title': f'{size} / {color}', 'product': row.title,
+                                     'price': row.price})
+            ProductVariant.objects.bulk_create(variant_rows)
+    return variants
+
+
+def _generate_orders(company: Company, prefix: str, total: int, items_per_order: int, days: int,
+                     customer_ids: List[int], variants: List[Dict], rng: random.Random,
+                     batch_size: int):
+    """Insert orders and their items; returns (orders, items) created"""
+    now = timezone.now()
+    start_at = now - timedelta(days=days)
+    variant_ids = dict(ProductVariant.objects.filter(
+        product__user__company=company
+    ).values_list('sku', 'pk'))
+    max_items = max(items_per_order * 2 - 1, 1)
+    order_batch = max(batch_size // items_per_order, 1)
+    item_count = 0
+    day_ranges: Dict[int, List[int]] = {}
+
+    for start, end in _batches(total, order_batch):
+        rows, lines = [], {}
+        for n in range(start, end):
+            customer = rng.randrange(len(customer_ids)) if customer_ids else None
+            first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            address = _address(rng, first_name, last_name)
+            picked = rng.sample(variants, min(rng.randint(1, max_items), len(variants)))
+            items = [(variant, rng.randint(1, 3)) for variant in picked]
+            subtotal = sum((variant['price'] * quantity for variant, quantity in items), Decimal('0'))
+            tax = (subtotal * Decimal('0.18')).quantize(Decimal('0.01'))
+            shipping = Decimal('0') if subtotal > 999 else Decimal('49')
+            order_id = f'#{prefix}-{n}'
+            paid = rng.random() < 0.7
+            rows.append(Order(
+                company=company,
+                order_id=order_id,
+                shopify_order_id=f'{prefix}-o{n}',
+                customer_id=customer_ids[customer] if customer_ids else None,
+                customer_email=f'customer{customer}@{prefix}.synthetic.invalid' if customer_ids else None,
+                customer_phone=address['phone'],
+                shipping_address=address,
+                billing_address=address,
+                subtotal_price=subtotal,
+                tax_amount=tax,
+                shipping_charges=shipping,
+                total_price=subtotal + tax + shipping,
+                payment_mode='Prepaid' if paid else 'COD',
+                payment_status='Paid' if paid else 'Pending',
+                fulfillment_status='Fulfilled' if rng.random() < 0.6 else 'Unfulfilled',
+                order_source='Shopify',
+                synced_with_shopify=True,
+            ))
+            lines[order_id] = items
+
+        with transaction.atomic():
+            Order.objects.bulk_create(rows)
+            order_pks = dict(Order.objects.filter(
+                company=company, order_id__in=list(lines)
+            ).values_list('order_id', 'pk'))
+            item_rows = []
+            for n, row in enumerate(rows, start):
+                order_pk = order_pks[row.order_id]
+                day_ranges.setdefault(n * days // max(total, 1), []).append(order_pk)
+                for variant, quantity in lines[row.order_id]:
+                    item_rows.append(OrderItem(
+                        order_id=order_pk,
+                        product_name=variant['product'],
+                        variant_name=variant['title'],
+                        sku=variant['sku'],
+                        variant_id=variant_ids.get(variant['sku']),
+                        quantity=quantity,
+                        unit_price=variant['price'],
+                        total_price=variant['price'] * quantity,
+                    ))
+            OrderItem.objects.bulk_create(item_rows, batch_size=batch_size)
+            item_count += len(item_rows)
+
+    # created_at is auto_now_add, so the history is written afterwards, one UPDATE per day
+    for day, pks in day_ranges.items():
+        Order.objects.filter(company=company, pk__in=pks).update(
+            created_at=start_at + timedelta(days=day, hours=rng.randint(8, 22))
+        )
+    return total, item_count
+
+
+def delete_tenant(company: Company):
+    """Remove a tenant and everything it owns; orders first, as they protect customers"""
+    with transaction.atomic():
+        Order.objects.filter(company=company).delete()
+        owner = company.owner
+        Product.objects.filter(user__company=company).delete()
+        company.delete()
+        if owner:
+            owner.delete()
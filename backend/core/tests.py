@@ -0,0 +1,186 @@
+import atexit
+import gzip
+import io
+import tempfile
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from companies.models import Company, Customer
+from core import compression, metrics
+from core.benchmarks import RecordedShopify, list_benchmarks, sync_benchmarks
+from core.parsers import ORJSONParser
+from core.renderers import ORJSONRenderer
+from core.synthetic import delete_tenant, generate_tenant
+from orders.models import Order, OrderItem
+from products.models import ProductVariant
+
+
+class MetricsTests(TestCase):
+    def multiprocess_registry(self, directory):
+        registry = metrics.Registry(directory)
+        self.addCleanup(atexit.unregister, registry.flush)
+        return registry
+
+    def test_histograms_are_rendered_cumulatively(self):
+        registry = metrics.Registry()
+        latency = registry.histogram('latency_seconds', 'Latency', ['view'], buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 3.0):
+            latency.observe(value, view='a"b')
+        registry.counter('calls_total', 'Calls').inc(2)
+        self.assertEqual(registry.render(), '\n'.join([
+            '# HELP calls_total Calls',
+            '# TYPE calls_total counter',
+            'calls_total 2',
+            '# HELP latency_seconds Latency',
+            '# TYPE latency_seconds histogram',
+            'latency_seconds_bucket{view="a\\"b",le="0.1"} 1',
+            'latency_seconds_bucket{view="a\\"b",le="1.0"} 3',
+            'latency_seconds_bucket{view="a\\"b",le="+Inf"} 4',
+            'latency_seconds_sum{view="a\\"b"} 4.05',
+            'latency_seconds_count{view="a\\"b"} 4',
+        ]) + '\n')
+
+    def test_worker_totals_are_merged(self):
+        with tempfile.TemporaryDirectory() as directory:
+            workers = [self.multiprocess_registry(directory) for _ in range(2)]
+            for count, worker in enumerate(workers, start=1):
+                worker.counter('rows_total', 'Rows', ['kind']).inc(count, kind='orders')
+                worker.histogram('wait_seconds', 'Wait', buckets=(1.0,)).observe(count)
+            workers[0].flush()
+            rendered = workers[1].render()
+        self.assertIn('rows_total{kind="orders"} 3\n', rendered)
+        self.assertIn('wait_seconds_bucket{le="1.0"} 1\n', rendered)
+        self.assertIn('wait_seconds_count 2\n', rendered)
+
+    def scrape(self, **headers):
+        response = self.client.get('/metrics', **headers)
+        return response.status_code, response.content.decode()
+
+    def requests_counted(self):
+        prefix = 'http_request_duration_seconds_count{method="GET",view="order-list",status="200"} '
+        lines = [line for line in self.scrape()[1].splitlines() if line.startswith(prefix)]
+        return int(lines[0][len(prefix):]) if lines else 0
+
+    def test_requests_are_counted_by_view(self):
+        user = User.objects.create_user(email='owner@example.com', password='secret', role='PARENT')
+        user.company = Company.objects.create(name='Metered', owner=user, email='metered@example.com')
+        user.save()
+        client = APIClient()
+        client.force_authenticate(user)
+        before = self.requests_counted()
+        client.get('/api/orders/')
+        client.get('/api/orders/')
+        self.assertEqual(self.requests_counted(), before + 2)
+        self.assertIn('# TYPE http_request_db_queries histogram', self.scrape()[1])
+
+        with override_settings(METRICS_TOKEN='scrape-secret'):
+            self.assertEqual(self.scrape()[0], 401)
+            self.assertEqual(self.scrape(HTTP_AUTHORIZATION='Bearer scrape-secret')[0], 200)
+
+
+class SyntheticTenantTests(TestCase):
+    def tenant(self, name, seed):
+        return generate_tenant(name, customers=6, products=4, variants_per_product=2, orders=10,
+                               items_per_order=2, days=30, seed=seed, batch_size=3)
+
+    def test_rows_are_generated_reproducibly(self):
+        first, second = self.tenant('First', seed=7), self.tenant('Second', seed=7)
+
+        def orders(company):
+            return list(Order.objects.filter(company=company).order_by('created_at', 'id', 'items__id').values_list(
+                'total_price', 'payment_mode', 'items__quantity', 'items__unit_price'
+            ))
+
+        self.assertEqual(Customer.objects.filter(company=first).count(), 6)
+        self.assertEqual(ProductVariant.objects.filter(product__user__company=first).count(), 8)
+        self.assertEqual(Order.objects.filter(company=first).count(), 10)
+        self.assertEqual(orders(first), orders(second))
+        self.assertFalse(OrderItem.objects.filter(order__company=first, variant__isnull=True).exists())
+        created = Order.objects.filter(company=first).order_by('created_at').values_list('created_at', flat=True)
+        self.assertLess(created[0], timezone.now() - timedelta(days=29))
+        self.assertGreater(len(set(created)), 1)
+
+        delete_tenant(first)
+        self.assertFalse(Company.objects.filter(pk=first.pk).exists())
+        self.assertEqual(Order.objects.count(), 10)
+
+    def test_benchmarks_sync_and_list_a_tenant(self):
+        shopify = RecordedShopify.generate(customers=4, products=3, orders=5, seed=1)
+        results = {result['name']: result for result in sync_benchmarks(shopify)}
+        self.assertEqual(list(results), [
+            f'sync_{resource_name}_{run}'
+            for resource_name in ('customers', 'products', 'orders') for run in ('initial', 'unchanged')
+        ])
+        self.assertEqual({result['status'] for result in results.values()}, {200})
+        self.assertGreater(shopify.requests, 0)
+        self.assertLess(results['sync_orders_unchanged']['queries'], results['sync_orders_initial']['queries'])
+        self.assertFalse(Company.objects.filter(name='Benchmark sync tenant').exists())
+
+        company = self.tenant('Listed', seed=1)
+        listed = {result['name']: result['rows'] for result in list_benchmarks(company)}
+        self.assertEqual(listed, {'list_customers': 6, 'list_products': 4, 'list_orders': 10})
+
+
+class ORJSONTests(TestCase):
+    def test_renders_same_bytes_as_stock_renderer(self):
+        data = {
+            'price': Decimal('10.50'), 'id': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+            'utc': timezone.now(), 'ist': timezone.localtime(timezone.now(), timezone.get_fixed_timezone(330)),
+            'day': timezone.localdate(), 'label': _('Orders'), 'text': 'caf\u00e9 \u2028 line', 1: (1, 2.5, None),
+            'big': 2 ** 70, 'items': Order.objects.none(),
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+        self.assertEqual(ORJSONRenderer().render([1], 'application/json; indent=4'),
+                         JSONRenderer().render([1], 'application/json; indent=4'))
+
+    def test_parses_like_stock_parser(self):
+        for body in (b'{"a": [1, 2.5, null, "caf\xc3\xa9"], "b": 9223372036854775807}', b'[]'):
+            self.assertEqual(ORJSONParser().parse(io.BytesIO(body)), JSONParser().parse(io.BytesIO(body)))
+        with self.assertRaisesMessage(ParseError, 'JSON parse error'):
+            ORJSONParser().parse(io.BytesIO(b'{"a": NaN}'))
+
+
+@override_settings(COMPRESSION_CACHE_MIN_SIZE=1024)
+class CompressionTests(TestCase):
+    def setUp(self):
+        self.company = generate_tenant('Compressed', customers=10, products=5, orders=40, seed=5)
+        self.client = APIClient()
+        self.client.force_authenticate(self.company.owner)
+
+    def test_list_is_gzipped_and_cached_by_etag(self):
+        plain = self.client.get('/api/orders/')
+        self.assertNotIn('Content-Encoding', plain)
+
+        with mock.patch.object(compression, 'compress_body', wraps=compression.compress_body) as compress:
+            first = self.client.get('/api/orders/', HTTP_ACCEPT_ENCODING='br;q=0, gzip;q=0.8')
+            second = self.client.get('/api/orders/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(first['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(first.content), plain.content)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(first['ETag'], f'W/{plain["ETag"]}')
+        self.assertIn('Accept-Encoding', first['Vary'])
+        self.assertEqual(compress.call_count, 1)
+
+    def test_export_is_compressed_while_streaming(self):
+        plain = b''.join(self.client.get('/api/orders/export/').streaming_content)
+        response = self.client.get('/api/orders/export/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), plain)
+
+    def test_negotiation(self):
+        self.assertEqual(compression.negotiate('gzip, deflate'), 'gzip')
+        self.assertEqual(compression.negotiate('*'), next(iter(compression.ENCODINGS)))
+        self.assertIsNone(compression.negotiate('gzip;q=0, deflate'))
+        self.assertIsNone(compression.negotiate(''))
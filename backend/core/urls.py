@@ -3,6 +3,8 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from core.metrics import metrics_view
+
 urlpatterns = [
     # Admin URLs
     path('admin/', admin.site.urls),
@@ -18,6 +20,9 @@ urlpatterns = [
     # FIX: Add this line to include the URLs from your orders app.
     # This will make the '/api/orders/' endpoint available.
     path('api/', include('orders.urls')),
+
+    # Prometheus metrics
+    path('metrics', metrics_view, name='metrics'),
 ]
 
 # Debug toolbar and static/media files in development
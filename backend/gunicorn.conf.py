@@ -0,0 +1,17 @@
+# Loaded automatically by gunicorn when started from this directory.
+import glob
+import os
+import tempfile
+
+wsgi_app = 'core.wsgi:application'
+
+# Each worker writes its metrics here and /metrics merges them (see core/metrics.py)
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'erp-metrics'))
+
+
+def on_starting(server):
+    # Start from zero so totals of a previous run are not reported again
+    directory = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, 'metrics-*.json*')):
+        os.remove(path)
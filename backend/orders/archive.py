@@ -0,0 +1,237 @@
+"""
+Monthly archival of finished orders, with MySQL partitions for the archive.
+
+Orders and their items grow without bound while most reads are of recent
+months. archive_orders() moves the finished orders (not pending, not being
+tracked) of every month older than ORDER_ARCHIVE_AFTER_MONTHS into
+orders_order_archive and orders_orderitem_archive, and records the month in
+OrderArchiveMonth. The archive tables have the live tables' columns, so one
+INSERT ... SELECT per batch moves the rows.
+
+The live tables keep their foreign keys and unique keys, neither of which
+MySQL allows on partitioned tables. The archive tables have neither, so on
+MySQL ensure_archive_partitions() compresses them and RANGE partitions them
+by month of created_at (items by their order's created_at). Other databases,
+SQLite in the tests, keep plain archive tables and archive the same way.
+
+Reads that can reach archived months use order_sources(), which gives the
+live models and, when the period starts before archived_until(), the
+archive models too.
+"""
+import logging
+from datetime import date, datetime, time, timezone as dt_timezone
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from django.db import connection, transaction
+from django.db.models import F, Max, Min
+
+from .models import ArchivedOrder, ArchivedOrderItem, Order, OrderArchiveMonth, OrderItem
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_BATCH_SIZE = 2000
+FUTURE_PARTITION = 'pfuture'
+OLDER_PARTITION = 'pold'
+
+
+def archivable_orders(queryset):
+    """Orders nothing will act on any more: shipped or cancelled, and not being tracked"""
+    return queryset.filter(tracking_next_check_at__isnull=True).exclude(erp_status='Pending')
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_bounds(month: date) -> Tuple[datetime, datetime]:
+    """The UTC datetimes a month starts and ends at; partitions are by UTC month"""
+    return (datetime.combine(month, time.min, tzinfo=dt_timezone.utc),
+            datetime.combine(add_months(month, 1), time.min, tzinfo=dt_timezone.utc))
+
+
+def month_of(value: datetime) -> date:
+    return value.astimezone(dt_timezone.utc).date().replace(day=1)
+
+
+def archived_until() -> Optional[datetime]:
+    """When the newest archived month ends; None if nothing was archived"""
+    latest = OrderArchiveMonth.objects.aggregate(latest=Max('month'))['latest']
+    return None if latest is None else month_bounds(latest)[1]
+
+
+def order_sources(since: Optional[datetime] = None) -> List[Tuple[type, type]]:
+    """
+    The (order model, item model) pairs holding the orders created since
+    `since` (None = ever): the live ones, and the archive ones if any of
+    that period was archived.
+    """
+    sources = [(Order, OrderItem)]
+    until = archived_until()
+    if until is not None and (since is None or since < until):
+        sources.append((ArchivedOrder, ArchivedOrderItem))
+    return sources
+
+
+def _columns(model) -> List[str]:
+    return [field.column for field in model._meta.concrete_fields]
+
+
+def _copy(target, queryset, columns: Sequence[str], target_columns: Sequence[str]) -> int:
+    """INSERT the given columns of queryset's rows into target_columns of target's table"""
+    select_sql, params = queryset.order_by().values_list(*columns).query.sql_with_params()
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {quote(target._meta.db_table)} ({', '.join(map(quote, target_columns))}) {select_sql}",
+            params,
+        )
+        return cursor.rowcount
+
+
+def _archive_batch(pks: List[int]) -> Tuple[int, int]:
+    with transaction.atomic():
+        # Locked and checked again, in case an order changed since it was picked
+        locked = archivable_orders(Order.objects.select_for_update().filter(pk__in=pks))
+        pks = list(locked.values_list('pk', flat=True))
+        if not pks:
+            return 0, 0
+        orders = Order.objects.filter(pk__in=pks)
+        items = OrderItem.objects.filter(order_id__in=pks)
+        item_columns = _columns(OrderItem)
+        item_count = _copy(ArchivedOrderItem, items, item_columns + ['order__created_at'],
+                           item_columns + ['order_created_at'])
+        order_count = _copy(ArchivedOrder, orders, _columns(Order), _columns(Order))
+        items.delete()
+        orders.delete()
+    return order_count, item_count
+
+
+def archive_month(month: date, batch_size: int = ARCHIVE_BATCH_SIZE) -> Tuple[int, int]:
+    """Move a month's archivable orders and their items to the archive; returns (orders, items) moved"""
+    start, end = month_bounds(month)
+    pks = list(archivable_orders(Order.objects.filter(created_at__gte=start, created_at__lt=end))
+               .order_by('pk').values_list('pk', flat=True))
+    orders = items = 0
+    for offset in range(0, len(pks), batch_size):
+        moved_orders, moved_items = _archive_batch(pks[offset:offset + batch_size])
+        orders += moved_orders
+        items += moved_items
+
+    OrderArchiveMonth.objects.get_or_create(month=month)
+    OrderArchiveMonth.objects.filter(month=month).update(orders=F('orders') + orders, items=F('items') + items)
+    return orders, items
+
+
+def archive_orders(before: date, batch_size: int = ARCHIVE_BATCH_SIZE,
+                   progress: Optional[Callable[[str], None]] = None) -> Dict:
+    """
+    Archive the archivable orders of every month before the month `before`.
+    Months already archived are gone over again for orders that finished since.
+    """
+    progress = progress or logger.info
+    oldest = archivable_orders(Order.objects.filter(created_at__lt=month_bounds(before)[0])).aggregate(
+        oldest=Min('created_at')
+    )['oldest']
+    result = {'months': 0, 'orders': 0, 'items': 0}
+    month = month_of(oldest) if oldest else before
+    while month < before:
+        orders, items = archive_month(month, batch_size)
+        progress(f"{month:%Y-%m}: archived {orders} orders, {items} items")
+        result['months'] += 1
+        result['orders'] += orders
+        result['items'] += items
+        month = add_months(month, 1)
+    return result
+
+
+def restore_orders(queryset) -> int:
+    """Move archived orders (an ArchivedOrder queryset) back to the live tables; returns how many"""
+    with transaction.atomic():
+        pks = list(queryset.values_list('pk', flat=True))
+        if not pks:
+            return 0
+        orders = ArchivedOrder.objects.filter(pk__in=pks)
+        items = ArchivedOrderItem.objects.filter(order_id__in=pks)
+        restored = _copy(Order, orders, _columns(Order), _columns(Order))
+        _copy(OrderItem, items, _columns(OrderItem), _columns(OrderItem))
+        items.delete()
+        orders.delete()
+    return restored
+
+
+def partition_name(month: date) -> str:
+    return f'p{month:%Y%m}'
+
+
+def _partition_clause(month: date) -> str:
+    return f"PARTITION {partition_name(month)} VALUES LESS THAN (TO_DAYS('{add_months(month, 1):%Y-%m-%d}'))"
+
+
+def partition_statements(table: str, column: str, months: Sequence[date], existing: Sequence[str]) -> List[str]:
+    """
+    MySQL statements giving table one RANGE partition on column per month in
+    months (sorted), given the names of its existing partitions. A new
+    table is compressed and partitioned; later months are split off the
+    catch-all future partition.
+    """
+    if not months:
+        return []
+    if not existing:
+        partitions = [f"PARTITION {OLDER_PARTITION} VALUES LESS THAN (TO_DAYS('{months[0]:%Y-%m-%d}'))"]
+        partitions += [_partition_clause(month) for month in months]
+        partitions.append(f"PARTITION {FUTURE_PARTITION} VALUES LESS THAN MAXVALUE")
+        return [
+            f"ALTER TABLE {table} ROW_FORMAT=COMPRESSED",
+            # Every unique key of a partitioned table must include the partitioning column
+            f"ALTER TABLE {table} DROP PRIMARY KEY, ADD PRIMARY KEY (id, {column})",
+            f"ALTER TABLE {table} PARTITION BY RANGE (TO_DAYS({column})) ({', '.join(partitions)})",
+        ]
+    # Only months after the newest partition can be split off the future one
+    last = max((name for name in existing if name not in (OLDER_PARTITION, FUTURE_PARTITION)), default='')
+    new = [month for month in months if partition_name(month) > last]
+    if not new:
+        return []
+    partitions = [_partition_clause(month) for month in new]
+    partitions.append(f"PARTITION {FUTURE_PARTITION} VALUES LESS THAN MAXVALUE")
+    return [f"ALTER TABLE {table} REORGANIZE PARTITION {FUTURE_PARTITION} INTO ({', '.join(partitions)})"]
+
+
+def _existing_partitions(table: str) -> List[str]:
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL",
+            [table],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def ensure_archive_partitions(through: date, dry_run: bool = False) -> List[str]:
+    """
+    On MySQL, give both archive tables a partition for every month from the
+    oldest order up to and including `through`. Returns the statements,
+    which dry_run leaves unexecuted. Does nothing on other databases.
+    """
+    if connection.vendor != 'mysql':
+        return []
+    oldest = [value for value in (
+        Order.objects.aggregate(oldest=Min('created_at'))['oldest'],
+        ArchivedOrder.objects.aggregate(oldest=Min('created_at'))['oldest'],
+    ) if value is not None]
+    month = min(month_of(value) for value in oldest) if oldest else through
+    months = []
+    while month <= through:
+        months.append(month)
+        month = add_months(month, 1)
+
+    statements = []
+    for model, column in ((ArchivedOrder, 'created_at'), (ArchivedOrderItem, 'order_created_at')):
+        table = model._meta.db_table
+        statements += partition_statements(table, column, months, _existing_partitions(table))
+    if not dry_run:
+        with connection.cursor() as cursor:
+            for statement in statements:
+                logger.info(statement)
+                cursor.execute(statement)
+    return statements
@@ -0,0 +1,342 @@
+import csv
+import io
+import itertools
+import logging
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Iterator, List, Tuple
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Order, OrderItem
+from .services import update_customer_order_stats
+from companies.models import Company, Customer
+from products.inventory import take_order_stock
+
+logger = logging.getLogger(__name__)
+
+IMPORT_CHUNK_SIZE = 500
+
+REQUIRED_COLUMNS = {'external_order_id', 'product_name', 'quantity', 'unit_price'}
+PAYMENT_MODES = {choice for choice, _ in Order._meta.get_field('payment_mode').choices}
+PAYMENT_STATUSES = {choice for choice, _ in Order._meta.get_field('payment_status').choices}
+FULFILLMENT_STATUSES = {choice for choice, _ in Order._meta.get_field('fulfillment_status').choices}
+ORDER_SOURCES = {choice for choice, _ in Order._meta.get_field('order_source').choices}
+
+
+class OrderImportError(ValueError):
+    pass
+
+
+def _decimal(row: Dict, column: str, default=None) -> Decimal:
+    value = (row.get(column) or '').strip()
+    if not value:
+        if default is None:
+            raise OrderImportError(f"'{column}' is required")
+        return default
+    try:
+        amount = Decimal(value).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise OrderImportError(f"'{column}' is not a valid amount: {value}")
+    if amount < 0:
+        raise OrderImportError(f"'{column}' cannot be negative")
+    return amount
+
+
+def _choice(row: Dict, column: str, choices, default: str) -> str:
+    value = (row.get(column) or '').strip() or default
+    if value not in choices:
+        raise OrderImportError(f"'{column}' must be one of: {', '.join(sorted(choices))}")
+    return value
+
+
+def _parse_item(row: Dict) -> Dict:
+    try:
+        quantity = int((row.get('quantity') or '').strip())
+    except ValueError:
+        raise OrderImportError("'quantity' must be a whole number")
+    if quantity < 1:
+        raise OrderImportError("'quantity' must be at least 1")
+    product_name = (row.get('product_name') or '').strip()
+    if not product_name:
+        raise OrderImportError("'product_name' is required")
+    unit_price = _decimal(row, 'unit_price')
+    return {
+        'product_name': product_name,
+        'variant_name': (row.get('variant_name') or '').strip(),
+        'category': (row.get('category') or '').strip(),
+        'sku': (row.get('sku') or '').strip() or None,
+        'quantity': quantity,
+        'unit_price': unit_price,
+        'total_price': unit_price * quantity,
+    }
+
+
+def _parse_order(external_order_id: str, rows: List[Tuple[int, Dict]]) -> Dict:
+    """Build one order from its rows; order-level columns are read from the first row"""
+    first = rows[0][1]
+    email = (first.get('customer_email') or '').strip() or None
+    phone = (first.get('customer_phone') or '').strip() or None
+    if not email and not phone:
+        raise OrderImportError("'customer_email' or 'customer_phone' is required")
+
+    items = [_parse_item(row) for _, row in rows]
+    subtotal = _decimal(first, 'subtotal_price', sum((item['total_price'] for item in items), Decimal('0')))
+    tax = _decimal(first, 'tax_amount', Decimal('0'))
+    shipping = _decimal(first, 'shipping_charges', Decimal('0'))
+
+    return {
+        'external_order_id': external_order_id,
+        'email': email,
+        'phone': phone,
+        'first_name': (first.get('first_name') or '').strip(),
+        'last_name': (first.get('last_name') or '').strip(),
+        'shipping_address': {
+            'address1': (first.get('shipping_address1') or '').strip(),
+            'city': (first.get('shipping_city') or '').strip(),
+            'province': (first.get('shipping_state') or '').strip(),
+            'country': (first.get('shipping_country') or '').strip(),
+            'zip': (first.get('shipping_zip') or '').strip(),
+        },
+        'subtotal_price': subtotal,
+        'tax_amount': tax,
+        'shipping_charges': shipping,
+        'total_price': _decimal(first, 'total_price', subtotal + tax + shipping),
+        'payment_mode': _choice(first, 'payment_mode', PAYMENT_MODES, 'Prepaid'),
+        'payment_status': _choice(first, 'payment_status', PAYMENT_STATUSES, 'Pending'),
+        'fulfillment_status': _choice(first, 'fulfillment_status', FULFILLMENT_STATUSES, 'Unfulfilled'),
+        'order_source': _choice(first, 'order_source', ORDER_SOURCES, 'Manual'),
+        'tags': (first.get('tags') or '').strip() or None,
+        'items': items,
+        'rows': [line for line, _ in rows],
+    }
+
+
+def _iter_order_rows(reader: csv.DictReader) -> Iterator[Tuple[str, List[Tuple[int, Dict]]]]:
+    """Group consecutive rows with the same external_order_id; line numbers count the header as 1"""
+    numbered = ((reader.line_num, row) for row in reader)
+    for external_order_id, group in itertools.groupby(
+        numbered, key=lambda item: (item[1].get('external_order_id') or '').strip()
+    ):
+        yield external_order_id, list(group)
+
+
+class OrderCSVImporter:
+    """
+    Import orders from a CSV with one row per line item.
+
+    Rows of the same order must be consecutive and share external_order_id,
+    which makes the import idempotent: orders already imported are skipped.
+    Orders are written in chunks, each with one customer lookup, one
+    bulk_create for orders and one for items.
+    """
+
+    def __init__(self, company: Company, chunk_size: int = IMPORT_CHUNK_SIZE):
+        self.company = company
+        self.chunk_size = chunk_size
+        self.result = {'created': 0, 'skipped': 0, 'failed': 0, 'customers_created': 0, 'errors': []}
+        self.seen = set()
+
+    def _fail(self, lines: List[int], external_order_id: str, error: str):
+        self.result['failed'] += 1
+        for line in lines:
+            self.result['errors'].append({
+                'row': line,
+                'external_order_id': external_order_id,
+                'error': error,
+            })
+
+    def run(self, upload) -> Dict:
+        text = io.TextIOWrapper(upload, encoding='utf-8-sig', newline='')
+        reader = csv.DictReader(text)
+        missing = REQUIRED_COLUMNS - set(reader.fieldnames or [])
+        if missing:
+            raise OrderImportError(f"Missing required columns: {', '.join(sorted(missing))}")
+
+        chunk = []
+        for external_order_id, rows in _iter_order_rows(reader):
+            lines = [line for line, _ in rows]
+            if not external_order_id:
+                self._fail(lines, '', "'external_order_id' is required")
+                continue
+            if external_order_id in self.seen:
+                self._fail(lines, external_order_id, 'Rows of an order must be consecutive in the file')
+                continue
+            self.seen.add(external_order_id)
+            try:
+                chunk.append(_parse_order(external_order_id, rows))
+            except OrderImportError as e:
+                self._fail(lines, external_order_id, str(e))
+                continue
+            if len(chunk) >= self.chunk_size:
+                self._write_chunk(chunk)
+                chunk = []
+        if chunk:
+            self._write_chunk(chunk)
+
+        logger.info(
+            f"Imported orders for company {self.company.id}: {self.result['created']} created, "
+            f"{self.result['skipped']} already imported, {self.result['failed']} failed"
+        )
+        return self.result
+
+    def _resolve_customers(self, orders: List[Dict]) -> Tuple[Dict, Dict]:
+        """
+        Map each order's email/phone to a customer id, creating missing customers.
+
+        New customers are validated first, as bulk_create skips the
+        full_clean in Customer.save(). Returns the customer ids and, for the
+        orders whose new customer is invalid, the error.
+        """
+        emails = {order['email'] for order in orders if order['email']}
+        phones = {order['phone'] for order in orders if order['phone']}
+
+        def lookup():
+            by_email, by_phone = {}, {}
+            for customer_id, email, phone in Customer.objects.filter(company=self.company).filter(
+                Q(email__in=emails) | Q(phone__in=phones)
+            ).order_by('id').values_list('id', 'email', 'phone'):
+                if email:
+                    by_email.setdefault(email, customer_id)
+                if phone:
+                    by_phone.setdefault(phone, customer_id)
+            return by_email, by_phone
+
+        def find(order, by_email, by_phone):
+            return (order['email'] and by_email.get(order['email'])) or \
+                (order['phone'] and by_phone.get(order['phone'])) or None
+
+        by_email, by_phone = lookup()
+        new_customers = {}
+        rejected = {}
+        invalid = {}
+        for order in orders:
+            if find(order, by_email, by_phone) is not None:
+                continue
+            key = order['email'] or order['phone']
+            if key in rejected:
+                invalid[order['external_order_id']] = rejected[key]
+                continue
+            if key in new_customers:
+                continue
+            address = order['shipping_address']
+            customer = Customer(
+                company=self.company,
+                email=order['email'],
+                phone=order['phone'],
+                first_name=order['first_name'],
+                last_name=order['last_name'],
+                valid_email_address=bool(order['email']),
+                addresses=[address] if any(address.values()) else None,
+                city=address['city'],
+                state=address['province'],
+                country=address['country'],
+                created_at=timezone.now(),
+                updated_at=timezone.now(),
+            )
+            try:
+                customer.full_clean(exclude=['company'], validate_unique=False)
+            except ValidationError as e:
+                rejected[key] = invalid[order['external_order_id']] = f"Invalid customer: {'; '.join(e.messages)}"
+                continue
+            new_customers[key] = customer
+        if new_customers:
+            Customer.objects.bulk_create(new_customers.values())
+            self.result['customers_created'] += len(new_customers)
+            # bulk_create does not return primary keys on MySQL, so look them up again
+            by_email, by_phone = lookup()
+
+        customer_ids = {
+            order['external_order_id']: find(order, by_email, by_phone)
+            for order in orders if order['external_order_id'] not in invalid
+        }
+        return customer_ids, invalid
+
+    def _write_chunk(self, orders: List[Dict]):
+        external_ids = [order['external_order_id'] for order in orders]
+        taken = list(Order.objects.filter(company=self.company).filter(
+            Q(external_order_id__in=external_ids) | Q(order_id__in=external_ids)
+        ).values_list('external_order_id', 'order_id'))
+        imported = {external_order_id for external_order_id, _ in taken}
+        used_order_ids = {order_id for _, order_id in taken}
+
+        pending = []
+        for order in orders:
+            if order['external_order_id'] in imported:
+                self.result['skipped'] += 1
+            elif order['external_order_id'] in used_order_ids:
+                self._fail(order['rows'], order['external_order_id'], 'Another order already uses this order ID')
+            else:
+                pending.append(order)
+        if not pending:
+            return
+
+        try:
+            created, invalid = self._create_orders(pending)
+        except IntegrityError as e:
+            # Most likely a concurrent import of the same orders; the chunk can be retried
+            logger.error(f"Error importing orders for company {self.company.id}: {str(e)}")
+            for order in pending:
+                self._fail(order['rows'], order['external_order_id'], f'Could not save order, please retry: {str(e)}')
+            return
+
+        for order in pending:
+            if order['external_order_id'] in invalid:
+                self._fail(order['rows'], order['external_order_id'], invalid[order['external_order_id']])
+        self.result['created'] += len(created)
+
+    def _create_orders(self, pending: List[Dict]) -> Tuple[List[Dict], Dict]:
+        """Write the orders of a chunk; returns those created and the errors of those left out"""
+        with transaction.atomic():
+            customer_ids, invalid = self._resolve_customers(pending)
+            pending = [order for order in pending if order['external_order_id'] not in invalid]
+            now = timezone.now()
+            Order.objects.bulk_create([
+                Order(
+                    company=self.company,
+                    order_id=order['external_order_id'],
+                    external_order_id=order['external_order_id'],
+                    customer_id=customer_ids[order['external_order_id']],
+                    customer_email=order['email'],
+                    customer_phone=order['phone'],
+                    shipping_address=order['shipping_address'],
+                    billing_address=order['shipping_address'],
+                    subtotal_price=order['subtotal_price'],
+                    tax_amount=order['tax_amount'],
+                    shipping_charges=order['shipping_charges'],
+                    total_price=order['total_price'],
+                    payment_mode=order['payment_mode'],
+                    payment_status=order['payment_status'],
+                    fulfillment_status=order['fulfillment_status'],
+                    order_source=order['order_source'],
+                    tags=order['tags'],
+                    last_synced_at=now,
+                )
+                for order in pending
+            ])
+            order_pks = dict(
+                Order.objects.filter(
+                    company=self.company,
+                    external_order_id__in=[order['external_order_id'] for order in pending]
+                ).values_list('external_order_id', 'id')
+            )
+            OrderItem.objects.bulk_create([
+                OrderItem(order_id=order_pks[order['external_order_id']], **item)
+                for order in pending
+                for item in order['items']
+            ], batch_size=1000)
+            take_order_stock(self.company, [
+                Order(pk=order_pk, order_id=external_order_id) for external_order_id, order_pk in order_pks.items()
+            ])
+
+            stats = defaultdict(lambda: [0, Decimal('0')])
+            for order in pending:
+                customer_stats = stats[customer_ids[order['external_order_id']]]
+                customer_stats[0] += 1
+                customer_stats[1] += order['total_price']
+            for customer_id, (orders_count, amount) in stats.items():
+                update_customer_order_stats(customer_id, orders_count, amount)
+        return pending, invalid
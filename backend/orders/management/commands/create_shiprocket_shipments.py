@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from companies.models import Company
+from orders.shipping import SHIPMENT_WORKERS, create_shipments
+from orders.utils.shiprocket_client import ShiprocketAuthError
+
+
+class Command(BaseCommand):
+    help = 'Create Shiprocket shipments and assign AWBs for orders that do not have one yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', help='Only ship orders of this company (UUID)')
+        parser.add_argument('--limit', type=int, help='Ship at most this many orders per company')
+        parser.add_argument('--workers', type=int, default=SHIPMENT_WORKERS,
+                            help='Concurrent Shiprocket requests')
+
+    def handle(self, *args, **options):
+        companies = Company.objects.filter(
+            is_active=True, shiprocket_email__isnull=False, shiprocket_token__isnull=False
+        )
+        if options['company']:
+            companies = companies.filter(id=options['company'])
+            if not companies.exists():
+                raise CommandError(f"Company {options['company']} not found or Shiprocket not connected")
+
+        for company in companies:
+            try:
+                stats = create_shipments(company, max_workers=options['workers'], limit=options['limit'])
+            except ShiprocketAuthError as e:
+                self.stderr.write(f"{company.name}: {e}")
+                continue
+            self.stdout.write(
+                f"{company.name}: {stats['created']} shipments created, {stats['awb_assigned']} AWBs assigned, "
+                f"{stats['failed']} failed"
+            )
+            for error in stats['errors']:
+                self.stdout.write(f"  {error['order_id']}: {error['error']}")
@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from orders.archive import add_months, archive_orders, ensure_archive_partitions, month_of
+
+
+class Command(BaseCommand):
+    help = ('Archive finished orders of old months and, on MySQL, add the monthly partitions '
+            'of the archive tables')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--archive-after-months', type=int,
+                            default=getattr(settings, 'ORDER_ARCHIVE_AFTER_MONTHS', 12),
+                            help='Archive orders created this many whole months ago or earlier')
+        parser.add_argument('--partitions-only', action='store_true',
+                            help='Only add partitions, do not move any orders')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Print the partition statements and archive nothing')
+
+    def handle(self, *args, **options):
+        if options['archive_after_months'] < 1:
+            raise CommandError('--archive-after-months must be at least 1')
+        before = add_months(month_of(timezone.now()), -options['archive_after_months'])
+
+        # Partitions up to the month being archived next time, so archived rows never land in the catch-all
+        statements = ensure_archive_partitions(through=before, dry_run=options['dry_run'])
+        for statement in statements:
+            self.stdout.write(statement if options['dry_run'] else f"Ran: {statement}")
+        if not statements:
+            self.stdout.write('Archive partitions are up to date (or the database is not MySQL)')
+
+        if options['dry_run'] or options['partitions_only']:
+            return
+        result = archive_orders(before, progress=self.stdout.write)
+        self.stdout.write(
+            f"Archived {result['orders']} orders and {result['items']} items from "
+            f"{result['months']} months before {before:%Y-%m}"
+        )
@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from companies.models import Company
+from orders.tracking import TRACKING_CHUNK_SIZE, TRACKING_WORKERS, poll_tracking
+from orders.utils.shiprocket_client import ShiprocketAuthError
+
+
+class Command(BaseCommand):
+    help = 'Poll Shiprocket for the tracking status of in-transit shipments that are due for a check'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', help='Only poll shipments of this company (UUID)')
+        parser.add_argument('--workers', type=int, default=TRACKING_WORKERS, help='Concurrent tracking requests')
+        parser.add_argument('--chunk-size', type=int, default=TRACKING_CHUNK_SIZE,
+                            help='Orders loaded and written back at a time')
+        parser.add_argument('--limit', type=int, help='Poll at most this many shipments per company')
+        parser.add_argument('--loop', action='store_true', help='Keep polling instead of exiting')
+        parser.add_argument('--sleep', type=float, default=300, help='Seconds between runs with --loop')
+
+    def handle(self, *args, **options):
+        companies = Company.objects.filter(
+            is_active=True, shiprocket_email__isnull=False, shiprocket_token__isnull=False
+        )
+        if options['company']:
+            companies = companies.filter(id=options['company'])
+            if not companies.exists():
+                raise CommandError(f"Company {options['company']} not found or Shiprocket not connected")
+
+        while True:
+            for company in companies:
+                try:
+                    stats = poll_tracking(
+                        company, max_workers=options['workers'], chunk_size=options['chunk_size'],
+                        limit=options['limit'],
+                    )
+                except ShiprocketAuthError as e:
+                    self.stderr.write(f"{company.name}: {e}")
+                    continue
+                self.stdout.write(
+                    f"{company.name}: polled {stats['polled']}, {stats['changed']} changed, "
+                    f"{stats['delivered']} closed, {stats['failed']} failed"
+                )
+            if not options['loop']:
+                break
+            time.sleep(options['sleep'])
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from companies.models import Company
+from orders.services import recompute_customer_order_stats
+
+
+class Command(BaseCommand):
+    help = "Rebuild customers' number_of_orders and amount_spent from their orders"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', help='Only recompute this company (UUID)')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Customers written per UPDATE statement')
+
+    def handle(self, *args, **options):
+        companies = Company.objects.all()
+        if options['company']:
+            companies = companies.filter(id=options['company'])
+            if not companies.exists():
+                raise CommandError(f"Company {options['company']} not found")
+
+        for company in companies:
+            updated = recompute_customer_order_stats(company, batch_size=options['batch_size'])
+            self.stdout.write(f"{company.name}: updated order stats for {updated} customers")
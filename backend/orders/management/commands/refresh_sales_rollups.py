@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from companies.models import Company
+from orders.services import refresh_sales_rollups
+
+
+class Command(BaseCommand):
+    help = 'Refresh the daily sales rollups from orders changed since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', help='Only refresh this company (UUID)')
+        parser.add_argument('--full', action='store_true',
+                            help='Rebuild all rollups instead of only the changed days')
+
+    def handle(self, *args, **options):
+        companies = Company.objects.filter(is_active=True)
+        if options['company']:
+            companies = companies.filter(id=options['company'])
+            if not companies.exists():
+                raise CommandError(f"Company {options['company']} not found")
+
+        for company in companies:
+            result = refresh_sales_rollups(company, full=options['full'])
+            days = 'all' if result['days'] is None else result['days']
+            self.stdout.write(f"{company.name}: refreshed {days} days, {result['rows']} rollup rows")
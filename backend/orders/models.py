@@ -19,6 +19,8 @@ class Order(models.Model):
     # ========== Order IDs ==========
     # ✨ FIX: Remove global uniqueness. Uniqueness will be handled per-company in Meta.
     order_id = models.CharField(max_length=100, blank=True)
+    # ID of the order in the client's own system, set by CSV imports to make them idempotent
+    external_order_id = models.CharField(max_length=100, null=True, blank=True)
     shopify_order_id = models.CharField(max_length=100, unique=True, null=True, blank=True)
 
     # ========== Customer (FK) ==========
@@ -42,17 +44,23 @@ class Order(models.Model):
     payment_mode = models.CharField(max_length=50, choices=[('COD', 'Cash on Delivery'), ('Prepaid', 'Prepaid (Online)')], default='Prepaid')
     payment_status = models.CharField(max_length=20, choices=[('Pending', 'Pending'), ('Paid', 'Paid')], default='Pending')
     fulfillment_status = models.CharField(max_length=20, choices=[('Unfulfilled', 'Unfulfilled'), ('Fulfilled', 'Fulfilled')], default='Unfulfilled')
-    erp_status = models.CharField(max_length=20, choices=[('Pending', 'Pending'), ('Shipped', 'Shipped')], default='Pending')
+    erp_status = models.CharField(max_length=20, choices=[('Pending', 'Pending'), ('Shipped', 'Shipped'), ('Cancelled', 'Cancelled')], default='Pending')
     order_source = models.CharField(max_length=50, choices=[('Shopify', 'Shopify'), ('Manual', 'Manual/Offline Entry')], default='Shopify')
     shiprocket_order_id = models.CharField(max_length=100, null=True, blank=True)
+    shiprocket_shipment_id = models.CharField(max_length=100, null=True, blank=True)
     awb_code = models.CharField(max_length=100, null=True, blank=True)
     courier_company = models.CharField(max_length=100, null=True, blank=True)
     tracking_url = models.URLField(null=True, blank=True)
     shipment_status = models.CharField(max_length=100, null=True, blank=True)
     expected_delivery_date = models.DateTimeField(null=True, blank=True)
+    # Set while a shipment is in transit; cleared once the courier reports a final status
+    tracking_next_check_at = models.DateTimeField(null=True, blank=True)
+    tracking_checked_at = models.DateTimeField(null=True, blank=True)
     synced_with_shopify = models.BooleanField(default=False)
     synced_with_shiprocket = models.BooleanField(default=False)
     last_synced_at = models.DateTimeField(null=True, blank=True)
+    # Shopify's updated_at of the version last written, so late webhooks cannot overwrite newer data
+    shopify_updated_at = models.DateTimeField(null=True, blank=True)
     tags = models.CharField(max_length=255, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -60,7 +68,12 @@ class Order(models.Model):
 
     class Meta:
         # ✨ FIX: Enforce that the order_id must be unique for each company.
-        unique_together = ('company', 'order_id')
+        unique_together = [('company', 'order_id'), ('company', 'external_order_id')]
+        indexes = [
+            models.Index(fields=['company', 'created_at']),
+            models.Index(fields=['company', 'updated_at']),
+            models.Index(fields=['company', 'tracking_next_check_at']),
+        ]
 
     def save(self, *args, **kwargs):
         # ✨ FIX: Cleaned up the save method. All logic is now handled in the view.
@@ -90,6 +103,14 @@ class OrderItem(models.Model):
     variant_name = models.CharField(max_length=255, blank=True)
     category = models.CharField(max_length=100, blank=True)
     sku = models.CharField(max_length=100, null=True, blank=True)
+    # Resolved from sku when the order's stock is taken out of inventory
+    variant = models.ForeignKey(
+        'products.ProductVariant',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='order_items'
+    )
     quantity = models.PositiveIntegerField(default=1)
     unit_price = models.DecimalField(max_digits=10, decimal_places=2)
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
@@ -98,3 +119,120 @@ class OrderItem(models.Model):
 
     def __str__(self):
         return f"{self.product_name} ({self.variant_name}) x {self.quantity}"
+
+
+class DailySalesRollup(models.Model):
+    """Per-company daily order totals, split by payment mode and order source"""
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='daily_sales_rollups')
+    date = models.DateField()
+    payment_mode = models.CharField(max_length=50)
+    order_source = models.CharField(max_length=50)
+    orders_count = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    subtotal = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    tax = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    shipping = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ('company', 'date', 'payment_mode', 'order_source')
+
+    def __str__(self):
+        return f"{self.company_id} {self.date} {self.payment_mode}/{self.order_source}: {self.revenue}"
+
+
+class DailySkuSalesRollup(models.Model):
+    """Per-company daily units and revenue for each SKU"""
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='daily_sku_sales_rollups')
+    date = models.DateField()
+    sku = models.CharField(max_length=100)
+    product_name = models.CharField(max_length=255, blank=True)
+    orders_count = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ('company', 'date', 'sku')
+
+    def __str__(self):
+        return f"{self.company_id} {self.date} {self.sku}: {self.units}"
+
+
+class SalesRollupState(models.Model):
+    """Tracks how far the sales rollups of a company have been refreshed"""
+    company = models.OneToOneField(Company, on_delete=models.CASCADE, related_name='sales_rollup_state')
+    refreshed_until = models.DateTimeField(null=True, blank=True)
+    # Days to recompute that no longer have an order to point at them, e.g. after a delete
+    pending_days = models.JSONField(default=list, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Sales rollups for {self.company_id} until {self.refreshed_until}"
+
+
+def _archive_fields(model, relations: dict) -> dict:
+    """
+    Copies of model's concrete fields for its archive table: the same names
+    and columns, the original primary key values, no unique constraints,
+    dates kept as copied and foreign keys without database constraints
+    (partitioned MySQL tables cannot have them). relations maps a foreign
+    key name to the (model, related_name) it points at in the archive.
+    """
+    fields = {}
+    for field in model._meta.concrete_fields:
+        if field.primary_key:
+            fields[field.name] = models.BigIntegerField(primary_key=True)
+        elif field.is_relation:
+            # Built by hand, as deconstruct() needs the app registry loaded
+            to, related_name = relations.get(field.name, (field.remote_field.model, '+'))
+            fields[field.name] = models.ForeignKey(
+                to, related_name=related_name, on_delete=models.DO_NOTHING, db_constraint=False,
+                null=field.null, blank=field.blank,
+            )
+        else:
+            name, _, args, kwargs = field.deconstruct()
+            if kwargs.pop('unique', False):
+                kwargs['db_index'] = True
+            kwargs.pop('auto_now', None)
+            kwargs.pop('auto_now_add', None)
+            fields[name] = type(field)(*args, **kwargs)
+    return fields
+
+
+def _archive_model(name: str, model, db_table: str, doc: str, indexes, relations=None, extra_fields=None):
+    meta = type('Meta', (), {'db_table': db_table, 'indexes': indexes})
+    attrs = {'__module__': __name__, '__doc__': doc, 'Meta': meta}
+    attrs.update(_archive_fields(model, relations or {}))
+    attrs.update(extra_fields or {})
+    return type(name, (models.Model,), attrs)
+
+
+# Orders and items moved out of the live tables by orders.archive. They have
+# the live tables' fields, so the same .values() and serializers read both.
+ArchivedOrder = _archive_model(
+    'ArchivedOrder', Order, 'orders_order_archive',
+    'An Order moved to the archive, see orders.archive',
+    indexes=[models.Index(fields=['company', 'created_at']), models.Index(fields=['company', 'order_id'])],
+)
+ArchivedOrderItem = _archive_model(
+    'ArchivedOrderItem', OrderItem, 'orders_orderitem_archive',
+    'An OrderItem of an ArchivedOrder',
+    indexes=[models.Index(fields=['order_created_at'])],
+    relations={'order': (ArchivedOrder, 'items')},
+    # Copied from the order, as the archive partitions are by the order's month
+    extra_fields={'order_created_at': models.DateTimeField()},
+)
+
+
+class OrderArchiveMonth(models.Model):
+    """A month whose finished orders were moved to the archive tables"""
+    month = models.DateField(unique=True)
+    orders = models.PositiveIntegerField(default=0)
+    items = models.PositiveIntegerField(default=0)
+    archived_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['month']
+
+    def __str__(self):
+        return f"{self.month:%Y-%m}: {self.orders} orders archived"
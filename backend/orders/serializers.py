@@ -1,6 +1,10 @@
+from django.db import transaction
 from rest_framework import serializers
 from .models import Order, OrderItem
-from companies.models import Customer
+from .services import record_order_created
+from products.inventory import InsufficientStock, reserve_order_stock
+from companies.models import Customer, format_full_name
+from core.fast_serializers import ValuesSerializer
 
 class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:
@@ -19,19 +23,19 @@ class OrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = [
-            'uuid', 'order_id', 'customer', 'customer_details',
+            'uuid', 'order_id', 'external_order_id', 'customer', 'customer_details',
             'shipping_address', 'billing_address',
             'subtotal_price', 'tax_amount', 'shipping_charges', 'total_price',
             'payment_mode', 'payment_status',
             'fulfillment_status', 'erp_status',
             'order_source',
-            'shiprocket_order_id', 'awb_code', 'courier_company',
+            'shiprocket_order_id', 'shiprocket_shipment_id', 'awb_code', 'courier_company',
             'tracking_url', 'shipment_status', 'expected_delivery_date',
             'synced_with_shopify', 'synced_with_shiprocket', 'last_synced_at',
             'tags', 'created_at', 'updated_at',
             'items'
         ]
-        read_only_fields = ['uuid', 'order_id', 'created_at', 'updated_at']
+        read_only_fields = ['uuid', 'order_id', 'external_order_id', 'created_at', 'updated_at']
 
     def get_customer_details(self, obj):
         customer = obj.customer
@@ -44,6 +48,21 @@ class OrderSerializer(serializers.ModelSerializer):
             }
         return None
 
+class OrderValuesSerializer(ValuesSerializer):
+    """OrderSerializer output for order lists, read from .values() rows"""
+    serializer_class = OrderSerializer
+    method_columns = ('customer', 'customer__email', 'customer__phone', 'customer__first_name', 'customer__last_name')
+
+    def get_customer_details(self, row):
+        if row['customer'] is None:
+            return None
+        return {
+            'id': row['customer'],
+            'email': row['customer__email'],
+            'phone': row['customer__phone'],
+            'full_name': format_full_name(row['customer__first_name'], row['customer__last_name'])
+        }
+
 class OrderCreateSerializer(serializers.ModelSerializer):
     items = OrderItemSerializer(many=True)
 
@@ -56,13 +75,21 @@ class OrderCreateSerializer(serializers.ModelSerializer):
             'items'
         ]
 
+    @transaction.atomic
     def create(self, validated_data):
         items_data = validated_data.pop('items')
         order = Order.objects.create(**validated_data)
         
         for item_data in items_data:
             OrderItem.objects.create(order=order, **item_data)
-        
+
+        record_order_created(order)
+        try:
+            reserve_order_stock(order.company, order)
+        except InsufficientStock as e:
+            # Raising inside the atomic block rolls the whole order back
+            raise serializers.ValidationError({'items': [f'Insufficient stock for {e}']})
+
         return order
 
 class OrderUpdateSerializer(serializers.ModelSerializer):
@@ -0,0 +1,414 @@
+import logging
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import ArchivedOrder, Order, OrderItem, DailySalesRollup, DailySkuSalesRollup, SalesRollupState
+from .archive import order_sources, restore_orders
+from companies.models import Company, Customer
+from products.inventory import take_order_stock, return_order_stock
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_SHIPPING_FIELDS = ['address1', 'city', 'province', 'country']
+
+
+def to_float(value):
+    try:
+        return float(value) if value else 0.0
+    except (ValueError, TypeError):
+        return 0.0
+
+
+def update_customer_order_stats(customer_id: int, orders: int, amount) -> None:
+    """Atomically add to a customer's number_of_orders and amount_spent (negative values reverse)"""
+    if not orders and not amount:
+        return
+    Customer.objects.filter(pk=customer_id).update(
+        number_of_orders=F('number_of_orders') + orders,
+        amount_spent=F('amount_spent') + Decimal(str(amount)),
+    )
+
+
+def record_order_created(order: Order) -> None:
+    update_customer_order_stats(order.customer_id, 1, order.total_price)
+
+
+def record_order_deleted(order: Order) -> None:
+    update_customer_order_stats(order.customer_id, -1, -Decimal(str(order.total_price)))
+
+
+def cancel_order(order: Order) -> bool:
+    """
+    Cancel an order, put its stock back into inventory and take it out of
+    its customer's order stats and the sales rollup of its day.
+
+    The order row is locked so concurrent cancellations release stock only
+    once. Returns False if the order was already cancelled.
+    """
+    with transaction.atomic():
+        locked = Order.objects.select_for_update().get(pk=order.pk)
+        if locked.erp_status == 'Cancelled':
+            return False
+        locked.erp_status = 'Cancelled'
+        locked.save(update_fields=['erp_status', 'updated_at'])
+        return_order_stock([locked], reason='order_cancelled')
+        update_customer_order_stats(locked.customer_id, -1, -Decimal(str(locked.total_price)))
+        mark_sales_rollup_day(locked.company, timezone.localtime(locked.created_at).date())
+    order.erp_status = 'Cancelled'
+    return True
+
+
+def recompute_customer_order_stats(company: Company, batch_size: int = 1000) -> int:
+    """
+    Rebuild number_of_orders and amount_spent of every customer of a company
+    from its orders, cancelled ones left out, with one grouped aggregate.
+    Only customers whose stats differ are written; from then on the Shopify
+    customer sync stops copying Shopify's figures.
+    Returns the number of customers updated.
+    """
+    totals = {}
+    for order_model, _ in order_sources():
+        for row in order_model.objects.filter(company=company).exclude(erp_status='Cancelled').values(
+            'customer_id'
+        ).annotate(
+            orders_count=Count('id'),
+            amount=Sum('total_price'),
+        ).order_by():
+            orders_count, amount = totals.get(row['customer_id'], (0, Decimal('0')))
+            totals[row['customer_id']] = (orders_count + row['orders_count'], amount + (row['amount'] or Decimal('0')))
+
+    to_update = []
+    for customer_id, number_of_orders, amount_spent in Customer.objects.filter(
+        company=company
+    ).values_list('id', 'number_of_orders', 'amount_spent').iterator(chunk_size=batch_size):
+        orders_count, amount = totals.get(customer_id, (0, Decimal('0')))
+        if number_of_orders != orders_count or amount_spent != amount:
+            to_update.append(Customer(id=customer_id, number_of_orders=orders_count, amount_spent=amount))
+
+    Customer.objects.bulk_update(to_update, ['number_of_orders', 'amount_spent'], batch_size=batch_size)
+    company.customer_stats_recomputed_at = timezone.now()
+    company.save(update_fields=['customer_stats_recomputed_at'])
+    logger.info(f"Recomputed order stats for company {company.id}: {len(to_update)} customers updated")
+    return len(to_update)
+
+
+def _shopify_order_fields(order_data: Dict) -> Dict:
+    """Order fields owned by Shopify, from a ShopifyOrdersClient.get_all_orders() entry"""
+    fields = {
+        'shopify_order_id': order_data.get('id'),
+        'customer_email': order_data.get('email'),
+        'customer_phone': order_data.get('phone'),
+        'shipping_address': order_data.get('shipping_address') or {},
+        'billing_address': order_data.get('billing_address') or {},
+        'subtotal_price': to_float(order_data.get('subtotal_price')),
+        'tax_amount': to_float(order_data.get('total_tax')),
+        'shipping_charges': to_float(order_data.get('total_shipping_price')),
+        'total_price': to_float(order_data.get('total_price')),
+        'payment_status': (order_data.get('financial_status') or 'pending').capitalize(),
+        'fulfillment_status': (order_data.get('fulfillment_status') or 'unfulfilled').capitalize(),
+    }
+    # Only webhook payloads carry it
+    if order_data.get('updated_at'):
+        fields['shopify_updated_at'] = parse_datetime(order_data['updated_at'])
+    return fields
+
+
+def _build_order_items(order: Order, order_data: Dict) -> list:
+    items = []
+    for item in order_data.get('line_items', []):
+        variant_name = item.get('variant_title') or ''
+        items.append(OrderItem(
+            order=order,
+            product_name=item.get('title', ''),
+            variant_name=variant_name,
+            sku=item.get('sku', ''),
+            quantity=item.get('quantity', 1),
+            unit_price=to_float(item.get('price')),
+            total_price=to_float(item.get('price')) * item.get('quantity', 1)
+        ))
+    return items
+
+
+def _differs(current, value) -> bool:
+    # Prices come in as floats and are stored as two-place decimals
+    if isinstance(current, Decimal) and isinstance(value, float):
+        return current != Decimal(str(value)).quantize(Decimal('0.01'))
+    return current != value
+
+
+def _item_key(product_name, variant_name, sku, quantity, unit_price) -> Tuple:
+    return (product_name, variant_name or '', sku or '', int(quantity), round(float(unit_price), 2))
+
+
+def upsert_shopify_order(company: Company, order_data: Dict, update_existing: bool = True,
+                         take_stock: bool = True) -> Tuple[Optional[Order], bool]:
+    """
+    Create or update an order from a ShopifyOrdersClient.get_all_orders() entry.
+
+    Returns (order, created). When the order already exists and update_existing
+    is False, returns (None, False) without touching it. Raises ValueError when
+    the payload cannot be turned into an order (no email or incomplete
+    shipping address). With take_stock False a new order's stock is left for
+    the caller to take, so a batch of orders can move stock in one go.
+    """
+    order_name = order_data.get('name')
+    if not order_name:
+        raise ValueError("Order has no name/ID")
+
+    existing_order = Order.objects.filter(company=company, order_id=order_name).first()
+    if existing_order is None:
+        archived = ArchivedOrder.objects.filter(company=company, order_id=order_name)
+        if archived.exists():
+            if not update_existing:
+                logger.info(f"Order {order_name} is archived. Skipping.")
+                return None, False
+            # Changed in Shopify after it was archived; live again until the next archival
+            restore_orders(archived)
+            existing_order = Order.objects.filter(company=company, order_id=order_name).first()
+    if existing_order and not update_existing:
+        logger.info(f"Order {order_name} already exists. Skipping.")
+        return None, False
+
+    customer_email = order_data.get('email')
+    if not customer_email:
+        raise ValueError(f"Order {order_name} has no customer email")
+
+    shipping_address = order_data.get('shipping_address') or {}
+    missing_fields = [f for f in REQUIRED_SHIPPING_FIELDS if not shipping_address.get(f)]
+    if missing_fields:
+        raise ValueError(
+            f"Order {order_name} shipping address is missing required fields: {', '.join(missing_fields)}"
+        )
+
+    fields = _shopify_order_fields(order_data)
+
+    if existing_order:
+        # Only write what Shopify changed, and only rewrite items if they differ
+        changed = [name for name, value in fields.items() if _differs(getattr(existing_order, name), value)]
+        previous_total = existing_order.total_price
+        for name in changed:
+            setattr(existing_order, name, fields[name])
+        existing_order.synced_with_shopify = True
+        existing_order.last_synced_at = timezone.now()
+        existing_order.save(update_fields=changed + ['synced_with_shopify', 'last_synced_at', 'updated_at'])
+        if 'total_price' in changed and existing_order.erp_status != 'Cancelled':
+            update_customer_order_stats(
+                existing_order.customer_id, 0,
+                Decimal(str(existing_order.total_price)) - Decimal(str(previous_total))
+            )
+
+        new_items = _build_order_items(existing_order, order_data)
+        current_keys = sorted(
+            _item_key(*row) for row in existing_order.items.values_list(
+                'product_name', 'variant_name', 'sku', 'quantity', 'unit_price'
+            )
+        )
+        new_keys = sorted(
+            _item_key(i.product_name, i.variant_name, i.sku, i.quantity, i.unit_price) for i in new_items
+        )
+        if current_keys != new_keys:
+            # Cancelled orders already gave their stock back
+            holds_stock = existing_order.erp_status != 'Cancelled'
+            if holds_stock:
+                return_order_stock([existing_order], reason='order_updated')
+            existing_order.items.all().delete()
+            OrderItem.objects.bulk_create(new_items)
+            if holds_stock:
+                take_order_stock(company, [existing_order])
+        return existing_order, False
+
+    customer_defaults = {
+        'phone': order_data.get('phone', ''),
+        'first_name': shipping_address.get('firstName', ''),
+        'last_name': shipping_address.get('lastName', ''),
+        'city': shipping_address.get('city'),
+        'state': shipping_address.get('province'),
+        'country': shipping_address.get('country'),
+        'addresses': [shipping_address],
+    }
+    try:
+        customer, _ = Customer.objects.update_or_create(
+            email=customer_email,
+            company=company,
+            defaults=customer_defaults
+        )
+    except Exception as e:
+        logger.error(f"CRITICAL: Failed to update or create CUSTOMER '{customer_email}' for order '{order_name}'. Error: {e}", exc_info=True)
+        raise
+
+    try:
+        new_order = Order(
+            company=company,
+            order_id=order_name,
+            order_source='Shopify',
+            customer=customer,
+            synced_with_shopify=True,
+            last_synced_at=timezone.now(),
+            **fields
+        )
+        new_order.save()
+    except Exception as e:
+        logger.error(f"CRITICAL: Failed to save new ORDER '{order_name}' to the database. Error: {e}", exc_info=True)
+        raise
+
+    OrderItem.objects.bulk_create(_build_order_items(new_order, order_data))
+    record_order_created(new_order)
+    if take_stock:
+        take_order_stock(company, [new_order])
+    return new_order, True
+
+
+def _orders_on_days(queryset, days: Optional[Iterable], date_field: str):
+    """Restrict queryset to rows whose order was created on one of days (None = all days)"""
+    queryset = queryset.annotate(day=TruncDate(date_field))
+    if days is None:
+        return queryset
+    days = sorted(days)
+    tz = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.combine(days[0], time.min), tz)
+    end = timezone.make_aware(datetime.combine(days[-1] + timedelta(days=1), time.min), tz)
+    # The range keeps the (company, created_at) index usable, the day filter drops the gaps
+    return queryset.filter(**{f'{date_field}__gte': start, f'{date_field}__lt': end, 'day__in': days})
+
+
+def _rebuild_sales_rollups(company: Company, days: Optional[Iterable] = None) -> int:
+    """
+    Recompute the rollup rows of the given days (None = every day) from
+    orders, archived ones included. Cancelled orders are left out.
+    """
+    since = None
+    if days:
+        since = timezone.make_aware(datetime.combine(min(days), time.min), timezone.get_current_timezone())
+
+    sales_rows = {}
+    sku_rows = {}
+    for order_model, item_model in order_sources(since):
+        orders = _orders_on_days(
+            order_model.objects.filter(company=company).exclude(erp_status='Cancelled'), days, 'created_at'
+        )
+        items = _orders_on_days(
+            item_model.objects.filter(order__company=company).exclude(order__erp_status='Cancelled'),
+            days, 'order__created_at',
+        )
+
+        order_totals = orders.values('day', 'payment_mode', 'order_source').annotate(
+            orders_count=Count('id'),
+            subtotal=Sum('subtotal_price'),
+            tax=Sum('tax_amount'),
+            shipping=Sum('shipping_charges'),
+            revenue=Sum('total_price'),
+        ).order_by()
+        unit_totals = {
+            (row['day'], row['order__payment_mode'], row['order__order_source']): row['units']
+            for row in items.values('day', 'order__payment_mode', 'order__order_source').annotate(
+                units=Sum('quantity')
+            ).order_by()
+        }
+        sku_totals = items.values('day', 'sku').annotate(
+            product_name=Max('product_name'),
+            orders_count=Count('order_id', distinct=True),
+            units=Sum('quantity'),
+            revenue=Sum('total_price'),
+        ).order_by()
+
+        # A day can have orders in both the live and the archive tables
+        for row in order_totals:
+            key = (row['day'], row['payment_mode'], row['order_source'])
+            sales_row = sales_rows.get(key)
+            if sales_row is None:
+                sales_row = sales_rows[key] = DailySalesRollup(
+                    company=company, date=row['day'], payment_mode=row['payment_mode'],
+                    order_source=row['order_source'], orders_count=0, units=0,
+                    subtotal=Decimal('0'), tax=Decimal('0'), shipping=Decimal('0'), revenue=Decimal('0'),
+                )
+            sales_row.orders_count += row['orders_count']
+            sales_row.units += unit_totals.get(key) or 0
+            sales_row.subtotal += row['subtotal'] or Decimal('0')
+            sales_row.tax += row['tax'] or Decimal('0')
+            sales_row.shipping += row['shipping'] or Decimal('0')
+            sales_row.revenue += row['revenue'] or Decimal('0')
+
+        for row in sku_totals:
+            # Items without a SKU are grouped together under ''
+            key = (row['day'], row['sku'] or '')
+            if key in sku_rows:
+                sku_row = sku_rows[key]
+                sku_row.orders_count += row['orders_count']
+                sku_row.units += row['units'] or 0
+                sku_row.revenue += row['revenue'] or Decimal('0')
+                continue
+            sku_rows[key] = DailySkuSalesRollup(
+                company=company,
+                date=row['day'],
+                sku=row['sku'] or '',
+                product_name=row['product_name'] or '',
+                orders_count=row['orders_count'],
+                units=row['units'] or 0,
+                revenue=row['revenue'] or Decimal('0'),
+            )
+    sales_rows = list(sales_rows.values())
+
+    with transaction.atomic():
+        stale_sales = DailySalesRollup.objects.filter(company=company)
+        stale_skus = DailySkuSalesRollup.objects.filter(company=company)
+        if days is not None:
+            stale_sales = stale_sales.filter(date__in=days)
+            stale_skus = stale_skus.filter(date__in=days)
+        stale_sales.delete()
+        stale_skus.delete()
+        DailySalesRollup.objects.bulk_create(sales_rows, batch_size=1000)
+        DailySkuSalesRollup.objects.bulk_create(sku_rows.values(), batch_size=1000)
+
+    return len(sales_rows)
+
+
+def mark_sales_rollup_day(company: Company, day) -> None:
+    """Queue a day for the next rollup refresh (used when its orders are deleted or cancelled)"""
+    with transaction.atomic():
+        state, _ = SalesRollupState.objects.select_for_update().get_or_create(company=company)
+        if state.refreshed_until is not None and day.isoformat() not in state.pending_days:
+            state.pending_days.append(day.isoformat())
+            state.save(update_fields=['pending_days', 'updated_at'])
+
+
+def refresh_sales_rollups(company: Company, full: bool = False) -> Dict:
+    """
+    Bring the daily sales rollups of a company up to date.
+
+    Only the days that have orders created or updated since the last refresh
+    are recomputed, unless full is set or the company was never rolled up.
+    """
+    with transaction.atomic():
+        state, _ = SalesRollupState.objects.select_for_update().get_or_create(company=company)
+        started_at = timezone.now()
+
+        if full or state.refreshed_until is None:
+            rows = _rebuild_sales_rollups(company)
+            dirty_days = None
+        else:
+            dirty_days = {datetime.strptime(day, '%Y-%m-%d').date() for day in state.pending_days}
+            dirty_days.update(
+                Order.objects.filter(
+                    company=company,
+                    updated_at__gte=state.refreshed_until
+                ).annotate(day=TruncDate('created_at')).values_list('day', flat=True).distinct()
+            )
+            rows = _rebuild_sales_rollups(company, dirty_days) if dirty_days else 0
+
+        # Orders saved while this refresh ran have updated_at >= started_at and are picked up next time
+        state.refreshed_until = started_at
+        state.pending_days = []
+        state.save(update_fields=['refreshed_until', 'pending_days', 'updated_at'])
+
+    logger.info(
+        f"Refreshed sales rollups for company {company.id}: "
+        f"{'all' if dirty_days is None else len(dirty_days)} days, {rows} rows"
+    )
+    return {'days': None if dirty_days is None else len(dirty_days), 'rows': rows}
@@ -0,0 +1,189 @@
+import logging
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Order, OrderItem
+from .tracking import DEFAULT_POLL_INTERVAL
+from .utils.shiprocket_client import ShiprocketClient, ShiprocketError
+from companies.models import Company
+
+logger = logging.getLogger(__name__)
+
+SHIPMENT_WORKERS = 8
+SHIPMENT_UPDATE_FIELDS = [
+    'shiprocket_order_id', 'shiprocket_shipment_id', 'awb_code', 'courier_company', 'tracking_url',
+    'shipment_status', 'tracking_next_check_at', 'synced_with_shiprocket', 'last_synced_at', 'updated_at',
+]
+TRACKING_URL = 'https://shiprocket.co/tracking/{awb}'
+
+
+def _address_name(address: Dict, order: Order):
+    first = address.get('firstName') or address.get('first_name') or ''
+    last = address.get('lastName') or address.get('last_name') or ''
+    if not first and order.customer_id:
+        first, last = order.customer.first_name or '', order.customer.last_name or ''
+    return first or 'Customer', last
+
+
+def build_shiprocket_order(order: Order, items: List[OrderItem], pickup_location: str) -> Dict:
+    """Shiprocket adhoc order payload for an order and its items"""
+    address = order.shipping_address or {}
+    first_name, last_name = _address_name(address, order)
+    package = settings.SHIPROCKET_DEFAULT_PACKAGE
+    return {
+        'order_id': order.order_id,
+        'order_date': timezone.localtime(order.created_at).strftime('%Y-%m-%d %H:%M'),
+        'pickup_location': pickup_location,
+        'billing_customer_name': first_name,
+        'billing_last_name': last_name,
+        'billing_address': address.get('address1') or '',
+        'billing_address_2': address.get('address2') or '',
+        'billing_city': address.get('city') or '',
+        'billing_pincode': address.get('zip') or '',
+        'billing_state': address.get('province') or '',
+        'billing_country': address.get('country') or 'India',
+        'billing_email': order.customer_email or '',
+        'billing_phone': order.customer_phone or address.get('phone') or '',
+        'shipping_is_billing': True,
+        'order_items': [
+            {
+                'name': item.product_name,
+                'sku': item.sku or item.product_name,
+                'units': item.quantity,
+                'selling_price': str(item.unit_price),
+            }
+            for item in items
+        ],
+        'payment_method': 'COD' if order.payment_mode == 'COD' else 'Prepaid',
+        'shipping_charges': str(order.shipping_charges),
+        'sub_total': str(order.subtotal_price),
+        'length': package['length'],
+        'breadth': package['breadth'],
+        'height': package['height'],
+        'weight': package['weight'],
+    }
+
+
+def _create_shipment(client: ShiprocketClient, order: Order, payload: Dict) -> Dict:
+    """
+    Create the Shiprocket order, unless an earlier run did, and assign an AWB.
+    Runs in a worker thread, so it only reads the order and never queries.
+    """
+    if order.shiprocket_shipment_id:
+        result = {
+            'created': False,
+            'shiprocket_order_id': order.shiprocket_order_id,
+            'shipment_id': order.shiprocket_shipment_id,
+            'shipment_status': order.shipment_status,
+        }
+    else:
+        created = client.create_adhoc_order(payload)
+        if not created.get('shipment_id'):
+            raise ShiprocketError(created.get('message') or 'Shiprocket did not return a shipment', payload=created)
+        result = {
+            'created': True,
+            'shiprocket_order_id': str(created.get('order_id') or ''),
+            'shipment_id': str(created['shipment_id']),
+            'shipment_status': created.get('status') or 'NEW',
+        }
+    result.update(awb_code=None, courier_company=None)
+
+    try:
+        assigned = client.assign_awb(result['shipment_id'])
+    except (ShiprocketError, OSError) as e:
+        # The shipment exists now, so it must be saved even without an AWB
+        result['awb_error'] = str(e)
+        return result
+    data = ((assigned.get('response') or {}).get('data')) or {}
+    if assigned.get('awb_assign_status') == 1 and data.get('awb_code'):
+        result['awb_code'] = str(data['awb_code'])
+        result['courier_company'] = data.get('courier_name')
+        result['shipment_status'] = 'AWB ASSIGNED'
+    else:
+        result['awb_error'] = assigned.get('message') or 'AWB not assigned'
+    return result
+
+
+def shipment_candidates(company: Company):
+    """Orders that still need a Shiprocket shipment, or an AWB for a shipment created earlier"""
+    return Order.objects.filter(
+        Q(shiprocket_order_id__isnull=True) | Q(shiprocket_shipment_id__isnull=False, awb_code__isnull=True),
+        company=company,
+        erp_status='Pending',
+        fulfillment_status='Unfulfilled',
+    ).order_by('created_at')
+
+
+def create_shipments(company: Company, orders=None, client: Optional[ShiprocketClient] = None,
+                     max_workers: int = SHIPMENT_WORKERS, limit: Optional[int] = None) -> Dict:
+    """
+    Create Shiprocket shipments and assign AWBs for many orders in one run.
+
+    Payloads are built up front (orders with customers, items in one query),
+    at most max_workers requests run at once through the client's shared
+    session and rate limiter, and the results are written back with a single
+    bulk_update. Orders that fail, or got a shipment but no AWB, are picked up
+    again by the next run.
+    """
+    started = time.monotonic()
+    orders = (shipment_candidates(company) if orders is None else orders).select_related('customer')
+    if limit:
+        orders = orders[:limit]
+    orders = list(orders)
+    stats = {'created': 0, 'awb_assigned': 0, 'failed': 0, 'errors': []}
+    if not orders:
+        return stats
+
+    client = client or ShiprocketClient.for_company(company, pool_size=max_workers)
+    items = defaultdict(list)
+    for item in OrderItem.objects.filter(order_id__in=[order.pk for order in orders]).order_by('id'):
+        items[item.order_id].append(item)
+    payloads = [
+        build_shiprocket_order(order, items[order.pk], company.shiprocket_pickup_location) for order in orders
+    ]
+
+    def run(order, payload):
+        try:
+            return _create_shipment(client, order, payload), None
+        except (ShiprocketError, OSError) as e:
+            return None, str(e)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(run, orders, payloads))
+
+    now = timezone.now()
+    to_update = []
+    for order, (result, error) in zip(orders, results):
+        if error:
+            stats['failed'] += 1
+            stats['errors'].append({'order_id': order.order_id, 'error': error})
+            continue
+        stats['created'] += result['created']
+        order.shiprocket_order_id = result['shiprocket_order_id']
+        order.shiprocket_shipment_id = result['shipment_id']
+        order.shipment_status = result['shipment_status']
+        order.synced_with_shiprocket = True
+        order.last_synced_at = now
+        order.updated_at = now
+        if result['awb_code']:
+            stats['awb_assigned'] += 1
+            order.awb_code = result['awb_code']
+            order.courier_company = result['courier_company']
+            order.tracking_url = TRACKING_URL.format(awb=result['awb_code'])
+            order.tracking_next_check_at = now + DEFAULT_POLL_INTERVAL
+        else:
+            stats['errors'].append({'order_id': order.order_id, 'error': result['awb_error']})
+        to_update.append(order)
+
+    Order.objects.bulk_update(to_update, SHIPMENT_UPDATE_FIELDS)
+    logger.info(
+        f"Created {stats['created']} Shiprocket shipments for company {company.id} "
+        f"({stats['awb_assigned']} with AWB, {stats['failed']} failed) in {time.monotonic() - started:.2f}s"
+    )
+    return stats
@@ -1,3 +1,836 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-# Create your tests here.
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from companies.models import Company, Customer, SyncRun
+from companies.services import upsert_shopify_customer
+from core.fake_shopify import FakeShopify, api_url, generate_store, start_server
+from core.synthetic import generate_tenant
+from products.models import InventoryMovement, Product, ProductCategory, ProductVariant
+from products.services import upsert_shopify_product
+from .archive import order_sources, partition_statements, restore_orders
+from .models import ArchivedOrder, ArchivedOrderItem, Order, OrderArchiveMonth, OrderItem, SalesRollupState
+from .serializers import OrderCreateSerializer, OrderSerializer, OrderValuesSerializer
+from .services import cancel_order, recompute_customer_order_stats, refresh_sales_rollups
+from .shipping import create_shipments
+from .tracking import poll_tracking
+from .utils.shiprocket_client import ShiprocketAuthError, ShiprocketClient
+
+
+class CustomerOrderStatsTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(email='owner@example.com', password='secret', role='PARENT')
+        self.company = Company.objects.create(name='Acme', owner=user, email='acme@example.com')
+        user.company = self.company
+        user.save()
+        self.customer = Customer.objects.create(company=self.company, email='buyer@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def create_order(self, total):
+        response = self.client.post('/api/orders/', {
+            'customer': self.customer.id,
+            'shipping_address': {}, 'billing_address': {},
+            'subtotal_price': total, 'tax_amount': '0', 'shipping_charges': '0', 'total_price': total,
+            'payment_mode': 'COD', 'payment_status': 'Pending', 'order_source': 'Manual',
+            'items': [{'product_name': 'Widget', 'sku': 'SKU-1', 'quantity': 1,
+                       'unit_price': total, 'total_price': total}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return Order.objects.latest('id')
+
+    def customer_stats(self, customer=None):
+        customer = Customer.objects.get(pk=(customer or self.customer).pk)
+        return customer.number_of_orders, customer.amount_spent
+
+    def test_created_and_deleted_orders_update_stats(self):
+        self.create_order('30.00')
+        doomed = self.create_order('20.00')
+        self.assertEqual(self.customer_stats(), (2, Decimal('50.00')))
+
+        self.assertEqual(self.client.delete(f'/api/orders/{doomed.uuid}/').status_code, 204)
+        self.assertEqual(self.customer_stats(), (1, Decimal('30.00')))
+
+    def test_recompute_repairs_drift(self):
+        self.create_order('30.00')
+        self.assertEqual(recompute_customer_order_stats(self.company), 0)
+
+        Customer.objects.filter(pk=self.customer.pk).update(number_of_orders=9, amount_spent=Decimal('1.00'))
+        self.assertEqual(recompute_customer_order_stats(self.company), 1)
+        self.assertEqual(self.customer_stats(), (1, Decimal('30.00')))
+
+    def test_cancelled_order_leaves_customer_stats(self):
+        self.create_order('30.00')
+        order = self.create_order('20.00')
+        cancel_order(order)
+        self.assertEqual(self.customer_stats(), (1, Decimal('30.00')))
+        self.assertEqual(recompute_customer_order_stats(self.company), 0)
+
+        self.assertEqual(self.client.delete(f'/api/orders/{order.uuid}/').status_code, 204)
+        self.assertEqual(self.customer_stats(), (1, Decimal('30.00')))
+
+    def test_shopify_figures_are_kept_until_recomputed(self):
+        data = {'id': '77', 'email': 'shopper@example.com', 'first_name': 'Ravi',
+                'number_of_orders': 7, 'amount_spent': '1234.50'}
+        shopper, _ = upsert_shopify_customer(self.company, data)
+        self.assertEqual(self.customer_stats(shopper), (7, Decimal('1234.50')))
+
+        recompute_customer_order_stats(self.company)
+        self.assertEqual(self.customer_stats(shopper), (0, Decimal('0.00')))
+        upsert_shopify_customer(self.company, {**data, 'number_of_orders': 8, 'amount_spent': '1300.00'})
+        self.assertEqual(self.customer_stats(shopper), (0, Decimal('0.00')))
+
+
+class ReservationFixtureMixin:
+    """A company with one product whose variant SKU-1 starts with `stock` units"""
+    stock = 10
+    inventory_policy = 'deny'
+
+    def create_fixtures(self):
+        self.user = User.objects.create_user(email='owner@example.com', password='secret', role='PARENT')
+        self.company = Company.objects.create(name='Acme', owner=self.user, email='acme@example.com')
+        self.user.company = self.company
+        self.user.save()
+        self.customer = Customer.objects.create(company=self.company, email='buyer@example.com')
+        product = Product.objects.create(
+            user=self.user, title='Widget', category=ProductCategory.objects.create(name='Widgets')
+        )
+        self.variant = ProductVariant.objects.create(
+            product=product, title='Default', sku='SKU-1', variant_id='SKU-1-V', price=Decimal('10.00'),
+            inventory_quantity=self.stock, inventory_policy=self.inventory_policy,
+        )
+
+    def order_data(self, quantity=1):
+        return {
+            'customer': self.customer.id,
+            'shipping_address': {}, 'billing_address': {},
+            'subtotal_price': '10.00', 'tax_amount': '0', 'shipping_charges': '0', 'total_price': '10.00',
+            'payment_mode': 'COD', 'payment_status': 'Pending', 'order_source': 'Manual',
+            'items': [{
+                'product_name': 'Widget', 'sku': 'SKU-1', 'quantity': quantity,
+                'unit_price': '10.00', 'total_price': str(10 * quantity),
+            }],
+        }
+
+    def place_order(self, quantity=1):
+        serializer = OrderCreateSerializer(data=self.order_data(quantity))
+        serializer.is_valid(raise_exception=True)
+        return serializer.save(company=self.company)
+
+    def stock_left(self):
+        self.variant.refresh_from_db()
+        return self.variant.inventory_quantity
+
+
+class OrderReservationTests(ReservationFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_fixtures()
+
+    def test_order_reserves_stock(self):
+        order = self.place_order(quantity=3)
+        self.assertEqual(self.stock_left(), 7)
+        self.assertEqual(order.items.get().variant_id, self.variant.id)
+        self.assertEqual(
+            list(InventoryMovement.objects.values_list('quantity', 'reason', 'reference')),
+            [(-3, 'order', order.order_id)],
+        )
+
+    def test_deny_policy_rejects_oversell(self):
+        self.place_order(quantity=8)
+        with self.assertRaises(serializers.ValidationError):
+            self.place_order(quantity=3)
+        self.assertEqual(self.stock_left(), 2)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_continue_policy_allows_backorder(self):
+        ProductVariant.objects.filter(pk=self.variant.pk).update(inventory_policy='continue')
+        self.place_order(quantity=12)
+        self.assertEqual(self.stock_left(), -2)
+
+    def test_backordered_variant_can_be_saved_and_resynced(self):
+        Product.objects.filter(pk=self.variant.product_id).update(shopify_product_id='100')
+        ProductVariant.objects.filter(pk=self.variant.pk).update(inventory_policy='continue', shopify_variant_id='200')
+        self.place_order(quantity=12)
+        self.variant.refresh_from_db()
+        self.variant.title = 'Default Title'
+        self.variant.save()
+
+        _, created, errors = upsert_shopify_product(self.user, {
+            'id': 'gid://shopify/Product/100', 'title': 'Widget', 'status': 'ACTIVE',
+            'variants': [{
+                'id': 'gid://shopify/ProductVariant/200', 'title': 'Default Title', 'sku': 'SKU-1',
+                'price': '10.00', 'inventoryQuantity': -3, 'inventoryPolicy': 'CONTINUE',
+            }],
+        })
+        self.assertEqual((created, errors), (False, []))
+        self.assertEqual(self.stock_left(), -3)
+
+        ProductVariant.objects.filter(pk=self.variant.pk).update(inventory_policy='deny')
+        self.variant.refresh_from_db()
+        with self.assertRaises(ValidationError):
+            self.variant.save()
+
+    def test_cancel_releases_stock_once(self):
+        order = self.place_order(quantity=4)
+        self.assertTrue(cancel_order(order))
+        self.assertFalse(cancel_order(order))
+        self.assertEqual(self.stock_left(), 10)
+        self.assertEqual(order.erp_status, 'Cancelled')
+
+    def test_cancel_action(self):
+        order = self.place_order(quantity=4)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post(f'/api/orders/{order.uuid}/cancel/')
+        self.assertEqual((response.status_code, response.json()['erp_status']), (200, 'Cancelled'))
+        self.assertEqual(client.post(f'/api/orders/{order.uuid}/cancel/').status_code, 400)
+        self.assertEqual(client.patch(f'/api/orders/{order.uuid}/', {'erp_status': 'Pending'},
+                                      format='json').status_code, 400)
+        self.assertEqual(self.stock_left(), 10)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class FlashSaleLoadTests(ReservationFixtureMixin, TransactionTestCase):
+    """Many threads ordering the same SKU at once must never oversell it"""
+    stock = 50
+    threads = 16
+    orders_per_thread = 10
+
+    def setUp(self):
+        self.create_fixtures()
+
+    def test_concurrent_orders_do_not_oversell(self):
+        placed, denied, errors = [], [], []
+        start = threading.Barrier(self.threads)
+
+        def buyer():
+            try:
+                start.wait()
+                for _ in range(self.orders_per_thread):
+                    try:
+                        placed.append(self.place_order())
+                    except serializers.ValidationError:
+                        denied.append(1)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=buyer) for _ in range(self.threads)]
+        started = time.monotonic()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.monotonic() - started
+
+        attempts = self.threads * self.orders_per_thread
+        print(
+            f"\n{attempts} order attempts from {self.threads} threads in {elapsed:.2f}s "
+            f"({attempts / elapsed:.0f} orders/s): {len(placed)} placed, {len(denied)} denied"
+        )
+        self.assertEqual(errors, [])
+        self.assertEqual(len(placed), self.stock)
+        self.assertEqual(len(denied), attempts - self.stock)
+        self.assertEqual(self.stock_left(), 0)
+        self.assertEqual(
+            InventoryMovement.objects.filter(variant=self.variant).aggregate(total=Sum('quantity'))['total'],
+            -self.stock,
+        )
+
+
+class OrderStockTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(email='owner@example.com', password='secret', role='PARENT')
+        self.company = Company.objects.create(name='Acme', owner=user, email='acme@example.com')
+        user.company = self.company
+        user.save()
+        self.customer = Customer.objects.create(company=self.company, email='buyer@example.com')
+        product = Product.objects.create(user=user, title='Widget',
+                                         category=ProductCategory.objects.create(name='Widgets'))
+        self.variant = ProductVariant.objects.create(product=product, title='Default', sku='SKU-1',
+                                                     price=Decimal('10.00'), inventory_quantity=10)
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def stock_left(self):
+        self.variant.refresh_from_db()
+        return self.variant.inventory_quantity
+
+    def test_orders_take_stock_and_deleting_puts_it_back(self):
+        response = self.client.post('/api/orders/', {
+            'customer': self.customer.id,
+            'shipping_address': {}, 'billing_address': {},
+            'subtotal_price': '20.00', 'tax_amount': '0', 'shipping_charges': '0', 'total_price': '20.00',
+            'payment_mode': 'COD', 'payment_status': 'Pending', 'order_source': 'Manual',
+            'items': [{'product_name': 'Widget', 'sku': 'SKU-1', 'quantity': 2,
+                       'unit_price': '10.00', 'total_price': '20.00'}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        order = Order.objects.get()
+        self.assertEqual(order.items.get().variant, self.variant)
+        self.assertEqual(self.stock_left(), 8)
+
+        self.assertEqual(self.client.delete(f'/api/orders/{order.uuid}/').status_code, 204)
+        self.assertEqual(self.stock_left(), 10)
+        self.assertEqual(list(InventoryMovement.objects.order_by('id').values_list('reason', 'quantity')),
+                         [('order', -2), ('order_cancelled', 2)])
+
+
+class SalesAnalyticsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='owner@example.com', password='secret', role='PARENT')
+        self.company = Company.objects.create(name='Acme', owner=self.user, email='acme@example.com')
+        self.user.company = self.company
+        self.user.save()
+        self.customer = Customer.objects.create(company=self.company, email='buyer@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def place_order(self, quantity=1, sku='SKU-1', payment_mode='COD'):
+        total = str(10 * quantity)
+        serializer = OrderCreateSerializer(data={
+            'customer': self.customer.id,
+            'shipping_address': {}, 'billing_address': {},
+            'subtotal_price': total, 'tax_amount': '0', 'shipping_charges': '0', 'total_price': total,
+            'payment_mode': payment_mode, 'payment_status': 'Pending', 'order_source': 'Manual',
+            'items': [{'product_name': 'Widget', 'sku': sku, 'quantity': quantity,
+                       'unit_price': '10.00', 'total_price': total}],
+        })
+        serializer.is_valid(raise_exception=True)
+        return serializer.save(company=self.company)
+
+    def get(self, action, **params):
+        response = self.client.get(f'/api/analytics/sales/{action}/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_rollups_follow_new_and_deleted_orders(self):
+        self.place_order(quantity=3)
+        doomed = self.place_order(quantity=2, sku='SKU-2', payment_mode='Prepaid')
+        refresh_sales_rollups(self.company)
+        totals = self.get('summary')['totals']
+        self.assertEqual((totals['orders_count'], totals['units'], Decimal(totals['revenue'])),
+                         (2, 5, Decimal('50.00')))
+        self.assertEqual(sorted(day['payment_mode'] for day in self.get('daily', group_by='payment_mode')['days']),
+                         ['COD', 'Prepaid'])
+
+        self.place_order(quantity=1)
+        self.assertEqual(self.client.delete(f'/api/orders/{doomed.uuid}/').status_code, 204)
+        refresh_sales_rollups(self.company)
+        totals = self.get('summary')['totals']
+        self.assertEqual((totals['orders_count'], totals['units']), (2, 4))
+        self.assertEqual([(sku['sku'], sku['units']) for sku in self.get('top_skus', order_by='units')['skus']],
+                         [('SKU-1', 4)])
+
+    def test_cancelled_orders_leave_the_rollups(self):
+        self.place_order(quantity=3)
+        cancelled = self.place_order(quantity=2, sku='SKU-2')
+        refresh_sales_rollups(self.company)
+
+        cancel_order(cancelled)
+        self.assertEqual(SalesRollupState.objects.get(company=self.company).pending_days,
+                         [timezone.localtime(cancelled.created_at).date().isoformat()])
+        refresh_sales_rollups(self.company)
+        totals = self.get('summary')['totals']
+        self.assertEqual((totals['orders_count'], totals['units']), (1, 3))
+        self.assertEqual([sku['sku'] for sku in self.get('top_skus')['skus']], ['SKU-1'])
+
+        refresh_sales_rollups(self.company, full=True)
+        self.assertEqual(self.get('summary')['totals']['orders_count'], 1)
+
+    def test_top_skus_limit_is_clamped(self):
+        self.place_order()
+        refresh_sales_rollups(self.company)
+        self.assertEqual(len(self.get('top_skus', limit=-1)['skus']), 1)
+        self.assertEqual(len(self.get('top_skus', limit=1000)['skus']), 1)
+        self.assertEqual(self.client.get('/api/analytics/sales/top_skus/', {'limit': 'ten'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/analytics/sales/daily/', {'group_by': 'sku'}).status_code, 400)
+
+
+class OrderCSVExportTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(email='owner@example.com', password='secret', role='PARENT')
+        self.company = Company.objects.create(name='Acme', owner=user, email='acme@example.com')
+        user.company = self.company
+        user.save()
+        self.customer = Customer.objects.create(company=self.company, email='buyer@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def create_order(self, *items):
+        total = sum(quantity * Decimal('10.00') for _, quantity in items)
+        order = Order.objects.create(company=self.company, customer=self.customer, order_source='Manual',
+                                     subtotal_price=total, tax_amount=0, shipping_charges=0, total_price=total)
+        for sku, quantity in items:
+            OrderItem.objects.create(order=order, product_name='Widget', sku=sku, quantity=quantity,
+                                     unit_price=Decimal('10.00'), total_price=quantity * Decimal('10.00'))
+        return order
+
+    def export(self, **params):
+        response = self.client.get('/api/orders/export/', params)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content)
+
+    def test_orders_have_one_row_per_item(self):
+        first = self.create_order(('SKU-1', 2), ('G-1', 1))
+        second = self.create_order()
+
+        rows = list(csv.DictReader(io.StringIO(self.export()[1].decode('utf-8'))))
+        self.assertEqual([(row['order_id'], row['item_sku'], row['item_quantity']) for row in rows], [
+            (first.order_id, 'SKU-1', '2'), (first.order_id, 'G-1', '1'), (second.order_id, '', ''),
+        ])
+        self.assertEqual((rows[1]['total_price'], rows[1]['item_unit_price']), ('30.00', '10.00'))
+
+    def test_gzip_export_has_the_same_rows(self):
+        self.create_order(('SKU-1', 1))
+        response, body = self.export(gzip='1')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertTrue(response['Content-Disposition'].endswith('.csv.gz"'))
+        self.assertEqual(gzip.decompress(body), self.export()[1])
+
+
+class OrderCSVImportTests(TestCase):
+    CSV = (
+        'external_order_id,customer_email,product_name,sku,quantity,unit_price\n'
+        'A-1,buyer@example.com,Widget,SKU-1,2,10.00\n'
+        'A-1,buyer@example.com,Widget,SKU-1,1,10.00\n'
+        'A-2,new@example.com,Gadget,,1,25.00\n'
+        'A-3,,Widget,SKU-1,1,10.00\n'
+        'A-4,other@example.com,Widget,SKU-1,two,10.00\n'
+        'A-5,other@example.com,Widget,SKU-1,1,5.00\n'
+    )
+
+    def setUp(self):
+        user = User.objects.create_user(email='owner@example.com', password='secret', role='PARENT')
+        company = Company.objects.create(name='Acme', owner=user, email='acme@example.com')
+        user.company = company
+        user.save()
+        Customer.objects.create(company=company, email='buyer@example.com')
+        product = Product.objects.create(user=user, title='Widget',
+                                         category=ProductCategory.objects.create(name='Widgets'))
+        self.variant = ProductVariant.objects.create(product=product, title='Default', sku='SKU-1',
+                                                     price=Decimal('10.00'), inventory_quantity=10)
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def stock_left(self):
+        self.variant.refresh_from_db()
+        return self.variant.inventory_quantity
+
+    def upload(self, text=None):
+        upload = SimpleUploadedFile('orders.csv', (text or self.CSV).encode('utf-8'), content_type='text/csv')
+        response = self.client.post('/api/orders/import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_bad_rows_are_reported_and_the_rest_imported(self):
+        result = self.upload()
+        self.assertEqual((result['created'], result['skipped'], result['failed']), (3, 0, 2))
+        self.assertEqual([(error['row'], error['external_order_id']) for error in result['errors']],
+                         [(5, 'A-3'), (6, 'A-4')])
+        self.assertEqual(result['customers_created'], 2)
+        order = Order.objects.get(external_order_id='A-1')
+        self.assertEqual((order.order_id, order.items.count(), order.total_price), ('A-1', 2, Decimal('30.00')))
+        self.assertEqual(Customer.objects.get(email='buyer@example.com').number_of_orders, 1)
+        self.assertEqual(self.stock_left(), 6)
+
+    def test_reimport_is_idempotent(self):
+        self.upload()
+        stats = Customer.objects.values_list('email', 'number_of_orders', 'amount_spent')
+        before = sorted(stats)
+
+        result = self.upload()
+        self.assertEqual((result['created'], result['skipped'], result['failed']), (0, 3, 2))
+        self.assertEqual(result['customers_created'], 0)
+        self.assertEqual(Order.objects.count(), 3)
+        self.assertEqual(OrderItem.objects.count(), 4)
+        self.assertEqual(self.stock_left(), 6)
+        self.assertEqual(sorted(stats), before)
+
+    def test_invalid_new_customers_are_reported(self):
+        result = self.upload(
+            'external_order_id,customer_email,product_name,quantity,unit_price,shipping_city\n'
+            'B-1,not-an-email,Widget,1,10.00,\n'
+            'B-2,not-an-email,Widget,1,10.00,\n'
+            'B-3,partial@example.com,Widget,1,10.00,Pune\n'
+            'B-4,fine@example.com,Widget,1,10.00,\n'
+        )
+        self.assertEqual((result['created'], result['failed'], result['customers_created']), (1, 3, 1))
+        self.assertEqual([(error['row'], error['external_order_id']) for error in result['errors']],
+                         [(2, 'B-1'), (3, 'B-2'), (4, 'B-3')])
+        self.assertIn('valid email', result['errors'][0]['error'])
+        self.assertIn('missing required fields', result['errors'][2]['error'])
+        self.assertEqual(list(Order.objects.values_list('external_order_id', flat=True)), ['B-4'])
+        self.assertFalse(Customer.objects.filter(email__in=['not-an-email', 'partial@example.com']).exists())
+
+
+class StubShiprocket(ThreadingHTTPServer):
+    """Local stand-in for the Shiprocket API that records what it was asked to do"""
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubShiprocketHandler)
+        self.lock = threading.Lock()
+        self.logins = 0
+        self.created = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.valid_tokens = set()
+        self.fail_awb_for = set()
+        self.reject_tracking_for = set()
+        self.tracking = {}
+        self.tracked = []
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class StubShiprocketHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status_code, data):
+        body = json.dumps(data).encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        awb_code = self.path.rstrip('/').split('/')[-1]
+        with server.lock:
+            server.tracked.append(awb_code)
+        if awb_code in server.reject_tracking_for:
+            return self.reply(401, {'message': 'Token has expired'})
+        if awb_code not in server.tracking:
+            return self.reply(404, {'message': 'AWB not found'})
+        status, etd = server.tracking[awb_code]
+        return self.reply(200, {'tracking_data': {
+            'track_status': 1, 'etd': etd, 'shipment_track': [{'awb_code': awb_code, 'current_status': status}],
+        }})
+
+    def do_POST(self):
+        server = self.server
+        data = json.loads(self.rfile.read(int(self.headers['Content-Length'])) or b'{}')
+        if self.path.endswith('/auth/login'):
+            with server.lock:
+                server.logins += 1
+                token = f'token-{server.logins}'
+                server.valid_tokens.add(token)
+            return self.reply(200, {'token': token})
+
+        if self.headers.get('Authorization', '').split(' ')[-1] not in server.valid_tokens:
+            return self.reply(401, {'message': 'Token has expired'})
+
+        with server.lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            time.sleep(0.02)
+            if self.path.endswith('/orders/create/adhoc'):
+                with server.lock:
+                    server.created.append(data['order_id'])
+                    number = len(server.created)
+                return self.reply(200, {'order_id': 1000 + number, 'shipment_id': 5000 + number, 'status': 'NEW'})
+            if self.path.endswith('/courier/assign/awb'):
+                if str(data['shipment_id']) in server.fail_awb_for:
+                    return self.reply(200, {'awb_assign_status': 0, 'message': 'No courier serviceable'})
+                return self.reply(200, {'awb_assign_status': 1, 'response': {'data': {
+                    'awb_code': f"AWB{data['shipment_id']}", 'courier_name': 'Delhivery',
+                }}})
+            return self.reply(404, {'message': 'Not found'})
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+
+class ShiprocketShipmentTests(TestCase):
+    workers = 4
+
+    def setUp(self):
+        self.stub = StubShiprocket()
+        self.addCleanup(self.stub.stop)
+        user = User.objects.create_user(email='ship@example.com', password='secret', role='PARENT')
+        self.company = Company.objects.create(
+            name='Shipper', owner=user, email='shipper@example.com', shiprocket_email='ops@example.com'
+        )
+        customer = Customer.objects.create(company=self.company, email='buyer@example.com')
+        for number in range(12):
+            order = Order.objects.create(
+                company=self.company, customer=customer, order_id=f'#{number}',
+                shipping_address={'address1': '1 Road', 'city': 'Pune', 'province': 'MH', 'zip': '411001'},
+                subtotal_price=Decimal('100'), tax_amount=Decimal('0'), shipping_charges=Decimal('0'),
+                total_price=Decimal('100'), order_source='Manual',
+            )
+            OrderItem.objects.create(order=order, product_name='Widget', sku='W-1', quantity=1,
+                                     unit_price=Decimal('100'), total_price=Decimal('100'))
+
+    def client_for(self, email):
+        return ShiprocketClient(email, password='secret', base_url=self.stub.url, requests_per_second=1000,
+                                pool_size=self.workers)
+
+    def test_creates_shipments_with_bounded_concurrency(self):
+        stats = create_shipments(self.company, client=self.client_for('bounded@example.com'),
+                                 max_workers=self.workers)
+
+        self.assertEqual((stats['created'], stats['awb_assigned'], stats['failed']), (12, 12, 0))
+        self.assertEqual(self.stub.logins, 1)
+        self.assertLessEqual(self.stub.max_in_flight, self.workers)
+        self.assertFalse(Order.objects.filter(awb_code__isnull=True).exists())
+        order = Order.objects.get(order_id='#0')
+        self.assertEqual(order.courier_company, 'Delhivery')
+        self.assertTrue(order.synced_with_shiprocket)
+
+    def test_shipment_without_awb_is_retried_without_recreating(self):
+        self.stub.fail_awb_for = {'5001'}
+        client = self.client_for('retry@example.com')
+        stats = create_shipments(self.company, client=client, max_workers=self.workers)
+        self.assertEqual((stats['created'], stats['awb_assigned']), (12, 11))
+
+        self.stub.fail_awb_for = set()
+        stats = create_shipments(self.company, client=client, max_workers=self.workers)
+        self.assertEqual((stats['created'], stats['awb_assigned']), (0, 1))
+        self.assertEqual(len(self.stub.created), 12)
+        self.assertFalse(Order.objects.filter(awb_code__isnull=True).exists())
+
+    def test_rejected_token_logs_in_again(self):
+        client = ShiprocketClient('expired@example.com', token='stale', password='secret',
+                                  base_url=self.stub.url, requests_per_second=1000)
+        self.assertEqual(client.assign_awb(5001)['awb_assign_status'], 1)
+        self.assertEqual(self.stub.logins, 1)
+
+
+class TrackingPollerTests(TestCase):
+    def setUp(self):
+        self.stub = StubShiprocket()
+        self.addCleanup(self.stub.stop)
+        user = User.objects.create_user(email='track@example.com', password='secret', role='PARENT')
+        self.company = Company.objects.create(name='Tracker', owner=user, email='tracker@example.com')
+        customer = Customer.objects.create(company=self.company, email='buyer@example.com')
+        self.now = timezone.now()
+        due, later = self.now - timedelta(minutes=1), self.now + timedelta(hours=3)
+        for number, (awb_code, next_check) in enumerate([
+            ('AWB1', due), ('AWB2', due), ('AWB3', due), ('AWB4', later), (None, None),
+        ]):
+            Order.objects.create(
+                company=self.company, customer=customer, order_id=f'#{number}',
+                subtotal_price=Decimal('100'), tax_amount=Decimal('0'), shipping_charges=Decimal('0'),
+                total_price=Decimal('100'), order_source='Manual', awb_code=awb_code,
+                shipment_status='AWB ASSIGNED' if awb_code else None, tracking_next_check_at=next_check,
+            )
+        self.stub.tracking = {
+            'AWB1': ('DELIVERED', None),
+            'AWB2': ('IN TRANSIT', '2030-01-05 18:00:00'),
+            'AWB4': ('IN TRANSIT', None),
+        }
+        self.shiprocket = ShiprocketClient('tracker@example.com', password='secret', base_url=self.stub.url,
+                                           requests_per_second=1000)
+
+    def poll(self):
+        return poll_tracking(self.company, client=self.shiprocket, max_workers=4, chunk_size=2)
+
+    def test_polls_only_due_shipments(self):
+        stats = self.poll()
+
+        self.assertEqual(sorted(self.stub.tracked), ['AWB1', 'AWB2', 'AWB3'])
+        self.assertEqual((stats['polled'], stats['failed'], stats['delivered']), (2, 1, 1))
+        delivered = Order.objects.get(awb_code='AWB1')
+        self.assertEqual((delivered.shipment_status, delivered.erp_status), ('DELIVERED', 'Shipped'))
+        self.assertIsNone(delivered.tracking_next_check_at)
+        in_transit = Order.objects.get(awb_code='AWB2')
+        self.assertEqual(in_transit.expected_delivery_date.year, 2030)
+        self.assertEqual(in_transit.tracking_next_check_at - in_transit.tracking_checked_at, timedelta(hours=4))
+        self.assertEqual(Order.objects.get(awb_code='AWB3').erp_status, 'Pending')
+
+        self.stub.tracked.clear()
+        self.assertEqual(self.poll()['polled'], 0)
+        self.assertEqual(self.stub.tracked, [])
+
+    def test_unchanged_status_backs_off(self):
+        self.poll()
+        # Four hours later the shipment is due again and still in transit
+        Order.objects.filter(awb_code='AWB2').update(
+            tracking_checked_at=self.now - timedelta(hours=4, minutes=1),
+            tracking_next_check_at=self.now - timedelta(minutes=1),
+        )
+        self.poll()
+        order = Order.objects.get(awb_code='AWB2')
+        self.assertEqual(order.tracking_next_check_at - order.tracking_checked_at, timedelta(hours=8))
+
+    def test_auth_failure_leaves_unpolled_shipments_due(self):
+        # The first chunk (AWB1, AWB2) is polled, then Shiprocket rejects the token for the second
+        self.stub.reject_tracking_for = {'AWB3'}
+        with self.assertRaises(ShiprocketAuthError):
+            self.poll()
+
+        self.assertEqual(Order.objects.get(awb_code='AWB1').shipment_status, 'DELIVERED')
+        unpolled = Order.objects.get(awb_code='AWB3')
+        self.assertIsNone(unpolled.tracking_checked_at)
+        self.assertLessEqual(unpolled.tracking_next_check_at, self.now)
+
+        self.stub.reject_tracking_for = set()
+        self.stub.tracked.clear()
+        stats = self.poll()
+        self.assertEqual(self.stub.tracked, ['AWB3'])
+        self.assertEqual((stats['polled'], stats['failed']), (0, 1))
+
+
+class ShopifyOrderSyncTests(TestCase):
+    def setUp(self):
+        self.fake = FakeShopify(generate_store(customers=20, products=10, orders=120))
+        server = start_server(self.fake)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.settings = override_settings(SHOPIFY_API_URL=api_url(server))
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+
+        user = User.objects.create_user(email='sync@example.com', password='secret', role='PARENT')
+        company = Company.objects.create(name='Syncer', owner=user, email='syncer@example.com',
+                                         shopify_domain='syncer.myshopify.com', shopify_access_token='token')
+        user.company = company
+        user.save()
+        self.company = company
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def test_sync_pages_through_all_orders(self):
+        response = self.client.post('/api/orders/sync_shopify_orders/')
+
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(Order.objects.filter(company=self.company).count(), 120)
+        # 50 orders a page
+        self.assertEqual(self.fake.stats['requests'], 3)
+
+        run = SyncRun.objects.get(pk=response.json()['sync_run'])
+        self.assertEqual((run.resource, run.status, run.pages), ('orders', 'succeeded', 3))
+        self.assertEqual((run.rows_fetched, run.created), (120, 120))
+        self.assertGreater(run.api_cost, 0)
+
+        response = self.client.post('/api/orders/sync_shopify_orders/')
+        self.assertEqual(response.json()['message'], 'Sync complete. Added 0 new orders.')
+
+        summary = self.client.get('/companies/api/sync-runs/summary/').json()['data']['orders']
+        self.assertEqual(summary['runs'], 2)
+        self.assertEqual(summary['rows'], 240)
+
+
+class OrderValuesSerializerTests(TestCase):
+    def test_renders_the_same_bytes_as_the_model_serializer(self):
+        company = generate_tenant('Parity', customers=10, products=5, orders=30, seed=3)
+        orders = Order.objects.filter(company=company)
+        values_serializer = OrderValuesSerializer()
+        self.assertEqual(JSONRenderer().render(values_serializer.serialize(values_serializer.values(orders))),
+                         JSONRenderer().render(OrderSerializer(orders, many=True).data))
+        # One query for the orders and their customers, one for all their items
+        with self.assertNumQueries(2):
+            values_serializer.serialize(values_serializer.values(orders))
+        self.assertEqual(values_serializer.serialize(values_serializer.values(orders.none())), [])
+
+
+class OrderArchiveTests(TestCase):
+    def setUp(self):
+        self.company = generate_tenant('Archive', customers=10, products=5, orders=60, days=730, seed=9)
+        orders = Order.objects.filter(company=self.company)
+        orders.update(erp_status='Shipped')
+        self.pending = orders.order_by('created_at').first()
+        Order.objects.filter(pk=self.pending.pk).update(erp_status='Pending')
+        self.client = APIClient()
+        self.client.force_authenticate(self.company.owner)
+
+    def listed(self, **params):
+        return sorted(self.client.get('/api/orders/', params).json(), key=lambda order: order['uuid'])
+
+    def exported(self, **params):
+        response = self.client.get('/api/orders/export/', params)
+        # The header row is left out
+        return sorted(b''.join(response.streaming_content).decode().splitlines()[1:])
+
+    def rollups(self):
+        refresh_sales_rollups(self.company, full=True)
+        return sorted(self.company.daily_sales_rollups.values_list('date', 'orders_count', 'units', 'revenue'))
+
+    def test_archived_orders_read_as_before(self):
+        listed, exported, rollups = self.listed(), self.exported(), self.rollups()
+        items = OrderItem.objects.filter(order__company=self.company).count()
+        recompute_customer_order_stats(self.company)
+
+        call_command('manage_order_partitions', archive_after_months=12, stdout=io.StringIO())
+
+        archived = ArchivedOrder.objects.filter(company=self.company)
+        self.assertGreater(archived.count(), 20)
+        self.assertEqual(Order.objects.filter(company=self.company).count() + archived.count(), 60)
+        self.assertEqual(OrderItem.objects.filter(order__company=self.company).count()
+                         + ArchivedOrderItem.objects.filter(order__company=self.company).count(), items)
+        self.assertTrue(Order.objects.filter(pk=self.pending.pk).exists())
+        self.assertEqual(OrderArchiveMonth.objects.aggregate(Sum('orders'))['orders__sum'], archived.count())
+        self.assertEqual(len(order_sources()), 2)
+        self.assertEqual(len(order_sources(timezone.now() - timedelta(days=30))), 1)
+
+        with CaptureQueriesContext(connection) as queries:
+            live = self.listed()
+            live_rows = self.exported()
+        self.assertFalse([query for query in queries if 'orders_order_archive' in query['sql']])
+        self.assertEqual(len(live), 60 - archived.count())
+        self.assertEqual(sorted(live + self.listed(archived=1), key=lambda order: order['uuid']), listed)
+        self.assertEqual(sorted(live_rows + self.exported(archived=1)), exported)
+        self.assertEqual({row.split(',')[0] for row in live_rows},
+                         set(Order.objects.filter(company=self.company).values_list('order_id', flat=True)))
+        self.assertEqual(self.rollups(), rollups)
+        self.assertEqual(recompute_customer_order_stats(self.company), 0)
+
+        order = archived.first()
+        response = self.client.get(f'/api/orders/{order.uuid}/')
+        self.assertEqual(response.json(), next(o for o in listed if o['uuid'] == str(order.uuid)))
+        self.assertEqual(self.client.patch(f'/api/orders/{order.uuid}/', {'tags': 'x'}, format='json').status_code,
+                         404)
+
+        self.assertEqual(restore_orders(ArchivedOrder.objects.filter(pk=order.pk)), 1)
+        self.assertEqual(Order.objects.get(pk=order.pk).items.count(), len(response.json()['items']))
+        self.assertIn(response.json(), self.listed())
+
+    def test_partition_statements(self):
+        months = [timezone.datetime(2024, month, 1).date() for month in (1, 2, 3)]
+        create = partition_statements('orders_order_archive', 'created_at', months, [])
+        self.assertEqual(create[-1], (
+            "ALTER TABLE orders_order_archive PARTITION BY RANGE (TO_DAYS(created_at)) ("
+            "PARTITION pold VALUES LESS THAN (TO_DAYS('2024-01-01')), "
+            "PARTITION p202401 VALUES LESS THAN (TO_DAYS('2024-02-01')), "
+            "PARTITION p202402 VALUES LESS THAN (TO_DAYS('2024-03-01')), "
+            "PARTITION p202403 VALUES LESS THAN (TO_DAYS('2024-04-01')), "
+            "PARTITION pfuture VALUES LESS THAN MAXVALUE)"
+        ))
+        self.assertEqual(partition_statements('t', 'created_at', months, ['pold', 'p202401', 'p202402', 'pfuture']), [
+            "ALTER TABLE t REORGANIZE PARTITION pfuture INTO ("
+            "PARTITION p202403 VALUES LESS THAN (TO_DAYS('2024-04-01')), PARTITION pfuture VALUES LESS THAN MAXVALUE)"
+        ])
+        self.assertEqual(partition_statements('t', 'created_at', months[:2], ['pold', 'p202402', 'pfuture']), [])
@@ -0,0 +1,155 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Order
+from .utils.shiprocket_client import ShiprocketClient, ShiprocketAuthError, ShiprocketError
+from companies.models import Company
+
+logger = logging.getLogger(__name__)
+
+TRACKING_WORKERS = 16
+# Orders loaded, polled and written back at a time
+TRACKING_CHUNK_SIZE = 1000
+
+# How long to wait before polling again, by the status the courier reported.
+# Each poll that finds the status unchanged doubles the wait, up to MAX_POLL_INTERVAL.
+POLL_INTERVALS = {
+    'OUT FOR DELIVERY': timedelta(hours=1),
+    'REACHED AT DESTINATION HUB': timedelta(hours=2),
+    'IN TRANSIT': timedelta(hours=4),
+    'SHIPPED': timedelta(hours=4),
+    'PICKED UP': timedelta(hours=4),
+    'UNDELIVERED': timedelta(hours=4),
+    'RTO INITIATED': timedelta(hours=12),
+    'RTO IN TRANSIT': timedelta(hours=12),
+}
+DEFAULT_POLL_INTERVAL = timedelta(hours=6)
+MAX_POLL_INTERVAL = timedelta(hours=24)
+# Statuses after which a shipment is no longer polled
+FINAL_STATUSES = {'DELIVERED', 'RTO DELIVERED', 'CANCELED', 'CANCELLED', 'LOST', 'DESTROYED'}
+# Statuses that mean the courier has the parcel, so the order counts as shipped
+NOT_YET_SHIPPED = {'NEW', 'AWB ASSIGNED', 'PICKUP SCHEDULED', 'PICKUP GENERATED', 'PICKUP QUEUED',
+                   'OUT FOR PICKUP', 'PICKUP EXCEPTION', 'CANCELED', 'CANCELLED'}
+
+TRACKING_UPDATE_FIELDS = [
+    'shipment_status', 'expected_delivery_date', 'erp_status',
+    'tracking_checked_at', 'tracking_next_check_at', 'updated_at',
+]
+
+
+def next_poll_interval(status: str, previous_status: Optional[str], previous_interval: Optional[timedelta]):
+    """Wait before the next poll: the status' base interval, doubled while nothing changes"""
+    interval = POLL_INTERVALS.get(status, DEFAULT_POLL_INTERVAL)
+    if status == previous_status and previous_interval:
+        interval = max(interval, min(previous_interval * 2, MAX_POLL_INTERVAL))
+    return interval
+
+
+def parse_tracking(data: Dict) -> Dict:
+    """Pull the current status and expected delivery date out of a track/awb response"""
+    tracking = data.get('tracking_data') or {}
+    tracks = tracking.get('shipment_track') or [{}]
+    status = (tracks[0].get('current_status') or '').strip().upper()
+    if not status:
+        activities = tracking.get('shipment_track_activities') or [{}]
+        status = (activities[0].get('sr-status-label') or activities[0].get('activity') or '').strip().upper()
+    etd = tracking.get('etd') or tracks[0].get('edd')
+    expected = parse_datetime(etd) if isinstance(etd, str) else None
+    if expected and timezone.is_naive(expected):
+        expected = timezone.make_aware(expected)
+    return {'status': status or None, 'expected_delivery_date': expected}
+
+
+def open_shipments(company: Company, now: datetime):
+    """In-transit orders due for a poll, found through the tracking_next_check_at index"""
+    return Order.objects.filter(
+        company=company,
+        tracking_next_check_at__lte=now,
+        awb_code__isnull=False,
+    ).order_by('tracking_next_check_at', 'id')
+
+
+def _apply_tracking(order: Order, tracking: Dict, now: datetime) -> bool:
+    """Update an order from its tracking result; returns whether the status or ETA changed"""
+    status = tracking['status'] or order.shipment_status
+    previous_interval = None
+    if order.tracking_checked_at and order.tracking_next_check_at:
+        previous_interval = order.tracking_next_check_at - order.tracking_checked_at
+    changed = status != order.shipment_status or (
+        tracking['expected_delivery_date'] and tracking['expected_delivery_date'] != order.expected_delivery_date
+    )
+
+    if status in FINAL_STATUSES:
+        order.tracking_next_check_at = None
+    else:
+        order.tracking_next_check_at = now + next_poll_interval(status, order.shipment_status, previous_interval)
+    if status and status not in NOT_YET_SHIPPED and order.erp_status == 'Pending':
+        order.erp_status = 'Shipped'
+    order.shipment_status = status
+    if tracking['expected_delivery_date']:
+        order.expected_delivery_date = tracking['expected_delivery_date']
+    order.tracking_checked_at = now
+    order.updated_at = now
+    return bool(changed)
+
+
+def poll_tracking(company: Company, client: Optional[ShiprocketClient] = None,
+                  max_workers: int = TRACKING_WORKERS, chunk_size: int = TRACKING_CHUNK_SIZE,
+                  limit: Optional[int] = None) -> Dict:
+    """
+    Poll the courier for every open shipment of a company that is due.
+
+    Orders are read in chunks of chunk_size with only the tracking fields
+    loaded, each chunk is fetched by a bounded thread pool sharing one
+    client, and written back with one bulk_update. Every polled order gets
+    its next poll time, so a chunk is never picked up twice in one run.
+    """
+    started = time.monotonic()
+    stats = {'polled': 0, 'changed': 0, 'delivered': 0, 'failed': 0}
+    client = client or ShiprocketClient.for_company(company, pool_size=max_workers)
+    now = timezone.now()
+
+    def fetch(awb_code):
+        try:
+            return parse_tracking(client.track_awb(awb_code)), None
+        except ShiprocketAuthError:
+            raise
+        except (ShiprocketError, OSError) as e:
+            return None, str(e)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while limit is None or stats['polled'] + stats['failed'] < limit:
+            size = chunk_size if limit is None else min(chunk_size, limit - stats['polled'] - stats['failed'])
+            orders = list(open_shipments(company, now).only(
+                'id', 'order_id', 'awb_code', 'shipment_status', 'expected_delivery_date', 'erp_status',
+                'tracking_checked_at', 'tracking_next_check_at',
+            )[:size])
+            if not orders:
+                break
+
+            results = list(pool.map(fetch, [order.awb_code for order in orders]))
+            for order, (tracking, error) in zip(orders, results):
+                if error:
+                    stats['failed'] += 1
+                    logger.warning(f"Tracking failed for order {order.order_id} (AWB {order.awb_code}): {error}")
+                    # Back off as if nothing changed so a broken AWB is not retried every run
+                    tracking = {'status': None, 'expected_delivery_date': None}
+                else:
+                    stats['polled'] += 1
+                if _apply_tracking(order, tracking, now):
+                    stats['changed'] += 1
+                if order.tracking_next_check_at is None:
+                    stats['delivered'] += 1
+            Order.objects.bulk_update(orders, TRACKING_UPDATE_FIELDS)
+
+    logger.info(
+        f"Polled {stats['polled']} shipments for company {company.id}: {stats['changed']} changed, "
+        f"{stats['delivered']} closed, {stats['failed']} failed in {time.monotonic() - started:.2f}s"
+    )
+    return stats
@@ -1,12 +1,13 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import OrderViewSet
+from .views import OrderViewSet, SalesAnalyticsViewSet
 
 router = DefaultRouter()
 
 # FIX: The prefix for your endpoint should be 'orders'.
 # This registers the ViewSet at the 'orders/' path within this app's URL configuration.
 router.register(r'orders', OrderViewSet, basename='order')
+router.register(r'analytics/sales', SalesAnalyticsViewSet, basename='sales-analytics')
 
 urlpatterns = [
     # This includes all the URLs generated by the router.
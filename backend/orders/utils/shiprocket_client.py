@@ -0,0 +1,184 @@
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# Shiprocket tokens are valid for 240 hours; refresh a little before that
+TOKEN_TTL_SECONDS = 9 * 24 * 3600
+REQUEST_TIMEOUT = 30
+
+# Tokens shared by every client in the process, keyed by account email
+_token_cache: Dict[str, Tuple[str, float]] = {}
+_token_lock = threading.Lock()
+
+
+class ShiprocketError(Exception):
+    def __init__(self, message: str, status_code: Optional[int] = None, payload: Any = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.payload = payload
+
+
+class ShiprocketAuthError(ShiprocketError):
+    """The token was rejected and there is no password to log in again"""
+
+
+class RateLimiter:
+    """Thread-safe token bucket allowing `rate` requests per second with bursts of `burst`"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def cache_token(email: str, token: str, ttl: float = TOKEN_TTL_SECONDS):
+    with _token_lock:
+        _token_cache[email] = (token, time.monotonic() + ttl)
+
+
+def cached_token(email: str) -> Optional[str]:
+    with _token_lock:
+        token, expires = _token_cache.get(email, (None, 0))
+    return token if token and expires > time.monotonic() else None
+
+
+def drop_token(email: str, token: str):
+    """Forget a rejected token, unless another thread already replaced it"""
+    with _token_lock:
+        if _token_cache.get(email, (None, 0))[0] == token:
+            del _token_cache[email]
+
+
+class ShiprocketClient:
+    """
+    Shiprocket API client safe to share between threads.
+
+    Requests go through one pooled session (pool_size connections) and a
+    rate limiter. The token is cached per account for the whole process;
+    with a password the client logs in again when the token expires or is
+    rejected, otherwise the stored token is used as is.
+    """
+
+    def __init__(self, email: str, token: Optional[str] = None, password: Optional[str] = None,
+                 base_url: Optional[str] = None, requests_per_second: Optional[float] = None,
+                 pool_size: int = 10):
+        self.email = email
+        self.password = password
+        self.base_url = (base_url or settings.SHIPROCKET_API_URL).rstrip('/')
+        self.login_lock = threading.Lock()
+        if token and token != cached_token(email):
+            # A token given explicitly (e.g. the one stored on the company) is the newest known
+            cache_token(email, token)
+        self.rate_limiter = RateLimiter(
+            requests_per_second or settings.SHIPROCKET_REQUESTS_PER_SECOND, burst=pool_size
+        )
+
+        self.session = requests.Session()
+        # Only idempotent requests are retried, so a shipment is never created twice
+        retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 502, 503, 504),
+                      respect_retry_after_header=True)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Content-Type': 'application/json'})
+
+    @classmethod
+    def for_company(cls, company, **kwargs) -> 'ShiprocketClient':
+        if not (company.shiprocket_email and company.shiprocket_token):
+            raise ShiprocketAuthError("Shiprocket credentials not configured")
+        return cls(company.shiprocket_email, token=company.shiprocket_token, **kwargs)
+
+    def login(self) -> str:
+        if not self.password:
+            raise ShiprocketAuthError("Shiprocket token expired, please reconnect Shiprocket")
+        self.rate_limiter.acquire()
+        response = self.session.post(
+            f"{self.base_url}/auth/login",
+            json={'email': self.email, 'password': self.password},
+            timeout=REQUEST_TIMEOUT,
+        )
+        if response.status_code != 200:
+            raise ShiprocketAuthError("Shiprocket login failed", response.status_code, _json(response))
+        token = response.json().get('token')
+        if not token:
+            raise ShiprocketAuthError("Shiprocket login returned no token")
+        cache_token(self.email, token)
+        return token
+
+    def get_token(self) -> str:
+        token = cached_token(self.email)
+        if token:
+            return token
+        # Threads that find no token wait for a single login instead of each logging in
+        with self.login_lock:
+            return cached_token(self.email) or self.login()
+
+    def request(self, method: str, path: str, **kwargs) -> Dict[str, Any]:
+        for attempt in range(2):
+            token = self.get_token()
+            self.rate_limiter.acquire()
+            response = self.session.request(
+                method, f"{self.base_url}/{path.lstrip('/')}",
+                headers={'Authorization': f'Bearer {token}'},
+                timeout=REQUEST_TIMEOUT,
+                **kwargs
+            )
+            if response.status_code == 401 and attempt == 0 and self.password:
+                # Expired or revoked token: drop it and log in once more
+                drop_token(self.email, token)
+                continue
+            break
+
+        if response.status_code == 401:
+            raise ShiprocketAuthError("Shiprocket rejected the token", 401, _json(response))
+        if response.status_code >= 400:
+            payload = _json(response)
+            message = payload.get('message') if isinstance(payload, dict) else None
+            raise ShiprocketError(
+                message or f"Shiprocket request failed with status {response.status_code}",
+                response.status_code, payload,
+            )
+        return _json(response)
+
+    def create_adhoc_order(self, order_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Create a Shiprocket order; the response has order_id and shipment_id"""
+        return self.request('POST', 'orders/create/adhoc', json=order_data)
+
+    def assign_awb(self, shipment_id, courier_id=None) -> Dict[str, Any]:
+        """Assign an AWB to a shipment, letting Shiprocket pick the courier unless courier_id is given"""
+        data = {'shipment_id': shipment_id}
+        if courier_id:
+            data['courier_id'] = courier_id
+        return self.request('POST', 'courier/assign/awb', json=data)
+
+    def track_awb(self, awb_code: str) -> Dict[str, Any]:
+        return self.request('GET', f'courier/track/awb/{awb_code}')
+
+
+def _json(response) -> Any:
+    try:
+        return response.json()
+    except ValueError:
+        return {}
@@ -1,7 +1,11 @@
 import logging
+import time
 from typing import Dict, List, Any, Optional
 import requests
 
+from companies.utils.shopify_client import query_cost, shopify_api_url
+from core.metrics import SHOPIFY_REQUEST_DURATION
+
 logger = logging.getLogger(__name__)
 
 ORDERS_QUERY = """
@@ -87,7 +91,9 @@ class ShopifyOrdersClient:
     def __init__(self, shop_domain: str, access_token: str):
         self.shop_domain = shop_domain
         self.access_token = access_token
-        self.api_url = f"https://{shop_domain}/admin/api/2024-01/graphql.json"
+        self.api_url = shopify_api_url(shop_domain)
+        # Answered requests and their API cost, for SyncRun
+        self.usage = {'requests': 0, 'cost': 0, 'throttle_wait': 0.0}
         logger.info(f"Initialized ShopifyOrdersClient for domain: {shop_domain}")
 
     def execute(self, query: str, variables: Dict = None) -> Dict[str, Any]:
@@ -107,12 +113,22 @@ class ShopifyOrdersClient:
             logger.debug(f"Query: {query}")
             logger.debug(f"Variables: {variables}")
             
-            response = requests.post(self.api_url, json=payload, headers=headers)
-            response.raise_for_status()
+            started = time.perf_counter()
+            try:
+                response = requests.post(self.api_url, json=payload, headers=headers)
+                response.raise_for_status()
+            except requests.exceptions.RequestException:
+                SHOPIFY_REQUEST_DURATION.observe(time.perf_counter() - started, client='orders', outcome='error')
+                raise
             
             logger.info(f"Shopify API Response Status: {response.status_code}")
             
             data = response.json()
+            SHOPIFY_REQUEST_DURATION.observe(
+                time.perf_counter() - started, client='orders', outcome='error' if 'errors' in data else 'ok'
+            )
+            self.usage['requests'] += 1
+            self.usage['cost'] += query_cost(data)
             
             if 'errors' in data:
                 logger.error(f"GraphQL Errors: {data['errors']}")
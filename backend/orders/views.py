@@ -2,38 +2,95 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.parsers import MultiPartParser
 from django.utils import timezone
 from django.db import transaction, IntegrityError
-from rest_framework.exceptions import PermissionDenied
+from django.db.models import Max, Sum
+from django.http import Http404
+from django.utils.dateparse import parse_date
+from datetime import timedelta
+from decimal import Decimal
+from rest_framework.exceptions import PermissionDenied, ValidationError as DRFValidationError
 import logging
+import time
 
-from .models import Order, OrderItem
+from .models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem, DailySalesRollup, DailySkuSalesRollup
 from .serializers import (
     OrderSerializer,
     OrderCreateSerializer,
     OrderUpdateSerializer,
+    OrderValuesSerializer,
 )
+from .csv_import import OrderCSVImporter, OrderImportError
+from .services import upsert_shopify_order, mark_sales_rollup_day, record_order_deleted, cancel_order
+from .archive import order_sources
+from products.inventory import take_order_stock, return_order_stock
 from .utils.shopify_orders_client import ShopifyOrdersClient
-from companies.models import Company, Customer
+from core.exports import EXPORT_CHUNK_SIZE, stream_csv_response, wants_gzip
+from core.fast_serializers import ValuesListMixin
+from core.metrics import record_sync
+from companies.models import Company, Customer, SyncRun
 
 logger = logging.getLogger(__name__)
 
-def to_float(value):
-    try:
-        return float(value) if value else 0.0
-    except (ValueError, TypeError):
-        return 0.0
+# The first field is only used to join items and is not exported
+ORDER_EXPORT_FIELDS = (
+    'id', 'order_id', 'created_at', 'order_source', 'customer_email', 'customer_phone',
+    'payment_mode', 'payment_status', 'fulfillment_status', 'erp_status',
+    'subtotal_price', 'tax_amount', 'shipping_charges', 'total_price',
+    'shipping_address__city', 'shipping_address__province', 'shipping_address__zip',
+    'awb_code', 'courier_company', 'shipment_status',
+)
+ORDER_EXPORT_HEADER = [
+    'order_id', 'created_at', 'order_source', 'customer_email', 'customer_phone',
+    'payment_mode', 'payment_status', 'fulfillment_status', 'erp_status',
+    'subtotal_price', 'tax_amount', 'shipping_charges', 'total_price',
+    'shipping_city', 'shipping_state', 'shipping_zip',
+    'awb_code', 'courier_company', 'shipment_status',
+]
+ORDER_ITEM_EXPORT_FIELDS = ('product_name', 'variant_name', 'sku', 'quantity', 'unit_price', 'total_price')
+ORDER_ITEM_EXPORT_HEADER = [
+    'item_product_name', 'item_variant_name', 'item_sku', 'item_quantity', 'item_unit_price', 'item_total_price',
+]
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(ValuesListMixin, viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
+    values_serializer_class = OrderValuesSerializer
     lookup_field = 'uuid'
 
     def get_queryset(self):
+        model = ArchivedOrder if self.lists_archive() else Order
+        if not self.request.user.is_superuser:
+            return model.objects.filter(company=self.request.user.company)
+        return model.objects.all()
+
+    def lists_archive(self) -> bool:
+        """?archived=1 lists or exports the archived orders instead of the live ones"""
+        return self.action in ('list', 'export') and self.request.query_params.get('archived', '').lower() in ('1', 'true', 'yes')
+
+    def get_values_serializer(self):
+        return OrderValuesSerializer(model=ArchivedOrder if self.lists_archive() else None)
+
+    def get_archived_queryset(self):
+        """The archived orders the user can read, or None if nothing was archived"""
+        if len(order_sources()) == 1:
+            return None
         if not self.request.user.is_superuser:
-            return Order.objects.filter(company=self.request.user.company)
-        return Order.objects.all()
+            return ArchivedOrder.objects.filter(company=self.request.user.company)
+        return ArchivedOrder.objects.all()
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            # Archived orders can still be read, though not changed
+            archived = self.get_archived_queryset()
+            order = archived.filter(uuid=kwargs['uuid']).first() if archived is not None else None
+            if order is None:
+                raise
+            return Response(OrderSerializer(order).data)
 
     def get_serializer_class(self):
         if self.action == 'create':
@@ -42,10 +99,21 @@ class OrderViewSet(viewsets.ModelViewSet):
             return OrderUpdateSerializer
         return OrderSerializer
 
+    def perform_create(self, serializer):
+        serializer.save(company=self.request.user.company)
+
     def perform_destroy(self, instance):
         if instance.order_source == 'Shopify':
             raise PermissionDenied("Shopify orders cannot be deleted from this system.")
-        super().perform_destroy(instance)
+        with transaction.atomic():
+            # A cancelled order already gave back its stock and left its customer's stats
+            cancelled = instance.erp_status == 'Cancelled'
+            if not cancelled:
+                return_order_stock([instance])
+            super().perform_destroy(instance)
+            if not cancelled:
+                record_order_deleted(instance)
+        mark_sales_rollup_day(instance.company, timezone.localtime(instance.created_at).date())
 
     # ✨ FIX: Completed the perform_update method with the correct validation logic.
     def perform_update(self, serializer):
@@ -60,8 +128,24 @@ class OrderViewSet(viewsets.ModelViewSet):
                     f"Cannot update {', '.join(forbidden_fields)} for Shopify orders. "
                     "These fields can only be updated in Shopify."
                 )
+        erp_status = serializer.validated_data.get('erp_status')
+        if erp_status and erp_status != instance.erp_status and 'Cancelled' in (erp_status, instance.erp_status):
+            raise DRFValidationError({'erp_status': "Use the cancel action to cancel an order; cancelled orders cannot be reopened."})
+        awb_code = serializer.validated_data.get('awb_code')
+        if awb_code and awb_code != instance.awb_code:
+            # A new AWB entered by hand is tracked from the next poller run
+            serializer.save(tracking_next_check_at=timezone.now(), tracking_checked_at=None)
+            return
         serializer.save()
 
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, uuid=None):
+        """Cancel an order and release the stock it reserved"""
+        order = self.get_object()
+        if not cancel_order(order):
+            return Response({"error": "Order is already cancelled."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(OrderSerializer(order).data)
+
     # ✨ FIX: Re-added the missing update_status action.
     @action(detail=True, methods=['post'])
     def update_status(self, request, uuid=None):
@@ -92,11 +176,85 @@ class OrderViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        if status_type == 'erp_status' and 'Cancelled' in (new_status, order.erp_status):
+            if order.erp_status == 'Cancelled':
+                return Response(
+                    {"error": "Order is already cancelled and cannot be reopened."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            cancel_order(order)
+            return Response(OrderSerializer(order).data)
+
         setattr(order, status_type, new_status)
         order.save()
         
         return Response(OrderSerializer(order).data)
 
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Stream the orders as CSV with one row per line item. Like the list,
+        ?archived=1 exports the archived orders instead. Add ?gzip=1 to compress.
+        """
+        rows = self._iter_order_export_rows(
+            self.filter_queryset(self.get_queryset()).order_by('id').values_list(*ORDER_EXPORT_FIELDS),
+            ArchivedOrderItem if self.lists_archive() else OrderItem,
+        )
+        return stream_csv_response(
+            'orders', ORDER_EXPORT_HEADER + ORDER_ITEM_EXPORT_HEADER, rows, gzip=wants_gzip(request)
+        )
+
+    @staticmethod
+    def _iter_order_export_rows(orders, item_model=OrderItem):
+        """Join each chunk of orders with its items using one query per chunk"""
+        chunk = []
+        for order in orders.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            chunk.append(order)
+            if len(chunk) >= EXPORT_CHUNK_SIZE:
+                yield from OrderViewSet._flatten_order_chunk(chunk, item_model)
+                chunk = []
+        if chunk:
+            yield from OrderViewSet._flatten_order_chunk(chunk, item_model)
+
+    @staticmethod
+    def _flatten_order_chunk(chunk, item_model=OrderItem):
+        items = {}
+        for item in item_model.objects.filter(
+            order_id__in=[order[0] for order in chunk]
+        ).order_by('order_id', 'id').values_list('order_id', *ORDER_ITEM_EXPORT_FIELDS):
+            items.setdefault(item[0], []).append(item[1:])
+        empty_item = ('',) * len(ORDER_ITEM_EXPORT_FIELDS)
+        for order in chunk:
+            for item in items.get(order[0]) or [empty_item]:
+                yield order[1:] + item
+
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser])
+    def import_csv(self, request):
+        """
+        Import manual/offline orders from an uploaded CSV ('file'), one row per line item.
+        Orders whose external_order_id was already imported are skipped.
+        """
+        company = request.user.company
+        if not company:
+            return Response({"error": "No company associated with user"}, status=status.HTTP_400_BAD_REQUEST)
+
+        upload = request.FILES.get('file')
+        if not upload:
+            return Response({"error": "A CSV file is required in the 'file' field."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            result = OrderCSVImporter(company).run(upload)
+        except UnicodeDecodeError:
+            return Response({"error": "The file must be UTF-8 encoded CSV."}, status=status.HTTP_400_BAD_REQUEST)
+        except OrderImportError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        message = (
+            f"Import complete. Added {result['created']} orders, skipped {result['skipped']} already imported, "
+            f"{result['failed']} failed."
+        )
+        return Response({"message": message, **result})
+
     @action(detail=False, methods=['post'])
     def sync_shopify_orders(self, request):
         logger.info("Shopify order sync process started.")
@@ -109,118 +267,165 @@ class OrderViewSet(viewsets.ModelViewSet):
             logger.error(f"Sync failed for company {company.id}: Shopify credentials not configured.")
             return Response({"error": "Shopify credentials not configured. Please connect Shopify first."}, status=status.HTTP_400_BAD_REQUEST)
 
-        try:
-            shopify_client = ShopifyOrdersClient(shop_domain=company.shopify_domain, access_token=company.shopify_access_token)
-            shopify_orders = shopify_client.get_all_orders()
-            logger.info(f"Fetched {len(shopify_orders)} orders from Shopify for company {company.id}.")
-        except Exception as e:
-            logger.error(f"Failed to fetch from Shopify API: {e}", exc_info=True)
-            return Response({"error": f"Could not connect to Shopify: {e}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        shopify_client = ShopifyOrdersClient(shop_domain=company.shopify_domain, access_token=company.shopify_access_token)
+        with SyncRun.record(company, SyncRun.Resource.ORDERS, user=request.user) as run:
+            try:
+                with run.timed('fetch'):
+                    shopify_orders = shopify_client.get_all_orders()
+                logger.info(f"Fetched {len(shopify_orders)} orders from Shopify for company {company.id}.")
+            except Exception as e:
+                logger.error(f"Failed to fetch from Shopify API: {e}", exc_info=True)
+                run.fail(str(e))
+                return Response({"error": f"Could not connect to Shopify: {e}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            finally:
+                run.add_usage(shopify_client.usage)
 
-        synced_count = 0
-        failed_orders = []
+            started = time.monotonic()
+            synced_count = 0
+            failed_orders = []
+            created_orders = []
+            errors = []
 
-        try:
-            with transaction.atomic():
-                for i, order_data in enumerate(shopify_orders):
-                    order_name = order_data.get('name')
-                    logger.info(f"--- Processing order {i+1}/{len(shopify_orders)}: {order_name} ---")
-
-                    if not order_name:
-                        logger.warning("Skipping order with no name/ID.")
-                        continue
-
-                    if Order.objects.filter(company=company, order_id=order_name).exists():
-                        logger.info(f"Order {order_name} already exists. Skipping.")
-                        continue
-
-                    customer_email = order_data.get('email')
-                    if not customer_email:
-                        logger.warning(f"Skipping Shopify order {order_name} due to missing customer email.")
-                        failed_orders.append(order_name)
-                        continue
-                    
-                    shipping_address = order_data.get('shipping_address') or {}
-                    billing_address = order_data.get('billing_address') or {}
-
-                    required_fields = ['address1', 'city', 'province', 'country']
-                    missing_fields = [f for f in required_fields if not shipping_address.get(f)]
-
-                    if missing_fields:
-                        logger.warning(f"Skipping order {order_name} because its shipping address is missing required fields: {', '.join(missing_fields)}.")
-                        failed_orders.append(order_name)
-                        continue
-
-                    try:
-                        customer_defaults = {
-                            'phone': order_data.get('phone', ''),
-                            'first_name': shipping_address.get('firstName', ''),
-                            'last_name': shipping_address.get('lastName', ''),
-                            'city': shipping_address.get('city'),
-                            'state': shipping_address.get('province'),
-                            'country': shipping_address.get('country'),
-                            'addresses': [shipping_address],
-                        }
-                        
-                        customer, created = Customer.objects.update_or_create(
-                            email=customer_email,
-                            company=company,
-                            defaults=customer_defaults
-                        )
-                    except Exception as e:
-                        logger.error(f"CRITICAL: Failed to update or create CUSTOMER '{customer_email}' for order '{order_name}'. Error: {e}", exc_info=True)
-                        raise e
-
-                    try:
-                        new_order = Order(
-                            company=company,
-                            order_id=order_name,
-                            shopify_order_id=order_data.get('id'),
-                            order_source='Shopify',
-                            customer=customer,
-                            customer_email=customer_email,
-                            customer_phone=order_data.get('phone'),
-                            shipping_address=shipping_address,
-                            billing_address=billing_address,
-                            subtotal_price=to_float(order_data.get('subtotal_price')),
-                            tax_amount=to_float(order_data.get('total_tax')),
-                            shipping_charges=to_float(order_data.get('total_shipping_price')),
-                            total_price=to_float(order_data.get('total_price')),
-                            payment_status=order_data.get('financial_status', 'pending').capitalize(),
-                            fulfillment_status=order_data.get('fulfillment_status', 'unfulfilled').capitalize(),
-                            synced_with_shopify=True,
-                            last_synced_at=timezone.now()
-                        )
-                        new_order.save()
-                    except Exception as e:
-                        logger.error(f"CRITICAL: Failed to save new ORDER '{order_name}' to the database. Error: {e}", exc_info=True)
-                        raise e
-
-                    for item in order_data.get('line_items', []):
-                        variant_name = item.get('variant_title') or ''
-                        
-                        OrderItem.objects.create(
-                            order=new_order,
-                            product_name=item.get('title', ''),
-                            variant_name=variant_name,
-                            sku=item.get('sku', ''),
-                            quantity=item.get('quantity', 1),
-                            unit_price=to_float(item.get('price')),
-                            total_price=to_float(item.get('price')) * item.get('quantity', 1)
-                        )
-                    
-                    synced_count += 1
-        
-        except Exception as e:
-            logger.error(f"Transaction failed and was rolled back. The root cause was: {e}", exc_info=True)
-            return Response(
-                {"error": f"The sync failed due to a server error. Please check the server logs for the CRITICAL error message. Error: {e}"},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+            try:
+                with run.timed('write'), transaction.atomic():
+                    for i, order_data in enumerate(shopify_orders):
+                        order_name = order_data.get('name')
+                        logger.info(f"--- Processing order {i+1}/{len(shopify_orders)}: {order_name} ---")
+
+                        if not order_name:
+                            logger.warning("Skipping order with no name/ID.")
+                            continue
+
+                        try:
+                            order, created = upsert_shopify_order(
+                                company, order_data, update_existing=False, take_stock=False
+                            )
+                        except ValueError as e:
+                            logger.warning(f"Skipping Shopify order {order_name}: {e}")
+                            failed_orders.append(order_name)
+                            errors.append(f"{order_name}: {e}")
+                            continue
+
+                        if created:
+                            synced_count += 1
+                            created_orders.append(order)
+
+                    # Stock for the whole batch moves with one SKU lookup and one update per variant batch
+                    take_order_stock(company, created_orders)
+
+            except Exception as e:
+                logger.error(f"Transaction failed and was rolled back. The root cause was: {e}", exc_info=True)
+                run.fail(str(e))
+                return Response(
+                    {"error": f"The sync failed due to a server error. Please check the server logs for the CRITICAL error message. Error: {e}"},
+                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                )
+
+            unchanged = len(shopify_orders) - synced_count - len(failed_orders)
+            run.add_rows(fetched=len(shopify_orders), created=synced_count, unchanged=unchanged,
+                         failed=len(failed_orders), errors=errors)
+            record_sync('orders', time.monotonic() - started, created=synced_count, failed=len(failed_orders),
+                        unchanged=unchanged)
 
         message = f"Sync complete. Added {synced_count} new orders."
         if failed_orders:
             message += f" Skipped {len(failed_orders)} orders due to missing or invalid address data."
         
         logger.info(message)
-        return Response({"message": message})
+        return Response({"message": message, "sync_run": run.id})
+
+
+class SalesAnalyticsViewSet(viewsets.ViewSet):
+    """
+    Sales analytics for the user's company. Reads only the daily rollup
+    tables, which are kept up to date by the refresh_sales_rollups command.
+    All actions accept ?start=YYYY-MM-DD&end=YYYY-MM-DD (default: last 30 days).
+    """
+    permission_classes = [IsAuthenticated]
+    SUM_FIELDS = ('orders_count', 'units', 'subtotal', 'tax', 'shipping', 'revenue')
+    GROUP_BY_FIELDS = ('payment_mode', 'order_source')
+
+    def _get_range(self, request):
+        end = parse_date(request.query_params.get('end', '')) or timezone.localdate()
+        start = parse_date(request.query_params.get('start', '')) or end - timedelta(days=29)
+        if start > end:
+            raise ValueError("'start' must not be after 'end'.")
+        return start, end
+
+    def _get_rollups(self, request, model):
+        company = request.user.company
+        if not company:
+            raise ValueError("No company associated with user")
+        start, end = self._get_range(request)
+        return model.objects.filter(company=company, date__gte=start, date__lte=end), start, end
+
+    def _totals(self, queryset):
+        totals = queryset.aggregate(**{field: Sum(field) for field in self.SUM_FIELDS})
+        totals = {field: value or 0 for field, value in totals.items()}
+        totals['average_order_value'] = (
+            (Decimal(totals['revenue']) / totals['orders_count']).quantize(Decimal('0.01'))
+            if totals['orders_count'] else Decimal('0.00')
+        )
+        return totals
+
+    @action(detail=False, methods=['get'])
+    def summary(self, request):
+        """Totals and average order value, with breakdowns by payment mode and order source"""
+        try:
+            rollups, start, end = self._get_rollups(request, DailySalesRollup)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        data = {'start': start, 'end': end, 'totals': self._totals(rollups)}
+        for field in self.GROUP_BY_FIELDS:
+            data[f'by_{field}'] = list(
+                rollups.values(field).annotate(
+                    orders_count=Sum('orders_count'),
+                    units=Sum('units'),
+                    revenue=Sum('revenue'),
+                ).order_by('-revenue')
+            )
+        return Response(data)
+
+    @action(detail=False, methods=['get'])
+    def daily(self, request):
+        """Per-day totals, optionally split with ?group_by=payment_mode|order_source"""
+        try:
+            rollups, start, end = self._get_rollups(request, DailySalesRollup)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        group_by = request.query_params.get('group_by')
+        if group_by and group_by not in self.GROUP_BY_FIELDS:
+            return Response(
+                {"error": f"Invalid group_by: must be one of {', '.join(self.GROUP_BY_FIELDS)}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        fields = ['date', group_by] if group_by else ['date']
+        days = rollups.values(*fields).annotate(
+            **{field: Sum(field) for field in self.SUM_FIELDS}
+        ).order_by(*fields)
+        return Response({'start': start, 'end': end, 'group_by': group_by, 'days': list(days)})
+
+    @action(detail=False, methods=['get'])
+    def top_skus(self, request):
+        """Best selling SKUs, ranked by ?order_by=revenue|units (default revenue), ?limit=10"""
+        try:
+            rollups, start, end = self._get_rollups(request, DailySkuSalesRollup)
+            limit = max(1, min(int(request.query_params.get('limit', 10)), 100))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        order_by = request.query_params.get('order_by', 'revenue')
+        if order_by not in ('revenue', 'units'):
+            return Response(
+                {"error": "Invalid order_by: must be 'revenue' or 'units'."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        skus = rollups.values('sku').annotate(
+            product_name=Max('product_name'),
+            orders_count=Sum('orders_count'),
+            units=Sum('units'),
+            revenue=Sum('revenue'),
+        ).order_by(f'-{order_by}', 'sku')[:limit]
+        return Response({'start': start, 'end': end, 'skus': list(skus)})
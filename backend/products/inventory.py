@@ -0,0 +1,304 @@
+import logging
+from collections import defaultdict
+from datetime import timedelta
+from typing import Dict, Iterable, List, Tuple
+
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Max, Sum, Value, When
+from django.utils import timezone
+
+from .models import InventoryMovement, InventorySnapshot, LowStockProduct, Product, ProductVariant
+
+logger = logging.getLogger(__name__)
+
+# Variants per UPDATE ... CASE statement and rows per bulk write
+INVENTORY_BATCH_SIZE = 500
+# Movements are kept this long after being folded into a snapshot
+LEDGER_RETAIN_DAYS = 90
+# Statuses derived from variant stock; pre_order and discontinued are set by hand
+COMPUTED_STOCK_STATUSES = ('in_stock', 'low_stock', 'out_of_stock')
+
+
+def resolve_variants(company, skus: Iterable[str]) -> Dict[str, int]:
+    """
+    Map SKUs to variant ids of a company's products with a single IN query.
+
+    SKUs are not unique, so when several variants share one the oldest wins.
+    """
+    skus = {sku for sku in skus if sku}
+    if not skus:
+        return {}
+    variants = {}
+    for variant_id, sku in ProductVariant.objects.filter(
+        product__user__company=company, sku__in=skus
+    ).order_by('-id').values_list('id', 'sku'):
+        variants[sku] = variant_id
+    return variants
+
+
+def record_inventory_movements(movements: List[Tuple[int, int, str, str]]) -> int:
+    """Write (variant_id, quantity, reason, reference) movements to the ledger without touching stock"""
+    rows = [
+        InventoryMovement(variant_id=variant_id, quantity=quantity, reason=reason, reference=reference[:100])
+        for variant_id, quantity, reason, reference in movements if quantity
+    ]
+    InventoryMovement.objects.bulk_create(rows, batch_size=INVENTORY_BATCH_SIZE)
+    return len(rows)
+
+
+def apply_inventory_movements(movements: List[Tuple[int, int, str, str]]) -> int:
+    """
+    Apply (variant_id, quantity, reason, reference) movements atomically.
+
+    Quantities are added with F('inventory_quantity') + delta so concurrent
+    writers never lose an update, with one UPDATE per INVENTORY_BATCH_SIZE
+    variants, and every movement is written to the ledger.
+    Returns the number of ledger rows written.
+    """
+    movements = [movement for movement in movements if movement[1]]
+    if not movements:
+        return 0
+
+    deltas = defaultdict(int)
+    for variant_id, quantity, _, _ in movements:
+        deltas[variant_id] += quantity
+
+    with transaction.atomic():
+        # Sorted so concurrent batches lock variant rows in the same order
+        variant_ids = sorted(variant_id for variant_id, delta in deltas.items() if delta)
+        for start in range(0, len(variant_ids), INVENTORY_BATCH_SIZE):
+            batch = variant_ids[start:start + INVENTORY_BATCH_SIZE]
+            ProductVariant.objects.filter(pk__in=batch).update(
+                inventory_quantity=F('inventory_quantity') + Case(
+                    *[When(pk=variant_id, then=Value(deltas[variant_id])) for variant_id in batch],
+                    default=Value(0),
+                    output_field=IntegerField(),
+                )
+            )
+        record_inventory_movements(movements)
+        product_ids = set(ProductVariant.objects.filter(pk__in=variant_ids).values_list('product_id', flat=True))
+        transaction.on_commit(lambda: recalculate_stock_status_for_products(product_ids))
+    return len(movements)
+
+
+class InsufficientStock(Exception):
+    """Raised when an order asks for more than a 'deny' policy variant has in stock"""
+    def __init__(self, shortages: List[Dict]):
+        self.shortages = shortages
+        super().__init__(', '.join(
+            f"SKU {shortage['sku']}: {shortage['requested']} requested, {shortage['available']} available"
+            for shortage in shortages
+        ))
+
+
+def _lock_and_check_stock(movements: List[Tuple[int, int, str, str]]) -> None:
+    """
+    Lock the variants of movements and raise InsufficientStock if any with a
+    'deny' inventory policy would go below zero.
+
+    Rows are locked in primary key order, so concurrent orders for
+    overlapping SKUs queue up behind each other instead of deadlocking.
+    """
+    requested = defaultdict(int)
+    for variant_id, quantity, _, _ in movements:
+        requested[variant_id] -= quantity
+
+    shortages = []
+    for variant_id, sku, available, policy in ProductVariant.objects.select_for_update().filter(
+        pk__in=sorted(requested)
+    ).order_by('pk').values_list('id', 'sku', 'inventory_quantity', 'inventory_policy'):
+        if policy == 'deny' and requested[variant_id] > 0 and available < requested[variant_id]:
+            shortages.append({'sku': sku, 'requested': requested[variant_id], 'available': max(available, 0)})
+    if shortages:
+        raise InsufficientStock(shortages)
+
+
+def take_order_stock(company, orders, enforce_policy: bool = False) -> int:
+    """
+    Take the stock of newly created orders out of inventory.
+
+    Items are linked to variants by SKU (one lookup for the whole batch) and
+    only items without a variant yet are counted, so an order's stock is
+    never taken twice. Items whose SKU matches no variant are left alone.
+    With enforce_policy the variants are locked first and InsufficientStock
+    is raised instead of overselling a 'deny' variant; the caller's
+    transaction must then be rolled back.
+    Returns the number of items that moved stock.
+    """
+    from orders.models import OrderItem
+
+    references = {order.pk: order.order_id for order in orders}
+    if not references:
+        return 0
+    items = list(OrderItem.objects.filter(
+        order_id__in=list(references), variant__isnull=True, sku__isnull=False
+    ).exclude(sku='').only('id', 'order_id', 'sku', 'quantity'))
+    variants = resolve_variants(company, (item.sku for item in items))
+
+    linked = []
+    movements = []
+    for item in items:
+        variant_id = variants.get(item.sku)
+        if variant_id is None:
+            continue
+        item.variant_id = variant_id
+        linked.append(item)
+        movements.append((variant_id, -item.quantity, 'order', references[item.order_id]))
+
+    with transaction.atomic():
+        if enforce_policy and movements:
+            _lock_and_check_stock(movements)
+        OrderItem.objects.bulk_update(linked, ['variant'], batch_size=INVENTORY_BATCH_SIZE)
+        apply_inventory_movements(movements)
+    return len(linked)
+
+
+def reserve_order_stock(company, order) -> int:
+    """Reserve stock for an order placed in the ERP, denying it if a 'deny' variant would oversell"""
+    return take_order_stock(company, [order], enforce_policy=True)
+
+
+def return_order_stock(orders, reason: str = 'order_cancelled') -> int:
+    """Put the stock taken by orders back into inventory, e.g. before they are deleted"""
+    from orders.models import OrderItem
+
+    references = {order.pk: order.order_id for order in orders}
+    if not references:
+        return 0
+    movements = [
+        (variant_id, quantity, reason, references[order_id])
+        for order_id, variant_id, quantity in OrderItem.objects.filter(
+            order_id__in=list(references), variant__isnull=False
+        ).values_list('order_id', 'variant_id', 'quantity')
+    ]
+    return apply_inventory_movements(movements)
+
+
+def compact_inventory_ledger(retain_days: int = LEDGER_RETAIN_DAYS) -> Dict:
+    """
+    Snapshot the balance of every variant that moved since the last run and
+    drop folded movements older than retain_days.
+
+    A snapshot holds the variant's quantity as of through_movement_id, so
+    stock at any later point is the snapshot plus the movements after it and
+    the ledger never has to be summed from the start. Balances are taken
+    from inventory_quantity, which the movements already updated, minus any
+    movement written after the compaction started.
+    """
+    with transaction.atomic():
+        through = InventoryMovement.objects.aggregate(last=Max('id'))['last']
+        if through is None:
+            return {'snapshots': 0, 'deleted': 0}
+        since = InventorySnapshot.objects.aggregate(last=Max('through_movement_id'))['last'] or 0
+
+        moved = set(InventoryMovement.objects.filter(
+            id__gt=since, id__lte=through
+        ).values_list('variant_id', flat=True).distinct().order_by())
+        later = dict(
+            InventoryMovement.objects.filter(id__gt=through).values('variant_id').annotate(
+                total=Sum('quantity')
+            ).order_by().values_list('variant_id', 'total')
+        )
+        existing = dict(InventorySnapshot.objects.filter(
+            variant_id__in=moved
+        ).values_list('variant_id', 'id'))
+
+        to_create, to_update = [], []
+        moved = sorted(moved)
+        for start in range(0, len(moved), INVENTORY_BATCH_SIZE):
+            for variant_id, quantity in ProductVariant.objects.filter(
+                pk__in=moved[start:start + INVENTORY_BATCH_SIZE]
+            ).values_list('id', 'inventory_quantity'):
+                snapshot = InventorySnapshot(
+                    id=existing.get(variant_id),
+                    variant_id=variant_id,
+                    quantity=quantity - later.get(variant_id, 0),
+                    through_movement_id=through,
+                    updated_at=timezone.now(),
+                )
+                (to_update if variant_id in existing else to_create).append(snapshot)
+
+        InventorySnapshot.objects.bulk_create(to_create, batch_size=INVENTORY_BATCH_SIZE)
+        InventorySnapshot.objects.bulk_update(
+            to_update, ['quantity', 'through_movement_id', 'updated_at'], batch_size=INVENTORY_BATCH_SIZE
+        )
+
+        cutoff = timezone.now() - timedelta(days=retain_days)
+        deleted, _ = InventoryMovement.objects.filter(id__lte=through, created_at__lt=cutoff).delete()
+
+    logger.info(
+        f"Compacted inventory ledger through movement {through}: "
+        f"{len(to_create) + len(to_update)} snapshots, {deleted} movements deleted"
+    )
+    return {'snapshots': len(to_create) + len(to_update), 'deleted': deleted}
+
+
+def _stock_status(quantity: int, company) -> str:
+    if quantity <= company.out_of_stock_threshold:
+        return 'out_of_stock'
+    if quantity <= company.low_stock_threshold:
+        return 'low_stock'
+    return 'in_stock'
+
+
+def recalculate_stock_status(company, product_ids: Iterable[int] = None) -> Dict:
+    """
+    Set stock_status of a company's products from their variants' stock.
+
+    Units are summed per product with one grouped aggregate (backordered
+    variants count as zero) and compared with the company's thresholds.
+    Products without variants and products marked pre_order or discontinued
+    keep their status. Changed statuses are written with one bulk_update and
+    the LowStockProduct report is rewritten for the same products.
+    """
+    products = Product.objects.filter(user__company=company)
+    if product_ids is not None:
+        products = products.filter(pk__in=list(product_ids))
+    rows = products.filter(stock_status__in=COMPUTED_STOCK_STATUSES).annotate(
+        units=Sum(Case(
+            When(variants__inventory_quantity__gt=0, then=F('variants__inventory_quantity')),
+            default=Value(0),
+            output_field=IntegerField(),
+        )),
+        variant_count=Count('variants'),
+    ).filter(variant_count__gt=0).order_by().values_list('id', 'title', 'stock_status', 'units', 'variant_count')
+
+    changed = []
+    report = []
+    for product_id, title, current, units, variant_count in rows:
+        stock_status = _stock_status(units, company)
+        if stock_status != current:
+            changed.append(Product(id=product_id, stock_status=stock_status))
+        if stock_status != 'in_stock':
+            report.append(LowStockProduct(
+                company=company, product_id=product_id, title=title, stock_status=stock_status,
+                inventory_quantity=units, variant_count=variant_count, threshold=company.low_stock_threshold,
+            ))
+
+    with transaction.atomic():
+        Product.objects.bulk_update(changed, ['stock_status'])
+        stale = LowStockProduct.objects.filter(company=company)
+        if product_ids is not None:
+            stale = stale.filter(product_id__in=list(product_ids))
+        stale.delete()
+        LowStockProduct.objects.bulk_create(report, batch_size=INVENTORY_BATCH_SIZE)
+
+    logger.info(
+        f"Recalculated stock status for company {company.id}: {len(changed)} changed, "
+        f"{len(report)} low or out of stock"
+    )
+    return {'changed': len(changed), 'low_stock': len(report)}
+
+
+def recalculate_stock_status_for_products(product_ids: Iterable[int]) -> None:
+    """Recalculate the stock status of products after their stock moved, grouped by company"""
+    from companies.models import Company
+
+    by_company = defaultdict(list)
+    for product_id, company_id in Product.objects.filter(
+        pk__in=list(product_ids)
+    ).values_list('id', 'user__company_id'):
+        if company_id:
+            by_company[company_id].append(product_id)
+    for company in Company.objects.filter(pk__in=list(by_company)):
+        recalculate_stock_status(company, by_company[company.id])
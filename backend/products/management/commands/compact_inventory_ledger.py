@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from products.inventory import LEDGER_RETAIN_DAYS, compact_inventory_ledger
+
+
+class Command(BaseCommand):
+    help = 'Snapshot variant stock balances and delete old inventory movements folded into them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retain-days', type=int, default=LEDGER_RETAIN_DAYS,
+                            help='Keep movements newer than this many days even after compaction')
+
+    def handle(self, *args, **options):
+        result = compact_inventory_ledger(retain_days=options['retain_days'])
+        self.stdout.write(f"Wrote {result['snapshots']} snapshots, deleted {result['deleted']} movements")
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from companies.models import Company
+from products.inventory import recalculate_stock_status
+
+
+class Command(BaseCommand):
+    help = "Recalculate products' stock status from variant stock and rebuild the low stock report"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', help='Only recalculate this company (UUID)')
+
+    def handle(self, *args, **options):
+        companies = Company.objects.filter(is_active=True)
+        if options['company']:
+            companies = companies.filter(id=options['company'])
+            if not companies.exists():
+                raise CommandError(f"Company {options['company']} not found")
+
+        for company in companies:
+            result = recalculate_stock_status(company)
+            self.stdout.write(
+                f"{company.name}: {result['changed']} products changed, {result['low_stock']} low or out of stock"
+            )
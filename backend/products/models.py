@@ -76,6 +76,11 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     published_at = models.DateTimeField(blank=True, null=True)
+    shopify_updated_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        help_text="Shopify's updated_at of the version last synced"
+    )
     published_scope = models.CharField(max_length=50, default='global')
     requires_shipping = models.BooleanField(default=True)
     weight = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
@@ -89,6 +94,23 @@ class Product(models.Model):
         ],
         default='kg'
     )
+    shopify_push_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        null=True,
+        help_text="Hash of the Shopify fields as of the last sync"
+    )
+    shopify_field_hashes = models.JSONField(
+        blank=True,
+        null=True,
+        help_text="Per-field hashes of the Shopify fields as of the last sync"
+    )
+    shopify_payload_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        null=True,
+        help_text="Hash of the Shopify payload this product was last synced from"
+    )
 
     def __str__(self):
         return self.title
@@ -174,6 +196,18 @@ class ProductVariant(models.Model):
         default='kg'
     )
     requires_shipping = models.BooleanField(default=True)
+    shopify_push_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        null=True,
+        help_text="Hash of the Shopify fields as of the last sync"
+    )
+    shopify_payload_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        null=True,
+        help_text="Hash of the Shopify payload this variant was last synced from"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -184,9 +218,73 @@ class ProductVariant(models.Model):
         """Validate the model data"""
         super().clean()
         
-        if self.inventory_quantity < 0:
+        # A 'continue' variant keeps selling when out of stock, so it can be backordered
+        if self.inventory_quantity < 0 and self.inventory_policy != 'continue':
             raise ValidationError({'inventory_quantity': 'Inventory quantity cannot be negative'})
 
     def save(self, *args, **kwargs):
         self.full_clean()
-        super().save(*args, **kwargs) 
\ No newline at end of file
+        super().save(*args, **kwargs) 
+
+class InventoryMovement(models.Model):
+    """One change to a variant's inventory_quantity; quantity is signed (negative = stock out)"""
+    REASON_CHOICES = [
+        ('order', 'Order'),
+        ('order_cancelled', 'Order Cancelled'),
+        ('order_updated', 'Order Updated'),
+        ('shopify_sync', 'Shopify Sync'),
+        ('adjustment', 'Manual Adjustment'),
+    ]
+
+    variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, related_name='inventory_movements')
+    quantity = models.IntegerField(help_text="Change in inventory_quantity")
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES)
+    reference = models.CharField(max_length=100, blank=True, help_text="E.g. the order ID that moved the stock")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['variant', 'id']),
+            models.Index(fields=['created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.variant_id}: {self.quantity:+d} ({self.reason})"
+
+
+class InventorySnapshot(models.Model):
+    """
+    Balance of a variant as of a ledger position, written by compact_inventory_ledger.
+    The snapshot plus movements with a higher id equals the variant's inventory_quantity.
+    """
+    variant = models.OneToOneField(ProductVariant, on_delete=models.CASCADE, related_name='inventory_snapshot')
+    quantity = models.IntegerField()
+    through_movement_id = models.BigIntegerField(help_text="Last InventoryMovement id folded into this balance")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.variant_id}: {self.quantity} through movement {self.through_movement_id}"
+
+
+class LowStockProduct(models.Model):
+    """
+    Precomputed low-stock report row, rewritten by recalculate_stock_status
+    for every product that is low on or out of stock.
+    """
+    company = models.ForeignKey('companies.Company', on_delete=models.CASCADE, related_name='low_stock_products')
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='low_stock_entry')
+    title = models.CharField(max_length=255)
+    stock_status = models.CharField(max_length=20, choices=Product.STOCK_STATUS_CHOICES)
+    inventory_quantity = models.IntegerField(help_text="Units in stock across the product's variants")
+    variant_count = models.PositiveIntegerField()
+    threshold = models.PositiveIntegerField(help_text="Company low stock threshold when computed")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['inventory_quantity', 'title']
+        indexes = [
+            models.Index(fields=['company', 'inventory_quantity']),
+        ]
+
+    def __str__(self):
+        return f"{self.title}: {self.inventory_quantity} ({self.stock_status})"
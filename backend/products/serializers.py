@@ -1,8 +1,8 @@
 from rest_framework import serializers
 from .models import ProductCategory, Vendor, Product, ProductVariant
+from .services import update_product_variants
 import uuid
-import pprint
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 import json
 
 class ProductCategorySerializer(serializers.ModelSerializer):
@@ -68,23 +68,17 @@ class ProductSerializer(serializers.ModelSerializer):
                     tags = [tag.strip() for tag in value.split(',') if tag.strip()]
                     return json.dumps(tags)
                     
-        except Exception as e:
-            print(f"Tag validation error: {str(e)}")
+        except Exception:
             raise serializers.ValidationError('Tags must be a valid JSON array or comma-separated string')
             
         return value
 
     def create(self, validated_data):
-        print('Full validated_data received in ProductSerializer.create:')
-        pprint.pprint(validated_data)
         category_name = validated_data.pop('category_name', None)
         vendor_name = validated_data.pop('vendor_name', None)
         variants_data = validated_data.pop('variants_data', None)
         if variants_data is None:
             variants_data = validated_data.pop('variants', [])
-        print('DEBUG: variants_data type:', type(variants_data))
-        print('DEBUG: variants_data contents:', variants_data)
-        print('DEBUG: ProductVariant count BEFORE:', ProductVariant.objects.count())
         if not category_name:
             raise serializers.ValidationError({'category_name': 'This field is required.'})
         category, _ = ProductCategory.objects.get_or_create(name=category_name)
@@ -95,7 +89,6 @@ class ProductSerializer(serializers.ModelSerializer):
         product = Product.objects.create(**validated_data)
         seen_skus = set()
         for idx, variant_data in enumerate(variants_data):
-            print(f'DEBUG: variant_data #{idx+1}:', variant_data)
             title = variant_data.get('title')
             sku = variant_data.get('sku')
             if not title or not sku:
@@ -111,9 +104,9 @@ class ProductSerializer(serializers.ModelSerializer):
             except IntegrityError as e:
                 product.delete()
                 raise serializers.ValidationError({f'variant_{idx+1}': f"Database integrity error: {str(e)}"})
-        print('DEBUG: ProductVariant count AFTER:', ProductVariant.objects.count())
         return product
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         category_name = validated_data.pop('category_name', None)
         vendor_name = validated_data.pop('vendor_name', None)
@@ -142,22 +135,9 @@ class ProductSerializer(serializers.ModelSerializer):
         except Exception as e:
             raise serializers.ValidationError(str(e))
 
-        variant_errors = []
         if variants_data is not None:
-            instance.variants.all().delete()
-            for idx, variant_data in enumerate(variants_data):
-                try:
-                    print('Updating/creating variant:', variant_data)
-                    ProductVariant.objects.create(product=instance, **variant_data)
-                except Exception as e:
-                    print('Error creating variant:', e)
-                    variant_errors.append(f"Variant #{idx+1}: {str(e)}")
+            _, variant_errors = update_product_variants(instance, variants_data)
             if variant_errors:
+                # Rolls back the product changes too
                 raise serializers.ValidationError({'variants_data': variant_errors})
         return instance
-
-    def to_representation(self, instance):
-        data = super().to_representation(instance)
-        if hasattr(instance, 'variants'):
-            data['variants'] = ProductVariantSerializer(instance.variants.all(), many=True).data
-        return data 
\ No newline at end of file
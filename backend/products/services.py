@@ -0,0 +1,507 @@
+import json
+import logging
+import time
+import uuid
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import ProductCategory, Vendor, ProductVariant, Product
+from .inventory import record_inventory_movements, recalculate_stock_status_for_products
+from companies.utils.shopify_client import PRODUCT_BATCH_SIZE, PUSH_READ_CHUNK_SIZE
+from companies.utils.sync_hash import content_hash, field_hashes
+from core.metrics import record_sync
+
+logger = logging.getLogger(__name__)
+
+# Fields that push_to_shopify actually sends, and therefore the ones whose
+# changes make a product or variant dirty.
+PRODUCT_PUSH_FIELDS = ('title', 'vendor', 'productType', 'tags', 'status', 'handle')
+VARIANT_PUSH_FIELDS = ('id', 'price', 'compareAtPrice', 'sku', 'barcode', 'inventoryPolicy')
+
+
+def build_shopify_variant_data(variant):
+    """Build the Shopify payload for a single variant."""
+    variant_data = {
+        'price': str(variant.price),
+        'compareAtPrice': str(variant.compare_at_price) if variant.compare_at_price else None,
+        'sku': variant.sku,
+        'barcode': variant.barcode,
+        'inventoryQuantity': variant.inventory_quantity,
+        'inventoryPolicy': variant.inventory_policy.upper(),
+        'option1': variant.option1,
+        'option2': variant.option2,
+        'option3': variant.option3,
+    }
+    # Add Shopify variant ID only for existing variants
+    if variant.shopify_variant_id:
+        variant_data['id'] = variant.shopify_variant_id
+    return variant_data
+
+
+def build_shopify_product_data(product, variants=None):
+    """Build the Shopify payload for a product and its variants."""
+    # Parse tags from JSON string to array
+    try:
+        tags = json.loads(product.tags) if product.tags else []
+    except json.JSONDecodeError:
+        tags = []
+
+    if variants is None:
+        variants = product.variants.all()
+
+    return {
+        'title': product.title,
+        'description': product.description,
+        'vendor': product.vendor.name if product.vendor else None,
+        'productType': product.category.name,
+        'tags': tags,
+        'status': product.status,
+        'handle': product.handle,
+        'options': product.options,
+        'variants': [build_shopify_variant_data(variant) for variant in variants],
+        'publishedAt': product.published_at.isoformat() if product.published_at else None,
+    }
+
+
+def save_created_shopify_ids(product, response):
+    """Store the Shopify product and variant IDs returned by productCreate."""
+    if not (response and response.get('product') and 'id' in response['product']):
+        return
+
+    product.shopify_product_id = response['product']['id']
+
+    # Save variant IDs
+    if 'variants' in response['product'] and 'edges' in response['product']['variants']:
+        shopify_variants = {v['node']['sku']: v['node']['id']
+                            for v in response['product']['variants']['edges']}
+
+        # Update local variants with Shopify IDs
+        for variant in product.variants.all():
+            if variant.sku in shopify_variants:
+                variant.shopify_variant_id = shopify_variants[variant.sku]
+                variant.save()
+
+    product.save()
+
+
+def _product_push_fields(product_data):
+    return {key: product_data.get(key) for key in PRODUCT_PUSH_FIELDS}
+
+
+def _variant_push_hash(variant_data):
+    return content_hash({key: variant_data.get(key) for key in VARIANT_PUSH_FIELDS})
+
+
+def build_changed_product_data(product):
+    """Build a Shopify payload holding only what changed since the last sync.
+
+    Product fields are compared against the per-field hashes stored at the
+    last sync and variants against their own row hash. Variants that do not
+    exist in Shopify yet are left out, as productVariantsBulkUpdate cannot
+    create them. Returns None when nothing changed.
+    """
+    variants = list(product.variants.all())
+    product_data = build_shopify_product_data(product, variants)
+
+    stored = product.shopify_field_hashes or {}
+    current = field_hashes(_product_push_fields(product_data))
+    changed = {key: product_data[key] for key in PRODUCT_PUSH_FIELDS if stored.get(key) != current[key]}
+
+    changed_variants = [
+        variant_data
+        for variant, variant_data in zip(variants, product_data['variants'])
+        if 'id' in variant_data and variant.shopify_push_hash != _variant_push_hash(variant_data)
+    ]
+    if changed_variants:
+        changed['variants'] = changed_variants
+
+    return changed or None
+
+
+def mark_products_synced(products):
+    """Record the current Shopify fields of products and their variants as synced, one bulk UPDATE each."""
+    synced_variants = []
+    for product in products:
+        variants = list(product.variants.all())
+        product_data = build_shopify_product_data(product, variants)
+        push_fields = _product_push_fields(product_data)
+        product.shopify_push_hash = content_hash(push_fields)
+        product.shopify_field_hashes = field_hashes(push_fields)
+
+        for variant, variant_data in zip(variants, product_data['variants']):
+            if 'id' in variant_data:
+                variant.shopify_push_hash = _variant_push_hash(variant_data)
+                synced_variants.append(variant)
+    Product.objects.bulk_update(products, ['shopify_push_hash', 'shopify_field_hashes'])
+    ProductVariant.objects.bulk_update(synced_variants, ['shopify_push_hash'])
+
+
+def mark_product_synced(product):
+    """Record the current Shopify fields of a product and its variants as synced."""
+    mark_products_synced([product])
+
+
+def _push_product_batch(client, batch, result):
+    updates = []
+    for product, shopify_data in batch:
+        shopify_id = product.shopify_product_id
+        if not shopify_id.startswith('gid://'):
+            shopify_id = f"gid://shopify/Product/{shopify_id}"
+        updates.append((shopify_id, shopify_data))
+
+    synced = []
+    for (product, _), response in zip(batch, client.bulk_update_products(updates, batch_size=len(batch))):
+        failure = response.get('errors') or response.get('userErrors')
+        if failure:
+            result['errors'].append({'product_id': product.id, 'error': str(failure)})
+        else:
+            synced.append(product)
+    mark_products_synced(synced)
+    result['updated'] += [product.id for product in synced]
+
+
+def push_dirty_products(client, products, batch_size=PRODUCT_BATCH_SIZE):
+    """Push the products whose Shopify fields or variants changed since the last sync.
+
+    The queryset is read ``PUSH_READ_CHUNK_SIZE`` rows at a time. Dirty
+    products already in Shopify are updated ``batch_size`` per batched
+    mutation, with only the changed fields and variants, and the hashes of
+    each pushed batch are written with one bulk UPDATE. Products not yet in
+    Shopify are created one at a time afterwards.
+    Returns the updated and created ids, the number unchanged and errors.
+    """
+    result = {'updated': [], 'created': [], 'unchanged': 0, 'errors': []}
+    batch = []
+    new = []
+    pks = list(products.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(pks), PUSH_READ_CHUNK_SIZE):
+        for product in products.filter(pk__in=pks[start:start + PUSH_READ_CHUNK_SIZE]).order_by('pk'):
+            if not product.shopify_product_id:
+                new.append(product.pk)
+                continue
+            shopify_data = build_changed_product_data(product)
+            if shopify_data is None:
+                result['unchanged'] += 1
+                continue
+            batch.append((product, shopify_data))
+            if len(batch) == batch_size:
+                _push_product_batch(client, batch, result)
+                batch = []
+    if batch:
+        _push_product_batch(client, batch, result)
+
+    for product in products.filter(pk__in=new).order_by('pk'):
+        try:
+            response = client.create_product(build_shopify_product_data(product))
+            if response.get('userErrors'):
+                result['errors'].append({'product_id': product.id, 'error': str(response['userErrors'])})
+                continue
+            save_created_shopify_ids(product, response)
+            mark_product_synced(product)
+            result['created'].append(product.id)
+        except Exception as e:
+            logger.error(f"Error creating product {product.id} in Shopify: {str(e)}")
+            result['errors'].append({'product_id': product.id, 'error': str(e)})
+    return result
+
+
+def _strip_gid(shopify_id, resource):
+    """Turn gid://shopify/<resource>/<id> into the bare numeric ID."""
+    prefix = f'gid://shopify/{resource}/'
+    shopify_id = str(shopify_id)
+    if shopify_id.startswith(prefix):
+        return shopify_id.replace(prefix, '')
+    return shopify_id
+
+
+def upsert_shopify_product(user, data, payload_hash=None, lookups=None, company=None):
+    """Create or update a product and its variants from a Shopify product payload.
+
+    ``data`` has the shape returned by ``ShopifyGraphQLClient.get_all_products``.
+    The product is looked up among the products of ``company`` (by default
+    the user's). Variants whose payload hash matches the stored one are not
+    written. ``lookups`` caches vendors and categories across calls in one
+    sync run. Returns ``(product, created, variant_errors)``.
+    """
+    if company is None:
+        company = user.company
+    if lookups is None:
+        lookups = {'vendors': {}, 'categories': {}}
+    if payload_hash is None:
+        payload_hash = content_hash(data)
+
+    shopify_id = _strip_gid(data['id'], 'Product')
+
+    # Get or create vendor
+    vendor_name = data.get('vendor')
+    vendor = None
+    if vendor_name:
+        vendor = lookups['vendors'].get(vendor_name)
+        if vendor is None:
+            vendor, _ = Vendor.objects.get_or_create(name=vendor_name)
+            lookups['vendors'][vendor_name] = vendor
+
+    # Get or create category
+    category_name = data.get('productType', 'Uncategorized')
+    category = lookups['categories'].get(category_name)
+    if category is None:
+        category, _ = ProductCategory.objects.get_or_create(name=category_name)
+        lookups['categories'][category_name] = category
+
+    # Format tags as JSON string
+    tags = json.dumps(data.get('tags', []))
+
+    # Prepare product data
+    product_data = {
+        'title': data.get('title', ''),
+        'description': data.get('description', ''),
+        'vendor': vendor,
+        'category': category,
+        'tags': tags,
+        'status': data.get('status', 'active').lower(),
+        'handle': data.get('handle'),
+        'options': data.get('options', []),
+        'images': data.get('images', []),
+        'published_at': data.get('publishedAt'),
+        'published_scope': 'global',
+        'requires_shipping': True,
+        'shopify_payload_hash': payload_hash,
+    }
+    if data.get('updatedAt'):
+        product_data['shopify_updated_at'] = parse_datetime(data['updatedAt'])
+
+    # Get existing product or create new one
+    try:
+        product = Product.objects.get(user__company=company, shopify_product_id=shopify_id)
+        for key, value in product_data.items():
+            setattr(product, key, value)
+        product.save()
+        created = False
+        stored_variants = {
+            shopify_variant_id: (variant_hash, quantity)
+            for shopify_variant_id, variant_hash, quantity in product.variants.values_list(
+                'shopify_variant_id', 'shopify_payload_hash', 'inventory_quantity'
+            )
+        }
+    except Product.DoesNotExist:
+        product = Product.objects.create(
+            shopify_product_id=shopify_id,
+            user=user,
+            **product_data
+        )
+        created = True
+        stored_variants = {}
+
+    # Handle variants
+    variant_errors = []
+    existing_variant_ids = set()
+    movements = []
+    for variant_data in data.get('variants', []):
+        try:
+            # Extract Shopify variant ID
+            shopify_variant_id = _strip_gid(variant_data['id'], 'ProductVariant')
+            existing_variant_ids.add(shopify_variant_id)
+
+            variant_hash = content_hash(variant_data)
+            stored_hash, stored_quantity = stored_variants.get(shopify_variant_id, (None, 0))
+            if stored_hash == variant_hash:
+                continue
+
+            # Get selected options
+            selected_options = variant_data.get('selectedOptions', [])
+            option_values = {}
+            for i, opt in enumerate(selected_options, 1):
+                if i <= 3:  # Shopify supports up to 3 options
+                    option_values[f'option{i}'] = opt.get('value')
+
+            variant_defaults = {
+                'title': variant_data.get('title', ''),
+                'sku': variant_data.get('sku', ''),
+                'barcode': variant_data.get('barcode'),
+                'price': variant_data.get('price'),
+                'compare_at_price': variant_data.get('compareAtPrice'),
+                'inventory_quantity': variant_data.get('inventoryQuantity', 0),
+                'inventory_policy': variant_data.get('inventoryPolicy', 'deny').lower(),
+                'inventory_management': 'shopify',
+                'shopify_payload_hash': variant_hash,
+                **option_values
+            }
+
+            # Update or create variant
+            variant, _ = ProductVariant.objects.update_or_create(
+                shopify_variant_id=shopify_variant_id,
+                product=product,
+                defaults=variant_defaults
+            )
+            # Shopify owns the quantity here; record what the sync changed
+            movements.append((
+                variant.id, int(variant.inventory_quantity or 0) - stored_quantity, 'shopify_sync', shopify_id
+            ))
+
+        except Exception as e:
+            variant_errors.append(str(e))
+            logger.error(f"Error syncing variant for product {data['id']}: {str(e)}")
+            continue
+
+    record_inventory_movements(movements)
+
+    # Clean up old variants that no longer exist in Shopify
+    if not created and set(stored_variants) - existing_variant_ids:
+        ProductVariant.objects.filter(
+            product=product
+        ).exclude(
+            shopify_variant_id__in=existing_variant_ids
+        ).delete()
+
+    # The local copy now matches Shopify, so it is not dirty
+    mark_product_synced(product)
+
+    return product, created, variant_errors
+
+
+def sync_shopify_products(user, products_data, company=None):
+    """Upsert a list of Shopify products into ``company`` (by default the user's),
+    skipping the ones that did not change.
+
+    Payload hashes for every incoming product are compared against the stored
+    ones with a single query, and unchanged products are not touched at all.
+    Returns created/updated/unchanged counts and a list of errors.
+    """
+    if company is None:
+        company = user.company
+    started = time.monotonic()
+    stats = {'created': 0, 'updated': 0, 'unchanged': 0, 'error_count': 0, 'errors': []}
+
+    payload_hashes = {
+        _strip_gid(data['id'], 'Product'): content_hash(data)
+        for data in products_data if data.get('id')
+    }
+    stored_hashes = dict(
+        Product.objects.filter(
+            user__company=company, shopify_product_id__in=list(payload_hashes)
+        ).values_list('shopify_product_id', 'shopify_payload_hash')
+    )
+
+    lookups = {'vendors': {}, 'categories': {}}
+    for data in products_data:
+        try:
+            shopify_id = _strip_gid(data['id'], 'Product')
+            payload_hash = payload_hashes[shopify_id]
+            if stored_hashes.get(shopify_id) == payload_hash:
+                stats['unchanged'] += 1
+                continue
+
+            product, created, variant_errors = upsert_shopify_product(user, data, payload_hash, lookups, company)
+            stats['created' if created else 'updated'] += 1
+            for error in variant_errors:
+                stats['error_count'] += 1
+                stats['errors'].append({
+                    'product_id': data['id'],
+                    'error': error
+                })
+
+        except Exception as e:
+            stats['error_count'] += 1
+            stats['errors'].append({
+                'product_id': data.get('id'),
+                'error': str(e)
+            })
+            logger.error(f"Error syncing product {data.get('id')}: {str(e)}")
+            continue
+
+    record_sync(
+        'products', time.monotonic() - started, created=stats['created'], updated=stats['updated'],
+        unchanged=stats['unchanged'], failed=stats['error_count']
+    )
+    return stats
+
+
+# Set by the ERP or by Shopify syncs; variant edits never overwrite them
+VARIANT_READ_ONLY_FIELDS = ('id', 'uuid', 'product', 'created_at', 'updated_at',
+                            'shopify_variant_id', 'shopify_push_hash', 'shopify_payload_hash')
+
+
+def update_product_variants(product, variants_data):
+    """Bring a product's variants in line with an edited list of variants.
+
+    Submitted variants are matched to stored ones by ``id``, then ``uuid``,
+    then ``sku``. Matched variants are written only if a field changed, with
+    one bulk_update; unmatched ones are created with one bulk_create and
+    stored variants missing from the list are removed with one delete.
+    Matched variants keep their uuid and Shopify ids. Quantity changes are
+    recorded in the inventory ledger as adjustments and stock statuses are
+    recalculated on commit. Call inside a transaction.
+    Returns ``(counts, errors)``; nothing is written if there are errors.
+    """
+    editable = {
+        field.name: field for field in ProductVariant._meta.concrete_fields
+        if field.name not in VARIANT_READ_ONLY_FIELDS
+    }
+    stored = list(product.variants.all())
+    by_id = {str(variant.id): variant for variant in stored}
+    by_uuid = {str(variant.uuid): variant for variant in stored}
+    by_sku = {}
+    for variant in stored:
+        if variant.sku:
+            by_sku.setdefault(variant.sku, []).append(variant)
+
+    matched, changed, created, changed_fields, movements, errors = set(), [], [], set(), [], []
+    for idx, variant_data in enumerate(variants_data):
+        unknown = set(variant_data) - set(editable) - set(VARIANT_READ_ONLY_FIELDS)
+        if unknown:
+            errors.append(f"Variant #{idx+1}: unknown fields {', '.join(sorted(unknown))}")
+            continue
+
+        variant = by_id.get(str(variant_data.get('id'))) or by_uuid.get(str(variant_data.get('uuid')))
+        if variant is None or variant.id in matched:
+            variant = next((v for v in by_sku.get(variant_data.get('sku'), []) if v.id not in matched), None)
+        values = {name: value for name, value in variant_data.items() if name in editable}
+
+        if variant is None:
+            variant = ProductVariant(product=product, **values)
+            if not variant.variant_id:
+                variant.variant_id = str(uuid.uuid4())
+        else:
+            matched.add(variant.id)
+            before = {name: getattr(variant, name) for name in values}
+            for name, value in values.items():
+                setattr(variant, name, value)
+
+        try:
+            # Converts submitted strings to field values, as save() would
+            variant.full_clean(exclude=['product'], validate_unique=False)
+        except ValidationError as e:
+            errors.append(f"Variant #{idx+1}: {e}")
+            continue
+
+        if variant.pk is None:
+            created.append(variant)
+            continue
+        fields = [name for name in values if getattr(variant, name) != before[name]]
+        if fields:
+            changed.append(variant)
+            changed_fields.update(fields)
+            if 'inventory_quantity' in fields:
+                movements.append((
+                    variant.id, variant.inventory_quantity - (before['inventory_quantity'] or 0),
+                    'adjustment', str(product.product_id or product.id)
+                ))
+
+    if errors:
+        return {'created': 0, 'updated': 0, 'deleted': 0}, errors
+
+    removed = [variant.id for variant in stored if variant.id not in matched]
+    if removed:
+        ProductVariant.objects.filter(id__in=removed).delete()
+    if changed:
+        now = timezone.now()
+        for variant in changed:
+            variant.updated_at = now
+        ProductVariant.objects.bulk_update(changed, sorted(changed_fields) + ['updated_at'])
+    if created:
+        ProductVariant.objects.bulk_create(created)
+    record_inventory_movements(movements)
+    if movements or created or removed:
+        transaction.on_commit(lambda: recalculate_stock_status_for_products([product.id]))
+    return {'created': len(created), 'updated': len(changed), 'deleted': len(removed)}, []
@@ -1 +1,422 @@
- 
\ No newline at end of file
+import csv
+import io
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from companies.models import Company
+from companies.utils.shopify_client import ShopifyGraphQLClient
+from core.fake_shopify import FakeShopify, api_url, generate_store, start_server
+from . import inventory
+from .inventory import apply_inventory_movements, compact_inventory_ledger, recalculate_stock_status
+from .models import (
+    InventoryMovement, InventorySnapshot, LowStockProduct, Product, ProductCategory, ProductVariant, Vendor,
+)
+from .services import build_changed_product_data, mark_product_synced, push_dirty_products, sync_shopify_products
+
+
+class ProductChangeTrackingTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(email='owner@example.com', password='secret', role='PARENT')
+        user.company = Company.objects.create(name='Acme', owner=user, email='acme@example.com')
+        user.save()
+        self.product = Product.objects.create(
+            user=user, title='Shirt', shopify_product_id='gid://shopify/Product/1',
+            category=ProductCategory.objects.create(name='Shirts'),
+        )
+        self.variants = [
+            ProductVariant.objects.create(product=self.product, title=f'Size {n}', sku=f'SHIRT-{n}',
+                                          price=Decimal('10.00'), shopify_variant_id=f'gid://shopify/ProductVariant/{n}')
+            for n in range(3)
+        ]
+        mark_product_synced(self.product)
+
+    def changed(self):
+        return build_changed_product_data(Product.objects.get(pk=self.product.pk))
+
+    def test_synced_product_has_no_changes(self):
+        self.assertIsNone(self.changed())
+
+    def test_only_changed_fields_and_variants_are_built(self):
+        Product.objects.filter(pk=self.product.pk).update(title='Tee')
+        ProductVariant.objects.filter(pk=self.variants[1].pk).update(price=Decimal('12.00'))
+
+        changed = self.changed()
+        self.assertEqual(set(changed), {'title', 'variants'})
+        self.assertEqual(changed['title'], 'Tee')
+        self.assertEqual([(v['id'], v['price']) for v in changed['variants']],
+                         [('gid://shopify/ProductVariant/1', '12.00')])
+
+    def test_variants_missing_from_shopify_are_left_out(self):
+        ProductVariant.objects.create(product=self.product, title='New', sku='SHIRT-NEW', price=Decimal('9.00'))
+        self.assertIsNone(self.changed())
+
+
+class ShopifyProductSyncTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='owner@example.com', password='secret', role='PARENT')
+        self.user.company = Company.objects.create(name='Acme', owner=self.user, email='acme@example.com')
+        self.user.save()
+        self.payloads = [
+            {
+                'id': f'gid://shopify/Product/{n}', 'title': f'Product {n}', 'productType': 'Shirts',
+                'vendor': 'Acme', 'status': 'ACTIVE', 'handle': f'product-{n}', 'tags': [],
+                'variants': [
+                    {'id': f'gid://shopify/ProductVariant/{n}{v}', 'title': f'Size {v}', 'sku': f'P{n}-{v}',
+                     'price': '10.00', 'inventoryQuantity': 5, 'inventoryPolicy': 'DENY'}
+                    for v in range(2)
+                ],
+            }
+            for n in range(1, 4)
+        ]
+
+    def product_writes(self, queries):
+        return [
+            query['sql'] for query in queries
+            if not query['sql'].startswith('SELECT') and ('"products_product"' in query['sql']
+                                                         or '"products_productvariant"' in query['sql'])
+        ]
+
+    def test_unchanged_resync_writes_nothing(self):
+        stats = sync_shopify_products(self.user, self.payloads)
+        self.assertEqual((stats['created'], stats['errors']), (3, []))
+        self.assertEqual(ProductVariant.objects.count(), 6)
+
+        with CaptureQueriesContext(connection) as queries:
+            stats = sync_shopify_products(self.user, self.payloads)
+        self.assertEqual((stats['updated'], stats['unchanged']), (0, 3))
+        self.assertEqual(self.product_writes(queries), [])
+
+    def test_only_changed_variants_are_written(self):
+        sync_shopify_products(self.user, self.payloads)
+        self.payloads[0]['variants'][1]['price'] = '11.00'
+
+        with CaptureQueriesContext(connection) as queries:
+            stats = sync_shopify_products(self.user, self.payloads)
+        self.assertEqual((stats['updated'], stats['unchanged']), (1, 2))
+        variant_writes = [sql for sql in self.product_writes(queries) if '"products_productvariant"' in sql
+                          and not sql.startswith('UPDATE "products_productvariant" SET "shopify_push_hash"')]
+        self.assertEqual(len(variant_writes), 1, variant_writes)
+        self.assertEqual(ProductVariant.objects.get(shopify_variant_id='11').price, Decimal('11.00'))
+
+
+class ProductCSVExportTests(TestCase):
+    def test_export_lists_only_the_users_products(self):
+        category = ProductCategory.objects.create(name='Widgets')
+        users = []
+        for name in ('acme', 'other'):
+            user = User.objects.create_user(email=f'{name}@example.com', password='secret', role='PARENT')
+            user.company = Company.objects.create(name=name, owner=user, email=f'{name}-co@example.com')
+            user.save()
+            Product.objects.create(user=user, title=f'{name} widget', category=category)
+            users.append(user)
+
+        client = APIClient()
+        client.force_authenticate(users[0])
+        response = client.get('/api/products/export/')
+        self.assertEqual(response.status_code, 200)
+        body = b''.join(response.streaming_content).decode('utf-8')
+        self.assertEqual([row['title'] for row in csv.DictReader(io.StringIO(body))], ['acme widget'])
+
+
+class InventoryLedgerTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(email='owner@example.com', password='secret', role='PARENT')
+        product = Product.objects.create(user=user, title='Mug', category=ProductCategory.objects.create(name='Mugs'))
+        self.a, self.b, self.c = (
+            ProductVariant.objects.create(product=product, title=sku, sku=sku, inventory_quantity=10)
+            for sku in ('MUG-A', 'MUG-B', 'MUG-C')
+        )
+
+    def stock(self):
+        return dict(ProductVariant.objects.values_list('sku', 'inventory_quantity'))
+
+    def test_movements_are_applied_in_batched_updates(self):
+        movements = [
+            (self.a.id, -3, 'order', '#1'), (self.b.id, 5, 'adjustment', ''),
+            (self.c.id, -1, 'order', '#1'), (self.a.id, -2, 'order', '#2'), (self.b.id, 0, 'order', '#2'),
+        ]
+        with mock.patch.object(inventory, 'INVENTORY_BATCH_SIZE', 2), CaptureQueriesContext(connection) as queries:
+            self.assertEqual(apply_inventory_movements(movements), 4)
+        updates = [query for query in queries if query['sql'].startswith('UPDATE "products_productvariant"')]
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(self.stock(), {'MUG-A': 5, 'MUG-B': 15, 'MUG-C': 9})
+        self.assertEqual(list(InventoryMovement.objects.order_by('id').values_list('variant__sku', 'quantity')),
+                         [('MUG-A', -3), ('MUG-B', 5), ('MUG-C', -1), ('MUG-A', -2)])
+
+    def test_compaction_snapshots_balances_and_prunes_old_movements(self):
+        apply_inventory_movements([(self.a.id, -3, 'order', '#1'), (self.b.id, 5, 'adjustment', '')])
+        InventoryMovement.objects.update(created_at=timezone.now() - timedelta(days=100))
+        apply_inventory_movements([(self.a.id, -1, 'order', '#2')])
+
+        self.assertEqual(compact_inventory_ledger(), {'snapshots': 2, 'deleted': 2})
+        self.assertEqual(dict(InventorySnapshot.objects.values_list('variant__sku', 'quantity')),
+                         {'MUG-A': 6, 'MUG-B': 15})
+        self.assertEqual(InventoryMovement.objects.count(), 1)
+
+        # Only variants that moved since the last run get a new snapshot
+        apply_inventory_movements([(self.c.id, -2, 'order', '#3')])
+        self.assertEqual(compact_inventory_ledger(), {'snapshots': 1, 'deleted': 0})
+        apply_inventory_movements([(self.a.id, 4, 'order_cancelled', '#2')])
+        for snapshot in InventorySnapshot.objects.select_related('variant'):
+            later = InventoryMovement.objects.filter(variant=snapshot.variant, id__gt=snapshot.through_movement_id)
+            self.assertEqual(snapshot.quantity + sum(later.values_list('quantity', flat=True)),
+                             snapshot.variant.inventory_quantity)
+
+
+class StockStatusTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='owner@example.com', password='secret', role='PARENT')
+        self.company = Company.objects.create(name='Acme', owner=self.user, email='acme@example.com',
+                                              low_stock_threshold=5)
+        self.user.company = self.company
+        self.user.save()
+        category = ProductCategory.objects.create(name='Mugs')
+        self.variants = {}
+        for title, quantities, fields in [
+            ('Plenty', [4, 3], {}),
+            ('Backordered', [5, -2], {}),
+            ('Sold out', [0], {}),
+            ('Coming soon', [0], {'stock_status': 'pre_order'}),
+            ('No variants', [], {}),
+        ]:
+            product = Product.objects.create(user=self.user, title=title, category=category, **fields)
+            for n, quantity in enumerate(quantities):
+                self.variants[f'{title} {n}'] = ProductVariant.objects.create(
+                    product=product, title=f'V{n}', sku=f'{title}-{n}', inventory_quantity=quantity,
+                    inventory_policy='continue' if quantity < 0 else 'deny',
+                )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def statuses(self):
+        return dict(Product.objects.values_list('title', 'stock_status'))
+
+    def report(self, **params):
+        response = self.client.get('/api/products/low_stock/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [(row['title'], row['inventory_quantity']) for row in response.json()['data']['products']]
+
+    def test_status_follows_variant_stock_and_thresholds(self):
+        self.assertEqual(recalculate_stock_status(self.company), {'changed': 2, 'low_stock': 2})
+        self.assertEqual(self.statuses(), {
+            'Plenty': 'in_stock', 'Backordered': 'low_stock', 'Sold out': 'out_of_stock',
+            'Coming soon': 'pre_order', 'No variants': 'in_stock',
+        })
+        self.assertEqual(self.report(), [('Sold out', 0), ('Backordered', 5)])
+        self.assertEqual(self.report(stock_status='out_of_stock'), [('Sold out', 0)])
+
+    def test_stock_movements_update_the_status(self):
+        recalculate_stock_status(self.company)
+        with self.captureOnCommitCallbacks(execute=True):
+            apply_inventory_movements([
+                (self.variants['Plenty 0'].id, -3, 'order', '#1'),
+                (self.variants['Sold out 0'].id, 9, 'adjustment', ''),
+            ])
+        self.assertEqual((self.statuses()['Plenty'], self.statuses()['Sold out']), ('low_stock', 'in_stock'))
+        self.assertEqual(list(LowStockProduct.objects.order_by('title').values_list('title', 'inventory_quantity')),
+                         [('Backordered', 5), ('Plenty', 4)])
+
+
+class ProductVariantUpdateTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='owner@example.com', password='secret', role='PARENT')
+        company = Company.objects.create(name='Acme', owner=self.user, email='acme@example.com')
+        self.user.company = company
+        self.user.save()
+        self.product = Product.objects.create(
+            user=self.user, title='Shirt', product_id='SHIRT', category=ProductCategory.objects.create(name='Shirts')
+        )
+        ProductVariant.objects.bulk_create([
+            ProductVariant(product=self.product, title=f'Size {n}', sku=f'SHIRT-{n}', price=Decimal('10.00'),
+                           inventory_quantity=5, shopify_variant_id=f'4000{n}')
+            for n in range(100)
+        ])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def variants(self):
+        return self.client.get(f'/api/products/{self.product.id}/').json()['variants']
+
+    def test_editing_one_variant_writes_one_row(self):
+        variants = self.variants()
+        before = {variant['sku']: variant['uuid'] for variant in variants}
+        variants[7]['price'] = '12.50'
+        variants[7]['inventory_quantity'] = 8
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(f'/api/products/{self.product.id}/', {'variants_data': variants},
+                                         format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        variant_writes = [
+            query['sql'] for query in queries
+            if 'productvariant' in query['sql'].split(' WHERE ')[0] and not query['sql'].startswith('SELECT')
+        ]
+        self.assertEqual(len(variant_writes), 1, variant_writes)
+        self.assertTrue(variant_writes[0].startswith('UPDATE'))
+
+        edited = ProductVariant.objects.get(sku='SHIRT-7')
+        self.assertEqual((edited.price, edited.inventory_quantity), (Decimal('12.50'), 8))
+        self.assertEqual(edited.shopify_variant_id, '40007')
+        self.assertEqual({sku: str(value) for sku, value in ProductVariant.objects.values_list('sku', 'uuid')},
+                         before)
+        self.assertEqual(list(InventoryMovement.objects.values_list('variant__sku', 'quantity', 'reason')),
+                         [('SHIRT-7', 3, 'adjustment')])
+
+    def test_variants_are_matched_created_and_removed(self):
+        variants = [
+            {'sku': 'SHIRT-1', 'title': 'Small'},       # matched by SKU
+            {'sku': 'SHIRT-NEW', 'title': 'Huge', 'price': '15.00'},
+        ]
+        response = self.client.patch(f'/api/products/{self.product.id}/', {'variants_data': variants}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(
+            sorted(ProductVariant.objects.values_list('sku', 'title', 'shopify_variant_id')),
+            [('SHIRT-1', 'Small', '40001'), ('SHIRT-NEW', 'Huge', None)],
+        )
+
+    def test_invalid_variant_changes_nothing(self):
+        variants = self.variants()
+        variants[0]['title'] = 'Renamed'
+        variants[1]['inventory_quantity'] = -1
+        response = self.client.patch(f'/api/products/{self.product.id}/',
+                                     {'title': 'Renamed', 'variants_data': variants}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Product.objects.get().title, 'Shirt')
+        self.assertEqual(ProductVariant.objects.get(sku='SHIRT-0').title, 'Size 0')
+
+    def test_backordered_variant_can_be_edited(self):
+        ProductVariant.objects.filter(sku='SHIRT-3').update(inventory_policy='continue', inventory_quantity=-4)
+        variants = self.variants()
+        variants[3]['price'] = '11.00'
+        response = self.client.patch(f'/api/products/{self.product.id}/', {'variants_data': variants}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        backordered = ProductVariant.objects.get(sku='SHIRT-3')
+        self.assertEqual((backordered.price, backordered.inventory_quantity), (Decimal('11.00'), -4))
+
+
+class ProductListTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='owner@example.com', password='secret', role='PARENT')
+        company = Company.objects.create(name='Acme', owner=self.user, email='acme@example.com')
+        self.user.company = company
+        self.user.save()
+        self.shirts = ProductCategory.objects.create(name='Shirts')
+        self.mugs = ProductCategory.objects.create(name='Mugs')
+        self.vendor = Vendor.objects.create(name='Weaver')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_products(self, count, **fields):
+        start = Product.objects.count()
+        for n in range(start, start + count):
+            product = Product.objects.create(
+                user=self.user, title=f'Product {n}', product_id=f'P{n}',
+                **{'category': self.shirts, 'vendor': self.vendor, **fields}
+            )
+            ProductVariant.objects.bulk_create([
+                ProductVariant(product=product, title=f'Size {v}', sku=f'P{n}-{v}') for v in range(3)
+            ])
+
+    def test_list_queries_do_not_grow_with_products(self):
+        self.add_products(2)
+        with self.assertNumQueries(3):  # company, products with category and vendor, variants
+            self.assertEqual(len(self.client.get('/api/products/').json()), 2)
+
+        self.add_products(30)
+        with self.assertNumQueries(3):
+            products = self.client.get('/api/products/').json()
+        self.assertEqual(len(products), 32)
+        self.assertEqual(products[0]['category']['name'], 'Shirts')
+        self.assertEqual(products[0]['vendor']['name'], 'Weaver')
+        self.assertEqual(len(products[0]['variants']), 3)
+
+        with self.assertNumQueries(4):  # and the count
+            page = self.client.get('/api/products/', {'page': 2, 'page_size': 10}).json()
+        self.assertEqual(page['count'], 32)
+        self.assertEqual([product['title'] for product in page['results']],
+                         [f'Product {n}' for n in range(10, 20)])
+
+    def test_filters(self):
+        self.add_products(2)
+        self.add_products(1, category=self.mugs, status='draft', stock_status='low_stock', vendor=None)
+
+        def titles(**params):
+            return [product['title'] for product in self.client.get('/api/products/', params).json()]
+
+        self.assertEqual(titles(status='draft'), ['Product 2'])
+        self.assertEqual(titles(stock_status='in_stock'), ['Product 0', 'Product 1'])
+        self.assertEqual(titles(category=self.mugs.id), ['Product 2'])
+        self.assertEqual(titles(vendor=self.vendor.id, status='active'), ['Product 0', 'Product 1'])
+        self.assertEqual(self.client.get('/api/products/', {'stock_status': 'gone'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/products/', {'vendor': 'weaver'}).status_code, 400)
+
+
+class ProductShopifyPushTests(TestCase):
+    def setUp(self):
+        self.fake = FakeShopify(generate_store(customers=0, products=5, orders=0, variants_per_product=2))
+        server = start_server(self.fake)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.settings = override_settings(SHOPIFY_API_URL=api_url(server))
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+
+        user = User.objects.create_user(email='push@example.com', password='secret', role='PARENT')
+        company = Company.objects.create(name='Pusher', owner=user, email='pusher@example.com',
+                                         shopify_domain='pusher.myshopify.com', shopify_access_token='token')
+        user.company = company
+        user.save()
+        self.api = APIClient()
+        self.api.force_authenticate(user)
+        response = self.api.post('/api/products/sync_shopify/', format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.requests = self.fake.stats['requests']
+
+    def requests_sent(self):
+        return self.fake.stats['requests'] - self.requests
+
+    def test_sync_only_matches_the_companys_products(self):
+        owner = User.objects.create_user(email='other@example.com', password='secret', role='PARENT')
+        other = Company.objects.create(name='Other', owner=owner, email='other-co@example.com')
+        owner.company = other
+        owner.save()
+        Product.objects.filter(shopify_product_id='1').delete()
+        Product.objects.create(user=owner, title='Theirs', shopify_product_id='1',
+                               category=ProductCategory.objects.create(name='Other'))
+
+        response = self.api.post('/api/products/sync_shopify/', format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        theirs = Product.objects.get(shopify_product_id='1')
+        self.assertEqual((theirs.user, theirs.title), (owner, 'Theirs'))
+        self.assertFalse(theirs.variants.exists())
+
+    def test_bulk_push_skips_unchanged_products(self):
+        response = self.api.post('/api/products/bulk-push-to-shopify/', format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['data']['unchanged'], 5)
+        self.assertEqual(self.requests_sent(), 0)
+
+        dirty = list(Product.objects.order_by('pk').values_list('pk', flat=True)[1:3])
+        Product.objects.filter(pk__in=dirty).update(title='Renamed')
+        data = self.api.post('/api/products/bulk-push-to-shopify/', format='json').json()['data']
+        self.assertEqual((data['updated'], data['created'], data['unchanged'], data['errors']), (dirty, [], 3, []))
+        self.assertEqual(self.requests_sent(), 1)
+
+    def test_bulk_push_sends_and_marks_batches(self):
+        Product.objects.update(title='Renamed')
+        client = ShopifyGraphQLClient('pusher.myshopify.com', 'token')
+        with CaptureQueriesContext(connection) as queries:
+            result = push_dirty_products(client, Product.objects.all(), batch_size=2)
+        self.assertEqual((len(result['updated']), result['errors']), (5, []))
+        self.assertEqual(self.requests_sent(), 3)
+        hash_writes = [query for query in queries if query['sql'].startswith('UPDATE "products_product"')]
+        self.assertEqual(len(hash_writes), 3)
+        self.assertFalse([product for product in Product.objects.all() if build_changed_product_data(product)])
@@ -1,16 +1,38 @@
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError as DRFValidationError
 from django.core.exceptions import ValidationError
-from .models import ProductCategory, Vendor, Product, ProductVariant
+from .models import ProductCategory, Vendor, Product, ProductVariant, LowStockProduct
 from .serializers import ProductCategorySerializer, VendorSerializer, ProductSerializer, ProductVariantSerializer
 from companies.utils.shopify_client import ShopifyGraphQLClient
-from companies.models import Company
+from companies.models import Company, SyncRun
+from core.exports import EXPORT_CHUNK_SIZE, stream_csv_response, wants_gzip
+from core.pagination import OptInPageNumberPagination
+from .services import (
+    build_shopify_product_data,
+    build_changed_product_data,
+    save_created_shopify_ids,
+    mark_product_synced,
+    push_dirty_products,
+    sync_shopify_products,
+)
+from .inventory import recalculate_stock_status
 import logging
 import json
 
 logger = logging.getLogger(__name__)
 
+PRODUCT_EXPORT_FIELDS = (
+    'id', 'product_id', 'shopify_product_id', 'title', 'handle', 'category__name', 'vendor__name',
+    'status', 'stock_status', 'price', 'compare_at_price', 'tax_rate', 'tags', 'created_at', 'updated_at',
+)
+PRODUCT_EXPORT_HEADER = [
+    'id', 'product_id', 'shopify_product_id', 'title', 'handle', 'category', 'vendor',
+    'status', 'stock_status', 'price', 'compare_at_price', 'tax_rate', 'tags', 'created_at', 'updated_at',
+]
+
+
 class ProductCategoryViewSet(viewsets.ModelViewSet):
     queryset = ProductCategory.objects.all()
     serializer_class = ProductCategorySerializer
@@ -22,8 +44,19 @@ class VendorViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
 class ProductViewSet(viewsets.ModelViewSet):
+    """
+    Products of the user's company. The list can be filtered with ?status=,
+    ?stock_status=, ?category=<id> and ?vendor=<id>, and is paged when
+    ?page= or ?page_size= is given.
+    """
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = OptInPageNumberPagination
+    CHOICE_FILTERS = {
+        'status': Product._meta.get_field('status').choices,
+        'stock_status': Product.STOCK_STATUS_CHOICES,
+    }
+    ID_FILTERS = ('category', 'vendor')
 
     def get_queryset(self):
         """Filter products by user's company"""
@@ -32,12 +65,81 @@ class ProductViewSet(viewsets.ModelViewSet):
             company = Company.objects.get(owner=user)
         else:
             company = user.company
-        return Product.objects.filter(user__company=company)
+        products = Product.objects.filter(user__company=company)
+        if self.action == 'export':
+            return products
+        # Everything ProductSerializer reads, so a page of products is three queries
+        return products.select_related('category', 'vendor').prefetch_related('variants').order_by('id')
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        for name, choices in self.CHOICE_FILTERS.items():
+            value = self.request.query_params.get(name)
+            if value:
+                values = [choice for choice, _ in choices]
+                if value not in values:
+                    raise DRFValidationError({name: f"Invalid {name}. Must be one of: {', '.join(values)}"})
+                queryset = queryset.filter(**{name: value})
+        for name in self.ID_FILTERS:
+            value = self.request.query_params.get(name)
+            if value:
+                if not value.isdigit():
+                    raise DRFValidationError({name: f"Invalid {name}. Must be a {name} id"})
+                queryset = queryset.filter(**{f'{name}_id': int(value)})
+        return queryset
 
     def perform_create(self, serializer):
         # Automatically set the user to the current user
         serializer.save(user=self.request.user)
 
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream the products as CSV. Accepts the list filters; add ?gzip=1 to compress."""
+        products = self.filter_queryset(self.get_queryset()).order_by('id').values_list(*PRODUCT_EXPORT_FIELDS)
+        return stream_csv_response(
+            'products', PRODUCT_EXPORT_HEADER,
+            products.iterator(chunk_size=EXPORT_CHUNK_SIZE), gzip=wants_gzip(request)
+        )
+
+    @action(detail=False, methods=['get'])
+    def low_stock(self, request):
+        """Products low on or out of stock, from the report kept by the stock status recalculation.
+        Add ?stock_status=out_of_stock to only list products that are out of stock."""
+        try:
+            user = request.user
+            if user.is_parent:
+                company = Company.objects.get(owner=user)
+            else:
+                company = user.company
+
+            report = LowStockProduct.objects.filter(company=company)
+            stock_status = request.query_params.get('stock_status')
+            if stock_status:
+                if stock_status not in ('low_stock', 'out_of_stock'):
+                    return Response({
+                        'success': False,
+                        'error': "stock_status must be 'low_stock' or 'out_of_stock'"
+                    }, status=status.HTTP_400_BAD_REQUEST)
+                report = report.filter(stock_status=stock_status)
+
+            return Response({
+                'success': True,
+                'data': {
+                    'low_stock_threshold': company.low_stock_threshold,
+                    'out_of_stock_threshold': company.out_of_stock_threshold,
+                    'products': list(report.values(
+                        'product_id', 'title', 'stock_status', 'inventory_quantity',
+                        'variant_count', 'threshold', 'updated_at'
+                    )),
+                }
+            })
+        except Exception as e:
+            logger.exception("Error loading low stock report")
+            return Response({
+                'success': False,
+                'error': f'Error loading low stock report: {str(e)}'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
     @action(detail=True, methods=['post'])
     def push_to_shopify(self, request, pk=None):
         """Push product changes to Shopify"""
@@ -63,44 +165,20 @@ class ProductViewSet(viewsets.ModelViewSet):
             client = ShopifyGraphQLClient(company.shopify_domain, company.shopify_access_token)
             
             try:
-                # Parse tags from JSON string to array
-                try:
-                    tags = json.loads(product.tags) if product.tags else []
-                except json.JSONDecodeError:
-                    tags = []
-
-                # Prepare variants data
-                variants = []
-                for variant in product.variants.all():
-                    variant_data = {
-                        'price': str(variant.price),
-                        'compareAtPrice': str(variant.compare_at_price) if variant.compare_at_price else None,
-                        'sku': variant.sku,
-                        'barcode': variant.barcode,
-                        'inventoryQuantity': variant.inventory_quantity,
-                        'inventoryPolicy': variant.inventory_policy.upper(),
-                        'option1': variant.option1,
-                        'option2': variant.option2,
-                        'option3': variant.option3,
-                    }
-                    # Add Shopify variant ID only for existing variants
-                    if variant.shopify_variant_id:
-                        variant_data['id'] = variant.shopify_variant_id
-                    variants.append(variant_data)
-
-                # Prepare product data for Shopify
-                shopify_data = {
-                    'title': product.title,
-                    'description': product.description,
-                    'vendor': product.vendor.name if product.vendor else None,
-                    'productType': product.category.name,
-                    'tags': tags,
-                    'status': product.status,
-                    'handle': product.handle,
-                    'options': product.options,
-                    'variants': variants,
-                    'publishedAt': product.published_at.isoformat() if product.published_at else None,
-                }
+                # Only send what changed since the last sync unless forced
+                if product.shopify_product_id and not request.data.get('force'):
+                    shopify_data = build_changed_product_data(product)
+                    if shopify_data is None:
+                        return Response({
+                            'success': True,
+                            'message': 'Product has no changes since the last Shopify sync',
+                            'data': {
+                                'product': self.get_serializer(product).data,
+                                'skipped': True
+                            }
+                        })
+                else:
+                    shopify_data = build_shopify_product_data(product)
 
                 logger.info(f"Prepared Shopify data: {shopify_data}")
             except Exception as e:
@@ -126,23 +204,7 @@ class ProductViewSet(viewsets.ModelViewSet):
                     # Create new product in Shopify
                     logger.info("Creating new product in Shopify")
                     response = client.create_product(shopify_data)
-                    
-                    # Extract and save the new Shopify product ID
-                    if response and 'product' in response and 'id' in response['product']:
-                        product.shopify_product_id = response['product']['id']
-                        
-                        # Save variant IDs
-                        if 'variants' in response['product'] and 'edges' in response['product']['variants']:
-                            shopify_variants = {v['node']['sku']: v['node']['id'] 
-                                             for v in response['product']['variants']['edges']}
-                            
-                            # Update local variants with Shopify IDs
-                            for variant in product.variants.all():
-                                if variant.sku in shopify_variants:
-                                    variant.shopify_variant_id = shopify_variants[variant.sku]
-                                    variant.save()
-                        
-                        product.save()
+                    save_created_shopify_ids(product, response)
                     operation = 'created'
 
                 logger.info(f"Shopify API response: {response}")
@@ -163,6 +225,8 @@ class ProductViewSet(viewsets.ModelViewSet):
                         'error': str(user_errors)
                     }, status=status.HTTP_400_BAD_REQUEST)
 
+                mark_product_synced(product)
+
                 return Response({
                     'success': True,
                     'message': f'Product {operation} in Shopify successfully',
@@ -191,6 +255,49 @@ class ProductViewSet(viewsets.ModelViewSet):
                 'error': f'Error pushing to Shopify: {str(e)}'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @action(detail=False, methods=['post'], url_path='bulk-push-to-shopify')
+    def bulk_push_to_shopify(self, request):
+        """Push all dirty products to Shopify in one job using batched mutations.
+
+        Accepts an optional ``ids`` list to limit the candidates. Only products
+        whose Shopify fields changed since the last sync are pushed, and only
+        the changed fields and variants are sent. Existing Shopify products are
+        updated in batches, products not yet in Shopify are created one at a time.
+        """
+        try:
+            user = request.user
+            if user.is_parent:
+                company = Company.objects.get(owner=user)
+            else:
+                company = user.company
+
+            if not (company.shopify_domain and company.shopify_access_token):
+                return Response({
+                    'success': False,
+                    'error': 'Shopify credentials not configured'
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+            products = self.get_queryset()
+            ids = request.data.get('ids')
+            if ids:
+                products = products.filter(pk__in=ids)
+
+            client = ShopifyGraphQLClient(company.shopify_domain, company.shopify_access_token)
+            result = push_dirty_products(client, products)
+
+            return Response({
+                'success': not result['errors'],
+                'message': f"Bulk push completed: {len(result['updated'])} products updated, {len(result['created'])} created, {result['unchanged']} unchanged, {len(result['errors'])} errors",
+                'data': result
+            })
+
+        except Exception as e:
+            logger.exception("Error bulk pushing products to Shopify")
+            return Response({
+                'success': False,
+                'error': f'Error pushing to Shopify: {str(e)}'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
     @action(detail=False, methods=['post'])
     def sync_shopify(self, request):
         """Pull products from Shopify and save to local database"""
@@ -214,142 +321,41 @@ class ProductViewSet(viewsets.ModelViewSet):
                 }, status=status.HTTP_400_BAD_REQUEST)
 
             client = ShopifyGraphQLClient(company.shopify_domain, company.shopify_access_token)
-            
-            try:
-                products_data = client.get_all_products()
-            except Exception as e:
-                logger.exception("Shopify sync failed")
-                return Response({
-                    'success': False,
-                    'error': f"Shopify sync failed: {str(e)}"
-                }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-            created_count = 0
-            updated_count = 0
-            error_count = 0
-            errors = []
 
-            for data in products_data:
+            with SyncRun.record(company, SyncRun.Resource.PRODUCTS, user=user) as run:
                 try:
-                    # Extract Shopify ID from GraphQL ID
-                    shopify_id = data['id']
-                    if shopify_id.startswith('gid://shopify/Product/'):
-                        shopify_id = shopify_id.replace('gid://shopify/Product/', '')
-
-                    # Get or create vendor
-                    vendor_name = data.get('vendor')
-                    if vendor_name:
-                        vendor, _ = Vendor.objects.get_or_create(name=vendor_name)
-                    else:
-                        vendor = None
-
-                    # Get or create category
-                    category_name = data.get('productType', 'Uncategorized')
-                    category, _ = ProductCategory.objects.get_or_create(name=category_name)
-
-                    # Format tags as JSON string
-                    tags = json.dumps(data.get('tags', []))
-
-                    # Prepare product data
-                    product_data = {
-                        'title': data.get('title', ''),
-                        'description': data.get('description', ''),
-                        'vendor': vendor,
-                        'category': category,
-                        'tags': tags,
-                        'status': data.get('status', 'active').lower(),
-                        'handle': data.get('handle'),
-                        'options': data.get('options', []),
-                        'images': data.get('images', []),
-                        'published_at': data.get('publishedAt'),
-                        'published_scope': 'global',
-                        'requires_shipping': True,
-                    }
-
-                    # Get existing product or create new one
-                    try:
-                        product = Product.objects.get(shopify_product_id=shopify_id)
-                        for key, value in product_data.items():
-                            setattr(product, key, value)
-                        product.save()
-                        updated_count += 1
-                    except Product.DoesNotExist:
-                        product = Product.objects.create(
-                            shopify_product_id=shopify_id,
-                            user=user,
-                            **product_data
-                        )
-                        created_count += 1
-
-                    # Handle variants
-                    existing_variant_ids = set()
-                    for variant_data in data.get('variants', []):
-                        try:
-                            # Extract Shopify variant ID
-                            shopify_variant_id = variant_data['id']
-                            if shopify_variant_id.startswith('gid://shopify/ProductVariant/'):
-                                shopify_variant_id = shopify_variant_id.replace('gid://shopify/ProductVariant/', '')
-                            
-                            existing_variant_ids.add(shopify_variant_id)
-
-                            # Get selected options
-                            selected_options = variant_data.get('selectedOptions', [])
-                            option_values = {}
-                            for i, opt in enumerate(selected_options, 1):
-                                if i <= 3:  # Shopify supports up to 3 options
-                                    option_values[f'option{i}'] = opt.get('value')
-
-                            variant_defaults = {
-                                'title': variant_data.get('title', ''),
-                                'sku': variant_data.get('sku', ''),
-                                'barcode': variant_data.get('barcode'),
-                                'price': variant_data.get('price'),
-                                'compare_at_price': variant_data.get('compareAtPrice'),
-                                'inventory_quantity': variant_data.get('inventoryQuantity', 0),
-                                'inventory_policy': variant_data.get('inventoryPolicy', 'deny').lower(),
-                                'inventory_management': 'shopify',
-                                **option_values
-                            }
-
-                            # Update or create variant
-                            variant, _ = ProductVariant.objects.update_or_create(
-                                shopify_variant_id=shopify_variant_id,
-                                product=product,
-                                defaults=variant_defaults
-                            )
-
-                        except Exception as e:
-                            error_count += 1
-                            errors.append({
-                                'product_id': data['id'],
-                                'error': str(e)
-                            })
-                            logger.error(f"Error syncing variant for product {data['id']}: {str(e)}")
-                            continue
-
-                    # Clean up old variants that no longer exist in Shopify
-                    ProductVariant.objects.filter(
-                        product=product
-                    ).exclude(
-                        shopify_variant_id__in=existing_variant_ids
-                    ).delete()
-
+                    with run.timed('fetch'):
+                        products_data = client.get_all_products()
                 except Exception as e:
-                    error_count += 1
-                    errors.append({
-                        'product_id': data['id'],
-                        'error': str(e)
-                    })
-                    logger.error(f"Error syncing product {data['id']}: {str(e)}")
-                    continue
+                    logger.exception("Shopify sync failed")
+                    run.fail(str(e))
+                    return Response({
+                        'success': False,
+                        'error': f"Shopify sync failed: {str(e)}"
+                    }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                finally:
+                    run.add_usage(client.usage)
+
+                with run.timed('write'):
+                    stats = sync_shopify_products(user, products_data, company)
+                    recalculate_stock_status(company)
+                run.add_rows(
+                    fetched=len(products_data), created=stats['created'], updated=stats['updated'],
+                    unchanged=stats['unchanged'], failed=stats['error_count'], errors=stats['errors']
+                )
 
             return Response({
                 'success': True,
-                'message': f'Sync completed: {created_count} products created, {updated_count} updated, {error_count} errors',
+                'message': (
+                    f"Sync completed: {stats['created']} products created, {stats['updated']} updated, "
+                    f"{stats['unchanged']} unchanged, {stats['error_count']} errors"
+                ),
                 'data': {
-                    'created': created_count,
-                    'updated': updated_count,
-                    'errors': errors
+                    'created': stats['created'],
+                    'updated': stats['updated'],
+                    'unchanged': stats['unchanged'],
+                    'errors': stats['errors'],
+                    'sync_run': run.id,
                 }
             })
 